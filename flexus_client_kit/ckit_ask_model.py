@@ -8,7 +8,7 @@ from typing import Optional, Any, List, Callable, Union, Dict
 
 import gql
 
-from flexus_client_kit import ckit_expert, ckit_client
+from flexus_client_kit import ckit_expert, ckit_client, gql_utils
 
 
 def openai_style_cloudtools(cloudtools: List[ckit_expert.FCloudTool]):
@@ -95,7 +95,7 @@ async def ask_model(
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(f"""mutation {who_is_asking}CreateCapturedThread($input: FThreadInput!, $u: String) {{
+            gql_utils.gql_cached(f"""mutation {who_is_asking}CreateCapturedThread($input: FThreadInput!, $u: String) {{
                 create_captured_thread(input: $input, on_behalf_of_fuser_id: $u) {{ ft_id }}
             }}"""),
             variable_values={
@@ -142,7 +142,7 @@ async def thread_add_user_message(
 
     async with http as h:
         await h.execute(
-            gql.gql(f"""mutation {who_is_asking}CreateMessages($input: FThreadMultipleMessagesInput!) {{
+            gql_utils.gql_cached(f"""mutation {who_is_asking}CreateMessages($input: FThreadMultipleMessagesInput!) {{
                 thread_messages_create_multiple(input: $input)
             }}"""),
             variable_values={
@@ -188,7 +188,7 @@ async def bot_activate(
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(f"""mutation {camel_case_for_logs}BotActivate($who_is_asking: String!, $persona_id: String!, $fexp_name: String!, $first_question: String!, $first_calls: String!, $title: String!, $sched_id: String!, $fexp_id: String!, $ft_btest_name: String!, $model: String!) {{
+            gql_utils.gql_cached(f"""mutation {camel_case_for_logs}BotActivate($who_is_asking: String!, $persona_id: String!, $fexp_name: String!, $first_question: String!, $first_calls: String!, $title: String!, $sched_id: String!, $fexp_id: String!, $ft_btest_name: String!, $model: String!) {{
                 bot_activate(who_is_asking: $who_is_asking, persona_id: $persona_id, fexp_name: $fexp_name, first_question: $first_question, first_calls: $first_calls, title: $title, sched_id: $sched_id, fexp_id: $fexp_id, ft_btest_name: $ft_btest_name, model: $model) {{ ft_id }}
             }}"""),
             variable_values={
@@ -226,7 +226,7 @@ async def bot_subchat_create_multiple(
     http = await client.use_http()
     async with http as h:
         result = await h.execute(
-            gql.gql(f"""mutation {camel_case_for_logs}BotSubchatCreateMultiple($who_is_asking: String!, $persona_id: String!, $first_question: [String!]!, $first_calls: [String!]!, $title: [String!]!, $fcall_id: String!, $fexp_name: String!, $max_tokens: Int, $temperature: Float, $model: String) {{
+            gql_utils.gql_cached(f"""mutation {camel_case_for_logs}BotSubchatCreateMultiple($who_is_asking: String!, $persona_id: String!, $first_question: [String!]!, $first_calls: [String!]!, $title: [String!]!, $fcall_id: String!, $fexp_name: String!, $max_tokens: Int, $temperature: Float, $model: String) {{
                 bot_subchat_create_multiple(who_is_asking: $who_is_asking, persona_id: $persona_id, first_question: $first_question, first_calls: $first_calls, title: $title, fcall_id: $fcall_id, fexp_name: $fexp_name, max_tokens: $max_tokens, temperature: $temperature, model: $model)
             }}"""),
             variable_values={
@@ -254,7 +254,7 @@ async def thread_app_capture_patch(
 ) -> bool:
     assert isinstance(ft_app_specific, str) or ft_app_specific is None
     async with http as http_sess:
-        r = await http_sess.execute(gql.gql("""
+        r = await http_sess.execute(gql_utils.gql_cached("""
             mutation ThreadAppCapturePatch($ft_id: String!, $ft_app_searchable: String, $ft_app_specific: String) {
                 thread_app_capture_patch(ft_id: $ft_id, ft_app_searchable: $ft_app_searchable, ft_app_specific: $ft_app_specific)
             }"""),
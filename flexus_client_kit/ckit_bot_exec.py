@@ -1,6 +1,7 @@
 import json
 import re
 import asyncio
+import collections
 import functools
 import logging
 import os
@@ -8,15 +9,15 @@ import sys
 import time
 import argparse
 import yaml
-from typing import Dict, List, Optional, Any, Callable, Awaitable, NamedTuple, Union, Type, TypeVar
+from typing import Dict, List, Optional, Any, Callable, Awaitable, NamedTuple, Union, Type, TypeVar, Tuple
 
 import gql
 import gql.transport.exceptions
 
 from flexus_client_kit import ckit_client, gql_utils, ckit_service_exec, ckit_kanban, ckit_cloudtool
 from flexus_client_kit import ckit_ask_model, ckit_shutdown, ckit_utils, ckit_bot_query, ckit_scenario
-from flexus_client_kit import ckit_passwords
-from flexus_client_kit import erp_schema
+from flexus_client_kit import ckit_passwords, ckit_heartbeat
+from flexus_client_kit import erp_schema, ckit_erp
 
 
 logger = logging.getLogger("btexe")
@@ -89,6 +90,12 @@ class RobotContext:
         self._parked_emessages: Dict[str, ckit_bot_query.FExternalMessageOutput] = {}
         self._parked_anything_new = asyncio.Event()
         self._shared_handled_emsg_ids = shared_handled_emsg_ids
+        # Concurrent dispatch: ordering key -> handler calls waiting for their turn, see _dispatch_concurrently()
+        self._lanes: Dict[tuple, collections.deque[Tuple[str, Callable[[], Awaitable[None]], str]]] = {}
+        self._lanes_semaphore: Optional[asyncio.Semaphore] = None
+        self._lanes_max_concurrency = 0
+        self._erp_router: Optional[ErpChangeRouter] = None   # set by BotsCollection, learns about on_erp_change() registrations
+        self._unpark_started = False
         # These fields are designed for direct access:
         self.fclient = fclient
         self.persona = p
@@ -100,6 +107,7 @@ class RobotContext:
         self.running_test_scenario = False
         self.running_happy_yaml = ""
         self.external_auth = external_auth or {}
+        self.handler_stats: Dict[str, Dict[str, float]] = dict()   # "message" -> {"calls", "errors", "total_sec", "max_sec", "last_sec"}
         os.makedirs(self.workdir, exist_ok=True)
 
     def on_updated_message(self, handler: Callable[[ckit_ask_model.FThreadMessageOutput], Awaitable[None]]):
@@ -125,6 +133,8 @@ class RobotContext:
             if table_name not in erp_schema.ERP_TABLE_TO_SCHEMA:
                 raise ValueError(f"Unknown ERP table {table_name!r}. Known tables: {list(erp_schema.ERP_TABLE_TO_SCHEMA.keys())}")
             self._handler_per_erp_table_change[table_name] = handler
+            if self._erp_router:
+                self._erp_router.bot_wants_table(self, table_name)
             return handler
         return decorator
 
@@ -136,18 +146,46 @@ class RobotContext:
             return handler
         return decorator
 
-    async def unpark_collected_events(self, sleep_if_no_work: float, turn_tool_calls_into_bg_tasks: set[str] = set()) -> None:
+    async def unpark_collected_events(self, sleep_if_no_work: float, turn_tool_calls_into_bg_tasks: set[str] = set(), max_concurrency: int = 1) -> None:
+        """
+        Calls your rcx.on_* handlers for everything that arrived since the last call.
+
+        max_concurrency=1 calls handlers one by one. With max_concurrency > 1 handlers run concurrently, up to that many at once,
+        but events about the same thread (messages, thread updates, tool calls) or the same ERP record are still handled strictly
+        in order, see _dispatch_concurrently().
+        """
         # logger.info("%s unpark_collected_events() started %d %d %d" % (self.persona.persona_id, len(self._parked_messages), len(self._parked_threads), len(self._parked_toolcalls)))
-        did_anything = False
         self._parked_anything_new.clear()
+        if not self._unpark_started:
+            self._unpark_started = True   # all the on_* handlers are registered by now
+            if self._erp_router:
+                self._erp_router.bot_settled(self)
+
+        if max_concurrency > 1:
+            did_anything = self._dispatch_concurrently(max_concurrency, turn_tool_calls_into_bg_tasks)
+        else:
+            did_anything = await self._dispatch_serially(turn_tool_calls_into_bg_tasks)
 
+        if not did_anything:
+            self._completed_initial_unpark = True
+            if self._restart_requested and not self.bg_call_tasks:
+                raise RestartBecauseSettingsChanged()
+            if self._soft_restart_requested and not self.bg_call_tasks:
+                raise RestartBecauseAuthChanged()
+            try:
+                await asyncio.wait_for(self._parked_anything_new.wait(), timeout=sleep_if_no_work)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch_serially(self, turn_tool_calls_into_bg_tasks: set[str]) -> bool:
+        did_anything = False
         todo = list(self._parked_messages.keys())  # can appear more in the background, as we await in loop body
         for k in todo:
             msg = self._parked_messages.pop(k)
             did_anything = True
             if self._handler_updated_message:
                 try:
-                    await self._handler_updated_message(msg)
+                    await self._timed("message", self._handler_updated_message(msg))
                 except Exception as e:
                     logger.error("%s error in handler_updated_message handler: %s\n%s", self.persona.persona_id, type(e).__name__, e, exc_info=e)
 
@@ -157,7 +195,7 @@ class RobotContext:
             did_anything = True
             if self._handler_upd_thread:
                 try:
-                    await self._handler_upd_thread(thread)
+                    await self._timed("thread", self._handler_upd_thread(thread))
                 except Exception as e:
                     logger.error("%s error in on_updated_thread handler: %s\n%s", self.persona.persona_id, type(e).__name__, e, exc_info=e)
 
@@ -167,7 +205,7 @@ class RobotContext:
             did_anything = True
             if self._handler_updated_task:
                 try:
-                    await self._handler_updated_task(task)
+                    await self._timed("task", self._handler_updated_task(task))
                 except Exception as e:
                     logger.error("%s error in on_updated_task handler: %s\n%s", self.persona.persona_id, type(e).__name__, e, exc_info=e)
 
@@ -181,7 +219,7 @@ class RobotContext:
                     dataclass_type = erp_schema.ERP_TABLE_TO_SCHEMA[table_name]
                     new_record = gql_utils.dataclass_from_dict(new_record_dict, dataclass_type) if new_record_dict else None
                     old_record = gql_utils.dataclass_from_dict(old_record_dict, dataclass_type) if old_record_dict else None
-                    await handler(action, new_record, old_record)
+                    await self._timed("erp", handler(action, new_record, old_record))
                 except Exception as e:
                     logger.error("%s error in on_erp_change(%r) handler: %s\n%s", self.persona.persona_id, table_name, type(e).__name__, e, exc_info=e)
 
@@ -195,7 +233,7 @@ class RobotContext:
                 logger.info("%s on_emessage(%r) handler not found, message is lost", self.persona.persona_id, emsg.emsg_type)
                 continue
             try:
-                await handler(emsg)
+                await self._timed("emessage", handler(emsg))
             except Exception as e:
                 logger.error("%s error in on_emessage(%r) handler: %s\n%s", self.persona.persona_id, emsg.emsg_type, type(e).__name__, e, exc_info=e)
 
@@ -208,24 +246,155 @@ class RobotContext:
                 continue
             if c.fcall_name not in turn_tool_calls_into_bg_tasks:
                 try:
-                    await self._local_tool_call(self.fclient, c)
+                    await self._timed("toolcall", self._local_tool_call(self.fclient, c))
                 except Exception as e:
                     logger.error("%s error in on_tool_call() handler: %s\n%s", self.persona.persona_id, type(e).__name__, e, exc_info=e)
             else:
                 task = asyncio.create_task(self._local_tool_call(self.fclient, c))
                 task.add_done_callback(lambda t: self.bg_call_tasks.discard(t))
                 self.bg_call_tasks.add(task)
+        return did_anything
+
+    def _dispatch_concurrently(self, max_concurrency: int, turn_tool_calls_into_bg_tasks: set[str]) -> bool:
+        # Each ordering key has a lane: a queue of handler calls plus one task that runs them in order. Lanes run in parallel,
+        # the semaphore limits how many handlers run at the same time. Lanes live across unpark_collected_events() calls, so
+        # a slow handler only delays later events with the same key. Lane tasks sit in bg_call_tasks, restarts wait for them.
+        if self._lanes_semaphore is None or self._lanes_max_concurrency != max_concurrency:
+            self._lanes_semaphore = asyncio.Semaphore(max_concurrency)
+            self._lanes_max_concurrency = max_concurrency
+        pid = self.persona.persona_id
+        did_anything = False
 
-        if not did_anything:
-            self._completed_initial_unpark = True
-            if self._restart_requested and not self.bg_call_tasks:
-                raise RestartBecauseSettingsChanged()
-            if self._soft_restart_requested and not self.bg_call_tasks:
-                raise RestartBecauseAuthChanged()
-            try:
-                await asyncio.wait_for(self._parked_anything_new.wait(), timeout=sleep_if_no_work)
-            except asyncio.TimeoutError:
-                pass
+        for k in list(self._parked_messages.keys()):
+            msg = self._parked_messages.pop(k)
+            did_anything = True
+            if self._handler_updated_message:
+                self._lane_push(("thread", msg.ftm_belongs_to_ft_id), "message", functools.partial(self._handler_updated_message, msg),
+                    "%s error in handler_updated_message handler" % pid)
+
+        for k in list(self._parked_threads.keys()):
+            thread = self._parked_threads.pop(k)
+            did_anything = True
+            if self._handler_upd_thread:
+                self._lane_push(("thread", thread.ft_id), "thread", functools.partial(self._handler_upd_thread, thread),
+                    "%s error in on_updated_thread handler" % pid)
+
+        for k in list(self._parked_tasks.keys()):
+            task = self._parked_tasks.pop(k)
+            did_anything = True
+            if self._handler_updated_task:
+                self._lane_push(("task", task.ktask_id), "task", functools.partial(self._handler_updated_task, task),
+                    "%s error in on_updated_task handler" % pid)
+
+        erp_changes = list(self._parked_erp_changes.items())
+        self._parked_erp_changes.clear()
+        for (table_name, record_id), (_, action, new_record_dict, old_record_dict) in erp_changes:
+            did_anything = True
+            handler = self._handler_per_erp_table_change.get(table_name)
+            if handler:
+                async def erp_call(handler=handler, table_name=table_name, action=action, new_record_dict=new_record_dict, old_record_dict=old_record_dict):
+                    dataclass_type = erp_schema.ERP_TABLE_TO_SCHEMA[table_name]
+                    new_record = gql_utils.dataclass_from_dict(new_record_dict, dataclass_type) if new_record_dict else None
+                    old_record = gql_utils.dataclass_from_dict(old_record_dict, dataclass_type) if old_record_dict else None
+                    await handler(action, new_record, old_record)
+                self._lane_push(("erp", table_name, record_id), "erp", erp_call, "%s error in on_erp_change(%r) handler" % (pid, table_name))
+
+        emessages = list(self._parked_emessages.values())
+        self._parked_emessages.clear()
+        for emsg in emessages:
+            did_anything = True
+            handler = self._handler_per_emsg_type.get(emsg.emsg_type)
+            self._shared_handled_emsg_ids.append(emsg.emsg_id)
+            if not handler:
+                logger.info("%s on_emessage(%r) handler not found, message is lost", pid, emsg.emsg_type)
+                continue
+            self._lane_push(("emsg", emsg.emsg_type, emsg.emsg_from), "emessage", functools.partial(handler, emsg),
+                "%s error in on_emessage(%r) handler" % (pid, emsg.emsg_type))
+
+        mycalls = list(self._parked_toolcalls)
+        self._parked_toolcalls.clear()
+        for c in mycalls:
+            did_anything = True
+            if c.fcall_name not in self._handler_per_tool:
+                logger.error("%s tool call %s for %s has no handler. Available handlers: %r", pid, c.fcall_id, c.fcall_name, list(self._handler_per_tool.keys()))
+                continue
+            if c.fcall_name not in turn_tool_calls_into_bg_tasks:
+                self._lane_push(("thread", c.fcall_ft_id), "toolcall", functools.partial(self._local_tool_call, self.fclient, c),
+                    "%s error in on_tool_call() handler" % pid)
+            else:
+                task = asyncio.create_task(self._local_tool_call(self.fclient, c))
+                task.add_done_callback(lambda t: self.bg_call_tasks.discard(t))
+                self.bg_call_tasks.add(task)
+        return did_anything
+
+    def _lane_push(self, key: tuple, kind: str, call: Callable[[], Awaitable[None]], error_prefix: str) -> None:
+        lane = self._lanes.get(key)
+        if lane is not None:
+            lane.append((kind, call, error_prefix))   # lane task is running, it will get there
+            return
+        lane = collections.deque([(kind, call, error_prefix)])
+        self._lanes[key] = lane
+        self._lane_start(key, lane)
+
+    def _lane_start(self, key: tuple, lane: collections.deque) -> None:
+        task = asyncio.create_task(self._lane_run(lane))
+        task.add_done_callback(functools.partial(self._lane_done, key, lane))
+        self.bg_call_tasks.add(task)
+
+    def _lane_done(self, key: tuple, lane: collections.deque, task: asyncio.Task) -> None:
+        # Here and not in _lane_run(), a task cancelled before its first step never runs its finally
+        self.bg_call_tasks.discard(task)
+        if lane and not task.cancelled():
+            self._lane_start(key, lane)   # pushed after the task looked at the lane the last time, before this callback
+            return
+        if lane:
+            logger.info("%s lane %r cancelled, %d events dropped", self.persona.persona_id, key, len(lane))
+        if self._lanes.get(key) is lane:
+            del self._lanes[key]
+        if self._restart_requested or self._soft_restart_requested:
+            self._parked_anything_new.set()   # wake up unpark_collected_events() to check if it's time to restart
+
+    async def _lane_run(self, lane: collections.deque) -> None:
+        while lane:
+            kind, call, error_prefix = lane.popleft()
+            async with self._lanes_semaphore:
+                try:
+                    await self._timed(kind, call())
+                except Exception as e:
+                    logger.error("%s: %s\n%s", error_prefix, type(e).__name__, e, exc_info=e)
+
+    async def _timed(self, kind: str, coro: Awaitable[Any]) -> Any:
+        st = self.handler_stats.get(kind)
+        if st is None:
+            st = self.handler_stats[kind] = {"calls": 0, "errors": 0, "total_sec": 0.0, "max_sec": 0.0, "last_sec": 0.0}
+        t0 = time.time()
+        try:
+            return await coro
+        except Exception:
+            st["errors"] += 1
+            raise
+        finally:
+            dt = time.time() - t0
+            st["calls"] += 1
+            st["total_sec"] += dt
+            st["last_sec"] = dt
+            st["max_sec"] = max(st["max_sec"], dt)
+
+    def queue_depth(self) -> Dict[str, int]:
+        """
+        How many events wait to be handled: parked (unpark_collected_events() didn't see them yet) and queued in lanes (concurrent mode).
+        """
+        return {
+            "parked_messages": len(self._parked_messages),
+            "parked_threads": len(self._parked_threads),
+            "parked_tasks": len(self._parked_tasks),
+            "parked_toolcalls": len(self._parked_toolcalls),
+            "parked_erp_changes": len(self._parked_erp_changes),
+            "parked_emessages": len(self._parked_emessages),
+            "lanes": len(self._lanes),
+            "lanes_queued": sum(len(lane) for lane in self._lanes.values()),
+            "bg_tasks": len(self.bg_call_tasks),
+        }
 
     async def wait_for_bg_tasks(self, timeout: float = 10.0) -> None:
         if not self.bg_call_tasks:
@@ -316,41 +485,220 @@ async def i_am_still_alive(
     marketable_name: str,
     marketable_version: int,
 ) -> None:
-    while not ckit_shutdown.shutdown_event.is_set():
-        try:
-            http_client = await fclient.use_http()
-            async with http_client as http:
-                # group_id takes priority over ws_id, send only one (not both)
-                use_group_id = fclient.group_id if fclient.group_id else None
-                use_ws_id_prefix = None if use_group_id else fclient.ws_id
-                await http.execute(
-                    gql.gql("""mutation BotConfirmExists($marketable_name: String!, $marketable_version: Int!, $ws_id_prefix: String, $group_id: String) {
-                        bot_confirm_exists(marketable_name: $marketable_name, marketable_version: $marketable_version, ws_id_prefix: $ws_id_prefix, group_id: $group_id)
-                    }"""),
-                    variable_values={
-                        "marketable_name": marketable_name,
-                        "marketable_version": marketable_version,
-                        "ws_id_prefix": use_ws_id_prefix,
-                        "group_id": use_group_id,
-                    },
-                )
-                logger.info("i_am_still_alive %s:%d %s=%s", marketable_name, marketable_version, "ws_id" if fclient.ws_id else "group_id", fclient.ws_id or fclient.group_id)
-            if await ckit_shutdown.wait(120):
-                break
+    # group_id takes priority over ws_id, send only one (not both)
+    use_group_id = fclient.group_id if fclient.group_id else None
+    use_ws_id_prefix = None if use_group_id else fclient.ws_id
+    key = "bot:%s:%d:%s" % (marketable_name, marketable_version, use_group_id or use_ws_id_prefix)
+    ckit_heartbeat.heartbeat_register(fclient, key, ckit_heartbeat.HeartbeatItem("bot_confirm_exists", {
+        "marketable_name": ("String!", marketable_name),
+        "marketable_version": ("Int!", marketable_version),
+        "ws_id_prefix": ("String", use_ws_id_prefix),
+        "group_id": ("String", use_group_id),
+    }))
+    logger.info("i_am_still_alive %s:%d %s=%s", marketable_name, marketable_version, "ws_id" if fclient.ws_id else "group_id", fclient.ws_id or fclient.group_id)
+    try:
+        await ckit_shutdown.shutdown_event.wait()
+    finally:
+        ckit_heartbeat.heartbeat_unregister(fclient, key)
 
-        except (
-            gql.transport.exceptions.TransportError,
-            OSError,
-            asyncio.exceptions.TimeoutError
-        ) as e:
-            if "403:" in str(e):
-                # It's gql.transport.exceptions.TransportQueryError with {'message': "403: Whoops your key didn't work (1).", ...}
-                # Unfortunately, no separate exception class for 403
-                logger.error("That looks bad, my key doesn't work: %s", e)
-            else:
-                logger.info("i_am_still_alive connection problem")
-            if await ckit_shutdown.wait(60):
-                break
+
+class ThreadOwnershipIndex:
+    """
+    Keeps thread_tracker and bots' latest_threads in sync one event at a time, instead of rescanning
+    all tracked threads for all running bots on every thread event.
+
+    persona_threads: persona_id -> thread ids, taken from ft_persona_id
+    thread_holders: thread id -> persona_ids whose running bot got it into latest_threads
+    The bot for a persona is bc.bots_running[persona_id].
+
+    After clear() (a new subscription) the first update does one full rescan, just like before, to drop threads that
+    bots still have in latest_threads but the backend doesn't track anymore.
+
+    With check_consistency=True each update is followed by a dry-run full rescan that must find nothing to fix, for tests.
+    """
+    def __init__(self, thread_tracker: Dict[str, ckit_bot_query.FThreadWithMessages], bots_running: Dict[str, "BotInstance"]):
+        self.thread_tracker = thread_tracker
+        self.bots_running = bots_running
+        self.persona_threads: Dict[str, set[str]] = {}
+        self.thread_persona: Dict[str, str] = {}
+        self.thread_holders: Dict[str, set[str]] = {}
+        self.full_rescan_pending = True
+        self.check_consistency = False
+
+    def clear(self) -> None:
+        self.thread_tracker.clear()
+        self.persona_threads.clear()
+        self.thread_persona.clear()
+        self.thread_holders.clear()
+        self.full_rescan_pending = True
+
+    def thread_upsert(self, thread: ckit_ask_model.FThreadOutput) -> None:
+        tid = thread.ft_id
+        if tid in self.thread_tracker:
+            self.thread_tracker[tid].thread_fields = thread
+        else:
+            self.thread_tracker[tid] = ckit_bot_query.FThreadWithMessages(thread.ft_persona_id, thread, thread_messages=dict())
+        persona_id = thread.ft_persona_id
+        assert persona_id, "Oops persona_id is empty 8-[  ]"
+        prev_persona_id = self.thread_persona.get(tid)
+        if prev_persona_id != persona_id:
+            if prev_persona_id is not None:
+                self.persona_threads[prev_persona_id].discard(tid)
+            self.thread_persona[tid] = persona_id
+            self.persona_threads.setdefault(persona_id, set()).add(tid)
+        if self.full_rescan_pending:
+            self.full_rescan()
+            return
+        self._give_to_bot(tid, persona_id)
+        self._check()
+
+    def thread_forget(self, tid: str) -> None:
+        if tid in self.thread_tracker:
+            logger.info("%s deleted from thread_tracker" % tid)
+            del self.thread_tracker[tid]
+        persona_id = self.thread_persona.pop(tid, None)
+        if persona_id is not None:
+            self.persona_threads[persona_id].discard(tid)
+        if self.full_rescan_pending:
+            self.full_rescan()
+            return
+        for holder_persona_id in self.thread_holders.pop(tid, ()):
+            if bot := self.bots_running.get(holder_persona_id):
+                bot.instance_rcx.latest_threads.pop(tid, None)
+        self._check()
+
+    def bot_started(self, persona_id: str) -> None:
+        if self.full_rescan_pending:
+            self.full_rescan()
+            return
+        for tid in self.persona_threads.get(persona_id, ()):
+            self._give_to_bot(tid, persona_id)
+        self._check()
+
+    def _give_to_bot(self, tid: str, persona_id: str) -> None:
+        bot = self.bots_running.get(persona_id)
+        if bot is None:
+            ckit_utils.log_with_throttle(logger.info,
+                "Thread %s belongs to persona %s, but no bot is running for it, maybe a little async not a big deal.", tid, persona_id)
+            return
+        ev = bot.instance_rcx
+        if tid not in ev.latest_threads:
+            thread = self.thread_tracker[tid]
+            ev.latest_threads[tid] = thread
+            ev._parked_messages.update(thread.thread_messages)
+            ev._parked_anything_new.set()
+        self.thread_holders.setdefault(tid, set()).add(persona_id)
+
+    def full_rescan(self, dry_run: bool = False) -> int:
+        """
+        The O(threads x bots) way, returns how many fixes to latest_threads it made (or would make if dry_run).
+        """
+        fixes = 0
+        for bot in self.bots_running.values():
+            to_test = list(bot.instance_rcx.latest_threads.keys())
+            for t in to_test:
+                if t not in self.thread_tracker:
+                    fixes += 1
+                    if not dry_run:
+                        del bot.instance_rcx.latest_threads[t]
+        for tid, thread in self.thread_tracker.items():
+            persona_id = thread.thread_fields.ft_persona_id
+            assert persona_id, "Oops persona_id is empty 8-[  ]"
+            if persona_id in self.bots_running:
+                if tid not in self.bots_running[persona_id].instance_rcx.latest_threads:
+                    fixes += 1
+                    if not dry_run:
+                        self._give_to_bot(tid, persona_id)
+            elif not dry_run:
+                self._give_to_bot(tid, persona_id)   # logs
+        if not dry_run:
+            self.thread_persona = {tid: thread.thread_fields.ft_persona_id for tid, thread in self.thread_tracker.items()}
+            self.persona_threads = {}
+            for tid, persona_id in self.thread_persona.items():
+                self.persona_threads.setdefault(persona_id, set()).add(tid)
+            self.thread_holders = {}
+            for persona_id, bot in self.bots_running.items():
+                for tid in bot.instance_rcx.latest_threads:
+                    self.thread_holders.setdefault(tid, set()).add(persona_id)
+            self.full_rescan_pending = False
+        return fixes
+
+    def _check(self) -> None:
+        if self.check_consistency:
+            fixes = self.full_rescan(dry_run=True)
+            assert fixes == 0, "thread ownership index is out of sync, full rescan would make %d fixes" % fixes
+
+
+class ErpChangeRouter:
+    """
+    erp.* changes go only to bots that have @rcx.on_erp_change() for that table, not to every running bot.
+
+    A bot that didn't call unpark_collected_events() yet is probably still registering its handlers, so it gets
+    changes for all the tables, like before. Unpark drops changes nobody handles anyway.
+    """
+    def __init__(self, bots_running: Dict[str, "BotInstance"]):
+        self.bots_running = bots_running
+        self.table_to_personas: Dict[str, set[str]] = {}
+        self.unsettled_personas: set[str] = set()
+        self.changes_routed = 0       # changes that found at least one bot
+        self.changes_dropped = 0      # changes nobody wanted
+        self.deliveries = 0           # (change, bot) pairs parked
+        self.wakeups_saved = 0        # (change, bot) pairs the broadcast would have parked, but not anymore
+
+    def bot_started(self, persona_id: str, rcx: "RobotContext") -> None:
+        self.bot_stopped(persona_id)
+        self.unsettled_personas.add(persona_id)
+        rcx._erp_router = self
+        for table_name in rcx._handler_per_erp_table_change:
+            self.bot_wants_table(rcx, table_name)
+
+    def bot_stopped(self, persona_id: str) -> None:
+        self.unsettled_personas.discard(persona_id)
+        for personas in self.table_to_personas.values():
+            personas.discard(persona_id)
+
+    def bot_wants_table(self, rcx: "RobotContext", table_name: str) -> None:
+        if self._is_current(rcx):
+            self.table_to_personas.setdefault(table_name, set()).add(rcx.persona.persona_id)
+
+    def bot_settled(self, rcx: "RobotContext") -> None:
+        if self._is_current(rcx):
+            self.unsettled_personas.discard(rcx.persona.persona_id)
+            for table_name in rcx._handler_per_erp_table_change:   # in case some handler got there without on_erp_change()
+                self.bot_wants_table(rcx, table_name)
+
+    def _is_current(self, rcx: "RobotContext") -> bool:
+        # A bot that is shutting down after its settings changed has the same persona_id as its replacement, ignore it
+        bot = self.bots_running.get(rcx.persona.persona_id)
+        return bot is not None and bot.instance_rcx is rcx
+
+    def route(self, table_name: str, record_id: str, action: str, new_record: Optional[Dict[str, Any]], old_record: Optional[Dict[str, Any]]) -> int:
+        targets = self.table_to_personas.get(table_name, set())
+        if self.unsettled_personas:
+            targets = targets | self.unsettled_personas
+        n = 0
+        for persona_id in targets:
+            bot = self.bots_running.get(persona_id)
+            if bot is None:
+                continue
+            bot.instance_rcx._parked_erp_changes[(table_name, record_id)] = (table_name, action, new_record, old_record)
+            bot.instance_rcx._parked_anything_new.set()
+            n += 1
+        if n:
+            self.changes_routed += 1
+        else:
+            self.changes_dropped += 1
+        self.deliveries += n
+        self.wakeups_saved += len(self.bots_running) - n
+        return n
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "changes_routed": self.changes_routed,
+            "changes_dropped": self.changes_dropped,
+            "deliveries": self.deliveries,
+            "wakeups_saved": self.wakeups_saved,
+        }
 
 
 class BotsCollection:
@@ -373,6 +721,8 @@ class BotsCollection:
         self.bots_running: Dict[str, BotInstance] = {}
         self.shutting_down_tasks: set[asyncio.Task] = set()
         self.thread_tracker: Dict[str, ckit_bot_query.FThreadWithMessages] = {}
+        self.thread_index = ThreadOwnershipIndex(self.thread_tracker, self.bots_running)
+        self.erp_router = ErpChangeRouter(self.bots_running)
         self.running_test_scenario = running_test_scenario
         self.running_happy_yaml = running_happy_yaml
         self.subscribe_to_erp_tables = subscribe_to_erp_tables
@@ -389,18 +739,18 @@ async def subscribe_and_produce_callbacks(
     # XXX check if it will really crash downstream without this check
     assert fclient.service_name.startswith(bc.marketable_name)
 
-    bc.thread_tracker.clear()  # Control reaches this after exception and reconnect, a new subscription will send all the threads anew, need to clear
+    bc.thread_index.clear()  # Control reaches this after exception and reconnect, a new subscription will send all the threads anew, need to clear
 
     if bc.subscribe_to_erp_tables:
         logger.info(f"Subscribing to ERP tables: {bc.subscribe_to_erp_tables}")
 
-    async with ws_client as ws:
+    async with ws_client as ws, ckit_erp.ErpCacheFeed(bc.subscribe_to_erp_tables) as erp_feed:
         assert fclient.ws_id is not None or fclient.group_id is not None
         # group_id takes priority over ws_id, send only one (not both)
         use_group_id = fclient.group_id if fclient.group_id else None
         use_ws_id_prefix = None if use_group_id else fclient.ws_id
         async for r in ws.subscribe(
-            gql.gql(f"""subscription KarenThreads($marketable_name: String!, $marketable_version: Int!, $inprocess_tool_names: [String!]!, $want_erp_tables: [String!]!, $ws_id_prefix: String, $group_id: String) {{
+            gql_utils.gql_cached(f"""subscription KarenThreads($marketable_name: String!, $marketable_version: Int!, $inprocess_tool_names: [String!]!, $want_erp_tables: [String!]!, $ws_id_prefix: String, $group_id: String) {{
                 bot_threads_calls_tasks(marketable_name: $marketable_name, marketable_version: $marketable_version, inprocess_tool_names: $inprocess_tool_names, max_threads: {MAX_THREADS}, want_personas: true, want_threads: true, want_messages: true, want_tasks: true, want_erp_tables: $want_erp_tables, ws_id_prefix: $ws_id_prefix, group_id: $group_id) {{
                     {gql_utils.gql_fields(ckit_bot_query.FBotThreadsCallsTasks)}
                 }}
@@ -416,7 +766,7 @@ async def subscribe_and_produce_callbacks(
         ):
             upd = gql_utils.dataclass_from_dict(r["bot_threads_calls_tasks"], ckit_bot_query.FBotThreadsCallsTasks)
             handled = False
-            reassign_threads = False
+            erp_feed.live()
             # logger.info("subs %s %s %s" % (upd.news_action, upd.news_about, upd.news_payload_id))
 
             if upd.news_about == "flexus_external_auth":
@@ -472,7 +822,8 @@ async def subscribe_and_produce_callbacks(
                             atask=asyncio.create_task(crash_boom_bang(fclient, rcx, bc.bot_main_loop)),
                             instance_rcx=rcx,
                         )
-                        reassign_threads = True
+                        bc.erp_router.bot_started(persona_id, rcx)
+                        bc.thread_index.bot_started(persona_id)
 
                 elif upd.news_action == "DELETE":
                     handled = True
@@ -484,30 +835,25 @@ async def subscribe_and_produce_callbacks(
                         except asyncio.CancelledError:
                             pass
                         del bc.bots_running[persona_id]
+                        bc.erp_router.bot_stopped(persona_id)
 
             elif upd.news_about == "flexus_thread":
                 if upd.news_action in ["INSERT", "UPDATE"]:
                     handled = True
                     thread = upd.news_payload_thread
-                    if thread.ft_id in bc.thread_tracker:
-                        bc.thread_tracker[thread.ft_id].thread_fields = thread
-                    else:
-                        bc.thread_tracker[thread.ft_id] = ckit_bot_query.FThreadWithMessages(thread.ft_persona_id, thread, thread_messages=dict())
                     persona_id = thread.ft_persona_id
                     if persona_id in bc.bots_running:
                         bc.bots_running[persona_id].instance_rcx._parked_threads[thread.ft_id] = thread
                         bc.bots_running[persona_id].instance_rcx._parked_anything_new.set()
                     else:
                         logger.info("Thread update %s is about persona=%s which is not running here." % (thread.ft_id, persona_id))
-                    reassign_threads = True
+                    bc.thread_index.thread_upsert(thread)
+                    assert len(bc.thread_tracker) <= MAX_THREADS, "backend should send STOP_TRACKING wtf"
 
                 elif upd.news_action in ["DELETE", "STOP_TRACKING"]:
                     # threads are never deleted (DELETE), but whatever it's a garbage collector for very old threads or something, let's handle that too
                     handled = True
-                    if upd.news_payload_id in bc.thread_tracker:
-                        logger.info("%s deleted from thread_tracker" % upd.news_payload_id)
-                        del bc.thread_tracker[upd.news_payload_id]
-                    reassign_threads = True
+                    bc.thread_index.thread_forget(upd.news_payload_id)
 
             elif upd.news_about == "flexus_thread_message":
                 if upd.news_action in ["INSERT", "UPDATE"]:
@@ -565,11 +911,9 @@ async def subscribe_and_produce_callbacks(
                 table_name = upd.news_about[4:]
                 if upd.news_action in ["INSERT", "UPDATE", "DELETE", "ARCHIVE"]:
                     handled = True
-                    new_record = upd.news_payload_erp_record_new
-                    old_record = upd.news_payload_erp_record_old
-                    for bot in bc.bots_running.values():
-                        bot.instance_rcx._parked_erp_changes[(table_name, upd.news_payload_id)] = (table_name, upd.news_action, new_record, old_record)
-                        bot.instance_rcx._parked_anything_new.set()
+                    if erp_feed.cache is not None:
+                        erp_feed.cache.on_change(table_name, upd.news_action, upd.news_payload_erp_record_new, upd.news_payload_erp_record_old)
+                    bc.erp_router.route(table_name, upd.news_payload_id, upd.news_action, upd.news_payload_erp_record_new, upd.news_payload_erp_record_old)
 
             elif upd.news_about == "flexus_persona_external_message":
                 if upd.news_action == "EMESSAGE" and upd.news_payload_emessage:
@@ -598,27 +942,6 @@ async def subscribe_and_produce_callbacks(
             if not handled:
                 logger.warning("Subscription has sent me something I can't understand:\n%s\n" % upd)
 
-            if reassign_threads:
-                assert len(bc.thread_tracker) <= MAX_THREADS, "backend should send STOP_TRACKING wtf"
-                # There we go, now it's O(1) because it's limited
-                for bot in bc.bots_running.values():
-                    to_test = list(bot.instance_rcx.latest_threads.keys())
-                    for t in to_test:
-                        if t not in bc.thread_tracker:
-                            del bot.instance_rcx.latest_threads[t]
-                for tid, thread in bc.thread_tracker.items():
-                    persona_id = thread.thread_fields.ft_persona_id
-                    assert persona_id, "Oops persona_id is empty 8-[  ]"
-                    if persona_id in bc.bots_running:
-                        ev = bc.bots_running[persona_id].instance_rcx
-                        if tid not in ev.latest_threads:
-                            ev.latest_threads[tid] = thread
-                            ev._parked_messages.update(thread.thread_messages)
-                            ev._parked_anything_new.set()
-                    else:
-                        ckit_utils.log_with_throttle(logger.info,
-                            "Thread %s belongs to persona %s, but no bot is running for it, maybe a little async not a big deal.", tid, persona_id)
-
             if ckit_shutdown.shutdown_event.is_set():
                 break
 
@@ -906,7 +1229,7 @@ async def run_happy_trajectory(
 
 async def _emsg_delete_batch(fclient: ckit_client.FlexusClient, batch: List[str]) -> None:
     async with (await fclient.use_http()) as http:
-        await http.execute(gql.gql("""mutation FlushDeleteEmessages($ids: [String!]!) {
+        await http.execute(gql_utils.gql_cached("""mutation FlushDeleteEmessages($ids: [String!]!) {
             emessages_delete(emsg_ids: $ids)
         }"""), variable_values={"ids": batch})
 
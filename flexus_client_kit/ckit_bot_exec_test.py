@@ -0,0 +1,180 @@
+import asyncio
+import json
+import random
+import time
+import types
+
+from flexus_client_kit import ckit_bot_exec, ckit_ask_model
+
+
+def _thread(ft_id: str, persona_id: str) -> ckit_ask_model.FThreadOutput:
+    return ckit_ask_model.FThreadOutput(
+        owner_fuser_id="fuser1", ft_id=ft_id, ft_fexp_id="default", ft_title="t", ft_btest_name="",
+        ft_toolset=None, ft_error=None, ft_need_assistant=-1, ft_need_tool_calls=-1, ft_need_user=-1,
+        ft_app_capture="", ft_app_searchable="", ft_app_specific=None, ft_persona_id=persona_id,
+        ft_created_ts=0.0, ft_updated_ts=0.0, ft_budget=0, ft_coins=0,
+    )
+
+
+def _collection() -> ckit_bot_exec.BotsCollection:
+    return ckit_bot_exec.BotsCollection(
+        ws_id_prefix="ws1", marketable_name="frog", marketable_version=1, inprocess_tools=[], bot_main_loop=None,
+    )
+
+
+def _start_bot(bc: ckit_bot_exec.BotsCollection, persona_id: str) -> None:
+    rcx = ckit_bot_exec.RobotContext(None, types.SimpleNamespace(persona_id=persona_id), [])
+    bc.bots_running[persona_id] = ckit_bot_exec.BotInstance(fclient=None, atask=None, instance_rcx=rcx)
+    bc.thread_index.bot_started(persona_id)
+
+
+def _replay(bc: ckit_bot_exec.BotsCollection, n_events: int, n_personas: int, max_threads: int, seed: int, full_rescan_each_time: bool) -> None:
+    rnd = random.Random(seed)
+    personas = ["persona%02d" % i for i in range(n_personas)]
+    for i in range(n_events):
+        x = rnd.random()
+        if x < 0.01:
+            p = rnd.choice(personas)
+            bc.bots_running.pop(p, None)   # persona deleted, or restarted because setup changed
+            if rnd.random() < 0.7:
+                _start_bot(bc, p)
+        elif x < 0.15 and bc.thread_tracker:
+            bc.thread_index.thread_forget(rnd.choice(list(bc.thread_tracker.keys())))
+        else:
+            ft_id = "ft%05d" % rnd.randrange(max_threads)
+            if ft_id not in bc.thread_tracker and len(bc.thread_tracker) >= max_threads:
+                continue
+            # the same thread mostly stays with its persona, but not always
+            p = personas[int(ft_id[2:]) % n_personas] if rnd.random() < 0.98 else rnd.choice(personas)
+            bc.thread_index.thread_upsert(_thread(ft_id, p))
+        if full_rescan_each_time:
+            bc.thread_index.full_rescan()
+
+
+def test_thread_index_matches_full_rescan():
+    async def go():
+        bc = _collection()
+        bc.thread_index.clear()
+        bc.thread_index.check_consistency = True
+        for i in range(5):
+            _start_bot(bc, "persona%02d" % i)
+        _replay(bc, 3000, n_personas=8, max_threads=200, seed=1337, full_rescan_each_time=False)
+        assert bc.thread_index.full_rescan(dry_run=True) == 0
+        for p, bot in bc.bots_running.items():
+            mine = {tid for tid, t in bc.thread_tracker.items() if t.thread_fields.ft_persona_id == p}
+            assert mine <= set(bot.instance_rcx.latest_threads.keys()) <= set(bc.thread_tracker.keys())
+    asyncio.run(go())
+
+
+def test_thread_index_after_reconnect():
+    async def go():
+        bc = _collection()
+        _start_bot(bc, "p1")
+        bc.thread_index.thread_upsert(_thread("ft1", "p1"))
+        bc.thread_index.thread_upsert(_thread("ft2", "p1"))
+        assert set(bc.bots_running["p1"].instance_rcx.latest_threads) == {"ft1", "ft2"}
+        bc.thread_index.clear()   # new subscription, backend doesn't track ft1 anymore
+        bc.thread_index.thread_upsert(_thread("ft2", "p1"))
+        assert set(bc.bots_running["p1"].instance_rcx.latest_threads) == {"ft2"}
+    asyncio.run(go())
+
+
+def test_erp_router_settled_bots():
+    from flexus_client_kit.integrations import fi_crm_automations
+    automations = {"deal_moved": {"triggers": [{"type": "erp_table", "table": "crm_deal", "operations": ["update"]}],
+        "actions": [{"type": "post_task_into_bot_inbox", "title": "x", "details": {}}]}}
+
+    async def go():
+        bc = _collection()
+        for p in ["vix", "frog", "direct", "idle"]:
+            _start_bot(bc, p)
+            bc.erp_router.bot_started(p, bc.bots_running[p].instance_rcx)
+        rcx = {p: bc.bots_running[p].instance_rcx for p in bc.bots_running}
+        # Registered inside the main loop, after the router already knows the bot, the way vix does it
+        fi_crm_automations.IntegrationCrmAutomations(None, rcx["vix"], lambda: {"crm_automations": json.dumps(automations)}, ["crm_deal"])
+        rcx["frog"].on_erp_change("crm_contact")(lambda *a: None)
+        rcx["direct"]._handler_per_erp_table_change["crm_activity"] = lambda *a: None   # no on_erp_change(), the router can't see it until settled
+        for r in rcx.values():
+            await r.unpark_collected_events(0.0)   # first unpark: settled, from now on gets only its own tables
+        assert not bc.erp_router.unsettled_personas
+
+        assert bc.erp_router.route("crm_deal", "d1", "UPDATE", {"deal_id": "d1"}, None) == 1
+        assert ("crm_deal", "d1") in rcx["vix"]._parked_erp_changes and not rcx["frog"]._parked_erp_changes
+        assert bc.erp_router.route("crm_contact", "c1", "INSERT", {"contact_id": "c1"}, None) == 1
+        assert bc.erp_router.route("crm_activity", "a1", "INSERT", {"activity_id": "a1"}, None) == 1
+        assert ("crm_activity", "a1") in rcx["direct"]._parked_erp_changes
+        assert bc.erp_router.route("crm_product", "p1", "INSERT", {}, None) == 0
+        assert not rcx["idle"]._parked_erp_changes
+        assert bc.erp_router.stats()["changes_dropped"] == 1 and bc.erp_router.stats()["deliveries"] == 3
+    asyncio.run(go())
+
+
+def test_lanes_keep_order_per_key_and_limit_concurrency():
+    rnd = random.Random(7)
+
+    async def go():
+        rcx = ckit_bot_exec.RobotContext(None, types.SimpleNamespace(persona_id="p1"), [])
+        rcx._dispatch_concurrently(3, set())   # nothing parked, sets up the semaphore
+        log, running, peak = [], {}, [0]
+
+        async def call(key, n):
+            assert key not in running   # one at a time per key
+            running[key] = n
+            peak[0] = max(peak[0], len(running))
+            log.append((key, n))
+            await asyncio.sleep(rnd.random() * 0.01)
+            del running[key]
+
+        for n in range(60):
+            key = ("thread", "ft%d" % rnd.randrange(8))
+            rcx._lane_push(key, "message", lambda key=key, n=n: call(key, n), "test")
+            if rnd.random() < 0.3:
+                await asyncio.sleep(0.005)   # some events come while lanes are busy, some after they finished
+        while rcx.bg_call_tasks:
+            await asyncio.wait(set(rcx.bg_call_tasks))
+        assert len(log) == 60 and peak[0] == 3
+        for key in {k for k, _ in log}:
+            ns = [n for k, n in log if k == key]
+            assert ns == sorted(ns), key
+        assert rcx._lanes == {} and rcx.handler_stats["message"]["calls"] == 60
+    asyncio.run(go())
+
+
+def test_lane_cancelled_before_first_step():
+    async def go():
+        rcx = ckit_bot_exec.RobotContext(None, types.SimpleNamespace(persona_id="p1"), [])
+        rcx._dispatch_concurrently(2, set())
+        called = []
+
+        async def call():
+            called.append(1)
+
+        rcx._lane_push(("task", "t1"), "task", call, "test")
+        rcx._lane_push(("task", "t1"), "task", call, "test")
+        for t in rcx.bg_call_tasks:
+            t.cancel()   # shutdown before the lane task got to run
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert not called and rcx._lanes == {} and not rcx.bg_call_tasks
+        rcx._lane_push(("task", "t1"), "task", call, "test")   # a new lane for the same key works
+        await asyncio.wait(set(rcx.bg_call_tasks))
+        assert called == [1] and rcx._lanes == {}
+    asyncio.run(go())
+
+
+def benchmark(n_events: int = 10000, n_personas: int = 30) -> None:
+    async def go():
+        for title, full in [("full rescan", True), ("index", False)]:
+            bc = _collection()
+            bc.thread_index.clear()
+            for i in range(n_personas):
+                _start_bot(bc, "persona%02d" % i)
+            t0 = time.perf_counter()
+            _replay(bc, n_events, n_personas=n_personas, max_threads=1000, seed=42, full_rescan_each_time=full)
+            dt = time.perf_counter() - t0
+            print("%-12s %d events %6.3fs, %6.1fus per event" % (title, n_events, dt, dt / n_events * 1e6))
+    asyncio.run(go())
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,7 +1,6 @@
 from dataclasses import dataclass, field
 from typing import Any, List, Optional, Dict
 
-import gql
 
 from flexus_client_kit import ckit_client, gql_utils, ckit_kanban, ckit_shutdown, ckit_cloudtool, ckit_ask_model
 
@@ -83,7 +82,7 @@ class FThreadWithMessages:
 
 async def persona_list(fclient: ckit_client.FlexusClient, fgroup_id: str) -> List[FPersonaOutput]:
     async with (await fclient.use_http()) as http:
-        r = await http.execute(gql.gql(f"""
+        r = await http.execute(gql_utils.gql_cached(f"""
             query PersonaList($fgroup_id: String!) {{
                 persona_list(located_fgroup_id: $fgroup_id, skip: 0, limit: 100) {{
                     {gql_utils.gql_fields(FPersonaOutput)}
@@ -94,7 +93,7 @@ async def persona_list(fclient: ckit_client.FlexusClient, fgroup_id: str) -> Lis
 
 async def personas_in_ws_list(fclient: ckit_client.FlexusClient, ws_id: str) -> List[FPersonaOutput]:
     async with (await fclient.use_http()) as http:
-        r = await http.execute(gql.gql(f"""
+        r = await http.execute(gql_utils.gql_cached(f"""
             query PersonasInWsList($ws_id: String!) {{
                 workspace_personas_list(ws_id: $ws_id, active_only: true) {{
                     personas {{ {gql_utils.gql_fields(FPersonaOutput)} }}
@@ -2,15 +2,17 @@ import os
 import asyncio
 import logging
 from dataclasses import dataclass
-from typing import Optional, Any, List
+from typing import Optional, Any, List, Dict
 
+import aiohttp
 import gql
 import re
+import time
 from gql.transport.websockets import WebsocketsTransport
 from gql.transport.aiohttp import AIOHTTPTransport
 
 from flexus_client_kit import ckit_logs
-from flexus_client_kit import ckit_passwords, gql_utils
+from flexus_client_kit import ckit_passwords, ckit_shutdown, gql_utils
 
 
 logger = logging.getLogger("fclnt")
@@ -26,6 +28,117 @@ export FLEXUS_API_BASEURL=https://flexus.team/
 
 FLEXUS_API_BASEURL_DEFAULT = "https://flexus.team/"
 
+HTTP_POOL_LIMIT = int(os.getenv("FLEXUS_HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("FLEXUS_HTTP_POOL_LIMIT_PER_HOST", "32"))
+HTTP_POOL_KEEPALIVE_SEC = float(os.getenv("FLEXUS_HTTP_POOL_KEEPALIVE_SEC", "30"))
+HTTP_POOL_DRAIN_SEC = 10.0
+
+
+class HttpPool:
+    """
+    Building AIOHTTPTransport and gql.Client for each use_http() is cheap, TCP+TLS handshake for each of them is not.
+    So all the transports borrow one aiohttp connector, and connections stay alive between calls.
+
+    The connector belongs to an event loop, if the loop is gone (another asyncio.run() for example) it gets replaced.
+    A guard task closes it while its loop is still there: asyncio.run() cancels tasks left over before it closes the
+    loop. After close() the pool stays closed, late callers get a private connector per transport, like before pooling.
+    """
+    def __init__(self, limit: int, limit_per_host: int, keepalive_timeout: float):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.in_flight = 0
+        self.sessions_total = 0
+        self.connectors_created = 0
+        self.closed_for_good = False
+        self._connector: Optional[aiohttp.TCPConnector] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._guard: Optional[asyncio.Task] = None
+        self._closer_given = False
+
+    def connector(self) -> Optional[aiohttp.TCPConnector]:
+        if self.closed_for_good:
+            return None
+        loop = asyncio.get_running_loop()
+        if self._connector is None or self._connector.closed or self._loop is not loop:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+                enable_cleanup_closed=True,
+            )
+            self._loop = loop
+            self._guard = loop.create_task(self._close_with_loop(self._connector))
+            self.connectors_created += 1
+            if not self._closer_given:
+                ckit_shutdown.give_closer("http_pool", self.close)
+                self._closer_given = True
+        return self._connector
+
+    async def _close_with_loop(self, c: aiohttp.TCPConnector) -> None:
+        try:
+            await asyncio.Future()   # cancelled when the loop shuts down, or by close()
+        finally:
+            if not c.closed:
+                await c.close()
+
+    def health(self) -> Dict[str, Any]:
+        c = self._connector
+        alive = c is not None and not c.closed
+        return {
+            "ok": not self.closed_for_good and (c is None or alive),
+            "connector_alive": alive,
+            "closed_for_good": self.closed_for_good,
+            "in_flight": self.in_flight,
+            "sessions_total": self.sessions_total,
+            "connectors_created": self.connectors_created,
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+        }
+
+    async def close(self, drain_timeout: float = HTTP_POOL_DRAIN_SEC) -> None:
+        self.closed_for_good = True
+        t0 = time.time()
+        while self.in_flight > 0 and time.time() - t0 < drain_timeout:
+            await asyncio.sleep(0.1)
+        if self.in_flight > 0:
+            logger.warning("http pool closing with %d requests still in flight", self.in_flight)
+        c, self._connector, self._loop, guard, self._guard = self._connector, None, None, self._guard, None
+        if c is not None and not c.closed:
+            await c.close()
+        if guard is not None:
+            guard.cancel()
+
+
+class PooledAIOHTTPTransport(AIOHTTPTransport):
+    def __init__(self, pool: HttpPool, **kwargs):
+        super().__init__(**kwargs)
+        self._pool = pool
+        self._counted = False
+
+    async def connect(self) -> None:
+        connector = self._pool.connector()
+        if connector is not None:
+            self.client_session_args = {"connector": connector, "connector_owner": False}
+        await super().connect()
+        self._pool.in_flight += 1
+        self._pool.sessions_total += 1
+        self._counted = True
+
+    async def close(self) -> None:
+        try:
+            if self.session is not None and self.client_session_args:
+                await self.session.close()   # connector_owner=False, so it only detaches from the shared connector
+            await super().close()
+        finally:
+            if self._counted:
+                self._counted = False
+                self._pool.in_flight -= 1
+
+
+http_pool = HttpPool(HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_POOL_KEEPALIVE_SEC)
+
 
 class FlexusClient:
     def __init__(self,
@@ -85,7 +198,7 @@ class FlexusClient:
                 "x-flexus-superuser": superpassword_curr,
                 "x-flexus-service-name": self.service_name,
             }
-        transport = AIOHTTPTransport(url=self.http_url, headers=headers)
+        transport = PooledAIOHTTPTransport(http_pool, url=self.http_url, headers=headers)
         return gql.Client(transport=transport, fetch_schema_from_transport=False, execute_timeout=execute_timeout)
 
     async def use_ws(self) -> gql.Client:
@@ -110,6 +223,25 @@ class FlexusClient:
         return gql.Client(transport=transport, fetch_schema_from_transport=False)
 
 
+async def http_pool_health_check(client: FlexusClient, timeout: float = 5) -> Dict[str, Any]:
+    """
+    Sends the cheapest possible query through the shared pool, returns pool stats plus round-trip time.
+    """
+    t0 = time.time()
+    error = None
+    try:
+        http = await client.use_http(execute_timeout=timeout)
+        async with http as h:
+            await h.execute(gql_utils.gql_cached("query CkitHealth { __typename }"))
+    except Exception as e:
+        error = "%s %s" % (type(e).__name__, e)
+    r = http_pool.health()
+    r["roundtrip_ms"] = (time.time() - t0) * 1000
+    r["error"] = error
+    r["ok"] = r["ok"] and error is None
+    return r
+
+
 def marketplace_version_as_int(v: str) -> int:
     if not re.match(r'^\d{1,4}\.\d{1,4}\.\d{1,4}$', v):
         raise ValueError('bad version')
@@ -171,7 +303,7 @@ async def query_basic_stuff(
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(f"""query CkitClientTest($w: Boolean!) {{
+            gql_utils.gql_cached(f"""query CkitClientTest($w: Boolean!) {{
                 query_basic_stuff(want_invitations: $w) {{
                     {gql_utils.gql_fields(BasicStuffOutput)}
                 }}
@@ -0,0 +1,78 @@
+import asyncio
+
+import aiohttp
+import aiohttp.web
+
+from flexus_client_kit import ckit_client, ckit_shutdown, gql_utils
+
+
+def test_http_pool_shares_one_connector_and_closes_at_shutdown():
+    peers = set()
+
+    async def graphql(request: aiohttp.web.Request) -> aiohttp.web.Response:
+        peers.add(request.transport.get_extra_info("peername"))
+        return aiohttp.web.json_response({"data": {"__typename": "Query"}})
+
+    async def query(client: ckit_client.FlexusClient) -> tuple:
+        async with await client.use_http() as h:
+            await h.execute(gql_utils.gql_cached("query CkitHealth { __typename }"))
+            session = h.transport.session
+            return session, session.connector, session.connector_owner
+
+    async def go():
+        app = aiohttp.web.Application()
+        app.router.add_post("/v1/graphql", graphql)
+        runner = aiohttp.web.AppRunner(app)
+        await runner.setup()
+        site = aiohttp.web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        try:
+            host, port = runner.addresses[0][:2]
+            client = ckit_client.FlexusClient("pool_test", api_key="fx-test", base_url="http://%s:%d" % (host, port), skip_logger_init=True)
+            used = [await query(client) for _ in range(3)]
+            connector = ckit_client.http_pool.connector()
+            assert all(c is connector and owner is False for _, c, owner in used)
+            assert all(s.closed for s, _, _ in used) and not connector.closed
+            assert len(peers) == 1   # one TCP connection, kept alive between sessions
+            health = ckit_client.http_pool.health()
+            assert health["ok"] and health["sessions_total"] == 3 and health["in_flight"] == 0 and health["connectors_created"] == 1
+
+            ckit_shutdown.spiral_down_now(asyncio.get_running_loop(), enable_exit1=False)
+            assert len(ckit_shutdown.closing_tasks) == 1   # the draining close is referenced until it's done
+            for _ in range(100):
+                if connector.closed:
+                    break
+                await asyncio.sleep(0.01)
+            assert connector.closed and ckit_client.http_pool.health()["closed_for_good"]
+            _, late, owner = await query(client)   # after shutdown, a private connector like before pooling
+            assert late is not connector and owner is True
+        finally:
+            await runner.cleanup()
+
+    orig_pool, orig_event, orig_closers = ckit_client.http_pool, ckit_shutdown.shutdown_event, dict(ckit_shutdown.closers)
+    ckit_client.http_pool = ckit_client.HttpPool(10, 10, 30)
+    ckit_shutdown.shutdown_event = asyncio.Event()
+    try:
+        asyncio.run(go())
+    finally:
+        ckit_client.http_pool, ckit_shutdown.shutdown_event = orig_pool, orig_event
+        ckit_shutdown.closers.clear()
+        ckit_shutdown.closers.update(orig_closers)
+
+
+def test_http_pool_closes_connector_of_a_finished_loop():
+    async def use() -> aiohttp.TCPConnector:
+        return ckit_client.http_pool.connector()
+
+    orig_pool, orig_closers = ckit_client.http_pool, dict(ckit_shutdown.closers)
+    ckit_client.http_pool = ckit_client.HttpPool(10, 10, 30)
+    try:
+        first = asyncio.run(use())
+        assert first.closed   # closed by asyncio.run() on the way out, not left for the garbage collector
+        second = asyncio.run(use())
+        assert second is not first and second.closed and ckit_client.http_pool.connectors_created == 2
+        assert ckit_shutdown.closers["http_pool"] == ckit_client.http_pool.close
+    finally:
+        ckit_client.http_pool = orig_pool
+        ckit_shutdown.closers.clear()
+        ckit_shutdown.closers.update(orig_closers)
@@ -1,9 +1,11 @@
 import asyncio
+import collections
+import heapq
 import json
 import logging
 import time
 from dataclasses import dataclass
-from typing import Any, Callable, Awaitable, List, Set, Optional, Tuple
+from typing import Any, Callable, Awaitable, Dict, List, Set, Optional, Tuple
 
 import gql
 import websockets
@@ -11,6 +13,7 @@ import websockets.exceptions
 from gql.transport.exceptions import TransportQueryError
 
 from flexus_client_kit import ckit_client
+from flexus_client_kit import ckit_heartbeat
 from flexus_client_kit import ckit_shutdown
 from flexus_client_kit import ckit_utils
 from flexus_client_kit import ckit_passwords
@@ -177,10 +180,16 @@ async def call_python_function_and_save_result(
     the_python_function: Callable[[ckit_client.FlexusClient, FCloudtoolCall, Any], Awaitable[Tuple[str | ToolResult, str] | Tuple[None, None]]],
     service_name: str,
     fclient: ckit_client.FlexusClient,
-) -> None:
+    timeout: float = 0,
+) -> str:
+    outcome = "ok"
+    t0 = time.monotonic()
     try:
         args = json.loads(call.fcall_arguments)
-        result, prov = await the_python_function(fclient, call, args)
+        if timeout > 0:
+            result, prov = await asyncio.wait_for(the_python_function(fclient, call, args), timeout)
+        else:
+            result, prov = await the_python_function(fclient, call, args)
         # NOTE: here we have 2 allowed variants for output
         # 1. (str | ToolResult, str) - immediate answer from handler
         # 2. (None, None) - delayed cloudtool_post_result
@@ -188,9 +197,11 @@ async def call_python_function_and_save_result(
         content = result.content if isinstance(result, ToolResult) else result
         dollars = result.dollars if isinstance(result, ToolResult) else 0.0
         logger.info("/%s %s:%03d:%03d %+d result=%s", call.fcall_id, call.fcall_ft_id, call.fcall_ftm_alt, call.fcall_called_ftm_num, call.fcall_call_n, content[:30] if content is not None else "delayed")
+        if result is None:
+            outcome = "delayed"
     except AlreadyFakedResult:
         logger.info("/%s fake %s:%03d:%03d %+d", call.fcall_id, call.fcall_ft_id, call.fcall_ftm_alt, call.fcall_called_ftm_num, call.fcall_call_n)
-        return
+        return "faked"
     except NeedsConfirmation as e:
         logger.info("%s needs human confirmation: %s", call.fcall_id, e.confirm_explanation)
         try:
@@ -206,20 +217,35 @@ async def call_python_function_and_save_result(
                 logger.info("Confirmation already requested for %s, ignoring", call.fcall_id)
             else:
                 raise
-        return
+        return "confirmation"
+    except asyncio.TimeoutError as e:
+        # On 3.11+ that's the builtin TimeoutError, the tool itself might raise it, only our deadline is a timeout
+        if timeout > 0 and time.monotonic() - t0 >= timeout:
+            logger.warning("call %s %s:%03d:%03d %+d %s timed out after %0.1fs", call.fcall_id, call.fcall_ft_id, call.fcall_ftm_alt, call.fcall_called_ftm_num, call.fcall_call_n, call.fcall_name, timeout)
+            result, prov, dollars = json.dumps(f"Timeout: {call.fcall_name} didn't finish in {timeout:g} seconds"), json.dumps({"system": service_name}), 0.0
+            outcome = "timeout"
+        else:
+            result, prov, dollars = _error_result(call, service_name, e)
+            outcome = "error"
     except Exception as e:
-        logger.warning("error processing call %s %s:%03d:%03d %+d: %s %s" % (call.fcall_id, call.fcall_ft_id, call.fcall_ftm_alt, call.fcall_called_ftm_num, call.fcall_call_n, type(e).__name__, e), exc_info=e)
-        content, prov = json.dumps(f"{type(e).__name__} {e}"), json.dumps({"system": service_name})
+        result, prov, dollars = _error_result(call, service_name, e)
+        outcome = "error"
     if result is not None:
         serialized_result = result if isinstance(result, str) else result.to_serialized()
         await cloudtool_post_result(fclient, call.fcall_id, call.fcall_untrusted_key, serialized_result, prov, dollars)
+    return outcome
+
+
+def _error_result(call: FCloudtoolCall, service_name: str, e: BaseException) -> Tuple[str, str, float]:
+    logger.warning("error processing call %s %s:%03d:%03d %+d: %s %s" % (call.fcall_id, call.fcall_ft_id, call.fcall_ftm_alt, call.fcall_called_ftm_num, call.fcall_call_n, type(e).__name__, e), exc_info=e)
+    return json.dumps(f"{type(e).__name__} {e}"), json.dumps({"system": service_name}), 0.0
 
 
 async def cloudtool_post_result(fclient: ckit_client.FlexusClient, fcall_id: str, fcall_untrusted_key: str, content: str, prov: str, dollars: float = 0.0, as_placeholder: bool = False):
     http_client = await fclient.use_http()
     async with http_client as http:
         await http.execute(
-            gql.gql("""mutation CloudtoolPost($input: CloudtoolResultInput!, $as_placeholder: Boolean!) {
+            gql_utils.gql_cached("""mutation CloudtoolPost($input: CloudtoolResultInput!, $as_placeholder: Boolean!) {
                 cloudtool_post_result(input: $input, as_placeholder: $as_placeholder)
             }"""),
             variable_values={
@@ -296,7 +322,7 @@ async def cloudtool_confirmation_request(
     http_client = await fclient.use_http()
     async with http_client as http:
         await http.execute(
-            gql.gql("""mutation CloudtoolConfirmationRequest(
+            gql_utils.gql_cached("""mutation CloudtoolConfirmationRequest(
                 $fcall_id: String!,
                 $confirm_setup_key: String!,
                 $confirm_command: String!,
@@ -325,41 +351,167 @@ async def cloudtool_i_am_still_alive(
         fuser_id: Optional[str],
         shared: bool,
 ) -> None:
-    while not ckit_shutdown.shutdown_event.is_set():
-        try:
-            http_client = await fclient.use_http()
-            async with http_client as http:
-                for t in tool_list:
-                    await http.execute(
-                        gql.gql("""mutation CloudtoolConfirm($name: String!, $desc: String!, $params: String!, $fgroup_id: String, $fuser_id: String, $shared: Boolean!) {
-                            cloudtool_confirm_exists(tool_name: $name, ctool_description: $desc, ctool_parameters: $params, fgroup_id: $fgroup_id, fuser_id: $fuser_id, shared: $shared)
-                        }"""),
-                        variable_values={
-                            "name": t.name,
-                            "desc": t.description,
-                            "params": json.dumps(t.parameters),
-                            "fgroup_id": fgroup_id,
-                            "fuser_id": fuser_id,
-                            "shared": shared,
-                        },
-                    )
-                    # logger.info("cloudtool_i_am_still_alive %s", t.name)
-            if await ckit_shutdown.wait(120):
-                break
+    keys = []
+    for t in tool_list:
+        key = "cloudtool:%s:%s:%s" % (t.name, fgroup_id, fuser_id)
+        ckit_heartbeat.heartbeat_register(fclient, key, ckit_heartbeat.HeartbeatItem("cloudtool_confirm_exists", {
+            "tool_name": ("String!", t.name),
+            "ctool_description": ("String!", t.description),
+            "ctool_parameters": ("String!", json.dumps(t.parameters)),
+            "fgroup_id": ("String", fgroup_id),
+            "fuser_id": ("String", fuser_id),
+            "shared": ("Boolean!", shared),
+        }))
+        keys.append(key)
+    try:
+        await ckit_shutdown.shutdown_event.wait()   # or cancelled when the service reconnects
+    finally:
+        for key in keys:
+            ckit_heartbeat.heartbeat_unregister(fclient, key)
+
+
+@dataclass
+class CloudtoolPolicy:
+    max_concurrent: int = 0   # 0 means only max_tasks of the whole service applies
+    priority: int = 0         # higher goes first when calls wait for a free slot
+    timeout: float = 0        # seconds, 0 means wait forever
+
 
-        except (
-            gql.transport.exceptions.TransportError,
-            OSError,
-            asyncio.exceptions.TimeoutError
-        ) as e:
-            if "403:" in str(e):
-                # It's gql.transport.exceptions.TransportQueryError with {'message': "403: Whoops your key didn't work (1).", ...}
-                # Unfortunately, no separate exception class for 403
-                logger.error("That looks bad, my key doesn't work: %s", e)
+class CloudtoolWorkerPool:
+    """
+    Admission for tool calls: at most max_tasks running in total, at most policy.max_concurrent per tool. When
+    the pool is full calls wait, and a freed slot goes to the highest priority waiting call whose tool has room,
+    FIFO within the same priority. A slow tool with a cap can't eat the whole pool anymore.
+
+    The subscription reader submit()s calls and waits in wait_for_room() when max_tasks calls are already in,
+    so running + waiting never goes above max_tasks.
+    """
+
+    def __init__(self, service_name: str, max_tasks: int, policies: Optional[Dict[str, CloudtoolPolicy]] = None):
+        self.service_name = service_name
+        self.max_tasks = max_tasks
+        self.policies = policies or {}
+        self.running_total = 0
+        self.running = collections.Counter()
+        self.waiting = collections.Counter()
+        self.outcomes: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+        self.queue_wait_hist: Dict[str, ckit_utils.LatencyHistogram] = collections.defaultdict(ckit_utils.LatencyHistogram)
+        self.exec_hist: Dict[str, ckit_utils.LatencyHistogram] = collections.defaultdict(ckit_utils.LatencyHistogram)
+        self._heap: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._seq = 0
+        self.submitted = 0   # calls given to submit() and not finished yet, running or waiting
+        self._room_waiters: List[asyncio.Future] = []
+
+    def policy(self, tool_name: str) -> CloudtoolPolicy:
+        return self.policies.get(tool_name) or CloudtoolPolicy()
+
+    def waiting_total(self) -> int:
+        return sum(self.waiting.values())
+
+    def _tool_has_room(self, tool_name: str) -> bool:
+        cap = self.policy(tool_name).max_concurrent
+        return cap <= 0 or self.running[tool_name] < cap
+
+    def _dispatch(self) -> None:
+        blocked = []
+        while self._heap and self.running_total < self.max_tasks:
+            item = heapq.heappop(self._heap)
+            _, _, tool_name, fut = item
+            if fut.done():   # cancelled while waiting
+                continue
+            if not self._tool_has_room(tool_name):
+                blocked.append(item)
+                continue
+            self.waiting[tool_name] -= 1
+            self.running[tool_name] += 1
+            self.running_total += 1
+            fut.set_result(None)
+        for item in blocked:
+            heapq.heappush(self._heap, item)
+
+    def _release(self, tool_name: str) -> None:
+        self.running[tool_name] -= 1
+        self.running_total -= 1
+        self._dispatch()
+
+    async def _admit(self, tool_name: str) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._heap, (-self.policy(tool_name).priority, self._seq, tool_name, fut))
+        self.waiting[tool_name] += 1
+        self._dispatch()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.cancelled():
+                self.waiting[tool_name] -= 1
             else:
-                logger.info("cloudtool_i_am_still_alive connection problem")
-            if await ckit_shutdown.wait(60):
-                break
+                self._release(tool_name)   # got the slot right before being cancelled
+            raise
+
+    async def run(self, tool_name: str, work: Callable[[], Awaitable[str]]) -> str:
+        t0 = time.time()
+        await self._admit(tool_name)
+        t1 = time.time()
+        self.queue_wait_hist[tool_name].observe(t1 - t0)
+        outcome = "crash"
+        try:
+            outcome = await work()
+            return outcome
+        finally:
+            self.exec_hist[tool_name].observe(time.time() - t1)
+            self.outcomes[tool_name][outcome] += 1
+            self._release(tool_name)
+
+    def submit(self, tool_name: str, work: Callable[[], Awaitable[str]]) -> asyncio.Task:
+        self.submitted += 1
+        t = asyncio.create_task(self.run(tool_name, work))
+        t.add_done_callback(self._submitted_done)
+        return t
+
+    def _submitted_done(self, _t: asyncio.Task) -> None:
+        self.submitted -= 1
+        for fut in self._room_waiters:
+            if not fut.done():
+                fut.set_result(None)
+        self._room_waiters.clear()
+
+    async def wait_for_room(self) -> None:
+        # Backpressure for the reader of calls: returns when fewer than max_tasks calls are submitted
+        while self.submitted >= self.max_tasks:
+            fut = asyncio.get_running_loop().create_future()
+            self._room_waiters.append(fut)
+            await fut
+
+    def state(self) -> Dict[str, Any]:
+        tools = {}
+        for tool_name in sorted(set(self.policies) | set(self.exec_hist) | set(self.waiting)):
+            p = self.policy(tool_name)
+            tools[tool_name] = {
+                "running": self.running[tool_name],
+                "waiting": self.waiting[tool_name],
+                "max_concurrent": p.max_concurrent,
+                "priority": p.priority,
+                "timeout": p.timeout,
+                "outcomes": dict(self.outcomes[tool_name]),
+                "queue_wait": self.queue_wait_hist[tool_name].summary(),
+                "exec": self.exec_hist[tool_name].summary(),
+            }
+        return {
+            "service_name": self.service_name,
+            "max_tasks": self.max_tasks,
+            "running": self.running_total,
+            "waiting": self.waiting_total(),
+            "tools": tools,
+        }
+
+
+cloudtool_pools: Dict[str, CloudtoolWorkerPool] = {}
+
+
+def cloudtool_pool_state(service_name: str) -> Optional[Dict[str, Any]]:
+    pool = cloudtool_pools.get(service_name)
+    return pool.state() if pool else None
 
 
 async def run_cloudtool_service_real(
@@ -372,7 +524,11 @@ async def run_cloudtool_service_real(
     fgroup_id: Optional[str],
     fuser_id: Optional[str],
     shared: bool,
+    pool: Optional[CloudtoolWorkerPool] = None,
 ) -> None:
+    if pool is None:
+        pool = CloudtoolWorkerPool(service_name, max_tasks)
+    cloudtool_pools[service_name] = pool
     fclient = ckit_client.FlexusClient(
         service_name,
         endpoint=endpoint,
@@ -389,16 +545,19 @@ async def run_cloudtool_service_real(
         while not ckit_shutdown.shutdown_event.is_set():
             if await ckit_shutdown.wait(1):
                 break
-            if len(workset) == 0:
+            if pool.running_total == 0:
                 idle_sec += 1
-            if len(workset) == max_tasks:
+            if pool.running_total >= max_tasks:
                 full_sec += 1
             now_minute = int(time.time() // 60)
             if now_minute != minute:
                 if badstat:
                     badstat = False
                 else:
-                    logger.info("idle %0.1f%% full %0.1f%% now %d %s", (idle_sec * 100 / 60), (full_sec * 100 / 60), len(workset), service_name)
+                    logger.info("idle %0.1f%% full %0.1f%% now %d waiting %d %s", (idle_sec * 100 / 60), (full_sec * 100 / 60), pool.running_total, pool.waiting_total(), service_name)
+                    for tool_name, st in pool.state()["tools"].items():
+                        if st["exec"]["n"]:
+                            logger.info("  %s wait p95 %0.2fs exec p50 %0.2fs p95 %0.2fs %s", tool_name, st["queue_wait"]["p95"], st["exec"]["p50"], st["exec"]["p95"], st["outcomes"])
                 idle_sec = 0
                 full_sec = 0
                 minute = now_minute
@@ -418,7 +577,7 @@ async def run_cloudtool_service_real(
 
     try:
         async with ws_client as ws:
-            async for r in ws.subscribe(gql.gql(
+            async for r in ws.subscribe(gql_utils.gql_cached(
                 f"""subscription CloudtoolWait($names: [String!]!, $fgroup_id: String, $fuser_id: String) {{
                     cloudtool_wait_for_call(tool_names: $names, fgroup_id: $fgroup_id, fuser_id: $fuser_id) {{
                         {gql_utils.gql_fields(FCloudtoolCall)}
@@ -430,14 +589,18 @@ async def run_cloudtool_service_real(
                     "fuser_id": None if shared else fuser_id,
                 }
             ):
-                while len(workset) >= max_tasks:
-                    logger.warning("too many tasks %d, sleeping instead of reading subs", len(workset))
-                    if await ckit_shutdown.wait(1):
-                        break
+                if pool.submitted >= max_tasks:
+                    logger.warning("too many tasks waiting %d (running %d), not reading subs until one finishes", pool.waiting_total(), pool.running_total)
+                    room = asyncio.create_task(pool.wait_for_room())
+                    shutdown = asyncio.create_task(ckit_shutdown.shutdown_event.wait())
+                    await asyncio.wait([room, shutdown], return_when=asyncio.FIRST_COMPLETED)
+                    room.cancel()
+                    shutdown.cancel()
                 call = gql_utils.dataclass_from_dict(r["cloudtool_wait_for_call"], FCloudtoolCall)
                 logger.info(" %s %s:%03d:%03d %+d %s(%s)", call.fcall_id, call.fcall_ft_id, call.fcall_ftm_alt, call.fcall_called_ftm_num, call.fcall_call_n, call.fcall_name, str(call.fcall_arguments)[:20])
 
-                t = asyncio.create_task(call_python_function_and_save_result(call, the_python_function, service_name, fclient))
+                work = lambda c=call: call_python_function_and_save_result(c, the_python_function, service_name, fclient, timeout=pool.policy(c.fcall_name).timeout)
+                t = pool.submit(call.fcall_name, work)
                 t.add_done_callback(lambda t, c = call: workset_done(t, c))
                 workset.add(t)
     finally:
@@ -459,7 +622,9 @@ async def run_cloudtool_service(
     fgroup_id: Optional[str] = None,
     fuser_id: Optional[str] = None,
     shared: bool = True,
+    tool_policies: Optional[Dict[str, CloudtoolPolicy]] = None,
 ) -> None:
+    pool = CloudtoolWorkerPool(service_name, max_tasks, tool_policies)   # survives reconnects, so the stats do too
     while not ckit_shutdown.shutdown_event.is_set():
         try:
             await run_cloudtool_service_real(
@@ -472,6 +637,7 @@ async def run_cloudtool_service(
                 fgroup_id,
                 fuser_id,
                 shared,
+                pool,
             )
 
         except (websockets.exceptions.ConnectionClosedError, gql.transport.exceptions.TransportError, OSError):
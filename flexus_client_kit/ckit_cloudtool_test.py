@@ -0,0 +1,174 @@
+import asyncio
+import json
+import time
+import types
+
+from flexus_client_kit import ckit_cloudtool
+
+
+def _pool(max_tasks: int, **policies) -> ckit_cloudtool.CloudtoolWorkerPool:
+    return ckit_cloudtool.CloudtoolWorkerPool("test_service", max_tasks, policies)
+
+
+def test_pool_priority_and_per_tool_cap():
+    async def go():
+        pool = _pool(2, slow=ckit_cloudtool.CloudtoolPolicy(max_concurrent=1), urgent=ckit_cloudtool.CloudtoolPolicy(priority=10))
+        started = []
+        gates = {}
+
+        def work(name: str):
+            async def w():
+                started.append(name)
+                gates[name] = asyncio.Event()
+                await gates[name].wait()
+                return "ok"
+            return w
+
+        tasks = [asyncio.create_task(pool.run(name.split("_")[0], work(name))) for name in ["slow_1", "slow_2", "normal_1", "urgent_1"]]
+        await asyncio.sleep(0.01)
+        # slow is capped at 1, so normal_1 takes the second slot even though slow_2 came first
+        assert started == ["slow_1", "normal_1"]
+        assert pool.state()["waiting"] == 2
+        gates["normal_1"].set()
+        await asyncio.sleep(0.01)
+        assert started == ["slow_1", "normal_1", "urgent_1"]
+        gates["urgent_1"].set()
+        gates["slow_1"].set()
+        await asyncio.sleep(0.01)
+        assert started[-1] == "slow_2"
+        gates["slow_2"].set()
+        await asyncio.gather(*tasks)
+        st = pool.state()
+        assert st["running"] == 0 and st["waiting"] == 0
+        assert st["tools"]["slow"]["outcomes"] == {"ok": 2}
+        assert st["tools"]["slow"]["exec"]["n"] == 2
+    asyncio.run(go())
+
+
+def test_pool_cancel_while_waiting():
+    async def go():
+        pool = _pool(1)
+        gate = asyncio.Event()
+
+        async def w():
+            await gate.wait()
+            return "ok"
+
+        t1 = asyncio.create_task(pool.run("a", w))
+        t2 = asyncio.create_task(pool.run("b", w))
+        await asyncio.sleep(0.01)
+        t2.cancel()
+        await asyncio.sleep(0.01)
+        assert pool.state()["waiting"] == 0
+        gate.set()
+        await t1
+        assert pool.running_total == 0
+        assert await pool.run("c", w) == "ok"
+    asyncio.run(go())
+
+
+def test_timeout_posts_result():
+    async def go():
+        posted = []
+
+        async def fake_post(fclient, fcall_id, fcall_untrusted_key, content, prov, dollars=0.0, as_placeholder=False):
+            posted.append(json.loads(content))
+
+        async def hangs(fclient, call, args):
+            await asyncio.sleep(10)
+            return "never", "{}"
+
+        call = types.SimpleNamespace(
+            fcall_id="call1", fcall_ft_id="ft1", fcall_ftm_alt=100, fcall_called_ftm_num=1, fcall_call_n=0,
+            fcall_name="hangs", fcall_arguments="{}", fcall_untrusted_key="key",
+        )
+        orig = ckit_cloudtool.cloudtool_post_result
+        ckit_cloudtool.cloudtool_post_result = fake_post
+        try:
+            outcome = await ckit_cloudtool.call_python_function_and_save_result(call, hangs, "test_service", None, timeout=0.05)
+        finally:
+            ckit_cloudtool.cloudtool_post_result = orig
+        assert outcome == "timeout"
+        assert posted == ["Timeout: hangs didn't finish in 0.05 seconds"]
+    asyncio.run(go())
+
+
+def test_own_timeout_error_is_an_error():
+    async def go():
+        posted = []
+
+        async def fake_post(fclient, fcall_id, fcall_untrusted_key, content, prov, dollars=0.0, as_placeholder=False):
+            posted.append(json.loads(content))
+
+        async def raises(fclient, call, args):
+            raise TimeoutError("upstream api took too long")
+
+        call = types.SimpleNamespace(
+            fcall_id="call1", fcall_ft_id="ft1", fcall_ftm_alt=100, fcall_called_ftm_num=1, fcall_call_n=0,
+            fcall_name="raises", fcall_arguments="{}", fcall_untrusted_key="key",
+        )
+        orig = ckit_cloudtool.cloudtool_post_result
+        ckit_cloudtool.cloudtool_post_result = fake_post
+        try:
+            for timeout in [0, 30]:
+                assert await ckit_cloudtool.call_python_function_and_save_result(call, raises, "test_service", None, timeout=timeout) == "error"
+        finally:
+            ckit_cloudtool.cloudtool_post_result = orig
+        assert posted == ["TimeoutError upstream api took too long"] * 2
+    asyncio.run(go())
+
+
+def test_backpressure_waits_for_the_pool():
+    async def go():
+        pool = _pool(3)
+        gates = [asyncio.Event() for _ in range(5)]
+        most = 0
+
+        def work(i):
+            async def w():
+                await gates[i].wait()
+                return "ok"
+            return w
+
+        async def reader():
+            nonlocal most
+            for i in range(5):
+                await pool.wait_for_room()
+                pool.submit("t", work(i))
+                most = max(most, pool.submitted)
+
+        r = asyncio.create_task(reader())
+        await asyncio.sleep(0.01)
+        assert pool.submitted == 3 and not r.done()
+        gates[1].set()
+        await asyncio.sleep(0.01)
+        assert pool.submitted == 3 and not r.done()   # took the next one right away, no polling
+        for g in gates:
+            g.set()
+        await asyncio.wait_for(r, 1)
+        await asyncio.sleep(0.01)
+        assert most == 3 and pool.submitted == 0 and pool.outcomes["t"]["ok"] == 5
+    asyncio.run(go())
+
+
+def benchmark(n_calls: int = 2000, max_tasks: int = 64) -> None:
+    # Each call holds its slot for 10ms, the old admission loop polled once per second when full
+    async def go():
+        pool = _pool(max_tasks)
+
+        async def w():
+            await asyncio.sleep(0.01)
+            return "ok"
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*[pool.run("tool%d" % (i % 5), w) for i in range(n_calls)])
+        dt = time.perf_counter() - t0
+        ideal = n_calls / max_tasks * 0.01
+        print("%d calls, max_tasks=%d: %0.3fs (ideal %0.3fs)" % (n_calls, max_tasks, dt, ideal))
+        for tool_name, st in pool.state()["tools"].items():
+            print("  %s wait p50 %0.3fs p95 %0.3fs" % (tool_name, st["queue_wait"]["p50"], st["queue_wait"]["p95"]))
+    asyncio.run(go())
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -2,7 +2,6 @@ import json
 import logging
 from dataclasses import dataclass
 from typing import Any, Dict, List, Optional
-import gql
 
 from flexus_client_kit import ckit_client, gql_utils
 
@@ -29,7 +28,7 @@ async def dev_environments_list_in_subgroups(
     http = await fclient.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 f"""query DevEnvListInSubgroups($fgroup_id: String!) {{
                     dev_environments_list_in_subgroups(fgroup_id: $fgroup_id) {{
                         {gql_utils.gql_fields(FDevEnvironmentOutput)}
@@ -52,7 +51,7 @@ async def dev_environment_create(
 ) -> FDevEnvironmentOutput:
     http = await fclient.use_http()
     async with http as h:
-        r = await h.execute(gql.gql(f"""
+        r = await h.execute(gql_utils.gql_cached(f"""
             mutation CreateDevEnv($input: FDevEnvironmentInput!, $fuser_id: String) {{
                 dev_environment_create(input: $input, fuser_id: $fuser_id) {{
                     {gql_utils.gql_fields(FDevEnvironmentOutput)}
@@ -88,7 +87,7 @@ async def dev_environment_patch(
         patch["devenv_env_vars"] = json.dumps(env_vars)
     http = await fclient.use_http()
     async with http as h:
-        r = await h.execute(gql.gql(f"""
+        r = await h.execute(gql_utils.gql_cached(f"""
             mutation PatchDevEnv($id: String!, $patch: FDevEnvironmentPatch!, $fuser_id: String) {{
                 dev_environment_patch(id: $id, patch: $patch, fuser_id: $fuser_id) {{
                     {gql_utils.gql_fields(FDevEnvironmentOutput)}
@@ -102,7 +101,7 @@ async def dev_environment_delete(fclient: ckit_client.FlexusClient, devenv_id: s
     http = await fclient.use_http()
     async with http as h:
         await h.execute(
-            gql.gql("""mutation DeleteDevEnv($id: String!, $fuser_id: String) {
+            gql_utils.gql_cached("""mutation DeleteDevEnv($id: String!, $fuser_id: String) {
                 dev_environment_delete(id: $id, fuser_id: $fuser_id)
             }"""),
             variable_values={"id": devenv_id, "fuser_id": fuser_id},
@@ -120,7 +119,7 @@ async def dev_environment_create_apikey(
 ) -> FDevEnvApiKeyOutput:
     http = await fclient.use_http()
     async with http as h:
-        r = await h.execute(gql.gql("""
+        r = await h.execute(gql_utils.gql_cached("""
             mutation BobCreateDevEnvApiKey($devenv_id: String!, $fuser_id: String!) {
                 dev_environment_create_apikey(devenv_id: $devenv_id, fuser_id: $fuser_id) {
                     apikey_id
@@ -134,7 +133,7 @@ async def dev_environment_create_apikey(
 async def dev_environment_get_github_auth_url(fclient: ckit_client.FlexusClient, devenv_id: str) -> str:
     http = await fclient.use_http()
     async with http as h:
-        r = await h.execute(gql.gql("""
+        r = await h.execute(gql_utils.gql_cached("""
             query BobGetGitHubAuthUrl($devenv_id: String!) {
                 dev_environment_get_github_auth_url(devenv_id: $devenv_id)
             }"""),
@@ -1,7 +1,6 @@
 import logging
 from dataclasses import dataclass
 from typing import AsyncGenerator, Dict, List, Any, Optional
-import gql
 
 from flexus_client_kit import ckit_client, gql_utils
 
@@ -48,7 +47,7 @@ async def edoc_get_existing_documents_for_eds(
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 f"""query EdocList($id: String!) {{
                     edoc_list_superuser(eds_id: $id) {{
                         {gql_utils.gql_fields(FEdocOutput)}
@@ -78,7 +77,7 @@ async def edoc_delete_batch(
         for i in range(0, len(edoc_ids), MAX_EDOCS_PER_REQ):
             batch = edoc_ids[i:i + MAX_EDOCS_PER_REQ]
             r = await h.execute(
-                gql.gql(
+                gql_utils.gql_cached(
                     """mutation EdocDel($ws_id: String!, $eds_id: String!, $eds_type: String!, $edoc_ids: [String!]!) {
                         edoc_delete_multi(ws_id: $ws_id, eds_id: $eds_id, eds_type: $eds_type, edoc_ids: $edoc_ids)
                     }""",
@@ -145,7 +144,7 @@ async def edoc_create(
     http_client = await client.use_http()
     async with http_client as http:
         result = await http.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation EdocUpsert($p: FEdocInput!) {
                     edoc_upsert(p: $p)
                 }""",
@@ -164,7 +163,7 @@ async def edoc_patch(
     http_client = await client.use_http()
     async with http_client as http:
         result = await http.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation EdocUpdate($p: FEdocPatch!) {
                     edoc_update(p: $p)
                 }""",
@@ -183,7 +182,7 @@ async def edoc_upsert(
     http_client = await client.use_http()
     async with http_client as http:
         result = await http.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation EdocUpsert($p: FEdocInput!) {
                     edoc_upsert(p: $p)
                 }""",
@@ -201,7 +200,7 @@ async def subscribe_to_eds_types(
     ws_id: Optional[str] = None,
 ) -> AsyncGenerator[FExternalDataSourceSubs, None]:
     async with ws_client as ws:
-        async for r in ws.subscribe(gql.gql(
+        async for r in ws.subscribe(gql_utils.gql_cached(
             f"""subscription EdsSubs($types: [String!]!, $ws_id: String) {{
                 eds_subs(eds_types: $types, ws_id: $ws_id) {{
                     {gql_utils.gql_fields(FExternalDataSourceSubs)}
@@ -214,7 +213,7 @@ async def eds_report_error(fclient: ckit_client.FlexusClient, eds_id: str, error
     http = await fclient.use_http()
     async with http as h:
         await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation EdsError($eds_id: String!, $error_msg: String!) {
                     eds_error(eds_id: $eds_id, error_msg: $error_msg)
                 }""",
@@ -228,7 +227,7 @@ async def eds_mark_success(fclient: ckit_client.FlexusClient, eds_id: str):
     http = await fclient.use_http()
     async with http as h:
         await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation EdsMarkSuccess($eds_id: String!) {
                     eds_mark_success(eds_id: $eds_id)
                 }""",
@@ -1,11 +1,17 @@
-from typing import List, Type, TypeVar, Any, Union
+from typing import List, Type, TypeVar, Any, Union, Callable, Dict, Optional, Tuple
 import asyncio
+import collections
+import copy
 import dataclasses
 import json
-import gql
+import logging
+import operator
+import os
 
 from flexus_client_kit import ckit_client, gql_utils, erp_schema
 
+logger = logging.getLogger("erp")
+
 T = TypeVar('T')
 
 
@@ -34,10 +40,18 @@ async def query_erp_table(
         for inc_field in include:
             assert inc_field in result_class.__annotations__, f"Field {inc_field!r} not in {result_class.__name__}"
 
+    cache = erp_cache if erp_cache is not None and not include and erp_cache.is_watched(table_name) else None
+    if cache:
+        qkey = cache.query_key(skip, limit, sort_by, filters)
+        cached_rows = cache.lookup(ws_id, table_name, qkey, filters)
+        if cached_rows is not None:
+            return [gql_utils.dataclass_from_dict(row, result_class) for row in cached_rows]
+        generation = cache.generation(table_name)
+
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql("""query ErpTableQuery(
+            gql_utils.gql_cached("""query ErpTableQuery(
                 $schema_name: String!,
                 $table_name: String!,
                 $ws_id: String!,
@@ -70,6 +84,8 @@ async def query_erp_table(
             },
         )
         rows = r["erp_table_data"]
+        if cache:
+            cache.store(ws_id, table_name, qkey, filters, rows, generation)
         return [gql_utils.dataclass_from_dict(row, result_class) for row in rows]
 
 
@@ -81,7 +97,7 @@ async def create_erp_record(
 ) -> int:
     http = await client.use_http()
     async with http as h:
-        r = await h.execute(gql.gql("""
+        r = await h.execute(gql_utils.gql_cached("""
             mutation ErpTableCreate($schema_name: String!, $table_name: String!, $ws_id: String!, $record_json: String!) {
                 erp_table_create(schema_name: $schema_name, table_name: $table_name, ws_id: $ws_id, record_json: $record_json)
             }"""),
@@ -92,6 +108,8 @@ async def create_erp_record(
                 "record_json": json.dumps(dataclass_or_dict_to_dict(record)),
             },
         )
+        if erp_cache is not None:
+            erp_cache.forget(ws_id, table_name)
         return r["erp_table_create"]
 
 
@@ -104,7 +122,7 @@ async def patch_erp_record(
 ) -> bool:
     http = await client.use_http()
     async with http as h:
-        r = await h.execute(gql.gql("""
+        r = await h.execute(gql_utils.gql_cached("""
             mutation ErpTablePatch($schema_name: String!, $table_name: String!, $ws_id: String!, $pk_value: String!, $updates_json: String!) {
                 erp_table_patch(schema_name: $schema_name, table_name: $table_name, ws_id: $ws_id, pk_value: $pk_value, updates_json: $updates_json)
             }"""),
@@ -116,6 +134,8 @@ async def patch_erp_record(
                 "updates_json": json.dumps(dataclass_or_dict_to_dict(updates)),
             },
         )
+        if erp_cache is not None:
+            erp_cache.forget(ws_id, table_name, pk_value)
         return r["erp_table_patch"]
 
 
@@ -127,7 +147,7 @@ async def delete_erp_record(
 ) -> bool:
     http = await client.use_http()
     async with http as h:
-        r = await h.execute(gql.gql("""
+        r = await h.execute(gql_utils.gql_cached("""
             mutation ErpTableDelete($schema_name: String!, $table_name: String!, $ws_id: String!, $pk_value: String!) {
                 erp_table_delete(schema_name: $schema_name, table_name: $table_name, ws_id: $ws_id, pk_value: $pk_value)
             }"""),
@@ -138,6 +158,8 @@ async def delete_erp_record(
                 "pk_value": pk_value,
             },
         )
+        if erp_cache is not None:
+            erp_cache.forget(ws_id, table_name, pk_value)
         return r["erp_table_delete"]
 
 
@@ -150,7 +172,7 @@ async def batch_upsert_erp_records(
 ) -> dict:
     http = await client.use_http()
     async with http as h:
-        r = await h.execute(gql.gql("""
+        r = await h.execute(gql_utils.gql_cached("""
             mutation ErpTableBatchUpsert($schema_name: String!, $table_name: String!, $ws_id: String!, $upsert_key: String!, $records_json: String!) {
                 erp_table_batch_upsert(schema_name: $schema_name, table_name: $table_name, ws_id: $ws_id, upsert_key: $upsert_key, records_json: $records_json)
             }"""),
@@ -162,27 +184,24 @@ async def batch_upsert_erp_records(
                 "records_json": json.dumps([dataclass_or_dict_to_dict(r) for r in records]),
             },
         )
+        if erp_cache is not None:
+            erp_cache.forget(ws_id, table_name, everything=True)
         result = r["erp_table_batch_upsert"]
         if isinstance(result, str):
             return json.loads(result)
         return result
 
 
+ERP_FILTER_CACHE_SIZE = 1000
+
+_NO_VALUE = object()   # json path doesn't exist in the record, no filter matches that
+_NO_COERCE = object()
+
+_compiled_filters: collections.OrderedDict = collections.OrderedDict()
+
+
 def check_record_matches_filters(record: dict, filters, col_names: set = None) -> bool:
-    if not filters:
-        return True
-    if isinstance(filters, str):
-        return check_record_matches_filter(record, filters, col_names)
-    if isinstance(filters, list):
-        return all(check_record_matches_filters(record, sub, col_names) for sub in filters)
-    if isinstance(filters, dict):
-        if "OR" in filters:
-            return any(check_record_matches_filters(record, sub, col_names) for sub in filters["OR"])
-        if "AND" in filters:
-            return all(check_record_matches_filters(record, sub, col_names) for sub in filters["AND"])
-        if "NOT" in filters:
-            return not check_record_matches_filters(record, filters["NOT"], col_names)
-    return True
+    return compile_erp_filters(filters, col_names)(record)
 
 
 def check_record_matches_filter(record: dict, f: str, col_names: set = None) -> bool:
@@ -194,6 +213,280 @@ def check_record_matches_filter(record: dict, f: str, col_names: set = None) ->
     Array operators: contains, not_contains
     JSON path: "task_details->email_subtype:=:welcome"
     """
+    return compile_erp_filters(f, col_names)(record)
+
+
+class ErpFilter:
+    """
+    Filters compiled into a predicate: "col:op:val" split, json paths, operators, lowercase and LIKE patterns
+    are all resolved once, evaluation for each record is just a few closure calls.
+    Filters are a string, a list (AND), or {"AND": [...]}, {"OR": [...]}, {"NOT": ...} nested as deep as you like.
+    """
+
+    def __init__(self, filters, col_names: set = None):
+        self.filters = filters
+        self._pred = _compile_filters(filters, col_names)
+
+    def __call__(self, record: dict) -> bool:
+        return self._pred(record)
+
+    def matches(self, records: List[dict]) -> List[bool]:
+        pred = self._pred
+        return [pred(r) for r in records]
+
+    def filter(self, records: List[dict]) -> List[dict]:
+        pred = self._pred
+        return [r for r in records if pred(r)]
+
+
+def compile_erp_filters(filters, col_names: set = None) -> ErpFilter:
+    key = (
+        filters if isinstance(filters, str) else json.dumps(filters, sort_keys=True, default=str),
+        frozenset(col_names) if col_names else None,
+    )
+    f = _compiled_filters.get(key)
+    if f is not None:
+        _compiled_filters.move_to_end(key)
+        return f
+    f = _compiled_filters[key] = ErpFilter(filters, col_names)
+    if len(_compiled_filters) > ERP_FILTER_CACHE_SIZE:
+        _compiled_filters.popitem(last=False)
+    return f
+
+
+def _always(record: dict) -> bool:
+    return True
+
+
+def _never(record: dict) -> bool:
+    return False
+
+
+def _compile_filters(filters, col_names: set | None) -> Callable[[dict], bool]:
+    if not filters:
+        return _always
+    if isinstance(filters, str):
+        return _compile_filter(filters, col_names)
+    if isinstance(filters, list):
+        return _all_of([_compile_filters(sub, col_names) for sub in filters])
+    if isinstance(filters, dict):
+        if "OR" in filters:
+            return _any_of([_compile_filters(sub, col_names) for sub in filters["OR"]])
+        if "AND" in filters:
+            return _all_of([_compile_filters(sub, col_names) for sub in filters["AND"]])
+        if "NOT" in filters:
+            pred = _compile_filters(filters["NOT"], col_names)
+            return lambda record: not pred(record)
+    return _always
+
+
+def _all_of(preds: List[Callable[[dict], bool]]) -> Callable[[dict], bool]:
+    if len(preds) == 1:
+        return preds[0]
+
+    def all_pred(record: dict) -> bool:
+        for p in preds:
+            if not p(record):
+                return False
+        return True
+    return all_pred
+
+
+def _any_of(preds: List[Callable[[dict], bool]]) -> Callable[[dict], bool]:
+    if len(preds) == 1:
+        return preds[0]
+
+    def any_pred(record: dict) -> bool:
+        for p in preds:
+            if p(record):
+                return True
+        return False
+    return any_pred
+
+
+def _compile_getter(col_spec: str, col_names: set | None) -> Callable[[dict], Any] | None:
+    if "->" in col_spec:
+        col_parts = col_spec.split("->")
+        col = col_parts[0].strip()
+        path = col_parts[1:]
+        if col_names and col not in col_names:
+            return None
+
+        def get_path(record: dict) -> Any:
+            if col not in record:
+                return _NO_VALUE
+            val = record[col]
+            for p in path:
+                if not isinstance(val, dict) or p not in val:
+                    return _NO_VALUE
+                val = val[p]
+            return val
+        return get_path
+
+    if col_names and col_spec not in col_names:
+        return None
+    return lambda record: record.get(col_spec)
+
+
+def _is_empty(val: Any) -> bool:
+    if val is None:
+        return True
+    if isinstance(val, str):
+        return val == ""
+    if isinstance(val, (list, dict)):
+        return len(val) == 0
+    return False
+
+
+def _is_not_empty(val: Any) -> bool:
+    if val is None:
+        return False
+    if isinstance(val, str):
+        return val != ""
+    if isinstance(val, (list, dict)):
+        return len(val) > 0
+    return True
+
+
+def _compile_like(pattern: str, lower: bool) -> Callable[[Any], bool]:
+    if lower:
+        pattern = pattern.lower()
+    if pattern.startswith("%") and pattern.endswith("%"):
+        mid = pattern[1:-1]
+        test = lambda s: mid in s
+    elif pattern.startswith("%"):
+        suffix = pattern[1:]
+        test = lambda s: s.endswith(suffix)
+    elif pattern.endswith("%"):
+        prefix = pattern[:-1]
+        test = lambda s: s.startswith(prefix)
+    else:
+        test = lambda s: s == pattern
+    if lower:
+        return lambda val: test(str(val).lower())
+    return lambda val: test(str(val))
+
+
+def _compile_value_test(op: str, filter_val: str) -> Callable[[Any], bool]:
+    if op in ("CONTAINS", "NOT_CONTAINS"):
+        fl = filter_val.lower()
+        negate = op == "NOT_CONTAINS"
+
+        def contains(val: Any) -> bool:
+            if val is None:
+                return negate
+            if isinstance(val, list):
+                found = any(str(v).lower() == fl for v in val)
+            else:
+                found = fl in str(val).lower()
+            return found != negate
+        return contains
+
+    if op == "=":
+        cmp = operator.eq
+    elif op == "!=":
+        cmp = operator.ne
+    elif op == ">":
+        cmp = operator.gt
+    elif op == ">=":
+        cmp = operator.ge
+    elif op == "<":
+        cmp = operator.lt
+    elif op == "<=":
+        cmp = operator.le
+    elif op in ("IN", "NOT_IN", "NOT IN"):
+        vals = frozenset(v.strip() for v in filter_val.split(","))
+        if op == "IN":
+            cmp = lambda val, fv: str(val) in vals
+        else:
+            cmp = lambda val, fv: str(val) not in vals
+    elif op == "CIEQL":
+        fl = filter_val.lower()
+        cmp = lambda val, fv: str(val).lower() == fl
+    elif op in ("LIKE", "ILIKE"):
+        like = _compile_like(filter_val, op == "ILIKE")
+        cmp = lambda val, fv: like(val)
+    else:
+        cmp = lambda val, fv: True
+
+    # Numbers in the record make the filter value a number of the same type, converted once per type
+    coerced = {}
+
+    def coerce(t: type) -> Any:
+        try:
+            return coerced[t]
+        except KeyError:
+            pass
+        try:
+            c = t(filter_val)
+        except (ValueError, TypeError):
+            c = _NO_COERCE
+        coerced[t] = c
+        return c
+
+    none_result = op == "!=" and filter_val != ""
+
+    def value_test(val: Any) -> bool:
+        fv = filter_val
+        if isinstance(val, (int, float)):
+            fv = coerce(type(val))
+            if fv is _NO_COERCE:
+                return False
+        if val is None:
+            return none_result
+        return cmp(val, fv)
+    return value_test
+
+
+def _compile_filter(f: str, col_names: set | None) -> Callable[[dict], bool]:
+    parts = f.split(":", 2)
+    if len(parts) < 2:
+        return _always
+    get = _compile_getter(parts[0].strip(), col_names)
+    if get is None:
+        return _never
+    op = parts[1].strip().upper()
+
+    if op in ("IS_NULL", "IS NULL"):
+        test = lambda val: val is None
+    elif op in ("IS_NOT_NULL", "IS NOT NULL"):
+        test = lambda val: val is not None
+    elif op in ("IS_EMPTY", "IS EMPTY"):
+        test = _is_empty
+    elif op in ("IS_NOT_EMPTY", "IS NOT EMPTY"):
+        test = _is_not_empty
+    elif len(parts) != 3:
+        test = lambda val: True
+    else:
+        test = _compile_value_test(op, parts[2].strip())
+
+    def leaf(record: dict) -> bool:
+        val = get(record)
+        if val is _NO_VALUE:
+            return False
+        return test(val)
+    return leaf
+
+
+def _check_record_matches_filters_interpreted(record: dict, filters, col_names: set = None) -> bool:
+    if not filters:
+        return True
+    if isinstance(filters, str):
+        return _check_record_matches_filter_interpreted(record, filters, col_names)
+    if isinstance(filters, list):
+        return all(_check_record_matches_filters_interpreted(record, sub, col_names) for sub in filters)
+    if isinstance(filters, dict):
+        if "OR" in filters:
+            return any(_check_record_matches_filters_interpreted(record, sub, col_names) for sub in filters["OR"])
+        if "AND" in filters:
+            return all(_check_record_matches_filters_interpreted(record, sub, col_names) for sub in filters["AND"])
+        if "NOT" in filters:
+            return not _check_record_matches_filters_interpreted(record, filters["NOT"], col_names)
+    return True
+
+
+def _check_record_matches_filter_interpreted(record: dict, f: str, col_names: set = None) -> bool:
+    # Original interpreter, compile_erp_filters() must give the same answers, see ckit_erp_test.py
     parts = f.split(":", 2)
     if len(parts) < 2:
         return True
@@ -311,6 +604,233 @@ def check_record_matches_filter(record: dict, f: str, col_names: set = None) ->
     return True
 
 
+ERP_CACHE_MAX_BYTES = int(float(os.getenv("FLEXUS_ERP_CACHE_MB", "0")) * 1024 * 1024)
+ERP_CACHE_MAX_QUERIES = 2000
+
+
+class ErpCache:
+    """
+    Read-through cache for query_erp_table(), opt-in with enable_erp_cache() or FLEXUS_ERP_CACHE_MB.
+
+    It's only used for tables that have a live erp.* change feed (subscribe_to_erp_tables in a bot), because
+    change events are what keeps it correct: records are updated in place by primary key, and a cached query
+    result is dropped when the changed record matches its filters before or after the change. When the feed
+    goes down, everything for its tables is forgotten, because changes might be missed until it's back.
+
+    Rows with include=[...] are never cached, change events don't carry the joined data.
+    """
+
+    def __init__(self, max_bytes: int, max_queries: int = ERP_CACHE_MAX_QUERIES):
+        self.max_bytes = max_bytes
+        self.max_queries = max_queries
+        self.watched: Dict[str, int] = {}   # table -> live subscriptions
+        self.records: collections.OrderedDict = collections.OrderedDict()    # (ws_id, table, pk_value) -> (row, size)
+        self.queries: collections.OrderedDict = collections.OrderedDict()    # (ws_id, table, qkey) -> (pk values, ErpFilter or None)
+        self.table_queries: Dict[str, set] = {}
+        self.generations: Dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.changes = 0
+        self._pkeys: Dict[str, Optional[str]] = {}
+
+    def pkey_field(self, table_name: str) -> Optional[str]:
+        if table_name not in self._pkeys:
+            cls = erp_schema.ERP_TABLE_TO_SCHEMA.get(table_name)
+            try:
+                self._pkeys[table_name] = erp_schema.get_pkey_field(cls) if cls else None
+            except ValueError:
+                self._pkeys[table_name] = None
+        return self._pkeys[table_name]
+
+    def is_watched(self, table_name: str) -> bool:
+        return table_name in self.watched and self.pkey_field(table_name) is not None
+
+    def feed_up(self, tables: List[str]) -> None:
+        for t in tables:
+            self.watched[t] = self.watched.get(t, 0) + 1
+
+    def feed_down(self, tables: List[str]) -> None:
+        for t in tables:
+            self.watched[t] = self.watched.get(t, 1) - 1
+            if self.watched[t] <= 0:
+                del self.watched[t]
+                self._drop_table(t)
+
+    def generation(self, table_name: str) -> int:
+        return self.generations.get(table_name, 0)
+
+    def query_key(self, skip: int, limit: int, sort_by: List[str], filters: Union[str, dict, list]) -> str:
+        return json.dumps([skip, limit, sort_by, filters], sort_keys=True, default=str)
+
+    def lookup(self, ws_id: str, table_name: str, qkey: str, filters: Union[str, dict, list]) -> Optional[List[dict]]:
+        rows = None
+        entry = self.queries.get((ws_id, table_name, qkey))
+        if entry is not None:
+            rows = self._rows(ws_id, table_name, entry[0])
+            if rows is None:   # some records were evicted
+                self._drop_query((ws_id, table_name, qkey))
+            else:
+                self.queries.move_to_end((ws_id, table_name, qkey))
+        elif isinstance(filters, str):
+            # "pkey:=:value" is answered from records, those are warmed up by change events too
+            parts = filters.split(":", 2)
+            if len(parts) == 3 and parts[0].strip() == self.pkey_field(table_name) and parts[1].strip() == "=":
+                rows = self._rows(ws_id, table_name, [parts[2].strip()])
+        if rows is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [copy.deepcopy(row) for row in rows]
+
+    def _rows(self, ws_id: str, table_name: str, pk_values: List[str]) -> Optional[List[dict]]:
+        rows = []
+        for pk in pk_values:
+            x = self.records.get((ws_id, table_name, pk))
+            if x is None:
+                return None
+            self.records.move_to_end((ws_id, table_name, pk))
+            rows.append(x[0])
+        return rows
+
+    def store(self, ws_id: str, table_name: str, qkey: str, filters: Union[str, dict, list], rows: List[dict], generation: int) -> None:
+        if generation != self.generation(table_name) or not self.is_watched(table_name):
+            return   # something changed while we were waiting for the answer, it might be stale already
+        pk = self.pkey_field(table_name)
+        if not all(isinstance(row, dict) and row.get(pk) for row in rows):
+            return
+        for row in rows:
+            self._put_record(ws_id, table_name, str(row[pk]), copy.deepcopy(row))
+        # NOT can't be evaluated safely here: the backend knows operators this side doesn't, so it's "always invalidate"
+        flt = None if '"NOT"' in qkey else compile_erp_filters(filters)
+        key = (ws_id, table_name, qkey)
+        self._drop_query(key)
+        self.queries[key] = ([str(row[pk]) for row in rows], flt)
+        self.table_queries.setdefault(table_name, set()).add(key)
+        while len(self.queries) > self.max_queries:
+            self._drop_query(next(iter(self.queries)))
+            self.evictions += 1
+
+    def on_change(self, table_name: str, action: str, new_record: Any, old_record: Any) -> None:
+        self.changes += 1
+        self.generations[table_name] = self.generation(table_name) + 1
+        pk = self.pkey_field(table_name)
+        if pk is None or table_name not in self.watched:
+            return
+        recs = [r for r in (new_record, old_record) if isinstance(r, dict)]
+        if not recs:
+            self._drop_table(table_name)
+            return
+        ws_id = recs[0].get("ws_id")
+        pk_value = str(recs[0].get(pk, ""))
+        if action in ("INSERT", "UPDATE") and isinstance(new_record, dict) and pk_value and ws_id:
+            if (ws_id, table_name, pk_value) in self.records or action == "INSERT":
+                self._put_record(ws_id, table_name, pk_value, copy.deepcopy(new_record))
+        elif ws_id:
+            self._drop_record((ws_id, table_name, pk_value))
+        else:
+            for key in [k for k in self.records if k[1] == table_name and k[2] == pk_value]:
+                self._drop_record(key)
+        for key in list(self.table_queries.get(table_name, ())):
+            if ws_id is not None and key[0] != ws_id:
+                continue
+            pk_values, flt = self.queries[key]
+            if flt is None or pk_value in pk_values or any(flt(r) for r in recs):
+                self._drop_query(key)
+                self.invalidations += 1
+
+    def forget(self, ws_id: str, table_name: str, pk_value: Optional[str] = None, everything: bool = False) -> None:
+        # Our own writes, don't wait for the change event to arrive
+        self.generations[table_name] = self.generation(table_name) + 1
+        if pk_value is not None:
+            self._drop_record((ws_id, table_name, str(pk_value)))
+        if everything:
+            for key in [k for k in self.records if k[0] == ws_id and k[1] == table_name]:
+                self._drop_record(key)
+        for key in list(self.table_queries.get(table_name, ())):
+            if key[0] == ws_id:
+                self._drop_query(key)
+
+    def _put_record(self, ws_id: str, table_name: str, pk_value: str, row: dict) -> None:
+        key = (ws_id, table_name, pk_value)
+        self._drop_record(key)
+        size = len(json.dumps(row, default=str)) + 200
+        self.records[key] = (row, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self.records:
+            _, (_, evicted_size) = self.records.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def _drop_record(self, key: Tuple[str, str, str]) -> None:
+        x = self.records.pop(key, None)
+        if x is not None:
+            self.bytes -= x[1]
+
+    def _drop_query(self, key: Tuple[str, str, str]) -> None:
+        if self.queries.pop(key, None) is not None:
+            self.table_queries.get(key[1], set()).discard(key)
+
+    def _drop_table(self, table_name: str) -> None:
+        for key in [k for k in self.records if k[1] == table_name]:
+            self._drop_record(key)
+        for key in list(self.table_queries.pop(table_name, ())):
+            self.queries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "records": len(self.records),
+            "queries": len(self.queries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "changes": self.changes,
+            "watched_tables": sorted(self.watched),
+        }
+
+
+erp_cache: Optional[ErpCache] = ErpCache(ERP_CACHE_MAX_BYTES) if ERP_CACHE_MAX_BYTES > 0 else None
+
+
+def enable_erp_cache(max_bytes: int = 64 * 1024 * 1024) -> ErpCache:
+    global erp_cache
+    if erp_cache is None:
+        erp_cache = ErpCache(max_bytes)
+        logger.info("erp cache enabled, %0.1fMB", max_bytes / 1024 / 1024)
+    return erp_cache
+
+
+class ErpCacheFeed:
+    """
+    async with ErpCacheFeed(tables) around a subscription; call live() when the first event arrives, that's
+    when the cache can start trusting the change feed.
+    """
+    def __init__(self, tables: List[str]):
+        self.tables = list(tables)
+        self.cache = erp_cache if tables else None
+        self.is_live = False
+
+    def live(self) -> None:
+        if self.cache is not None and not self.is_live:
+            self.cache.feed_up(self.tables)
+            self.is_live = True
+
+    async def __aenter__(self) -> "ErpCacheFeed":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self.is_live:
+            self.cache.feed_down(self.tables)
+            self.is_live = False
+
+
 async def test():
     client = ckit_client.FlexusClient("ckit_erp_test")
     ws_id = "solarsystem"
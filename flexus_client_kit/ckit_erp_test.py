@@ -0,0 +1,197 @@
+import random
+import time
+
+from flexus_client_kit import ckit_erp
+
+
+_COUNTRIES = ["US", "DE", "FR", "GB", "ES", "", None]
+_SOURCES = ["google", "facebook", "linkedin", "newsletter", "", None]
+_TAGS = ["vip", "lead", "Customer", "churned", "beta"]
+
+
+def _contact(rnd: random.Random, i: int) -> dict:
+    return {
+        "ws_id": "ws1",
+        "contact_id": "c%06d" % i,
+        "contact_first_name": rnd.choice(["Anna", "bob", "Carlos", "Dmitry", "Eve", ""]),
+        "contact_last_name": rnd.choice(["Smith", "Müller", "O'Brien", "Lee"]),
+        "contact_email": "user%d@%s" % (i, rnd.choice(["gmail.com", "Example.com", "corp.io"])),
+        "contact_address_country": rnd.choice(_COUNTRIES),
+        "contact_utm_first_source": rnd.choice(_SOURCES),
+        "contact_tags": rnd.sample(_TAGS, rnd.randrange(0, 3)),
+        "contact_bant_score": rnd.randrange(-1, 5),
+        "contact_created_ts": 1760000000.0 + rnd.randrange(100000),
+        "contact_details": rnd.choice([
+            {},
+            {"bant": {"budget": rnd.randrange(0, 100000), "authority": rnd.choice([True, False])}},
+            {"bant": "unknown"},
+            {"social": {"linkedin": "https://linkedin.com/in/x%d" % i}},
+        ]),
+    }
+
+
+_LEAF_FILTERS = [
+    "contact_address_country:=:US",
+    "contact_address_country:!=:US",
+    "contact_address_country:!=:",
+    "contact_address_country:IN:US, DE,FR",
+    "contact_address_country:NOT_IN:US,DE",
+    "contact_address_country:IS_NULL",
+    "contact_address_country:IS_NOT_EMPTY",
+    "contact_address_country:is empty",
+    "contact_first_name:CIEQL:BOB",
+    "contact_first_name:LIKE:A%",
+    "contact_first_name:ILIKE:%o%",
+    "contact_email:ILIKE:%example.com",
+    "contact_email:LIKE:%Example.com",
+    "contact_email:LIKE:user1@corp.io",
+    "contact_tags:CONTAINS:customer",
+    "contact_tags:NOT_CONTAINS:vip",
+    "contact_tags:IS_EMPTY",
+    "contact_email:contains:GMAIL",
+    "contact_bant_score:>:2",
+    "contact_bant_score:>=:2",
+    "contact_bant_score:<:0",
+    "contact_bant_score:<=:abc",
+    "contact_bant_score:=:3",
+    "contact_bant_score:IN:3,4",
+    "contact_created_ts:>:1760050000",
+    "contact_details->bant->budget:>:50000",
+    "contact_details->bant->authority:=:yes",
+    "contact_details->bant:IS_NOT_NULL",
+    "contact_details->social->linkedin:ILIKE:%LINKEDIN%",
+    "contact_details->nope:IS_NULL",
+    "no_such_column:IS_NULL",
+    "no_such_column:!=:x",
+    "contact_first_name:=",
+    "contact_first_name:WEIRD_OP:x",
+    "garbage",
+]
+
+
+def _random_filters(rnd: random.Random, depth: int = 0):
+    x = rnd.random()
+    if depth > 2 or x < 0.4:
+        return rnd.choice(_LEAF_FILTERS)
+    subs = [_random_filters(rnd, depth + 1) for _ in range(rnd.randrange(0, 4))]
+    if x < 0.55:
+        return subs
+    if x < 0.75:
+        return {"OR": subs}
+    if x < 0.9:
+        return {"AND": subs}
+    return {"NOT": _random_filters(rnd, depth + 1)}
+
+
+def test_compiled_filters_same_as_interpreted():
+    rnd = random.Random(2025)
+    contacts = [_contact(rnd, i) for i in range(300)]
+    col_names_variants = [None, {"contact_address_country", "contact_first_name", "contact_details"}]
+    compared = 0
+    for _ in range(400):
+        filters = _random_filters(rnd)
+        col_names = rnd.choice(col_names_variants)
+        compiled = ckit_erp.compile_erp_filters(filters, col_names)
+        for c in contacts:
+            try:
+                want = ckit_erp._check_record_matches_filters_interpreted(c, filters, col_names)
+            except TypeError:
+                continue   # like comparing a dict with a string, the interpreter crashes too
+            assert compiled(c) == want, (filters, c)
+            compared += 1
+    assert compared > 100000
+
+
+def test_compiled_filters_api():
+    rnd = random.Random(1)
+    contacts = [_contact(rnd, i) for i in range(1000)]
+    f = ckit_erp.compile_erp_filters({"OR": ["contact_address_country:=:US", ["contact_bant_score:>=:3", "contact_tags:CONTAINS:vip"]]})
+    assert f is ckit_erp.compile_erp_filters({"OR": ["contact_address_country:=:US", ["contact_bant_score:>=:3", "contact_tags:CONTAINS:vip"]]})
+    picked = f.filter(contacts)
+    assert picked == [c for c, m in zip(contacts, f.matches(contacts)) if m]
+    assert all(c["contact_address_country"] == "US" or (c["contact_bant_score"] >= 3 and "vip" in c["contact_tags"]) for c in picked)
+    assert 0 < len(picked) < len(contacts)
+    assert ckit_erp.check_record_matches_filter(contacts[0], "contact_id:=:c000000")
+    assert ckit_erp.check_record_matches_filters(contacts[0], []) is True
+
+
+def _cache_with_contacts(n: int, max_bytes: int = 10 * 1024 * 1024):
+    rnd = random.Random(7)
+    cache = ckit_erp.ErpCache(max_bytes)
+    cache.feed_up(["crm_contact"])
+    return cache, [_contact(rnd, i) for i in range(n)]
+
+
+def test_erp_cache_invalidation():
+    cache, contacts = _cache_with_contacts(20)
+    us = [c for c in contacts if c["contact_address_country"] == "US"]
+    de = [c for c in contacts if c["contact_address_country"] == "DE"]
+    q_us = cache.query_key(0, 100, [], "contact_address_country:=:US")
+    q_de = cache.query_key(0, 100, [], "contact_address_country:=:DE")
+    for q, f, rows in [(q_us, "contact_address_country:=:US", us), (q_de, "contact_address_country:=:DE", de)]:
+        cache.store("ws1", "crm_contact", q, f, rows, cache.generation("crm_contact"))
+        assert cache.lookup("ws1", "crm_contact", q, f) == rows
+    assert cache.lookup("ws2", "crm_contact", q_us, "contact_address_country:=:US") is None
+
+    # A new US contact drops the US query only
+    new = dict(contacts[0], contact_id="c999999", contact_address_country="US")
+    cache.on_change("crm_contact", "INSERT", new, None)
+    assert cache.lookup("ws1", "crm_contact", q_us, "contact_address_country:=:US") is None
+    assert cache.lookup("ws1", "crm_contact", q_de, "contact_address_country:=:DE") == de
+    # ...and warms up records, lookup by pkey doesn't need a query cached
+    assert cache.lookup("ws1", "crm_contact", cache.query_key(0, 1, [], "contact_id:=:c999999"), "contact_id:=:c999999") == [new]
+
+    # A DE contact moving to FR drops DE query, because the old record matched
+    moved = dict(de[0], contact_address_country="FR")
+    cache.on_change("crm_contact", "UPDATE", moved, de[0])
+    assert cache.lookup("ws1", "crm_contact", q_de, "contact_address_country:=:DE") is None
+    assert cache.lookup("ws1", "crm_contact", cache.query_key(0, 1, [], "contact_id:=:" + moved["contact_id"]), "contact_id:=:" + moved["contact_id"]) == [moved]
+
+    # Fetch started before a change must not be stored
+    gen = cache.generation("crm_contact")
+    cache.on_change("crm_contact", "DELETE", None, us[0])
+    cache.store("ws1", "crm_contact", q_us, "contact_address_country:=:US", us, gen)
+    assert cache.lookup("ws1", "crm_contact", q_us, "contact_address_country:=:US") is None
+
+    # Change feed down: nothing is trusted anymore
+    cache.store("ws1", "crm_contact", q_de, "contact_address_country:=:DE", de[1:], cache.generation("crm_contact"))
+    cache.feed_down(["crm_contact"])
+    assert not cache.is_watched("crm_contact")
+    assert cache.stats()["records"] == 0 and cache.stats()["queries"] == 0
+
+
+def test_erp_cache_returns_copies_and_evicts():
+    cache, contacts = _cache_with_contacts(200, max_bytes=20000)
+    for c in contacts:
+        f = "contact_id:=:" + c["contact_id"]
+        cache.store("ws1", "crm_contact", cache.query_key(0, 1, [], f), f, [c], cache.generation("crm_contact"))
+    st = cache.stats()
+    assert st["bytes"] <= 20000 and st["evictions"] > 0 and 0 < st["records"] < 200
+    last = contacts[-1]
+    f = "contact_id:=:" + last["contact_id"]
+    got = cache.lookup("ws1", "crm_contact", cache.query_key(0, 1, [], f), f)
+    got[0]["contact_details"]["mutated"] = True
+    assert "mutated" not in cache.lookup("ws1", "crm_contact", cache.query_key(0, 1, [], f), f)[0]["contact_details"]
+    f0 = "contact_id:=:" + contacts[0]["contact_id"]
+    assert cache.lookup("ws1", "crm_contact", cache.query_key(0, 1, [], f0), f0) is None
+
+
+def benchmark(n: int = 100000) -> None:
+    rnd = random.Random(42)
+    contacts = [_contact(rnd, i) for i in range(n)]
+    for title, filters in [
+        ("single =", "contact_address_country:=:US"),
+        ("ILIKE + number", ["contact_email:ILIKE:%example.com", "contact_bant_score:>=:2"]),
+        ("OR with json path", {"OR": ["contact_details->bant->budget:>:50000", "contact_tags:CONTAINS:vip", "contact_first_name:CIEQL:anna"]}),
+    ]:
+        t0 = time.perf_counter()
+        want = [c for c in contacts if ckit_erp._check_record_matches_filters_interpreted(c, filters)]
+        t1 = time.perf_counter()
+        got = ckit_erp.compile_erp_filters(filters).filter(contacts)
+        t2 = time.perf_counter()
+        assert got == want
+        print("%-18s %dk contacts, %d match: interpreted %6.1fms  compiled %6.1fms  x%0.1f" % (title, n // 1000, len(got), (t1 - t0) * 1000, (t2 - t1) * 1000, (t1 - t0) / (t2 - t1)))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,7 +1,6 @@
 import asyncio
 from typing import Optional, Any, List
 from dataclasses import dataclass
-import gql
 
 from flexus_client_kit import ckit_client, gql_utils
 
@@ -39,7 +38,7 @@ async def make_sure_have_expert(
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation MakeSure($sp: String!, $pk: String!, $o: String, $g: String, $n: String!) {
                     make_sure_have_expert(
                         system_prompt: $sp,
@@ -69,7 +68,7 @@ async def expert_choice_consequences(
     http = await client.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 f"""query Conseq2($e: String!, $g: String!) {{
                     expert_choice_consequences(
                         fexp_id: $e,
@@ -0,0 +1,244 @@
+import ast
+import datetime
+import functools
+import operator
+import time
+from typing import Any, Callable, Dict, List
+
+# Small expression language for templates, like {{now() + days(5)}} or {{trigger.new_record.deal_value * 0.1}}
+#
+# Python syntax parsed by ast, but only the whitelisted nodes and functions below survive compilation. The result
+# is a tree of closures (an evaluation plan), there's no eval(), no attribute access on python objects: a.b.c is
+# only a lookup in nested dicts. Anything that goes wrong, at compile time or at run time, is ExprError with a
+# message that depends only on the expression and the data.
+
+EXPR_MAX_LEN = 1000
+EXPR_MAX_NODES = 200
+EXPR_MAX_STR = 100000
+
+
+class ExprError(ValueError):
+    pass
+
+
+def _seconds(k: int) -> Callable[[Any], Any]:
+    def f(n):
+        if isinstance(n, bool) or not isinstance(n, (int, float)):
+            raise TypeError("expected a number, got %s" % type(n).__name__)
+        return n * k
+    return f
+
+
+def _f_date(ts: Any, fmt: str = "%Y-%m-%d") -> str:
+    return datetime.datetime.fromtimestamp(float(ts), datetime.timezone.utc).strftime(fmt)
+
+
+def _f_parse_date(s: str) -> float:
+    dt = datetime.datetime.fromisoformat(s.strip().replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+EXPR_FUNCTIONS: Dict[str, Callable] = {
+    # time, all timestamps are unix seconds, dates are UTC
+    "now": lambda: time.time(),
+    "minutes": _seconds(60),
+    "hours": _seconds(3600),
+    "days": _seconds(86400),
+    "weeks": _seconds(604800),
+    "date": _f_date,
+    "parse_date": _f_parse_date,
+    # numbers
+    "abs": abs,
+    "min": min,
+    "max": max,
+    "round": round,
+    "int": int,
+    "float": float,
+    # strings
+    "str": str,
+    "len": len,
+    "lower": lambda s: s.lower(),
+    "upper": lambda s: s.upper(),
+    "strip": lambda s: s.strip(),
+}
+
+_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+_UNARYOPS = {ast.USub: operator.neg, ast.UAdd: operator.pos, ast.Not: operator.not_}
+_CMPOPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+_RUNTIME_ERRORS = (TypeError, ValueError, ZeroDivisionError, OverflowError, AttributeError, OSError)
+_SEQUENCES = (str, list, tuple)
+
+
+class Expr:
+    __slots__ = ("source", "_plan")
+
+    def __init__(self, source: str, plan: Callable[[Dict[str, Any]], Any]):
+        self.source = source
+        self._plan = plan
+
+    def __call__(self, names: Dict[str, Any]) -> Any:
+        return self._plan(names)
+
+    def __repr__(self) -> str:
+        return "Expr(%r)" % self.source
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_expr(source: str) -> Expr:
+    """
+    Raises ExprError for syntax that's not allowed. Cached, compiling the same text again costs a dict lookup.
+    """
+    if len(source) > EXPR_MAX_LEN:
+        raise ExprError("expression is longer than %d characters" % EXPR_MAX_LEN)
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ExprError("syntax error at column %s: %s" % (e.offset, e.msg))
+    except ValueError as e:   # null bytes
+        raise ExprError("syntax error: %s" % e)
+    n_nodes = sum(1 for _ in ast.walk(tree))
+    if n_nodes > EXPR_MAX_NODES:
+        raise ExprError("expression is too complex, %d nodes > %d" % (n_nodes, EXPR_MAX_NODES))
+    return Expr(source, _compile(tree.body))
+
+
+def evaluate(source: str, names: Dict[str, Any]) -> Any:
+    return compile_expr(source)(names)
+
+
+def _dotted(node: ast.AST) -> List[str]:
+    if isinstance(node, ast.Name):
+        return [node.id]
+    if isinstance(node, ast.Attribute):
+        return _dotted(node.value) + [node.attr]
+    raise ExprError("attribute access is only allowed on names, like trigger.new_record.x")
+
+
+def _compile(node: ast.AST) -> Callable[[Dict[str, Any]], Any]:
+    if isinstance(node, ast.Constant):
+        if not isinstance(node.value, (int, float, str, type(None))):
+            raise ExprError("constant of type %s is not allowed" % type(node.value).__name__)
+        v = node.value
+        return lambda names: v
+
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        path = _dotted(node)
+        dotted = ".".join(path)
+
+        def lookup(names):
+            v = names
+            for p in path:
+                if not isinstance(v, dict) or p not in v:
+                    raise ExprError("'%s' is not set" % dotted)
+                v = v[p]
+            return v
+        return lookup
+
+    if isinstance(node, ast.BinOp):
+        op = _BINOPS.get(type(node.op))
+        if op is None:
+            raise ExprError("operator %s is not allowed" % type(node.op).__name__)
+        left, right = _compile(node.left), _compile(node.right)
+        is_mult, is_mod = isinstance(node.op, ast.Mult), isinstance(node.op, ast.Mod)
+
+        def binop(names):
+            a, b = left(names), right(names)
+            if is_mod and isinstance(a, str):
+                raise ExprError("string formatting with % is not allowed")
+            if is_mult and (isinstance(a, _SEQUENCES) or isinstance(b, _SEQUENCES)):
+                s, n = (a, b) if isinstance(a, _SEQUENCES) else (b, a)
+                if isinstance(n, int) and len(s) * n > EXPR_MAX_STR:
+                    raise ExprError("result longer than %d items" % EXPR_MAX_STR)
+            try:
+                return op(a, b)
+            except _RUNTIME_ERRORS as e:
+                raise ExprError(str(e))
+        return binop
+
+    if isinstance(node, ast.UnaryOp):
+        op = _UNARYOPS.get(type(node.op))
+        if op is None:
+            raise ExprError("operator %s is not allowed" % type(node.op).__name__)
+        operand = _compile(node.operand)
+
+        def unaryop(names):
+            try:
+                return op(operand(names))
+            except _RUNTIME_ERRORS as e:
+                raise ExprError(str(e))
+        return unaryop
+
+    if isinstance(node, ast.Compare):
+        ops = []
+        for o in node.ops:
+            if type(o) not in _CMPOPS:
+                raise ExprError("comparison %s is not allowed" % type(o).__name__)
+            ops.append(_CMPOPS[type(o)])
+        first, rest = _compile(node.left), [_compile(c) for c in node.comparators]
+
+        def compare(names):
+            a = first(names)
+            for op, c in zip(ops, rest):
+                b = c(names)
+                try:
+                    if not op(a, b):
+                        return False
+                except _RUNTIME_ERRORS as e:
+                    raise ExprError(str(e))
+                a = b
+            return True
+        return compare
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile(v) for v in node.values]
+        is_and = isinstance(node.op, ast.And)
+
+        def boolop(names):
+            v = None
+            for f in values:
+                v = f(names)
+                if bool(v) != is_and:
+                    return v
+            return v
+        return boolop
+
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = _compile(node.test), _compile(node.body), _compile(node.orelse)
+        return lambda names: body(names) if test(names) else orelse(names)
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in EXPR_FUNCTIONS:
+            name = node.func.id if isinstance(node.func, ast.Name) else ast.unparse(node.func)
+            raise ExprError("function '%s' is not allowed, available: %s" % (name, ", ".join(sorted(EXPR_FUNCTIONS))))
+        if node.keywords or any(isinstance(a, ast.Starred) for a in node.args):
+            raise ExprError("only positional arguments are allowed in '%s'" % node.func.id)
+        fname, fn, args = node.func.id, EXPR_FUNCTIONS[node.func.id], [_compile(a) for a in node.args]
+
+        def call(names):
+            a = [x(names) for x in args]
+            try:
+                r = fn(*a)
+            except _RUNTIME_ERRORS as e:
+                raise ExprError("%s(): %s" % (fname, e))
+            if isinstance(r, str) and len(r) > EXPR_MAX_STR:
+                raise ExprError("string longer than %d characters" % EXPR_MAX_STR)
+            return r
+        return call
+
+    raise ExprError("%s is not allowed" % type(node).__name__)
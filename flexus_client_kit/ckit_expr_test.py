@@ -0,0 +1,148 @@
+import math
+import random
+import time
+import warnings
+
+from flexus_client_kit import ckit_expr
+
+
+_NOW = 1760000000.5
+_NAMES = {"trigger": {"new_record": {"contact_created_ts": 1750000000.0, "contact_bant_score": 3, "contact_first_name": " Anna ", "contact_tags": ["a", "b"]}}}
+
+
+def _random_arith(rnd: random.Random, depth: int = 0) -> str:
+    x = rnd.random()
+    if depth > 4 or x < 0.3:
+        return rnd.choice(["0", "1", "7", "86400", "2.5", "0.0", "now()", "-3", "1e3"])
+    if x < 0.4:
+        return "(" + _random_arith(rnd, depth + 1) + ")"
+    if x < 0.5:
+        return "-" + _random_arith(rnd, depth + 1)
+    if x < 0.6:
+        return "%s %s %s" % (_random_arith(rnd, depth + 1), rnd.choice(["<", "<=", "==", "!=", ">", ">="]), _random_arith(rnd, depth + 1))
+    return "%s %s %s" % (_random_arith(rnd, depth + 1), rnd.choice(["+", "-", "*", "/", "//", "%"]), _random_arith(rnd, depth + 1))
+
+
+def _same(a, b) -> bool:
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b and type(a) == type(b)
+
+
+def test_fuzz_arithmetic_same_as_eval():
+    rnd = random.Random(2025)
+    orig = time.time
+    time.time = lambda: _NOW
+    try:
+        errors = 0
+        for _ in range(5000):
+            src = _random_arith(rnd)
+            try:
+                want = eval(src, {"__builtins__": {}, "now": lambda: _NOW}, {})
+            except ArithmeticError as e:
+                try:
+                    ckit_expr.evaluate(src, {})
+                    assert False, src
+                except ckit_expr.ExprError as e1:
+                    assert str(e1) == str(e), src
+                errors += 1
+                continue
+            assert _same(ckit_expr.evaluate(src, {}), want), src
+        assert 0 < errors < 2500
+    finally:
+        time.time = orig
+
+
+def test_fuzz_garbage_only_raises_expr_error():
+    rnd = random.Random(7)
+    atoms = ["now", "(", ")", "+", "-", "*", "**", "/", "%", ".", ",", "'x'", "\"y\"", "1", "2.0", "trigger", "new_record",
+        "contact_bant_score", "contact_tags", "__class__", "__import__", "lambda", ":", "[", "]", "{", "}", "if", "else",
+        "and", "or", "not", "==", "<", "days", "date", "len", "upper", "str", "int", "x", "=", ";", "@", "\\", "\x00", " "]
+    outcomes = {"ok": 0, "error": 0}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", SyntaxWarning)   # ast.parse() complains about things like "1if", hundreds of times
+        for _ in range(20000):
+            src = "".join(rnd.choice(atoms) for _ in range(rnd.randrange(1, 12)))
+            try:
+                ckit_expr.evaluate(src, _NAMES)
+                outcomes["ok"] += 1
+            except ckit_expr.ExprError as e:
+                outcomes["error"] += 1
+                try:
+                    ckit_expr.evaluate(src, _NAMES)
+                    assert False, src
+                except ckit_expr.ExprError as e2:
+                    assert str(e2) == str(e), src   # deterministic
+    assert outcomes["ok"] > 100 and outcomes["error"] > 100
+
+
+def test_hostile_expressions_rejected():
+    for src in [
+        "__import__('os').system('true')",
+        "().__class__.__bases__[0].__subclasses__()",
+        "(lambda: 1)()",
+        "[x for x in 'abc']",
+        "2 ** 1000000",
+        "'a' * 1000000000",
+        "trigger.new_record.contact_tags * 100000000",
+        "days('a' * 99999)",
+        "'%0999999999d' % 1",
+        "now.__globals__",
+        "str(" * 120 + "1" + ")" * 120,   # too many nodes
+        "open('/etc/passwd')",
+        "x := 1",
+        "1 if 1 else",
+    ]:
+        try:
+            ckit_expr.evaluate(src, _NAMES)
+            assert False, src
+        except ckit_expr.ExprError:
+            pass
+
+
+def test_functions_and_names():
+    orig = time.time
+    time.time = lambda: _NOW
+    try:
+        for src, want in [
+            ("now() + days(5)", _NOW + 5 * 86400),
+            ("trigger.new_record.contact_created_ts + hours(1)", 1750003600.0),
+            ("date(trigger.new_record.contact_created_ts)", "2025-06-15"),
+            ("date(0, '%Y-%m-%d %H:%M')", "1970-01-01 00:00"),
+            ("parse_date('2025-06-15T15:06:40Z')", 1750000000.0),
+            ("upper(strip(trigger.new_record.contact_first_name))", "ANNA"),
+            ("len(trigger.new_record.contact_tags)", 2),
+            ("'hot' if trigger.new_record.contact_bant_score >= 3 else 'cold'", "hot"),
+            ("max(1, trigger.new_record.contact_bant_score, 2)", 3),
+            ("round(10 / 3, 2)", 3.33),
+        ]:
+            assert ckit_expr.evaluate(src, _NAMES) == want, src
+    finally:
+        time.time = orig
+    for src, msg in [
+        ("trigger.new_record.nope + 1", "'trigger.new_record.nope' is not set"),
+        ("1 / 0", "division by zero"),
+        ("int('abc')", "int(): invalid literal for int() with base 10: 'abc'"),
+        ("system()", "function 'system' is not allowed"),
+    ]:
+        try:
+            ckit_expr.evaluate(src, _NAMES)
+            assert False, src
+        except ckit_expr.ExprError as e:
+            assert str(e).startswith(msg), (src, str(e))
+
+
+def benchmark(n: int = 100000) -> None:
+    for src in ["now() + 432000", "(now() - 3600) * 1 + 86400 / 2"]:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            eval(src, {"__builtins__": {}, "now": lambda: time.time()}, {})   # what fi_crm_automations did every action
+        t1 = time.perf_counter()
+        for _ in range(n):
+            ckit_expr.compile_expr(src)({})
+        t2 = time.perf_counter()
+        print("%-32s eval %5.2fus  compiled %5.2fus  x%0.1f" % (src, (t1 - t0) / n * 1e6, (t2 - t1) / n * 1e6, (t1 - t0) / (t2 - t1)))
+
+
+if __name__ == "__main__":
+    benchmark()
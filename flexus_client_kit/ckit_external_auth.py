@@ -38,7 +38,7 @@ async def upsert_external_auth(
     http = await fclient.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(f"""
+            gql_utils.gql_cached(f"""
                 mutation UpsertExternalAuth(
                     $persona_id: String!,
                     $auth_searchable: String!,
@@ -68,7 +68,7 @@ async def decrypt_external_auth(
     http = await fclient.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql("""
+            gql_utils.gql_cached("""
                 query DecryptExternalAuth($auth_searchable: String!) {
                     decrypt_external_auth(auth_searchable: $auth_searchable)
                 }"""),
@@ -86,7 +86,7 @@ async def get_external_auth_token(
     http = await fclient.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql("""
+            gql_utils.gql_cached("""
                 query GetExternalAuthToken($ws_id: String!, $provider: String!, $fuser_id: String) {
                     external_auth_token(ws_id: $ws_id, provider: $provider, fuser_id: $fuser_id) {
                         access_token
@@ -130,7 +130,7 @@ async def start_external_auth_flow(
     http = await fclient.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql("""
+            gql_utils.gql_cached("""
                 mutation StartExternalAuth($ws_id: String!, $provider: String!, $scope_values: [String!], $fuser_id: String) {
                     external_auth_start(
                         ws_id: $ws_id,
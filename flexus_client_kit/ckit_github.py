@@ -6,7 +6,6 @@ from datetime import datetime
 from dataclasses import dataclass
 import httpx
 import jwt
-import gql
 from flexus_client_kit import gql_utils
 
 logger = logging.getLogger(__name__)
@@ -130,7 +129,7 @@ async def get_gh_repo_token_from_external_auth(fclient, devenv_id: str, repo_uri
     http = await fclient.use_http()
     async with http as h:
         r = await h.execute(
-            gql.gql(f"""
+            gql_utils.gql_cached(f"""
                 query GetGhRepoTokenFromExternalAuth($devenv_id: String!, $repo_uri: String!) {{
                     get_gh_repo_token_from_external_auth(devenv_id: $devenv_id, repo_uri: $repo_uri) {{
                         {gql_utils.gql_fields(GhRepoToken)}
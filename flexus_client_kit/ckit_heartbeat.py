@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import gql
+from gql.transport.exceptions import TransportQueryError
+
+from flexus_client_kit import ckit_client
+from flexus_client_kit import ckit_shutdown
+from flexus_client_kit import ckit_utils
+from flexus_client_kit import gql_utils
+
+logger = logging.getLogger("hbeat")
+
+# Liveness mutations (cloudtool_confirm_exists, bot_confirm_exists, ...) from the whole process are collected here, and
+# sent as one aliased mutation per client identity, instead of N requests every 2 minutes.
+HEARTBEAT_PERIOD_SEC = float(os.getenv("FLEXUS_HEARTBEAT_PERIOD_SEC", "120"))
+HEARTBEAT_JITTER_SEC = float(os.getenv("FLEXUS_HEARTBEAT_JITTER_SEC", "15"))
+HEARTBEAT_MAX_BATCH = int(os.getenv("FLEXUS_HEARTBEAT_MAX_BATCH", "50"))
+HEARTBEAT_DEBOUNCE_SEC = 0.5   # new items registered close together go out in the same request
+
+
+@dataclass
+class HeartbeatItem:
+    field: str                           # mutation field, like "cloudtool_confirm_exists"
+    args: Dict[str, Tuple[str, Any]]     # argument name -> (graphql type, value)
+
+
+def heartbeat_mutation(items: List[HeartbeatItem]) -> Tuple[str, Dict[str, Any]]:
+    decl, fields, variables = [], [], {}
+    for i, it in enumerate(items):
+        call_args = []
+        for arg, (gql_type, value) in it.args.items():
+            v = "h%d_%s" % (i, arg)
+            decl.append("$%s: %s" % (v, gql_type))
+            call_args.append("%s: $%s" % (arg, v))
+            variables[v] = value
+        fields.append("    h%d: %s(%s)" % (i, it.field, ", ".join(call_args)))
+    return "mutation Heartbeat(%s) {\n%s\n}" % (", ".join(decl), "\n".join(fields)), variables
+
+
+class HeartbeatAggregator:
+    def __init__(self, fclient: ckit_client.FlexusClient):
+        self.fclient = fclient
+        self.items: Dict[str, HeartbeatItem] = {}
+        self.batching = True          # turned off if the backend rejects batches, but takes items one by one
+        self.requests_sent = 0
+        self.beats = 0
+        self.last_beat_ts = 0.0
+        self.task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    def register(self, key: str, item: HeartbeatItem) -> None:
+        new = key not in self.items
+        self.items[key] = item
+        if new:
+            self._wake.set()   # confirm promptly, don't make the backend wait 2 minutes for a new tool or bot
+
+    def unregister(self, key: str) -> None:
+        self.items.pop(key, None)
+        if not self.items:
+            self._wake.set()
+
+    async def _execute(self, items: List[HeartbeatItem]) -> None:
+        text, variables = heartbeat_mutation(items)
+        self.requests_sent += 1
+        http_client = await self.fclient.use_http()
+        async with http_client as http:
+            await http.execute(gql_utils.gql_cached(text), variable_values=variables)
+
+    async def beat_once(self) -> None:
+        items = list(self.items.values())
+        if not items:
+            return
+        if not self.batching:
+            for it in items:
+                await self._execute([it])
+        else:
+            for i in range(0, len(items), HEARTBEAT_MAX_BATCH):
+                chunk = items[i:i + HEARTBEAT_MAX_BATCH]
+                try:
+                    await self._execute(chunk)
+                except TransportQueryError as e:
+                    if len(chunk) == 1:
+                        raise
+                    logger.warning("batched heartbeat of %d items rejected, sending one by one: %s", len(chunk), e)
+                    failed = None
+                    for it in chunk:
+                        try:
+                            await self._execute([it])
+                        except TransportQueryError as e1:
+                            failed = e1
+                    if failed is not None:
+                        raise failed   # something is wrong with an item, not with batching
+                    self.batching = False
+                    logger.warning("backend takes heartbeats one by one but not batched, batching off for %s", self.fclient.service_name)
+        self.beats += 1
+        self.last_beat_ts = time.time()
+        logger.info("heartbeat %s: %d items, %d requests sent so far", self.fclient.service_name, len(items), self.requests_sent)
+
+    async def _sleep(self, sec: float) -> bool:
+        self._wake.clear()
+        sleep = asyncio.create_task(self._wake.wait())
+        shutdown = asyncio.create_task(ckit_shutdown.shutdown_event.wait())
+        try:
+            await asyncio.wait([sleep, shutdown], timeout=sec, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            sleep.cancel()
+            shutdown.cancel()
+        return ckit_shutdown.shutdown_event.is_set()
+
+    async def loop(self) -> None:
+        while self.items and not ckit_shutdown.shutdown_event.is_set():
+            await asyncio.sleep(HEARTBEAT_DEBOUNCE_SEC)
+            try:
+                await self.beat_once()
+                pause = HEARTBEAT_PERIOD_SEC + random.uniform(-HEARTBEAT_JITTER_SEC, HEARTBEAT_JITTER_SEC)
+            except (
+                gql.transport.exceptions.TransportError,
+                OSError,
+                asyncio.exceptions.TimeoutError
+            ) as e:
+                if "403:" in str(e):
+                    # It's gql.transport.exceptions.TransportQueryError with {'message': "403: Whoops your key didn't work (1).", ...}
+                    # Unfortunately, no separate exception class for 403
+                    logger.error("That looks bad, my key doesn't work: %s", e)
+                else:
+                    logger.info("heartbeat connection problem %s: %s", type(e).__name__, e)
+                pause = 60 + random.uniform(0, HEARTBEAT_JITTER_SEC)
+            if await self._sleep(pause):
+                break
+
+
+_aggregators: Dict[Tuple[str, str, Optional[str]], HeartbeatAggregator] = {}
+
+
+def _aggregator_key(fclient: ckit_client.FlexusClient) -> Tuple[str, str, Optional[str]]:
+    return (fclient.http_url, fclient.service_name, fclient.api_key)
+
+
+def heartbeat_register(fclient: ckit_client.FlexusClient, key: str, item: HeartbeatItem) -> HeartbeatAggregator:
+    """
+    Clients with the same url, service name and key share one aggregator. The sending task runs while there
+    are items, and exits when the last one is unregistered.
+    """
+    akey = _aggregator_key(fclient)
+    agg = _aggregators.get(akey)
+    if agg is None:
+        agg = _aggregators[akey] = HeartbeatAggregator(fclient)
+    agg.register(key, item)
+    if agg.task is None or agg.task.done():
+        agg._wake = asyncio.Event()   # might be a new event loop
+        agg.task = asyncio.create_task(agg.loop())
+        agg.task.add_done_callback(lambda t: ckit_utils.report_crash(t, logger))
+    return agg
+
+
+def heartbeat_unregister(fclient: ckit_client.FlexusClient, key: str) -> None:
+    akey = _aggregator_key(fclient)
+    agg = _aggregators.get(akey)
+    if agg is None:
+        return
+    agg.unregister(key)
+    if not agg.items:
+        del _aggregators[akey]
+
+
+def heartbeat_stats() -> List[Dict[str, Any]]:
+    return [{
+        "service_name": agg.fclient.service_name,
+        "items": len(agg.items),
+        "batching": agg.batching,
+        "beats": agg.beats,
+        "requests_sent": agg.requests_sent,
+        "last_beat_ts": agg.last_beat_ts,
+    } for agg in _aggregators.values()]
@@ -0,0 +1,79 @@
+import asyncio
+import json
+import re
+
+from aiohttp import web
+
+from flexus_client_kit import ckit_client, ckit_cloudtool, ckit_heartbeat, ckit_bot_exec, ckit_shutdown
+
+
+class _FakeBackend:
+    def __init__(self, reject_batches: bool):
+        self.reject_batches = reject_batches
+        self.requests = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        aliases = re.findall(r"(h\d+): (\w+)\(", body["query"])
+        self.requests.append((aliases, body["variables"]))
+        if self.reject_batches and len(aliases) > 1:
+            return web.json_response({"data": None, "errors": [{"message": "too many root fields"}]})
+        return web.json_response({"data": {alias: True for alias, _ in aliases}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/graphql", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        return "http://127.0.0.1:%d" % port
+
+
+def _tools(n: int):
+    return [ckit_cloudtool.CloudTool(strict=True, name="tool%02d" % i, description="test tool %d" % i, parameters={"type": "object", "properties": {}}) for i in range(n)]
+
+
+async def _run(reject_batches: bool):
+    orig_event = ckit_shutdown.shutdown_event
+    ckit_shutdown.shutdown_event = asyncio.Event()   # the module one sticks to the event loop of the previous test
+    backend = _FakeBackend(reject_batches)
+    url = await backend.start()
+    try:
+        fclient = ckit_client.FlexusClient("heartbeat_test", api_key="sk_test", base_url=url, skip_logger_init=True)
+        tasks = [
+            asyncio.create_task(ckit_cloudtool.cloudtool_i_am_still_alive(fclient, _tools(12), "group1", None, True)),
+            asyncio.create_task(ckit_bot_exec.i_am_still_alive(fclient, "frog", 3)),
+        ]
+        await asyncio.sleep(ckit_heartbeat.HEARTBEAT_DEBOUNCE_SEC + 0.3)
+        first_round = list(backend.requests)
+        agg = ckit_heartbeat._aggregators[ckit_heartbeat._aggregator_key(fclient)]
+        await agg.beat_once()
+        second_round = backend.requests[len(first_round):]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        assert ckit_heartbeat._aggregator_key(fclient) not in ckit_heartbeat._aggregators
+        await agg.task
+        return first_round, second_round
+    finally:
+        ckit_shutdown.shutdown_event = orig_event
+        await backend.runner.cleanup()
+
+
+def test_heartbeats_batched():
+    first_round, second_round = asyncio.run(_run(reject_batches=False))
+    assert len(first_round) == 1 and len(second_round) == 1
+    aliases, variables = first_round[0]
+    assert sorted(f for _, f in aliases) == ["bot_confirm_exists"] + ["cloudtool_confirm_exists"] * 12
+    assert {variables[k] for k in variables if k.endswith("_tool_name")} == {"tool%02d" % i for i in range(12)}
+    assert json.loads([v for k, v in variables.items() if k.endswith("_ctool_parameters")][0]) == {"type": "object", "properties": {}}
+
+
+def test_heartbeats_fallback_when_batch_rejected():
+    first_round, second_round = asyncio.run(_run(reject_batches=True))
+    # one rejected batch, then one by one, and it remembers not to try batches again
+    assert len(first_round) == 1 + 13
+    assert len(second_round) == 13
+    assert all(len(aliases) == 1 for aliases, _ in second_round)
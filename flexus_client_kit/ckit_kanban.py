@@ -3,7 +3,6 @@ from dataclasses import dataclass
 import dataclasses
 from typing import List, Tuple, Optional, Any
 
-import gql
 
 from flexus_client_kit import ckit_client, gql_utils
 
@@ -60,7 +59,7 @@ async def persona_kanban_list(
     ws_client = await client.use_ws()
     async with ws_client as ws:
         async for r in ws.subscribe(
-            gql.gql(f"""subscription PersonaKanban($persona_id: String!) {{
+            gql_utils.gql_cached(f"""subscription PersonaKanban($persona_id: String!) {{
                 persona_kanban_subs(persona_id: $persona_id, limit_inbox: 100, limit_done: 100) {{
                     news_action
                     news_payload_id
@@ -92,7 +91,7 @@ async def bot_kanban_post_into_inbox(
     http = await client.use_http()
     async with http as h:
         await h.execute(
-            gql.gql(
+            gql_utils.gql_cached(
                 """mutation KanbanInbox($pid: String!, $title: String!, $details: String!, $prov: String!, $fexp: String!, $comingup: Float!) {
                     bot_kanban_post_into_inbox(persona_id: $pid, title: $title, details_json: $details, provenance_message: $prov, fexp_name: $fexp, comingup_ts: $comingup)
                 }""",
@@ -116,7 +115,7 @@ async def get_tasks_by_thread(
     http = await client.use_http()
     async with http as h:
         result = await h.execute(
-            gql.gql("""query GetTasksForThread($ft_id: String!) {
+            gql_utils.gql_cached("""query GetTasksForThread($ft_id: String!) {
                 persona_kanban_tasks_by_thread(ft_id: $ft_id) {
                     persona_id
                     ktask_id
@@ -154,7 +153,7 @@ async def bot_kanban_update_details(
     http = await client.use_http()
     async with http as h:
         result = await h.execute(
-            gql.gql("""mutation UpdateTaskDetails($ktask_id: String!, $details: String!) {
+            gql_utils.gql_cached("""mutation UpdateTaskDetails($ktask_id: String!, $details: String!) {
                 kanban_task_update_details(ktask_id: $ktask_id, ktask_details: $details)
             }"""),
             variable_values={
@@ -173,7 +172,7 @@ async def bot_get_all_tasks(
     http = await client.use_http()
     async with http as h:
         result = await h.execute(
-            gql.gql("""query GetAllTasks($persona_id: String!) {
+            gql_utils.gql_cached("""query GetAllTasks($persona_id: String!) {
                 bot_get_all_tasks(persona_id: $persona_id) {
                     persona_id
                     ktask_id
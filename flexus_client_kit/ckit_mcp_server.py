@@ -5,7 +5,6 @@ import logging
 from typing import Optional
 from dataclasses import dataclass
 
-import gql
 
 from flexus_client_kit import ckit_client, gql_utils
 
@@ -38,7 +37,7 @@ async def create_mcp(
     mcp_env_vars: Optional[dict] = None
 ) -> FMcpServerOutput:
     async with (await fclient.use_http()) as http:
-        resp = await http.execute(gql.gql(f"""mutation CreateMCP($input: FMcpServerInput!) {{
+        resp = await http.execute(gql_utils.gql_cached(f"""mutation CreateMCP($input: FMcpServerInput!) {{
             mcp_server_create(input: $input) {{ {gql_utils.gql_fields(FMcpServerOutput)} }}
         }}"""), variable_values={"input": {
             "located_fgroup_id": located_fgroup_id,
@@ -58,7 +57,7 @@ async def wait_for_mcp(fclient: ckit_client.FlexusClient, mcp_id: str, timeout:
     start_time = time.time()
     while time.time() - start_time < timeout:
         async with (await fclient.use_http()) as http:
-            resp = await http.execute(gql.gql("""query GetMCP($id: String!) {
+            resp = await http.execute(gql_utils.gql_cached("""query GetMCP($id: String!) {
                 mcp_server_get(id: $id) { mcp_status }
             }"""), variable_values={"id": mcp_id})
         if resp["mcp_server_get"]["mcp_status"] == "RUNNING":
@@ -1,14 +1,44 @@
+import asyncio
+import concurrent.futures
+import datetime
+import hashlib
 import json
-import gql
+import logging
+import os
+import random
+import re
 import time
-from typing import Dict, Any, List, Optional
-from bson import Binary
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple, Union, Iterable, AsyncIterable, AsyncIterator
+from bson import Binary, ObjectId
+from pymongo import ReturnDocument
 from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 
-from flexus_client_kit import ckit_client
+from flexus_client_kit import ckit_client, ckit_shutdown, ckit_trigram, gql_utils
 
+logger = logging.getLogger("mongo")
 
-MAX_FILE_SIZE = 2 * 1024 * 1024
+
+MAX_FILE_SIZE = 2 * 1024 * 1024   # bigger files are stored in chunks
+MONGO_CHUNK_SIZE = 256 * 1024
+MONGO_CHUNKS_PER_ROUNDTRIP = 16
+MONGO_MAX_CHUNKED_SIZE = int(os.getenv("FLEXUS_MONGO_MAX_FILE_MB", "256")) * 1024 * 1024
+MONGO_LS_PAGE_MAX = 1000
+LS_PROJECTION = {"data": 0, "json": 0, "mon_chunks": 0}
+MONGO_GREP_WORKERS = 4
+MONGO_GREP_MAX_FILE = 16 * 1024 * 1024
+MONGO_RETENTION_SEC = 2 * 86400            # deleted files can be brought back for that long, then compaction purges them
+MONGO_CHUNK_GRACE_SEC = 3600               # unreferenced chunks younger than that might belong to an upload in progress
+MONGO_COMPACT_PERIOD = 6 * 3600
+MONGO_DELETE_BATCH = 1000
+
+# Save modes, see mongo_save()
+SAVE_CREATE = "create"           # path taken (deleted files too) -> ValueError "File already exists at path"
+SAVE_OVERWRITE = "overwrite"     # replace the content, keeps mon_ctime, brings back a deleted file
+SAVE_VERSION = "version"         # path taken -> next free of name.v2.ext, name.v3.ext, ...
+
+_indexes_ensured = set()
 
 
 async def mongo_fetch_creds(
@@ -19,7 +49,7 @@ async def mongo_fetch_creds(
     # XXX use gql_with_retry
     async with http as h:
         r = await h.execute(
-            gql.gql("""mutation GetMongoDbCreds($persona_id: String!) {
+            gql_utils.gql_cached("""mutation GetMongoDbCreds($persona_id: String!) {
                 bot_mongodb_creds(persona_id: $persona_id)
             }"""),
             variable_values={
@@ -29,35 +59,123 @@ async def mongo_fetch_creds(
         return r["bot_mongodb_creds"]
 
 
-async def mongo_store_file(
+@dataclass
+class SaveResult:
+    id: str
+    path: str              # where it went, differs from the requested path for SAVE_VERSION
+    overwritten: bool
+
+
+_CONTENT_FIELDS = ["data", "json", "mon_chunks", "mon_lines", "mon_sha256", "mon_purge_at"]
+
+
+def _versioned_path(file_path: str, n: int) -> str:
+    # "a/report.json", 2 -> "a/report.v2.json"
+    d, slash, name = file_path.rpartition("/")
+    stem, dot, ext = name.rpartition(".")
+    name = f"{stem}.v{n}.{ext}" if stem else f"{name}.v{n}"
+    return d + slash + name
+
+
+async def _save_fields(mongo_collection: Collection, file_path: str, fields: Dict[str, Any], t: float, mode: str) -> SaveResult:
+    # One round trip for create and overwrite, the unique path index makes concurrent writers safe. Version mode
+    # takes 2 more when the path is taken: bump the counter on the original, create the versioned file.
+    await mongo_ensure_indexes(mongo_collection)
+    unset = {k: "" for k in _CONTENT_FIELDS + ["mon_archived", "mon_new_location", "mon_deleted_ts"] if k not in fields}
+    new_id = ObjectId()
+    if mode == SAVE_OVERWRITE:
+        for attempt in range(2):
+            try:
+                before = await mongo_collection.find_one_and_update(
+                    {"path": file_path},
+                    {"$set": fields, "$unset": unset, "$setOnInsert": {"_id": new_id, "mon_ctime": t}},
+                    projection={"_id": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.BEFORE,
+                )
+                break
+            except DuplicateKeyError:
+                if attempt:   # two upserts raced to insert, the loser retries as an update
+                    raise
+        return SaveResult(str(before["_id"] if before else new_id), file_path, before is not None)
+    if mode not in (SAVE_CREATE, SAVE_VERSION):
+        raise ValueError(f"Unknown save mode {mode!r}")
+    try:
+        r = await mongo_collection.update_one(
+            {"path": file_path},
+            {"$setOnInsert": {"_id": new_id, "path": file_path, "mon_ctime": t, **fields}},
+            upsert=True,
+        )
+        taken = r.upserted_id is None
+    except DuplicateKeyError:
+        taken = True
+    if not taken:
+        return SaveResult(str(new_id), file_path, False)
+    if mode == SAVE_CREATE:
+        raise ValueError(f"File already exists at path: {file_path}")
+    while 1:
+        counter = await mongo_collection.find_one_and_update(
+            {"path": file_path},
+            {"$inc": {"mon_versions": 1}},
+            projection={"mon_versions": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if counter is None:   # deleted for real in the meantime
+            return await _save_fields(mongo_collection, file_path, fields, t, mode)
+        try:
+            return await _save_fields(mongo_collection, _versioned_path(file_path, counter["mon_versions"] + 1), fields, t, SAVE_CREATE)
+        except ValueError:
+            pass   # somebody saved "report.v2.json" by hand, take the next number
+
+
+def _inline_fields(file_path: str, file_data: bytes, t: float, ttl: int) -> Dict[str, Any]:
+    fields = {
+        "mon_mtime": t,
+        "mon_size": len(file_data),
+        "mon_expires_ts": t + ttl,
+    }
+    if file_path.endswith(".json"):
+        fields["json"] = json.loads(file_data.decode("utf-8"))
+    else:
+        fields["data"] = Binary(file_data)
+    return fields
+
+
+def _purge_at(t: float, ttl: int) -> datetime.datetime:
+    # mongo TTL index only works with dates, it deletes the document (checks once a minute) after that
+    return datetime.datetime.fromtimestamp(t + ttl, datetime.timezone.utc)
+
+
+async def mongo_save(
     mongo_collection: Collection,
     file_path: str,
     file_data: bytes,
     ttl: int = 30 * 86400,
-) -> str:
+    mode: str = SAVE_CREATE,
+    temporary: bool = False,
+) -> SaveResult:
+    """
+    Temporary files are deleted by mongo itself when ttl runs out, no soft delete, no way to bring them back.
+    """
     assert ttl > 0
     if len(file_data) > MAX_FILE_SIZE:
-        raise ValueError(f"File size {len(file_data)} exceeds maximum {MAX_FILE_SIZE}")
-    existing_doc = await mongo_collection.find_one({"path": file_path}, {"_id": 1})
-    if existing_doc:
-        raise ValueError(f"File already exists at path: {file_path}")
+        if file_path.endswith(".json"):
+            json.loads(file_data.decode("utf-8"))   # same error as for small files
+        return await mongo_save_stream(mongo_collection, file_path, [file_data], ttl, mode, temporary)
     t = time.time()
-    document = {
-        "path": file_path,
-        "mon_ctime": t,
-        "mon_mtime": t,
-        "mon_size": len(file_data),
-        "mon_expires_ts": t + ttl,
-    }
+    fields = _inline_fields(file_path, file_data, t, ttl)
+    if temporary:
+        fields["mon_purge_at"] = _purge_at(t, ttl)
+    return await _save_fields(mongo_collection, file_path, fields, t, mode)
 
-    if file_path.endswith(".json"):
-        json_data = json.loads(file_data.decode("utf-8"))
-        document["json"] = json_data
-    else:
-        document["data"] = Binary(file_data)
 
-    result = await mongo_collection.insert_one(document)
-    return str(result.inserted_id)
+async def mongo_store_file(
+    mongo_collection: Collection,
+    file_path: str,
+    file_data: bytes,
+    ttl: int = 30 * 86400,
+) -> str:
+    return (await mongo_save(mongo_collection, file_path, file_data, ttl, SAVE_CREATE)).id
 
 
 async def mongo_overwrite(
@@ -66,56 +184,252 @@ async def mongo_overwrite(
     file_data: bytes,
     ttl: int = 30 * 86400,
 ) -> str:
-    if len(file_data) > MAX_FILE_SIZE:
-        raise ValueError(f"File size {len(file_data)} exceeds maximum {MAX_FILE_SIZE}")
-    t = time.time()
-    existing_doc = await mongo_collection.find_one({"path": file_path}, {"mon_ctime": 1, "_id": 1})
-    if existing_doc:
-        doc_id = existing_doc["_id"]
-        update_doc = {
-            "$set": {
-                "mon_mtime": t,
-                "mon_size": len(file_data),
-                "mon_expires_ts": t + ttl,
-            }
-        }
-        if file_path.endswith(".json"):
-            json_data = json.loads(file_data.decode("utf-8"))
-            update_doc["$set"]["json"] = json_data
-            update_doc["$unset"] = {"data": ""}
-        else:
-            update_doc["$set"]["data"] = Binary(file_data)
-            update_doc["$unset"] = {"json": ""}
-        await mongo_collection.update_one({"_id": doc_id}, update_doc)
-        return str(doc_id)
-    return await mongo_store_file(mongo_collection, file_path, file_data, ttl)
+    return (await mongo_save(mongo_collection, file_path, file_data, ttl, SAVE_OVERWRITE)).id
 
 
 async def mongo_retrieve_file(
     mongo_collection: Collection,
     file_path: str,
     best_effort_to_find: bool = False,
+    load_chunks: bool = True,
 ) -> Optional[Dict[str, Any]]:
+    """
+    Chunked files come back like small ones, with "data" or "json" assembled from chunks. With load_chunks=False
+    the document has "mon_chunks" instead, use mongo_open_stream() or mongo_read_lines() to read it.
+    """
     document = await mongo_collection.find_one({"path": file_path})
     if not document:
         return None
     if "mon_new_location" in document:
         if best_effort_to_find:
-            return await mongo_retrieve_file(mongo_collection, document["mon_new_location"], best_effort_to_find)
+            return await mongo_retrieve_file(mongo_collection, document["mon_new_location"], best_effort_to_find, load_chunks)
         return None
     document["_id"] = str(document["_id"])
+    if load_chunks and "mon_chunks" in document:
+        data = b"".join([piece async for piece in mongo_open_stream(mongo_collection, document)])
+        del document["mon_chunks"]
+        document["data"] = data
+        if file_path.endswith(".json"):
+            try:
+                document["json"] = json.loads(data.decode("utf-8"))
+                del document["data"]
+            except ValueError:
+                logger.warning("chunked %s is not valid json, returning as data", file_path)
     return document
 
 
+def _chunks_collection(mongo_collection: Collection) -> Collection:
+    return mongo_collection.database[mongo_collection.name + "_chunks"]
+
+
+async def _put_chunks(chunks_collection: Collection, pieces: List[Tuple[str, bytes]], t: float) -> int:
+    # Chunks are content addressed, _id is sha256 of the data, so the same content is stored once. Existing ones get
+    # mon_mtime refreshed, cleanup doesn't delete recently used chunks even if no file refers to them yet.
+    ids = list({h for h, _ in pieces})
+    existing = {d["_id"] async for d in chunks_collection.find({"_id": {"$in": ids}}, {"_id": 1})}
+    if existing:
+        r = await chunks_collection.update_many({"_id": {"$in": list(existing)}}, {"$set": {"mon_mtime": t}})
+        if r.matched_count < len(existing):   # mongo_compact() swept some between find and update, upload them again
+            existing = {d["_id"] async for d in chunks_collection.find({"_id": {"$in": ids}, "mon_mtime": t}, {"_id": 1})}
+    new, seen = [], set(existing)
+    for h, data in pieces:
+        if h not in seen:
+            seen.add(h)
+            new.append({"_id": h, "data": Binary(data), "size": len(data), "mon_ctime": t, "mon_mtime": t})
+    if new:
+        try:
+            await chunks_collection.insert_many(new, ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise   # not just a concurrent upload of the same chunk
+    return sum(len(d["data"]) for d in new)
+
+
+async def mongo_store_stream(
+    mongo_collection: Collection,
+    file_path: str,
+    stream: Union[Iterable[bytes], AsyncIterable[bytes]],
+    ttl: int = 30 * 86400,
+    overwrite: bool = False,
+) -> str:
+    return (await mongo_save_stream(mongo_collection, file_path, stream, ttl, SAVE_OVERWRITE if overwrite else SAVE_CREATE)).id
+
+
+async def mongo_save_stream(
+    mongo_collection: Collection,
+    file_path: str,
+    stream: Union[Iterable[bytes], AsyncIterable[bytes]],
+    ttl: int = 30 * 86400,
+    mode: str = SAVE_CREATE,
+    temporary: bool = False,
+) -> SaveResult:
+    """
+    Stores a file of any size up to MONGO_MAX_CHUNKED_SIZE in MONGO_CHUNK_SIZE chunks, without holding it in memory.
+    Chunks that are already stored (same content) are not uploaded again.
+    """
+    assert ttl > 0
+    if mode == SAVE_CREATE and await mongo_collection.find_one({"path": file_path}, {"_id": 1}):
+        raise ValueError(f"File already exists at path: {file_path}")   # fail before uploading the chunks
+    t = time.time()
+    chunks_collection = _chunks_collection(mongo_collection)
+    whole = hashlib.sha256()
+    chunks: List[Dict[str, Any]] = []
+    pending: List[Tuple[str, bytes]] = []
+    size, new_bytes, last_byte = 0, 0, b""
+    buf = bytearray()
+
+    async def flush(final: bool) -> None:
+        nonlocal buf, pending, new_bytes
+        while len(buf) >= MONGO_CHUNK_SIZE or (final and buf):
+            piece = bytes(buf[:MONGO_CHUNK_SIZE])
+            del buf[:MONGO_CHUNK_SIZE]
+            h = hashlib.sha256(piece).hexdigest()
+            chunks.append({"h": h, "n": len(piece), "nl": piece.count(b"\n")})
+            pending.append((h, piece))
+        if len(pending) >= MONGO_CHUNKS_PER_ROUNDTRIP or (final and pending):
+            new_bytes += await _put_chunks(chunks_collection, pending, t)
+            pending = []
+
+    async def pieces() -> AsyncIterator[bytes]:
+        if hasattr(stream, "__aiter__"):
+            async for piece in stream:
+                yield piece
+        else:
+            for piece in stream:
+                yield piece
+
+    async for piece in pieces():
+        size += len(piece)
+        if size > MONGO_MAX_CHUNKED_SIZE:
+            raise ValueError(f"File size exceeds maximum {MONGO_MAX_CHUNKED_SIZE}")
+        whole.update(piece)
+        buf += piece
+        last_byte = piece[-1:] or last_byte
+        await flush(False)
+    await flush(True)
+
+    fields = {
+        "mon_mtime": t,
+        "mon_size": size,
+        "mon_expires_ts": t + ttl,
+        "mon_chunks": chunks,
+        "mon_lines": sum(c["nl"] for c in chunks) + (1 if last_byte not in (b"", b"\n") else 0),   # like splitlines()
+        "mon_sha256": whole.hexdigest(),
+    }
+    if temporary:
+        fields["mon_purge_at"] = _purge_at(t, ttl)
+    logger.info("stored %s in %d chunks, %d bytes, %d of them new", file_path, len(chunks), size, new_bytes)
+    return await _save_fields(mongo_collection, file_path, fields, t, mode)
+
+
+async def _fetch_chunks(mongo_collection: Collection, hashes: List[str], first_batch: int = MONGO_CHUNKS_PER_ROUNDTRIP) -> AsyncIterator[bytes]:
+    # Batches grow from first_batch, range reads that need one chunk fetch one chunk
+    chunks_collection = _chunks_collection(mongo_collection)
+    i, n = 0, first_batch
+    while i < len(hashes):
+        batch = hashes[i:i + n]
+        got = {d["_id"]: bytes(d["data"]) async for d in chunks_collection.find({"_id": {"$in": list(set(batch))}})}
+        for h in batch:
+            if h not in got:
+                raise ValueError(f"chunk {h} is missing")
+            yield got[h]
+        i, n = i + n, min(n * 2, MONGO_CHUNKS_PER_ROUNDTRIP)
+
+
+async def mongo_open_stream(mongo_collection: Collection, document: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """
+    Content of a document from mongo_retrieve_file(), piece by piece, works for chunked and small files.
+    """
+    if "mon_chunks" in document:
+        async for piece in _fetch_chunks(mongo_collection, [c["h"] for c in document["mon_chunks"]]):
+            yield piece
+    elif document.get("data") is not None:
+        yield bytes(document["data"])
+    elif "json" in document:
+        yield json.dumps(document["json"], indent=2).encode("utf-8")
+
+
+async def mongo_read_lines(
+    mongo_collection: Collection,
+    document: Dict[str, Any],
+    start: int,
+    end: Optional[int] = None,
+    max_bytes: int = 1024 * 1024,
+) -> Tuple[bytes, int]:
+    """
+    Lines start..end (0-based, end exclusive, None for all) of a chunked document, fetching only the chunks they are
+    in, and not more than about max_bytes. Returns (data, total number of lines in the file).
+    """
+    chunks = document["mon_chunks"]
+    total_lines = document.get("mon_lines", sum(c["nl"] for c in chunks))
+    if end is not None and end <= start:
+        return b"", total_lines
+    first, newlines_before = 0, 0
+    while first < len(chunks) and newlines_before + chunks[first]["nl"] < start:
+        newlines_before += chunks[first]["nl"]
+        first += 1
+    out = bytearray()
+    skip = start - newlines_before   # newlines to skip in the first fetched chunk
+    want = None if end is None else end - start
+    async for piece in _fetch_chunks(mongo_collection, [c["h"] for c in chunks[first:]], first_batch=1):
+        if skip:
+            pos = -1
+            while skip and (pos := piece.find(b"\n", pos + 1)) != -1:
+                skip -= 1
+            if skip:
+                continue
+            piece = piece[pos + 1:]
+        out += piece
+        if want is not None and out.count(b"\n") >= want:
+            break
+        if len(out) >= max_bytes:
+            break
+    if want is not None:
+        cut, pos = want, -1
+        while cut and (pos := out.find(b"\n", pos + 1)) != -1:
+            cut -= 1
+        if not cut:
+            del out[pos:]
+    return bytes(out), total_lines
+
+
+async def mongo_ensure_indexes(mongo_collection: Collection) -> None:
+    """
+    Indexes for path lookups, prefix listing (path, _id is also the page order) and newest first. Once per
+    collection per process, create_index() is a no-op for an existing index but still a round trip.
+    """
+    key = (mongo_collection.database.name, mongo_collection.name)
+    if key in _indexes_ensured:
+        return
+    await mongo_collection.create_index([("path", 1), ("_id", 1)], name="path_id")
+    await mongo_collection.create_index([("mon_ctime", -1)], name="mon_ctime")
+    await mongo_collection.create_index([("mon_purge_at", 1)], name="mon_purge_at_ttl", expireAfterSeconds=0)
+    try:
+        await mongo_collection.create_index([("path", 1)], name="path_unique", unique=True)
+    except OperationFailure as e:
+        # collections from before the index might have the same path twice, writes still work, only not race-safe
+        logger.warning("cannot create unique path index on %s.%s: %s", key[0], key[1], e)
+    _indexes_ensured.add(key)
+    logger.info("ensured indexes for %s.%s", *key)
+
+
+def _prefix_range(path_prefix: str) -> Dict[str, str]:
+    # "abc/" -> {"$gte": "abc/", "$lt": "abc0"}, a range goes through the path index and doesn't need regex escaping
+    if not path_prefix:
+        return {"$gte": ""}
+    return {"$gte": path_prefix, "$lt": path_prefix[:-1] + chr(ord(path_prefix[-1]) + 1)}
+
+
 async def mongo_ls(
     mongo_collection: Collection,
     path_prefix: Optional[str] = None,
     limit: Optional[int] = None,
 ) -> List[Dict[str, Any]]:
+    await mongo_ensure_indexes(mongo_collection)
     query = {"mon_archived": {"$ne": True}}
     if path_prefix:
-        query["path"] = {"$regex": f"^{path_prefix}"}
-    cursor = mongo_collection.find(query, {"data": 0, "json": 0}).sort("mon_ctime", -1)
+        query["path"] = _prefix_range(path_prefix)
+    cursor = mongo_collection.find(query, LS_PROJECTION).sort("mon_ctime", -1)
     if limit:
         cursor = cursor.limit(limit)
     documents = []
@@ -125,34 +439,70 @@ async def mongo_ls(
     return documents
 
 
+async def mongo_ls_page(
+    mongo_collection: Collection,
+    path_prefix: str = "",
+    limit: int = 100,
+    after: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Files under path_prefix ordered by path, without data. Returns (documents, next_page), pass next_page as
+    `after` to continue, it's None on the last page. Every page is one index range scan, however many files there are.
+    """
+    await mongo_ensure_indexes(mongo_collection)
+    limit = max(1, min(limit, MONGO_LS_PAGE_MAX))
+    query: Dict[str, Any] = {"path": _prefix_range(path_prefix), "mon_archived": {"$ne": True}}
+    if after:
+        after_path, after_id = json.loads(after)
+        after_id = ObjectId(after_id) if ObjectId.is_valid(after_id) else after_id
+        query["$or"] = [{"path": {"$gt": after_path}}, {"path": after_path, "_id": {"$gt": after_id}}]
+    cursor = mongo_collection.find(query, LS_PROJECTION).sort([("path", 1), ("_id", 1)]).limit(limit + 1)
+    documents = await cursor.to_list(length=limit + 1)
+    next_page = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_page = json.dumps([documents[-1]["path"], str(documents[-1]["_id"])])
+    for doc in documents:
+        doc["_id"] = str(doc["_id"])
+    return documents, next_page
+
+
 async def mongo_ls_subdir(
     mongo_collection: Collection,
     path: str,
 ) -> List[Dict[str, Any]]:
+    """
+    Immediate children of path: files as they are, subdirectories with min ctime, max mtime, total size and
+    count of files inside. Grouped by the server, only the children come back. Newest mtime first.
+    """
     # XXX only used by persona_mongo_docs_list() which is UI to re-work
-    path_filter = {"path": {"$exists": True, "$ne": None}, "mon_archived": {"$ne": True}}
-    if path:
-        path_filter["path"] = {"$regex": f"^{path.rstrip('/')}/"}
-    cursor = mongo_collection.find(path_filter, {"path": 1, "mon_ctime": 1, "mon_mtime": 1, "mon_size": 1, "ctime": 1, "mtime": 1, "size_bytes": 1, "_id": 0}).sort([("mon_mtime", -1), ("mtime", -1)])
-    docs = await cursor.to_list(length=None)
-    items = {}
-    for doc in docs:
-        relative = doc["path"][len(path.rstrip('/')) + 1:] if path else doc["path"]
-        immediate = relative.split('/')[0]
-        current_path = f"{path.rstrip('/')}/{immediate}" if path else immediate
-        doc_ctime = doc["mon_ctime"]
-        doc_mtime = doc["mon_mtime"]
-        doc_size = doc["mon_size"]
-        if '/' in relative:
-            if current_path not in items:
-                items[current_path] = {"path": current_path, "mime_type": "subdir", "mon_ctime": doc_ctime, "mon_mtime": doc_mtime, "mon_size": doc_size}
-            else:
-                items[current_path]["mon_ctime"] = min(items[current_path]["mon_ctime"], doc_ctime)
-                items[current_path]["mon_mtime"] = max(items[current_path]["mon_mtime"], doc_mtime)
-                items[current_path]["mon_size"] += doc_size
-        else:
-            items[current_path] = {"path": doc["path"], "mime_type": "", "mon_ctime": doc_ctime, "mon_mtime": doc_mtime, "mon_size": doc_size}
-    return list(items.values())
+    await mongo_ensure_indexes(mongo_collection)
+    prefix = f"{path.rstrip('/')}/" if path else ""
+    is_dir = {"$gte": ["$slash", 0]}
+    pipeline = [
+        {"$match": {"path": _prefix_range(prefix), "mon_archived": {"$ne": True}}},
+        {"$project": {"_id": 0, "path": 1, "mon_ctime": 1, "mon_mtime": 1, "mon_size": 1, "rel": {"$substrCP": ["$path", len(prefix), MAX_FILE_SIZE]}}},
+        {"$project": {"path": 1, "mon_ctime": 1, "mon_mtime": 1, "mon_size": 1, "rel": 1, "slash": {"$indexOfCP": ["$rel", "/"]}}},
+        {"$group": {
+            "_id": {"path": {"$cond": [is_dir, {"$concat": [prefix, {"$substrCP": ["$rel", 0, "$slash"]}]}, "$path"]}, "dir": is_dir},
+            "mon_ctime": {"$min": "$mon_ctime"},
+            "mon_mtime": {"$max": "$mon_mtime"},
+            "mon_size": {"$sum": "$mon_size"},
+            "count": {"$sum": 1},
+        }},
+        {"$sort": {"mon_mtime": -1}},
+    ]
+    items = []
+    async for g in await mongo_collection.aggregate(pipeline):
+        items.append({
+            "path": g["_id"]["path"],
+            "mime_type": "subdir" if g["_id"]["dir"] else "",
+            "mon_ctime": g["mon_ctime"],
+            "mon_mtime": g["mon_mtime"],
+            "mon_size": g["mon_size"],
+            "count": g["count"],
+        })
+    return items
 
 
 async def mongo_mv(
@@ -163,9 +513,12 @@ async def mongo_mv(
     doc = await mongo_collection.find_one({"path": old_path})
     if not doc:
         return False
-    doc["_id"] = None
+    del doc["_id"]
     doc["path"] = new_path
-    await mongo_collection.insert_one(doc)
+    try:
+        await mongo_collection.insert_one(doc)
+    except DuplicateKeyError:
+        raise ValueError(f"File already exists at path: {new_path}")
     t = time.time()
     await mongo_collection.update_one(
         {"path": old_path},
@@ -173,11 +526,13 @@ async def mongo_mv(
             "mon_new_location": new_path,
             "mon_mtime": t,
             "mon_archived": True,
-            "mon_expires_ts": t + 2*86400
+            "mon_deleted_ts": t,
+            "mon_expires_ts": t + MONGO_RETENTION_SEC
         },
         "$unset": {
             "data": "",
-            "json": ""
+            "json": "",
+            "mon_chunks": ""
         }}
     )
     return True
@@ -192,7 +547,276 @@ async def mongo_rm(
         {"path": file_path},
         {"$set": {
             "mon_archived": True,
-            "mon_expires_ts": t + 2*86400
+            "mon_deleted_ts": t,
+            "mon_expires_ts": t + MONGO_RETENTION_SEC
         }}
     )
     return result.modified_count > 0
+
+
+async def mongo_rm_many(
+    mongo_collection: Collection,
+    paths: Optional[List[str]] = None,
+    path_prefix: Optional[str] = None,
+    except_prefix: Optional[str] = None,
+) -> int:
+    """
+    Soft delete of many files in one update_many, by exact paths or by prefix ("" means everything), files under
+    except_prefix stay. Returns how many were deleted, already deleted ones don't count.
+    """
+    assert (paths is None) != (path_prefix is None), "either paths or path_prefix"
+    await mongo_ensure_indexes(mongo_collection)
+    query: Dict[str, Any] = {"mon_archived": {"$ne": True}}
+    query["path"] = {"$in": paths} if paths is not None else _prefix_range(path_prefix)
+    if except_prefix:
+        query["$nor"] = [{"path": _prefix_range(except_prefix)}]
+    t = time.time()
+    result = await mongo_collection.update_many(query, {"$set": {
+        "mon_archived": True,
+        "mon_deleted_ts": t,
+        "mon_expires_ts": t + MONGO_RETENTION_SEC,
+    }})
+    return result.modified_count
+
+
+@dataclass
+class CompactReport:
+    files_purged: int = 0
+    file_bytes: int = 0        # BSON size of the purged documents
+    chunks_purged: int = 0
+    chunk_bytes: int = 0
+
+    @property
+    def bytes_reclaimed(self) -> int:
+        return self.file_bytes + self.chunk_bytes
+
+
+async def mongo_compact(
+    mongo_collection: Collection,
+    retention: float = MONGO_RETENTION_SEC,
+    chunk_grace: float = MONGO_CHUNK_GRACE_SEC,
+) -> CompactReport:
+    """
+    Purges files deleted more than retention seconds ago, then chunks no file refers to (overwritten, purged, or
+    expired by the TTL index). Safe to run from several processes at once.
+    """
+    t = time.time()
+    report = CompactReport()
+    old_deleted = {"mon_archived": True, "$or": [
+        {"mon_deleted_ts": {"$lt": t - retention}},
+        {"mon_deleted_ts": {"$exists": False}, "mon_expires_ts": {"$lt": t}},   # deleted before mon_deleted_ts existed
+    ]}
+    batch: List[Tuple[ObjectId, int]] = []
+
+    async def purge_files() -> None:
+        r = await mongo_collection.delete_many({"_id": {"$in": [i for i, _ in batch]}, **old_deleted})   # not undeleted in the meantime
+        report.files_purged += r.deleted_count
+        report.file_bytes += sum(n for _, n in batch) * r.deleted_count // len(batch)   # exact unless raced
+        batch.clear()
+
+    cursor = await mongo_collection.aggregate([{"$match": old_deleted}, {"$project": {"size": {"$bsonSize": "$$ROOT"}}}])
+    async for doc in cursor:
+        batch.append((doc["_id"], doc["size"]))
+        if len(batch) >= MONGO_DELETE_BATCH:
+            await purge_files()
+    if batch:
+        await purge_files()
+
+    # Mark and sweep. _put_chunks() refreshes mon_mtime on chunks it reuses, so a chunk an upload in progress
+    # refers to is never older than chunk_grace, even if the file document is not written yet.
+    chunks_collection = _chunks_collection(mongo_collection)
+    referenced = set()
+    cursor = await mongo_collection.aggregate([
+        {"$match": {"mon_chunks": {"$exists": True}}},
+        {"$unwind": "$mon_chunks"},
+        {"$group": {"_id": "$mon_chunks.h"}},
+    ])
+    async for doc in cursor:
+        referenced.add(doc["_id"])
+    orphans: List[Tuple[str, int]] = []
+
+    async def purge_chunks() -> None:
+        r = await chunks_collection.delete_many({"_id": {"$in": [h for h, _ in orphans]}, "mon_mtime": {"$lt": t - chunk_grace}})
+        report.chunks_purged += r.deleted_count
+        report.chunk_bytes += sum(n for _, n in orphans) * r.deleted_count // len(orphans)
+        orphans.clear()
+
+    async for chunk in chunks_collection.find({"mon_mtime": {"$lt": t - chunk_grace}}, {"_id": 1, "size": 1}):
+        if chunk["_id"] not in referenced:
+            orphans.append((chunk["_id"], chunk.get("size", 0)))
+            if len(orphans) >= MONGO_DELETE_BATCH:
+                await purge_chunks()
+    if orphans:
+        await purge_chunks()
+    logger.info("compacted %s.%s: %d files %d bytes, %d chunks %d bytes, took %.1fs",
+        mongo_collection.database.name, mongo_collection.name,
+        report.files_purged, report.file_bytes, report.chunks_purged, report.chunk_bytes, time.time() - t)
+    return report
+
+
+_compaction_tasks: Dict[Tuple[str, str], Tuple[Collection, asyncio.Task]] = {}
+
+
+async def _compaction_loop(mongo_collection: Collection, period: float) -> None:
+    delay = random.uniform(0.05, 1.0) * period   # not all the bots at once after a restart
+    while 1:
+        try:
+            await asyncio.wait_for(ckit_shutdown.shutdown_event.wait(), timeout=delay)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await mongo_compact(mongo_collection)
+        except Exception as e:
+            logger.warning("compaction of %s.%s failed: %s", mongo_collection.database.name, mongo_collection.name, e)
+        delay = period
+
+
+def mongo_start_compaction(mongo_collection: Collection, period: float = MONGO_COMPACT_PERIOD) -> asyncio.Task:
+    """
+    Runs mongo_compact() in the background every period seconds until shutdown, once per collection per process.
+    The caller owns the task: cancel it when the collection's client goes away, typically in the finally of the
+    bot main loop. Starting again with another collection object (a restarted main loop, a new client) replaces
+    the old task.
+    """
+    key = (mongo_collection.database.name, mongo_collection.name)
+    name = "mongo_compact_%s_%s" % key
+    coll, task = _compaction_tasks.get(key, (None, None))
+    if task is not None and not task.done():
+        if coll is mongo_collection:
+            return task
+        task.cancel()
+    task = asyncio.create_task(_compaction_loop(mongo_collection, period))
+    _compaction_tasks[key] = (mongo_collection, task)
+    ckit_shutdown.give_task_to_cancel(name, task)
+
+    def forget(t: asyncio.Task) -> None:
+        if _compaction_tasks.get(key, (None, None))[1] is t:
+            del _compaction_tasks[key]
+        if ckit_shutdown.tasks_to_cancel.get(name) is t:
+            ckit_shutdown.take_away_task_to_cancel(name)
+    task.add_done_callback(forget)
+    return task
+
+
+@dataclass
+class GrepFileResult:
+    path: str
+    matches: int                      # all matching lines in the file, even over the per file cap
+    lines: List[Tuple[int, str]]      # (line number from 1, text), matching lines and context, up to the cap
+    mtime: float
+
+
+@dataclass
+class GrepResult:
+    files: List[GrepFileResult] = field(default_factory=list)   # ranked, most matches first
+    candidates: int = 0       # documents mongo returned for the path prefix
+    scanned: int = 0          # ran the regex
+    prefiltered: int = 0      # skipped without regex, a literal from the pattern is not in the file
+    skipped_binary: int = 0
+    timed_out: bool = False
+    dropped_files: int = 0    # had matches, but ranked below max_matches worth of better files
+    dropped_matches: int = 0
+
+
+_grep_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+
+def _grep_content(path: str, data: Optional[bytes], json_data: Any, pattern: re.Pattern, literal: Optional[bytes], context: int, per_file: int) -> Tuple[str, int, List[Tuple[int, str]]]:
+    # Runs in the thread pool. Returns (outcome, matches, lines)
+    if data is not None:
+        if literal is not None and data.find(literal) == -1:
+            return "prefiltered", 0, []
+        if b"\x00" in data[:1024]:
+            return "binary", 0, []
+        content = data.decode("utf-8", errors="replace")
+    else:
+        content = json.dumps(json_data, indent=2)
+        if literal is not None and literal.decode("utf-8") not in content:
+            return "prefiltered", 0, []
+    lines = content.splitlines()
+    matches, shown, last = 0, [], -1
+    for i, line in enumerate(lines):
+        if not pattern.search(line):
+            continue
+        matches += 1
+        if matches > per_file:
+            continue
+        for j in range(max(last + 1, i - context), min(len(lines), i + context + 1)):
+            shown.append((j + 1, lines[j]))
+            last = j
+    return "scanned", matches, shown
+
+
+async def mongo_grep(
+    mongo_collection: Collection,
+    path_prefix: str,
+    pattern: re.Pattern,
+    context: int = 0,
+    per_file: int = 20,
+    max_matches: int = 200,
+    time_budget: float = 10.0,
+) -> GrepResult:
+    """
+    Regex search over all files under path_prefix. Mongo narrows down candidates by path (index range), not archived,
+    size; they stream in path order, the regex runs in a thread pool. Keeps only the best ranked files that together
+    have max_matches shown lines. Stops when time_budget runs out, whatever was found by then is returned.
+    """
+    global _grep_pool
+    if _grep_pool is None:
+        _grep_pool = concurrent.futures.ThreadPoolExecutor(MONGO_GREP_WORKERS, thread_name_prefix="mongo_grep")
+    await mongo_ensure_indexes(mongo_collection)
+    deadline = time.monotonic() + time_budget
+    literal = ckit_trigram.required_literal(pattern)   # files without it are skipped with bytes.find(), no decode, no regex
+    loop = asyncio.get_running_loop()
+    result = GrepResult()
+    shown_total = 0
+    in_flight: Dict[asyncio.Future, Tuple[str, float]] = {}
+
+    def collect(done) -> None:
+        nonlocal shown_total
+        for fut in done:
+            path, mtime = in_flight.pop(fut)
+            outcome, matches, lines = fut.result()
+            if outcome == "prefiltered":
+                result.prefiltered += 1
+            elif outcome == "binary":
+                result.skipped_binary += 1
+            else:
+                result.scanned += 1
+                if matches:
+                    result.files.append(GrepFileResult(path, matches, lines, mtime))
+                    shown_total += min(matches, per_file)
+        result.files.sort(key=lambda f: (-f.matches, -f.mtime, f.path))
+        while result.files and shown_total - min(result.files[-1].matches, per_file) >= max_matches:
+            worst = result.files.pop()
+            shown_total -= min(worst.matches, per_file)
+            result.dropped_files += 1
+            result.dropped_matches += worst.matches
+
+    query = {"path": _prefix_range(path_prefix), "mon_archived": {"$ne": True}, "mon_size": {"$not": {"$gt": MONGO_GREP_MAX_FILE}}}   # $lte would skip docs without mon_size
+    cursor = mongo_collection.find(query, {"path": 1, "data": 1, "json": 1, "mon_chunks": 1, "mon_mtime": 1}).sort([("path", 1), ("_id", 1)]).batch_size(MONGO_GREP_WORKERS * 4)
+    try:
+        async for doc in cursor:
+            if time.monotonic() > deadline:
+                result.timed_out = True
+                break
+            result.candidates += 1
+            data = doc.get("data")
+            if "mon_chunks" in doc:
+                data = b"".join([piece async for piece in mongo_open_stream(mongo_collection, doc)])
+            fut = loop.run_in_executor(_grep_pool, _grep_content, doc["path"], bytes(data) if data is not None else None, doc.get("json"), pattern, literal, context, per_file)
+            in_flight[fut] = (doc["path"], doc.get("mon_mtime", 0.0))
+            if len(in_flight) >= MONGO_GREP_WORKERS * 2:
+                done, _ = await asyncio.wait(list(in_flight), timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+        if in_flight:
+            done, _ = await asyncio.wait(list(in_flight), timeout=max(0.0, deadline - time.monotonic()))
+            collect(done)
+    finally:
+        if in_flight:
+            result.timed_out = True
+            for fut in in_flight:
+                fut.cancel()   # those that didn't start yet
+    return result
+
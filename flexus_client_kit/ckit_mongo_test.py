@@ -0,0 +1,762 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import bson
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from flexus_client_kit import ckit_mongo, ckit_trigram
+
+
+# In-memory collection, just enough of the query and aggregation language that ckit_mongo uses. There's no mongod
+# in tests, set FLEXUS_TEST_MONGO=mongodb://... to run the benchmark against a real one.
+
+def _get(doc: dict, field: str) -> Any:
+    v = doc
+    for p in field.split("."):
+        if not isinstance(v, dict) or p not in v:
+            return None
+        v = v[p]
+    return v
+
+
+def _comparable(a: Any, b: Any) -> bool:
+    num = (int, float)
+    return (isinstance(a, num) and isinstance(b, num) and not isinstance(a, bool)) or type(a) == type(b)
+
+
+def _match_cond(v: Any, cond: Any, present: bool) -> bool:
+    if not isinstance(cond, dict) or not any(k.startswith("$") for k in cond):
+        return present and v == cond
+    for op, x in cond.items():
+        if op == "$ne":
+            if present and v == x:
+                return False
+        elif op == "$exists":
+            if present != bool(x):
+                return False
+        elif op == "$in":
+            if not present or v not in x:
+                return False
+        elif op == "$not":
+            if _match_cond(v, x, present):
+                return False
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if not present or v is None or not _comparable(v, x):
+                return False
+            if not {"$gt": v > x, "$gte": v >= x, "$lt": v < x, "$lte": v <= x}[op]:
+                return False
+        else:
+            raise NotImplementedError(op)
+    return True
+
+
+def match(doc: dict, query: dict) -> bool:
+    for k, cond in query.items():
+        if k == "$or":
+            if not any(match(doc, q) for q in cond):
+                return False
+        elif k == "$and":
+            if not all(match(doc, q) for q in cond):
+                return False
+        elif k == "$nor":
+            if any(match(doc, q) for q in cond):
+                return False
+        else:
+            present = _get(doc, k) is not None or (k in doc)
+            if not _match_cond(_get(doc, k), cond, present):
+                return False
+    return True
+
+
+def _expr(doc: dict, e: Any) -> Any:
+    if e == "$$ROOT":
+        return doc
+    if isinstance(e, str) and e.startswith("$"):
+        return _get(doc, e[1:])
+    if isinstance(e, list):
+        return [_expr(doc, x) for x in e]
+    if not isinstance(e, dict):
+        return e
+    if len(e) == 1 and next(iter(e)).startswith("$"):
+        op, args = next(iter(e.items()))
+        a = _expr(doc, args)
+        if op == "$substrCP":
+            return a[0][a[1]:a[1] + a[2]]
+        if op == "$indexOfCP":
+            return a[0].find(a[1])
+        if op == "$concat":
+            return "".join(a)
+        if op == "$cond":
+            return a[1] if a[0] else a[2]
+        if op == "$gte":
+            return a[0] >= a[1]
+        if op == "$ifNull":
+            return a[0] if a[0] is not None else a[1]
+        if op == "$bsonSize":
+            return len(bson.encode(a))
+        raise NotImplementedError(op)
+    return {k: _expr(doc, v) for k, v in e.items()}
+
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return dict(doc)
+    if all(v == 0 for v in projection.values()):
+        return {k: v for k, v in doc.items() if k not in projection}
+    out = {"_id": doc.get("_id")} if projection.get("_id", 1) else {}
+    for k, v in projection.items():
+        if k == "_id":
+            continue
+        if v == 1:
+            if k in doc:
+                out[k] = doc[k]
+        else:
+            out[k] = _expr(doc, v)
+    return out
+
+
+def _sort_key(spec: List[tuple]):
+    def key(doc):
+        return tuple(_Desc(_get(doc, f)) if d < 0 else _Asc(_get(doc, f)) for f, d in spec)
+    return key
+
+
+class _Asc:
+    def __init__(self, v):
+        self.v = v
+
+    def __lt__(self, other):
+        if self.v is None or other.v is None:
+            return self.v is None and other.v is not None
+        return self.v < other.v
+
+    def __eq__(self, other):
+        return self.v == other.v
+
+
+class _Desc(_Asc):
+    def __lt__(self, other):
+        return _Asc(other.v) < _Asc(self.v)
+
+
+class FakeCursor:
+    def __init__(self, coll: "FakeCollection", docs: List[dict]):
+        self.coll = coll
+        self.docs = docs
+        self._limit = 0
+
+    def sort(self, key, direction: int = 1) -> "FakeCursor":
+        spec = [(key, direction)] if isinstance(key, str) else list(key)
+        self.docs.sort(key=_sort_key(spec))
+        return self
+
+    def limit(self, n: int) -> "FakeCursor":
+        self._limit = n
+        return self
+
+    def batch_size(self, n: int) -> "FakeCursor":
+        return self
+
+    def _out(self) -> List[dict]:
+        docs = self.docs[:self._limit] if self._limit else self.docs
+        self.coll.returned += len(docs)
+        self.coll.roundtrips += 1
+        return docs
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        docs = self._out()
+        return docs[:length] if length else docs
+
+    def __aiter__(self):
+        async def gen():
+            for d in self._out():
+                yield d
+        return gen()
+
+
+class FakeDatabase:
+    _n = 0
+
+    def __init__(self, name: str = ""):
+        FakeDatabase._n += 1
+        self.name = name or "test_db%d" % FakeDatabase._n   # new name every time, ckit_mongo remembers ensured indexes by name
+        self.collections: Dict[str, "FakeCollection"] = {}
+
+    def __getitem__(self, name: str) -> "FakeCollection":
+        return self.collections.setdefault(name, FakeCollection(name, self))
+
+
+class FakeCollection:
+    def __init__(self, name: str = "personal_mongo", database: Optional[FakeDatabase] = None):
+        self.name = name
+        self.database = database or FakeDatabase()
+        self.docs: List[dict] = []
+        self.indexes: Dict[str, list] = {}
+        self.unique: List[str] = []
+        self.returned = 0    # documents sent to the client, to see how much a query pulls
+        self.roundtrips = 0
+
+    def _check_unique(self, doc: dict, ignore: Optional[dict] = None) -> None:
+        for field in self.unique:
+            if any(d is not ignore and d is not doc and d.get(field) == doc.get(field) for d in self.docs):
+                raise DuplicateKeyError("E11000 duplicate key error, %s: %r" % (field, doc.get(field)))
+
+    def _apply(self, doc: dict, update: dict, inserting: bool) -> None:
+        for op, fields in update.items():
+            for k, v in fields.items():
+                if op == "$set" or (op == "$setOnInsert" and inserting):
+                    doc[k] = v
+                elif op == "$unset":
+                    doc.pop(k, None)
+                elif op == "$inc":
+                    doc[k] = doc.get(k, 0) + v
+                elif op != "$setOnInsert":
+                    raise NotImplementedError(op)
+
+    def _upsert(self, query: dict, update: dict, upsert: bool):
+        # -> (before, after, upserted_id)
+        self.roundtrips += 1
+        doc = next((d for d in self.docs if match(d, query)), None)
+        if doc is not None:
+            before = dict(doc)
+            new = dict(doc)
+            self._apply(new, update, False)
+            self._check_unique(new, doc)
+            doc.clear()
+            doc.update(new)
+            return before, doc, None
+        if not upsert:
+            return None, None, None
+        doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        self._apply(doc, update, True)
+        doc.setdefault("_id", ObjectId())
+        self._check_unique(doc)
+        self.docs.append(doc)
+        return None, doc, doc["_id"]
+
+    async def create_index(self, keys, name: str = "", unique: bool = False, **kwargs) -> str:
+        self.roundtrips += 1
+        if unique:
+            field = keys[0][0]
+            values = [d.get(field) for d in self.docs]
+            if len(values) != len(set(values)):
+                raise OperationFailure("E11000 duplicate key error building index %s" % name)
+            if field not in self.unique:
+                self.unique.append(field)
+        self.indexes[name] = list(keys)
+        return name
+
+    def find(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> FakeCursor:
+        return FakeCursor(self, [_project(d, projection) for d in self.docs if match(d, query or {})])
+
+    async def find_one(self, query: Optional[dict] = None, projection: Optional[dict] = None) -> Optional[dict]:
+        self.roundtrips += 1
+        for d in self.docs:
+            if match(d, query or {}):
+                self.returned += 1
+                return _project(d, projection)
+        return None
+
+    async def insert_one(self, doc: dict):
+        self.roundtrips += 1
+        if doc.get("_id") is None:
+            doc["_id"] = ObjectId()
+        self._check_unique(doc)
+        self.docs.append(dict(doc))
+        return type("InsertOneResult", (), {"inserted_id": doc["_id"]})()
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True):
+        self.roundtrips += 1
+        have = {d["_id"] for d in self.docs}
+        errors = []
+        for i, doc in enumerate(docs):
+            if doc.get("_id") is None:
+                doc["_id"] = ObjectId()
+            if doc["_id"] in have:
+                errors.append({"index": i, "code": 11000})
+                if ordered:
+                    break
+                continue
+            have.add(doc["_id"])
+            self.docs.append(dict(doc))
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+    async def update_many(self, query: dict, update: dict):
+        self.roundtrips += 1
+        n = 0
+        for doc in self.docs:
+            if match(doc, query):
+                self._apply(doc, update, False)
+                n += 1
+        return type("UpdateResult", (), {"modified_count": n, "matched_count": n})()
+
+    async def delete_many(self, query: dict):
+        self.roundtrips += 1
+        keep = [d for d in self.docs if not match(d, query)]
+        n = len(self.docs) - len(keep)
+        self.docs = keep
+        return type("DeleteResult", (), {"deleted_count": n})()
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        before, after, upserted_id = self._upsert(query, update, upsert)
+        n = 1 if before is not None else 0
+        return type("UpdateResult", (), {"modified_count": n, "matched_count": n, "upserted_id": upserted_id})()
+
+    async def find_one_and_update(self, query: dict, update: dict, projection: Optional[dict] = None, upsert: bool = False, return_document: bool = ReturnDocument.BEFORE):
+        before, after, _ = self._upsert(query, update, upsert)
+        doc = after if return_document == ReturnDocument.AFTER else before
+        if doc is None:
+            return None
+        self.returned += 1
+        return _project(doc, projection)
+
+    async def aggregate(self, pipeline: List[dict]) -> FakeCursor:
+        docs = [dict(d) for d in self.docs]
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if match(d, arg)]
+            elif op == "$project":
+                docs = [_project(d, arg) for d in docs]
+            elif op == "$sort":
+                docs.sort(key=_sort_key(list(arg.items())))
+            elif op == "$limit":
+                docs = docs[:arg]
+            elif op == "$unwind":
+                field = arg[1:]
+                docs = [{**d, field: x} for d in docs for x in (_get(d, field) or [])]
+            elif op == "$group":
+                groups: Dict[Any, dict] = {}
+                for d in docs:
+                    gid = _expr(d, arg["_id"])
+                    g = groups.setdefault(repr(gid), {"_id": gid})
+                    for field, acc in arg.items():
+                        if field == "_id":
+                            continue
+                        (aop, aexpr), = acc.items()
+                        v = _expr(d, aexpr)
+                        if field not in g:
+                            g[field] = v
+                        elif aop == "$min":
+                            g[field] = min(g[field], v)
+                        elif aop == "$max":
+                            g[field] = max(g[field], v)
+                        elif aop == "$sum":
+                            g[field] += v
+                        elif aop != "$first":
+                            raise NotImplementedError(aop)
+                docs = list(groups.values())
+            else:
+                raise NotImplementedError(op)
+        return FakeCursor(self, docs)
+
+
+def _files(n: int, seed: int = 1) -> List[dict]:
+    rnd = random.Random(seed)
+    docs = []
+    t = 1760000000.0
+    for i in range(n):
+        d = rnd.choice(["reports/", "reports/2025/", "reports/2025/q3/", "uploads/", "", "notes.", "notes/"])
+        docs.append({"_id": ObjectId(), "path": "%sfile%05d.txt" % (d, i), "mon_ctime": t + i, "mon_mtime": t + i + rnd.randrange(100), "mon_size": rnd.randrange(1, 1000), "data": b"x"})
+    return docs
+
+
+def _ls_subdir_old(docs: List[dict], path: str) -> List[dict]:
+    # what mongo_ls_subdir computed on the client from every document
+    items = {}
+    for doc in sorted((d for d in docs if not d.get("mon_archived") and (not path or d["path"].startswith(path.rstrip("/") + "/"))), key=lambda d: -d["mon_mtime"]):
+        relative = doc["path"][len(path.rstrip('/')) + 1:] if path else doc["path"]
+        immediate = relative.split('/')[0]
+        current_path = f"{path.rstrip('/')}/{immediate}" if path else immediate
+        if '/' in relative:
+            if current_path not in items:
+                items[current_path] = {"path": current_path, "mime_type": "subdir", "mon_ctime": doc["mon_ctime"], "mon_mtime": doc["mon_mtime"], "mon_size": doc["mon_size"], "count": 1}
+            else:
+                it = items[current_path]
+                it["mon_ctime"] = min(it["mon_ctime"], doc["mon_ctime"])
+                it["mon_mtime"] = max(it["mon_mtime"], doc["mon_mtime"])
+                it["mon_size"] += doc["mon_size"]
+                it["count"] += 1
+        else:
+            items[current_path] = {"path": doc["path"], "mime_type": "", "mon_ctime": doc["mon_ctime"], "mon_mtime": doc["mon_mtime"], "mon_size": doc["mon_size"], "count": 1}
+    return list(items.values())
+
+
+def test_ls_page_walks_everything_once():
+    ckit_mongo._indexes_ensured.clear()
+    coll = FakeCollection()
+    coll.docs = _files(500)
+    coll.docs[3]["mon_archived"] = True
+    coll.docs.append(dict(coll.docs[10], _id=ObjectId()))   # same path twice, like after mv back and forth
+
+    async def go():
+        seen, after, pages = [], None, 0
+        while True:
+            docs, after = await ckit_mongo.mongo_ls_page(coll, "reports/", limit=37, after=after)
+            assert len(docs) <= 37 and all("data" not in d for d in docs)
+            seen += [(d["path"], d["_id"]) for d in docs]
+            pages += 1
+            if after is None:
+                return seen, pages
+    seen, pages = asyncio.run(go())
+    want = sorted((d["path"], str(d["_id"])) for d in coll.docs if d["path"].startswith("reports/") and not d.get("mon_archived"))
+    assert seen == want
+    assert pages == len(want) // 37 + 1
+    assert "path_id" in coll.indexes and "mon_ctime" in coll.indexes
+
+
+def test_ls_prefix_is_not_a_regex():
+    coll = FakeCollection()
+    coll.docs = _files(300)
+    docs = asyncio.run(ckit_mongo.mongo_ls(coll, "notes."))
+    assert docs and all(d["path"].startswith("notes.") for d in docs)   # regex "^notes." also matched "notes/..."
+    assert [d["mon_ctime"] for d in docs] == sorted((d["mon_ctime"] for d in docs), reverse=True)
+
+
+def test_ls_subdir_same_as_client_side():
+    coll = FakeCollection()
+    coll.docs = _files(400)
+    coll.docs[5]["mon_archived"] = True
+    for path in ["", "reports", "reports/", "reports/2025", "nothing/here"]:
+        got = asyncio.run(ckit_mongo.mongo_ls_subdir(coll, path))
+        want = _ls_subdir_old(coll.docs, path)
+        assert sorted(got, key=lambda x: x["path"]) == sorted(want, key=lambda x: x["path"]), path
+        assert [x["mon_mtime"] for x in got] == sorted((x["mon_mtime"] for x in got), reverse=True)
+
+
+def _text(n_lines: int, seed: int = 3) -> bytes:
+    rnd = random.Random(seed)
+    return "".join("line %d %s ünïcode\n" % (i + 1, "x" * rnd.choice([0, 5, 80, 3000])) for i in range(n_lines)).encode("utf-8")
+
+
+def test_chunked_store_retrieve_and_dedup():
+    coll = FakeCollection()
+    chunks = coll.database[coll.name + "_chunks"]
+    big = _text(8000)
+    assert len(big) > 3 * ckit_mongo.MAX_FILE_SIZE
+
+    async def go():
+        await ckit_mongo.mongo_store_file(coll, "exports/big.txt", big)
+        doc = await ckit_mongo.mongo_retrieve_file(coll, "exports/big.txt")
+        assert doc["data"] == big and "mon_chunks" not in doc and doc["mon_size"] == len(big)
+        n_chunks = len(chunks.docs)
+        assert n_chunks == len(big) // ckit_mongo.MONGO_CHUNK_SIZE + 1
+        assert all(len(d["data"]) <= ckit_mongo.MONGO_CHUNK_SIZE for d in chunks.docs)
+
+        async def stream():
+            for i in range(0, len(big), 1000):   # different piece sizes, same chunks
+                yield big[i:i + 1000]
+        await ckit_mongo.mongo_store_stream(coll, "exports/copy.txt", stream())
+        assert len(chunks.docs) == n_chunks   # deduplicated
+        raw = await ckit_mongo.mongo_retrieve_file(coll, "exports/copy.txt", load_chunks=False)
+        assert raw["mon_lines"] == 8000 and b"".join([p async for p in ckit_mongo.mongo_open_stream(coll, raw)]) == big
+        try:
+            await ckit_mongo.mongo_store_file(coll, "exports/copy.txt", big)
+            assert False
+        except ValueError as e:
+            assert "already exists" in str(e)
+
+        # overwrite with a small file goes back to inline, with a big one to chunks, json comes back as json
+        await ckit_mongo.mongo_overwrite(coll, "exports/copy.txt", b"small")
+        doc = await ckit_mongo.mongo_retrieve_file(coll, "exports/copy.txt", load_chunks=False)
+        assert bytes(doc["data"]) == b"small" and "mon_chunks" not in doc and "mon_sha256" not in doc
+        big_json = json.dumps([{"i": i, "s": "y" * 100} for i in range(30000)]).encode()
+        await ckit_mongo.mongo_overwrite(coll, "exports/copy.json", big_json)
+        doc = await ckit_mongo.mongo_retrieve_file(coll, "exports/copy.json")
+        assert doc["json"][29999] == {"i": 29999, "s": "y" * 100} and "data" not in doc
+        listed = await ckit_mongo.mongo_ls(coll, "exports/")
+        assert all("mon_chunks" not in d and "data" not in d for d in listed)
+    asyncio.run(go())
+
+
+def test_read_lines_fetches_only_needed_chunks():
+    coll = FakeCollection()
+    big = _text(8000, seed=5)
+    lines = big.decode().splitlines()
+
+    async def go():
+        await ckit_mongo.mongo_store_file(coll, "big.txt", big)
+        doc = await ckit_mongo.mongo_retrieve_file(coll, "big.txt", load_chunks=False)
+        chunks = coll.database[coll.name + "_chunks"]
+        for start, end in [(0, 10), (0, 1), (3999, 4010), (7990, None), (7999, 8000), (8000, 8005), (1234, 1234)]:
+            before = chunks.returned
+            data, total = await ckit_mongo.mongo_read_lines(coll, doc, start, end, max_bytes=10 ** 9)
+            assert total == 8000
+            assert data.decode().splitlines() == lines[start:end], (start, end)
+            if end is not None and end - start <= 10:
+                assert chunks.returned - before <= 2
+    asyncio.run(go())
+
+
+def test_grep_many_files():
+    import re
+    coll = FakeCollection()
+
+    async def go():
+        for i in range(60):
+            body = "".join("row %d %s\n" % (j, "ERROR code=%d" % i if j % (i + 1) == 0 else "ok") for j in range(50))
+            await ckit_mongo.mongo_store_file(coll, "logs/f%02d.txt" % i, body.encode())
+        await ckit_mongo.mongo_store_file(coll, "logs/big.txt", _text(8000) + b"ERROR in the chunked one\n")
+        await ckit_mongo.mongo_store_file(coll, "logs/blob.bin", b"\x00\x01ERROR code=1\n")
+        await ckit_mongo.mongo_store_file(coll, "logs/data.json", json.dumps({"note": "ERROR code=99"}).encode())
+        await ckit_mongo.mongo_store_file(coll, "other/f.txt", b"ERROR elsewhere\n")
+        await ckit_mongo.mongo_rm(coll, "logs/f59.txt")
+        coll.docs.append({"_id": ObjectId(), "path": "logs/old.txt", "data": b"ERROR code=7\n", "mon_mtime": 0.0})   # saved before mon_size existed
+        r = await ckit_mongo.mongo_grep(coll, "logs/", re.compile(r"ERROR code=\d+"), context=1, per_file=5, max_matches=10000)
+        assert "logs/old.txt" in [f.path for f in r.files]
+        coll.docs.pop()
+        r = await ckit_mongo.mongo_grep(coll, "logs/", re.compile(r"ERROR code=\d+"), context=1, per_file=5, max_matches=10000)
+        assert r.candidates == 62 and r.skipped_binary == 1 and r.prefiltered == 1   # big.txt has no "ERROR code="
+        assert [f.path for f in r.files[:3]] == ["logs/f00.txt", "logs/f01.txt", "logs/f02.txt"]
+        f0 = r.files[0]
+        assert f0.matches == 50 and [n for n, _ in f0.lines] == list(range(1, 7))   # 5 matches + 1 line of context
+        assert "logs/data.json" in [f.path for f in r.files] and not r.timed_out and not r.dropped_files
+        r = await ckit_mongo.mongo_grep(coll, "", re.compile("chunked one|elsewhere"))
+        assert sorted(f.path for f in r.files) == ["logs/big.txt", "other/f.txt"]
+        r = await ckit_mongo.mongo_grep(coll, "logs/", re.compile("ERROR"), per_file=20, max_matches=30)
+        assert [f.path for f in r.files] == ["logs/f00.txt", "logs/f01.txt"] and r.dropped_files == 59
+        r = await ckit_mongo.mongo_grep(coll, "logs/", re.compile("ERROR"), time_budget=0.0)
+        assert r.timed_out
+    asyncio.run(go())
+
+
+def test_required_literal():
+    import re
+    for pat, want in [(r"ERROR \d+", b"ERROR "), ("a|bcdef", None), ("(?i)error", None), (r"^def \w+_handler", b"_handler"), ("ab", None),
+            ("(?i:warn)ERROR", b"ERROR"), (r"(x|y)+(ERROR_(one|two))", b"ERROR_"), ("(abc|abd)", None), (r"\+\+\+ b/", b"+++ b/")]:
+        assert ckit_trigram.required_literal(re.compile(pat)) == want, pat
+
+
+def test_save_modes():
+    coll = FakeCollection()
+
+    async def go():
+        await ckit_mongo.mongo_ensure_indexes(coll)
+        assert "path_unique" in coll.indexes
+        rt = coll.roundtrips
+        r = await ckit_mongo.mongo_save(coll, "a/report.json", b'{"v": 1}')
+        assert coll.roundtrips - rt == 1 and not r.overwritten and r.path == "a/report.json"
+        try:
+            await ckit_mongo.mongo_store_file(coll, "a/report.json", b'{"v": 2}')
+            assert False
+        except ValueError as e:
+            assert str(e) == "File already exists at path: a/report.json"
+
+        rt = coll.roundtrips
+        r2 = await ckit_mongo.mongo_save(coll, "a/report.json", b'{"v": 3}', mode=ckit_mongo.SAVE_OVERWRITE)
+        assert coll.roundtrips - rt == 1 and r2.overwritten and r2.id == r.id
+        doc = await ckit_mongo.mongo_retrieve_file(coll, "a/report.json")
+        assert doc["json"] == {"v": 3} and "data" not in doc
+
+        big = b'{"v": [%s]}' % b", ".join([b"1"] * 1500000)
+        await ckit_mongo.mongo_overwrite(coll, "a/report.json", big)   # inline -> chunked
+        doc = coll.docs[0]
+        assert "mon_chunks" in doc and "json" not in doc and str(doc["_id"]) == r.id
+        await ckit_mongo.mongo_save(coll, "a/report.json", b'{"v": 4}', mode=ckit_mongo.SAVE_OVERWRITE)   # and back
+        assert "mon_chunks" not in doc and "mon_sha256" not in doc and doc["json"] == {"v": 4}
+
+        await ckit_mongo.mongo_rm(coll, "a/report.json")
+        r3 = await ckit_mongo.mongo_save(coll, "a/report.json", b'{"v": 5}', mode=ckit_mongo.SAVE_OVERWRITE)
+        assert r3.overwritten and "mon_archived" not in doc   # overwriting a deleted file brings it back
+
+        paths = []
+        for v in range(3):
+            paths.append((await ckit_mongo.mongo_save(coll, "a/report.json", b'{}', mode=ckit_mongo.SAVE_VERSION)).path)
+        await ckit_mongo.mongo_save(coll, "a/report.v5.json", b"{}")   # made by hand, skipped
+        paths.append((await ckit_mongo.mongo_save(coll, "a/report.json", b'{}', mode=ckit_mongo.SAVE_VERSION)).path)
+        paths.append((await ckit_mongo.mongo_save(coll, "noext", b'x', mode=ckit_mongo.SAVE_VERSION)).path)
+        paths.append((await ckit_mongo.mongo_save(coll, "noext", b'x', mode=ckit_mongo.SAVE_VERSION)).path)
+        assert paths == ["a/report.v2.json", "a/report.v3.json", "a/report.v4.json", "a/report.v6.json", "noext", "noext.v2"], paths
+
+        big = _text(5000)
+        try:
+            await ckit_mongo.mongo_save_stream(coll, "noext", [big])
+            assert False
+        except ValueError as e:
+            assert "File already exists" in str(e)
+        r = await ckit_mongo.mongo_save_stream(coll, "noext", [big], mode=ckit_mongo.SAVE_VERSION)
+        assert r.path == "noext.v3"
+        assert len({d["path"] for d in coll.docs}) == len(coll.docs)
+    asyncio.run(go())
+
+
+def test_save_races_and_old_collections():
+    coll = FakeCollection()
+    coll.docs = [{"_id": ObjectId(), "path": "dup.txt", "data": b"1"}, {"_id": ObjectId(), "path": "dup.txt", "data": b"2"}]
+
+    async def go():
+        await ckit_mongo.mongo_ensure_indexes(coll)   # logs a warning, no unique index
+        assert "path_unique" not in coll.indexes and "path_id" in coll.indexes
+        assert "File already exists" in str(await _raises(ckit_mongo.mongo_store_file(coll, "dup.txt", b"3")))
+        ok = await asyncio.gather(*[ckit_mongo.mongo_save(coll, "race.txt", b"%d" % i) for i in range(10)], return_exceptions=True)
+        assert sum(1 for x in ok if isinstance(x, ckit_mongo.SaveResult)) == 1
+    asyncio.run(go())
+
+    coll = FakeCollection()
+    asyncio.run(ckit_mongo.mongo_ensure_indexes(coll))
+    orig = coll._upsert
+
+    def racing_upsert(query, update, upsert):
+        # another writer inserted the same path between our match and our insert
+        if upsert and not any(d["path"] == query["path"] for d in coll.docs):
+            coll.docs.append({"_id": ObjectId(), "path": query["path"], "data": b"theirs", "mon_ctime": 1.0})
+            coll._check_unique({"path": query["path"]})
+        return orig(query, update, upsert)
+    coll._upsert = racing_upsert
+    assert "File already exists" in str(asyncio.run(_raises(ckit_mongo.mongo_store_file(coll, "x.txt", b"mine"))))
+    coll.docs.clear()
+    r = asyncio.run(ckit_mongo.mongo_save(coll, "x.txt", b"mine", mode=ckit_mongo.SAVE_OVERWRITE))
+    assert r.overwritten and [bytes(d["data"]) for d in coll.docs] == [b"mine"]
+
+
+def test_rm_many_and_compact():
+    coll = FakeCollection()
+    chunks = coll.database[coll.name + "_chunks"]
+
+    async def go():
+        for p in ["report_1.json", "report_2.html", "tmp/a.txt", "tmp/b.txt", "meta_data_1_x.json", "keep.txt"]:
+            await ckit_mongo.mongo_save(coll, p, b"{}" if p.endswith(".json") else b"hello")
+        await ckit_mongo.mongo_save(coll, "tmp/big.txt", _text(5000, seed=1))
+        assert await ckit_mongo.mongo_rm_many(coll, paths=["tmp/a.txt", "nope.txt"]) == 1
+        assert await ckit_mongo.mongo_rm_many(coll, path_prefix="tmp/") == 2   # a.txt is already deleted
+        assert await ckit_mongo.mongo_rm_many(coll, path_prefix="", except_prefix="report_") == 2
+        assert sorted(d["path"] for d in await ckit_mongo.mongo_ls(coll)) == ["report_1.json", "report_2.html"]
+        await ckit_mongo.mongo_save(coll, "shared_big.txt", _text(5000, seed=1)[:9 * ckit_mongo.MONGO_CHUNK_SIZE])   # same first chunks
+
+        r = await ckit_mongo.mongo_compact(coll)
+        assert r.files_purged == 0 and r.chunks_purged == 0   # within retention, chunks are fresh
+        await ckit_mongo.mongo_save(coll, "keep.txt", b"back", mode=ckit_mongo.SAVE_OVERWRITE)   # undeleted before compaction
+        n_chunks = len(chunks.docs)
+        for d in coll.docs + chunks.docs:
+            for k in ["mon_deleted_ts", "mon_mtime"]:
+                if k in d:
+                    d[k] -= ckit_mongo.MONGO_RETENTION_SEC + 1
+        r = await ckit_mongo.mongo_compact(coll)
+        assert r.files_purged == 4 and r.file_bytes > 4 * 50
+        assert sorted(d["path"] for d in coll.docs) == ["keep.txt", "report_1.json", "report_2.html", "shared_big.txt"]
+        assert r.chunks_purged == n_chunks - 9 and r.chunk_bytes == len(_text(5000, seed=1)) - 9 * ckit_mongo.MONGO_CHUNK_SIZE
+        assert r.bytes_reclaimed == r.file_bytes + r.chunk_bytes
+        assert (await ckit_mongo.mongo_compact(coll)).bytes_reclaimed == 0
+
+        t = await ckit_mongo.mongo_save(coll, "scratch.json", b"{}", ttl=3600, temporary=True)
+        doc = next(d for d in coll.docs if d["path"] == "scratch.json")
+        assert abs(doc["mon_purge_at"].timestamp() - doc["mon_ctime"] - 3600) < 1 and "mon_purge_at_ttl" in coll.indexes
+        await ckit_mongo.mongo_save(coll, "scratch.json", b"{}", mode=ckit_mongo.SAVE_OVERWRITE)
+        assert "mon_purge_at" not in doc   # not temporary any more
+    asyncio.run(go())
+
+
+def test_compaction_in_background():
+    from flexus_client_kit import ckit_shutdown
+    coll = FakeCollection(database=FakeDatabase("persona_db"))
+    runs = []
+    orig_compact, orig_event = ckit_mongo.mongo_compact, ckit_shutdown.shutdown_event
+
+    async def fake_compact(c, *args):
+        runs.append(c)
+        return ckit_mongo.CompactReport()
+
+    async def go():
+        ckit_shutdown.shutdown_event = asyncio.Event()   # the module one sticks to the event loop of the previous test
+        task = ckit_mongo.mongo_start_compaction(coll, period=0.02)
+        assert ckit_mongo.mongo_start_compaction(coll) is task
+        await asyncio.sleep(0.2)
+        assert len(runs) >= 3 and all(c is coll for c in runs)
+
+        # A restarted main loop with a new client replaces the task, the old one stops using the old client
+        coll2 = FakeCollection(database=FakeDatabase("persona_db"))
+        task2 = ckit_mongo.mongo_start_compaction(coll2, period=0.02)
+        assert task2 is not task and ckit_shutdown.tasks_to_cancel["mongo_compact_persona_db_personal_mongo"] is task2
+        await asyncio.wait([task], timeout=1)
+        assert task.cancelled()
+        runs.clear()
+        await asyncio.sleep(0.2)
+        assert len(runs) >= 3 and all(c is coll2 for c in runs)
+
+        # The main loop cancels it in its finally, nothing is left behind
+        task2.cancel()
+        await asyncio.wait([task2], timeout=1)
+        assert ckit_mongo._compaction_tasks == {} and "mongo_compact_persona_db_personal_mongo" not in ckit_shutdown.tasks_to_cancel
+
+        task3 = ckit_mongo.mongo_start_compaction(coll2, period=0.02)
+        ckit_shutdown.shutdown_event.set()
+        await asyncio.wait_for(task3, 1)
+    ckit_mongo.mongo_compact = fake_compact
+    try:
+        asyncio.run(go())
+    finally:
+        ckit_mongo.mongo_compact, ckit_shutdown.shutdown_event = orig_compact, orig_event
+        ckit_shutdown.tasks_to_cancel.clear()
+
+
+async def _raises(coro) -> Exception:
+    try:
+        await coro
+    except Exception as e:
+        return e
+    assert False, "didn't raise"
+
+
+async def _save_old(coll, path: str, data: bytes) -> None:
+    # what mongo_store save op did: existence check for the [OVERWRITTEN] note, then mongo_store_file checked again
+    await coll.find_one({"path": path}, {"mon_ctime": 1})
+    if await coll.find_one({"path": path}, {"_id": 1}):
+        raise ValueError(f"File already exists at path: {path}")
+    t = time.time()
+    await coll.insert_one({"path": path, "mon_ctime": t, "mon_mtime": t, "mon_size": len(data), "mon_expires_ts": t + 86400, "data": data})
+
+
+def benchmark(n: int = 50000) -> None:
+    url = os.getenv("FLEXUS_TEST_MONGO")
+    if url:
+        from pymongo import AsyncMongoClient
+        coll = AsyncMongoClient(url)["flexus_benchmark_db"]["personal_mongo"]
+    else:
+        coll = FakeCollection()
+        print("FLEXUS_TEST_MONGO not set, in-memory collection: timings are not representative, document counts are")
+
+    async def go():
+        docs = _files(n)
+        if url:
+            await coll.delete_many({})
+            await coll.insert_many(docs)
+        else:
+            coll.docs = docs
+        await ckit_mongo.mongo_ensure_indexes(coll)
+        for title, f in [
+            ("ls_subdir root", lambda: ckit_mongo.mongo_ls_subdir(coll, "")),
+            ("ls_page 100", lambda: ckit_mongo.mongo_ls_page(coll, "reports/2025/", limit=100)),
+            ("ls (everything)", lambda: ckit_mongo.mongo_ls(coll, "reports/2025/")),
+        ]:
+            before = getattr(coll, "returned", 0)
+            t0 = time.perf_counter()
+            await f()
+            dt = time.perf_counter() - t0
+            print("%-16s %dk files: %7.1fms, %s documents to client" % (title, n // 1000, dt * 1000, getattr(coll, "returned", 0) - before if not url else "?"))
+        print("before: ls_subdir pulled all %d documents to the client" % n)
+
+        for title, f in [
+            ("save, before", lambda i: _save_old(coll, "saves/old%05d.txt" % i, b"x" * 100)),
+            ("save create", lambda i: ckit_mongo.mongo_save(coll, "saves/new%05d.txt" % i, b"x" * 100)),
+            ("save overwrite", lambda i: ckit_mongo.mongo_save(coll, "saves/new%05d.txt" % i, b"y" * 100, mode=ckit_mongo.SAVE_OVERWRITE)),
+        ]:
+            n_saves = 1000
+            rt = getattr(coll, "roundtrips", 0)
+            t0 = time.perf_counter()
+            for i in range(n_saves):
+                await f(i)
+            dt = time.perf_counter() - t0
+            per = "%.1f round trips" % ((coll.roundtrips - rt) / n_saves) if not url else ""
+            print("%-16s %7.3fms per save %s" % (title, dt / n_saves * 1000, per))
+    asyncio.run(go())
+
+
+if __name__ == "__main__":
+    benchmark()
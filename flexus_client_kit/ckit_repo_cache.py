@@ -0,0 +1,322 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional, Tuple
+
+from flexus_client_kit import ckit_trigram
+
+logger = logging.getLogger("repo_cache")
+
+
+REPO_CACHE_DIR = os.path.join(tempfile.gettempdir(), "flexus_repo_cache")
+REPO_REFRESH_TIMEOUT = 600        # after that "git ls-remote" tells if the ref moved, also re-checks access for the token
+REPO_CACHE_BUDGET = int(os.getenv("FLEXUS_REPO_CACHE_MB", "4096")) * 1024 * 1024
+REPO_EVICT_GRACE = 60             # checkouts used more recently than that are not evicted, somebody might be reading
+REPO_GIT_TIMEOUT = 300
+
+# What _fetch() and _save_meta() write before renaming into place, "<key>.tmp<pid>" and "<key>.json.tmp<pid>"
+_TMP_NAME = re.compile(r"-[0-9a-f]{16}(\.json)?\.tmp(\d*)$")
+
+
+@dataclass
+class RepoEntry:
+    key: str
+    url: str                  # without credentials
+    ref: Optional[str]        # branch or tag, None is the remote's default branch
+    path: str
+    head: str = ""            # commit checked out, "" until the first fetch finishes
+    size: int = 0             # bytes on disk, including .git
+    last_access: float = 0.0
+    verified: Dict[str, float] = field(default_factory=dict)   # credential id -> when ls-remote last worked with it
+
+
+def clean_url(url: str) -> str:
+    if "://" in url:
+        scheme, rest = url.split("://", 1)
+        host, _, path = rest.partition("/")
+        url = scheme + "://" + host.rsplit("@", 1)[-1] + ("/" + path if path else "")
+    url = url.rstrip("/")
+    return url[:-4] if url.endswith(".git") else url
+
+
+def repo_key(url: str, ref: Optional[str]) -> str:
+    # Content addressed by what is checked out, the same repo and branch is one checkout for every persona
+    url = clean_url(url)
+    name = "".join(c if c.isalnum() or c in "-_." else "_" for c in url.rsplit("/", 1)[-1])[:40]
+    return "%s-%s" % (name, hashlib.sha1((url + "#" + (ref or "")).encode()).hexdigest()[:16])
+
+
+def _auth_url(url: str, token: Optional[str]) -> str:
+    url = clean_url(url) + ".git" if url.startswith("https://") else url
+    if token and url.startswith("https://"):
+        return "https://oauth2:%s@%s" % (token, url[len("https://"):])
+    return url
+
+
+def _credential_id(token: Optional[str]) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()[:16] if token else ""
+
+
+def _pick_sha(ls_remote: str, ref: Optional[str]) -> str:
+    refs = {}
+    for line in ls_remote.splitlines():
+        sha, _, name = line.partition("\t")
+        refs[name.strip()] = sha.strip()
+    if ref is None:
+        return refs.get("HEAD", "")
+    for name in ["refs/heads/" + ref, "refs/tags/" + ref + "^{}", "refs/tags/" + ref]:
+        if name in refs:
+            return refs[name]
+    return ""
+
+
+def _disk_usage(path: str) -> int:
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for fn in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, fn))
+            except OSError:
+                continue
+            total += st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+    return total
+
+
+async def _git(args: List[str], cwd: Optional[str] = None, token: Optional[str] = None, timeout: float = REPO_GIT_TIMEOUT) -> str:
+    proc = await asyncio.create_subprocess_exec(
+        "git", *args,
+        cwd=cwd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise RuntimeError(f"git {args[0]} took longer than {timeout}s")
+    except asyncio.CancelledError:
+        proc.kill()
+        raise
+    if proc.returncode != 0:
+        msg = err.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(f"git {args[0]} failed: {msg.replace(token, '***') if token else msg}")
+    return out.decode("utf-8", errors="replace")
+
+
+def _tmp_in_use(path: str, pid: int) -> bool:
+    # Pids get reused, a container restart gives the same pid again, so an old enough one is not in use either way
+    try:
+        if time.time() - os.stat(path).st_mtime > 4 * REPO_GIT_TIMEOUT:
+            return False
+        os.kill(pid, 0)
+    except (ProcessLookupError, FileNotFoundError, OverflowError):
+        return False
+    except PermissionError:
+        pass   # exists, belongs to somebody else
+    return True
+
+
+class RepoCache:
+    """
+    Shallow checkouts of remote repositories shared by everything in the process. Every token is checked against
+    the remote with "git ls-remote" before it can read a checkout, and again after refresh_timeout, that's also how
+    new commits are noticed. Concurrent requests for the same checkout share one git run. Least recently used
+    checkouts are removed when the total goes over the disk budget.
+    """
+    def __init__(self, cache_dir: str = REPO_CACHE_DIR, budget: int = REPO_CACHE_BUDGET, refresh_timeout: float = REPO_REFRESH_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.budget = budget
+        self.refresh_timeout = refresh_timeout
+        self.evict_grace = REPO_EVICT_GRACE
+        self.entries: "OrderedDict[str, RepoEntry]" = OrderedDict()   # least recently used first
+        self.inflight: Dict[str, Tuple[str, asyncio.Future]] = {}     # key -> (credential id, git work in progress)
+        self.disk_loaded = False
+        self.counters = {"hits": 0, "joined": 0, "revalidated": 0, "cloned": 0, "updated": 0, "stale": 0, "errors": 0,
+            "evicted": 0, "bytes_fetched": 0, "bytes_evicted": 0}
+
+    async def ensure(self, url: str, ref: Optional[str] = None, token: Optional[str] = None) -> str:
+        # Returns the checkout directory, raises RuntimeError if git can't get it (no access, no such ref, network)
+        if not self.disk_loaded:
+            await asyncio.to_thread(self._load_disk)
+            self.disk_loaded = True
+        key = repo_key(url, ref)
+        cred = _credential_id(token)
+        while True:
+            e = self.entries.get(key)
+            if e is not None and e.head and time.time() - e.verified.get(cred, 0) < self.refresh_timeout:
+                self.counters["hits"] += 1
+                self._touch(e)
+                return e.path
+            running = self.inflight.get(key)
+            if running is None:
+                fut = asyncio.ensure_future(self._refresh(key, url, ref, token, cred))
+                self.inflight[key] = (cred, fut)
+                fut.add_done_callback(lambda _: self.inflight.pop(key, None))
+                return await asyncio.shield(fut)
+            self.counters["joined"] += 1
+            if running[0] == cred:
+                return await asyncio.shield(running[1])
+            try:
+                await asyncio.shield(running[1])   # somebody else's token, wait and check ours
+            except RuntimeError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.counters
+        served = c["hits"] + c["joined"] + c["revalidated"]
+        total = served + c["cloned"] + c["updated"]
+        return {**c, "entries": len(self.entries), "bytes_on_disk": sum(e.size for e in self.entries.values()),
+            "budget": self.budget, "hit_rate": round(served / total, 3) if total else 0.0}
+
+    def _touch(self, e: RepoEntry) -> None:
+        e.last_access = time.time()
+        self.entries.move_to_end(e.key)
+
+    async def _refresh(self, key: str, url: str, ref: Optional[str], token: Optional[str], cred: str) -> str:
+        e = self.entries.get(key)
+        if e is None:
+            e = self.entries[key] = RepoEntry(key=key, url=clean_url(url), ref=ref, path=os.path.join(self.cache_dir, key))
+        auth_url = _auth_url(url, token)
+        try:
+            sha = _pick_sha(await _git(["ls-remote", auth_url, ref or "HEAD"], token=token), ref)
+            if not sha:
+                raise RuntimeError(f"{e.url} has no branch or tag {ref!r}" if ref else f"{e.url} has no default branch")
+        except RuntimeError as err:
+            if e.head and cred in e.verified:   # worked for this token before, most likely the network
+                logger.info("%s cannot check for updates, using what we have: %s", e.url, err)
+                self.counters["stale"] += 1
+                self._touch(e)
+                return e.path
+            self.counters["errors"] += 1
+            if not e.head:
+                del self.entries[key]
+            raise
+
+        if e.head == sha and os.path.isdir(e.path):
+            self.counters["revalidated"] += 1
+        else:
+            t0 = time.time()
+            was = e.size
+            cloned = not e.head or not os.path.isdir(e.path)
+            try:
+                await self._fetch(e, auth_url, token, cloned)
+            except RuntimeError:
+                self.counters["errors"] += 1
+                if not e.head:
+                    del self.entries[key]
+                raise
+            e.size = await asyncio.to_thread(_disk_usage, e.path)
+            self.counters["cloned" if cloned else "updated"] += 1
+            self.counters["bytes_fetched"] += max(0, e.size - (0 if cloned else was))
+            logger.info("%s %s %s at %s, %0.1fMB on disk, %0.1fs", "cloned" if cloned else "updated", e.url, ref or "HEAD", e.head[:10], e.size / 1e6, time.time() - t0)
+            ckit_trigram.index_for(e.path, rescan_sec=math.inf)   # only we change files here
+            ckit_trigram.mark_stale(e.path)
+        e.verified[cred] = time.time()
+        self._touch(e)
+        await asyncio.to_thread(self._save_meta, e)
+        await self._evict(keep=key)
+        return e.path
+
+    async def _fetch(self, e: RepoEntry, auth_url: str, token: Optional[str], clone: bool) -> None:
+        what = e.ref or "HEAD"
+        if not clone:
+            await _git(["fetch", "--quiet", "--depth", "1", auth_url, what], cwd=e.path, token=token)
+            await _git(["reset", "--quiet", "--hard", "FETCH_HEAD"], cwd=e.path)
+        else:
+            # Into a temporary directory first, nobody should see a half cloned repo
+            tmp = "%s.tmp%d" % (e.path, os.getpid())
+            await asyncio.to_thread(shutil.rmtree, tmp, True)
+            os.makedirs(tmp)
+            try:
+                await _git(["init", "--quiet"], cwd=tmp)
+                await _git(["fetch", "--quiet", "--depth", "1", auth_url, what], cwd=tmp, token=token)
+                await _git(["checkout", "--quiet", "FETCH_HEAD"], cwd=tmp)
+                await asyncio.to_thread(shutil.rmtree, e.path, True)
+                os.rename(tmp, e.path)
+            finally:
+                await asyncio.to_thread(shutil.rmtree, tmp, True)
+        e.head = (await _git(["rev-parse", "HEAD"], cwd=e.path)).strip()
+
+    async def _evict(self, keep: str) -> None:
+        total = sum(e.size for e in self.entries.values())
+        now = time.time()
+        for key in list(self.entries):
+            if total <= self.budget:
+                break
+            e = self.entries[key]
+            if key == keep or key in self.inflight or now - e.last_access < self.evict_grace:
+                continue
+            del self.entries[key]
+            total -= e.size
+            self.counters["evicted"] += 1
+            self.counters["bytes_evicted"] += e.size
+            logger.info("evicting %s %s, %0.1fMB, not used for %0.0fs", e.url, e.ref or "HEAD", e.size / 1e6, now - e.last_access)
+            ckit_trigram.forget(e.path)
+            await asyncio.to_thread(self._remove, e)
+
+    def _remove(self, e: RepoEntry) -> None:
+        shutil.rmtree(e.path, ignore_errors=True)
+        try:
+            os.remove(e.path + ".json")
+        except FileNotFoundError:
+            pass
+
+    def _save_meta(self, e: RepoEntry) -> None:
+        # Next to the checkout, not inside where ls and find would see it. No credentials in there.
+        meta = {"url": e.url, "ref": e.ref, "head": e.head, "size": e.size, "last_access": e.last_access}
+        tmp = "%s.json.tmp%d" % (e.path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, e.path + ".json")
+
+    def _load_disk(self) -> None:
+        # Checkouts left by the previous run count against the budget and are reused, after ls-remote says so
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for fn in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, fn)
+            if m := _TMP_NAME.search(fn):   # interrupted clone or metadata write, unless another process is still at it
+                if m.group(2) and _tmp_in_use(path, int(m.group(2))):
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                continue
+            if not fn.endswith(".json"):
+                continue
+            try:
+                with open(path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            key = fn[:-len(".json")]
+            if os.path.isdir(os.path.join(self.cache_dir, key)) and key not in self.entries:
+                found.append(RepoEntry(key=key, url=meta["url"], ref=meta["ref"], path=os.path.join(self.cache_dir, key),
+                    head=meta["head"], size=meta["size"], last_access=meta["last_access"]))
+        for e in sorted(found, key=lambda e: e.last_access):
+            self.entries[e.key] = e
+        if found:
+            logger.info("%d repos in %s from the previous run, %0.1fMB", len(found), self.cache_dir, sum(e.size for e in found) / 1e6)
+
+
+repo_cache = RepoCache()
+
+
+async def ensure_repo(url: str, ref: Optional[str] = None, token: Optional[str] = None) -> str:
+    return await repo_cache.ensure(url, ref, token)
+
+
+def repo_cache_stats() -> Dict[str, Any]:
+    return repo_cache.stats()
@@ -6,7 +6,6 @@ import dataclasses
 from dataclasses import dataclass
 from typing import Optional, Dict, List, Union, Any
 
-import gql
 
 from flexus_client_kit import gql_utils, ckit_bot_install, ckit_client, ckit_ask_model, ckit_kanban, ckit_bot_query, ckit_cloudtool
 
@@ -70,7 +69,7 @@ async def scenario_generate_human_message(
     http_client.execute_timeout = 120
     async with http_client as http:
         r = await http.execute(
-            gql.gql(f"""mutation ScenarioGenerateHumanMessage(
+            gql_utils.gql_cached(f"""mutation ScenarioGenerateHumanMessage(
                 $happy_trajectory: String!,
                 $fgroup_id: String!,
                 $ft_id: String
@@ -102,7 +101,7 @@ async def scenario_judge(
     http_client.execute_timeout = 120
     async with http_client as http:
         r = await http.execute(
-            gql.gql(f"""mutation ScenarioJudge(
+            gql_utils.gql_cached(f"""mutation ScenarioJudge(
                 $happy_trajectory: String!,
                 $ft_id: String!,
                 $judge_instructions: String!
@@ -158,7 +157,7 @@ async def scenario_generate_tool_result_via_model(
     http_client = await fclient.use_http(execute_timeout=120)
     async with http_client as http:
         await http.execute(
-            gql.gql("""mutation ScenarioGenerateToolResult(
+            gql_utils.gql_cached("""mutation ScenarioGenerateToolResult(
                 $fcall_id: String!,
                 $fcall_untrusted_key: String!,
                 $tool_handler_source_code: String!
@@ -201,7 +200,7 @@ async def scenario_print_personas(fclient: ckit_client.FlexusClient, fgroup_id:
 
 async def scenario_print_threads(fclient: ckit_client.FlexusClient, fgroup_id: str) -> str:
     async with (await fclient.use_http()) as http:
-        threads = await http.execute(gql.gql(f"""
+        threads = await http.execute(gql_utils.gql_cached(f"""
             query GetGroupThreads($fgroup_id: String!) {{
                 thread_list(located_fgroup_id: $fgroup_id, skip: 0, limit: 100) {{
                     {gql_utils.gql_fields(ckit_ask_model.FThreadOutput)}
@@ -222,7 +221,7 @@ async def scenario_print_threads(fclient: ckit_client.FlexusClient, fgroup_id: s
             if thread.ft_error:
                 lines.append(f"    ft_error=\033[91m{thread.ft_error}\033[0m")
 
-            messages = await http.execute(gql.gql(f"""
+            messages = await http.execute(gql_utils.gql_cached(f"""
                 query ThreadMessages($ft_id: String!) {{
                     thread_messages_list(ft_id: $ft_id) {{ {gql_utils.gql_fields(ckit_ask_model.FThreadMessageOutput)} }}
                 }}"""), variable_values={"ft_id": thread.ft_id})
@@ -284,7 +283,7 @@ class ScenarioSetup:
             raise RuntimeError("FLEXUS_WORKSPACE environment variable is not set")
 
         async with (await self.fclient.use_http()) as http:
-            ws_query = await http.execute(gql.gql(f"""
+            ws_query = await http.execute(gql_utils.gql_cached(f"""
                 query GetWorkspace {{
                     query_basic_stuff(want_invitations: false) {{
                         workspaces {{
@@ -298,7 +297,7 @@ class ScenarioSetup:
                 raise RuntimeError(f"Workspace {self.fclient.ws_id} not found in user's workspaces")
 
             self.fgroup_name = f"{group_prefix}-{uuid.uuid4().hex[:6]}"
-            self.fgroup_id = (await http.execute(gql.gql("""
+            self.fgroup_id = (await http.execute(gql_utils.gql_cached("""
                 mutation CreateGroup($input: FlexusGroupInput!) {
                     group_create(input: $input) { fgroup_id }
                 }"""),
@@ -331,7 +330,7 @@ class ScenarioSetup:
 
             except Exception as e:
                 try:
-                    await http.execute(gql.gql("""mutation($id:String!){group_delete(fgroup_id:$id)}"""), variable_values={"id": self.fgroup_id})
+                    await http.execute(gql_utils.gql_cached("""mutation($id:String!){group_delete(fgroup_id:$id)}"""), variable_values={"id": self.fgroup_id})
                 except Exception as cleanup_error:
                     logger.warning(f"⚠️ Failed to delete test group {self.fgroup_name} after installation failure: {cleanup_error}")
                 raise e
@@ -340,7 +339,7 @@ class ScenarioSetup:
         if self.fgroup_id:
             try:
                 async with (await self.fclient.use_http()) as http:
-                    await http.execute(gql.gql("""mutation($id:String!){group_delete(fgroup_id:$id)}"""), variable_values={"id": self.fgroup_id})
+                    await http.execute(gql_utils.gql_cached("""mutation($id:String!){group_delete(fgroup_id:$id)}"""), variable_values={"id": self.fgroup_id})
             except Exception as e:
                 logger.warning(f"⚠️ Failed to delete test group {self.fgroup_name}: {e}")
 
@@ -352,7 +351,7 @@ async def bot_scenario_result_upsert(
     http_client = await client.use_http()
     async with http_client as http:
         result = await http.execute(
-            gql.gql("""mutation BotScenarioResultUpsert($input: BotScenarioUpsertInput!) {
+            gql_utils.gql_cached("""mutation BotScenarioResultUpsert($input: BotScenarioUpsertInput!) {
                 bot_scenario_result_upsert(input: $input)
             }"""),
             variable_values={
@@ -2,7 +2,7 @@ import asyncio
 import logging
 import signal
 import sys
-from typing import Dict
+from typing import Dict, Callable, Awaitable, Set
 
 import gql
 
@@ -15,6 +15,10 @@ shutdown_event = asyncio.Event()
 # transport recv() without looking at anything
 ws_clients: Dict[str, gql.Client] = {}
 tasks_to_cancel: Dict[str, asyncio.Task] = {}
+# Things like the shared http connector pool, closed gracefully (they drain in-flight requests first)
+closers: Dict[str, Callable[[], Awaitable[None]]] = {}
+# The loop keeps only weak references to tasks, a closer that is still draining must not be garbage collected
+closing_tasks: Set[asyncio.Task] = set()
 
 def give_ws_client(under_name: str, ws_client: gql.Client):
     ws_clients[under_name] = ws_client
@@ -28,6 +32,9 @@ def give_task_to_cancel(under_name: str, task: asyncio.Task):
 def take_away_task_to_cancel(under_name: str) -> asyncio.Task:
     return tasks_to_cancel.pop(under_name)
 
+def give_closer(under_name: str, closer: Callable[[], Awaitable[None]]):
+    closers[under_name] = closer
+
 
 def spiral_down_now(loop, enable_exit1):
     if shutdown_event.is_set() and enable_exit1:
@@ -37,10 +44,18 @@ def spiral_down_now(loop, enable_exit1):
     for k, ws_client in ws_clients.items():
         logger.info("ws close %r" % k)
         # Luckily, there is a way to kick them from outside
-        loop.create_task(ws_client.transport.close())
+        _keep(loop.create_task(ws_client.transport.close()))
     for k, task in tasks_to_cancel.items():
         logger.info("task cancel %r" % k)
         task.cancel()
+    for k, closer in closers.items():
+        logger.info("close %r" % k)
+        _keep(loop.create_task(closer()))
+
+
+def _keep(task: asyncio.Task) -> None:
+    closing_tasks.add(task)
+    task.add_done_callback(closing_tasks.discard)
 
 
 def setup_signals():
@@ -0,0 +1,420 @@
+import array
+import collections
+import hashlib
+import itertools
+import logging
+import os
+import pickle
+import re
+import stat
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Set, FrozenSet, Tuple, Iterator
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger("trigram")
+
+
+TRIGRAM_CACHE_DIR = os.path.join(tempfile.gettempdir(), "flexus_trigram_%d" % os.getuid())   # see _private_dir()
+TRIGRAM_RESCAN_SEC = 3.0               # queries within that time after a rescan trust the index, see mark_stale()
+TRIGRAM_SAVE_SEC = 30.0
+TRIGRAM_PERSIST_MIN_FILES = 1000       # smaller trees are faster to index again than to load from disk
+TRIGRAM_MAX_FILE = 10 * 1024 * 1024    # bigger files are not indexed, they are always candidates
+TRIGRAM_MAX_ALTERNATIVES = 32
+TRIGRAM_WORD_CACHE = 200000
+TRIGRAM_FORMAT = 1
+
+# Under IGNORECASE these match non-ascii characters too: "k" matches Kelvin sign, "s" long s, "i" dotless i
+_IGNORECASE_UNSAFE = set(b"iksIKS")
+
+Query = Optional[List[FrozenSet[bytes]]]   # OR of ANDs of trigrams or literals, None means any file can match
+
+# Only trigrams inside words are indexed: "self.cache" gives sel elf cac ach che, not "f.c". Files are mostly made of
+# the same words over and over, so that's a dict lookup per distinct word instead of a bytes object per byte of
+# content, several times faster to build and a third of the postings. Punctuation in a pattern just narrows less.
+_WORDS = re.compile(rb"\w{3,}")
+_word_trigrams_cache: Dict[bytes, FrozenSet[bytes]] = {}
+
+
+def _word_trigrams(word: bytes) -> FrozenSet[bytes]:
+    if (t := _word_trigrams_cache.get(word)) is None:
+        if len(_word_trigrams_cache) > TRIGRAM_WORD_CACHE:
+            _word_trigrams_cache.clear()
+        t = _word_trigrams_cache[word] = frozenset([word[i:i + 3] for i in range(len(word) - 2)])
+    return t
+
+
+def _trigrams(data: bytes) -> Set[bytes]:
+    return set().union(*map(_word_trigrams, set(_WORDS.findall(data.lower()))))
+
+
+class _Postings(dict):
+    def __missing__(self, t: bytes) -> array.array:
+        arr = self[t] = array.array("I")
+        return arr
+
+
+def _and(a: Query, b: Query) -> Query:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if len(a) * len(b) > TRIGRAM_MAX_ALTERNATIVES:
+        return a if len(a) <= len(b) else b   # dropping a condition only adds candidates
+    return [x | y for x in a for y in b]
+
+
+def _or(alternatives: List[Query]) -> Query:
+    result = []
+    for q in alternatives:
+        if q is None:
+            return None
+        result.extend(q)
+    return result if len(result) <= TRIGRAM_MAX_ALTERNATIVES else None
+
+
+def _query_seq(items, ignorecase: bool, exact: bool) -> Query:
+    # OR of ANDs of literal runs (ascii, at least 3 characters) every match must contain
+    q, run = None, []
+
+    def flush():
+        nonlocal q, run
+        if len(run) >= 3 and not (exact and ignorecase):
+            q = _and(q, [frozenset([bytes(run)])])
+        run = []
+
+    for op, arg in items:
+        if op == sre_parse.LITERAL and arg < 128 and not (ignorecase and arg in _IGNORECASE_UNSAFE):
+            run.append(arg)
+            continue
+        flush()
+        if op == sre_parse.SUBPATTERN:
+            q = _and(q, _query_seq(arg[-1], ignorecase or bool(arg[1] & re.IGNORECASE), exact))
+        elif op == sre_parse.BRANCH:
+            q = _and(q, _or([_query_seq(alt, ignorecase, exact) for alt in arg[1]]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and arg[0] >= 1:
+            q = _and(q, _query_seq(arg[2], ignorecase, exact))
+        # classes, anchors, lookarounds, backrefs, optional parts: nothing every match must contain
+    flush()
+    return q
+
+
+def regex_literals(pattern: re.Pattern, exact: bool = False) -> Query:
+    # Strings a line must contain to match, like codesearch does: "foo(bar|qux)" -> foo & (bar | qux). Only ascii is
+    # used, file bytes are decoded with errors="replace" or latin-1 before the regex runs. Under IGNORECASE the case
+    # of what's returned means nothing, exact=True leaves those parts out.
+    if not isinstance(pattern.pattern, str):
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except Exception:
+        return None
+    return _query_seq(parsed, bool(parsed.state.flags & re.IGNORECASE), exact)
+
+
+def regex_query(pattern: re.Pattern) -> Query:
+    # Which lowercase trigrams a line must contain to match
+    if (q := regex_literals(pattern)) is None:
+        return None
+    result = []
+    for conj in q:
+        if not (trigrams := frozenset().union(*map(_trigrams, conj))):
+            return None   # this alternative doesn't narrow anything, any file can match
+        result.append(trigrams)
+    return result
+
+
+def required_literal(pattern: re.Pattern) -> Optional[bytes]:
+    # Longest string every match contains, for a bytes.find() before running the regex: "ERROR " in r"ERROR \d+"
+    if (q := regex_literals(pattern, exact=True)) is None:
+        return None
+    common = frozenset.intersection(*q) if q else frozenset()
+    return max(common, key=len) if common else None
+
+
+def _walk(root: str, scope: str = "") -> Iterator[Tuple[str, os.stat_result]]:
+    # Same files glob("**/*") sees: hidden files and directories are skipped, symlinks followed (each target once).
+    # With a scope ("sub/dir/") only that part of the tree.
+    if any(part.startswith(".") for part in scope.split("/")[:-1]):
+        return
+    visited = {root}
+    stack = [scope.rstrip("/")]
+    while stack:
+        rel = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel) if rel else root)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                erel = rel + "/" + entry.name if rel else entry.name
+                try:
+                    if entry.is_dir():
+                        if entry.is_symlink():
+                            target = os.path.realpath(entry.path)
+                            if target in visited:
+                                continue
+                            visited.add(target)
+                        stack.append(erel)
+                    elif entry.is_file():
+                        yield erel, entry.stat()
+                except OSError:
+                    continue
+
+
+def _private_dir(path: str, create: bool) -> bool:
+    # Index files are pickles, loading one that somebody else could have written runs their code. Only a directory
+    # that is ours and nobody else can write into is used, a symlink or a directory planted in /tmp isn't.
+    if create:
+        try:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+        except OSError:
+            return False
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+
+class TrigramIndex:
+    # Inverted index trigram -> file ids, ids are never reused: a changed file gets a new id and the old one is
+    # tombstoned in self.paths until compaction drops it from posting lists. Thread safe, meant to run in a thread.
+
+    def __init__(self, root: str, index_path: Optional[str] = None):
+        self.root = os.path.realpath(root)
+        self.index_path = index_path or os.path.join(TRIGRAM_CACHE_DIR, hashlib.sha1(self.root.encode()).hexdigest()[:20] + ".idx")
+        self.lock = threading.Lock()
+        self.files: Dict[str, Tuple[int, int, int, bytes]] = {}   # relpath -> (mtime_ns, size, file_id, digest), file_id -1 not indexed
+        self.paths: List[Optional[str]] = []                       # file_id -> relpath, None for tombstones
+        self.postings: Dict[bytes, array.array] = _Postings()
+        self.unindexed: Set[str] = set()
+        self.pending: Set[str] = set()   # written by us, check before the next query even if no rescan is due
+        self.rescan_sec = TRIGRAM_RESCAN_SEC
+        self.dead = 0
+        self.loaded = False
+        self.scanned: Dict[str, float] = {}   # scope ("" or "sub/dir/") -> when it was last rescanned
+        self.saved_ts = 0.0
+        self.unsaved = 0
+        self.counters = {"indexed": 0, "rehashed": 0, "removed": 0, "queries": 0, "candidates": 0}
+
+    def refresh(self, force: bool = False, scope: str = "", deadline: Optional[float] = None) -> bool:
+        # Rescans scope ("" for everything or "sub/dir/"), unless it or a parent was rescanned recently. With a
+        # deadline (time.monotonic()) gives up when it passes and returns False, the index is then not to be trusted
+        # for that scope, what was checked so far is kept and the next refresh goes on from there.
+        if not self.lock.acquire(timeout=-1 if deadline is None else max(0.0, deadline - time.monotonic())):
+            return False
+        try:
+            if not self.loaded:
+                self._load()
+                self.loaded = True
+            t0 = time.time()
+            while self.pending:
+                rel = self.pending.pop()
+                try:
+                    st = os.stat(os.path.join(self.root, rel))
+                except OSError:
+                    self._forget(rel)
+                    continue
+                self._check(rel, st.st_mtime_ns, st.st_size)
+            if not force and any(scope.startswith(s) and t0 - ts < self.rescan_sec for s, ts in list(self.scanned.items())):
+                return True
+            seen = {}
+            for n, (rel, st) in enumerate(_walk(self.root, scope)):
+                if n % 256 == 255 and deadline is not None and time.monotonic() > deadline:
+                    return False
+                seen[rel] = (st.st_mtime_ns, st.st_size)
+            changed = 0
+            for rel in [rel for rel in self.files if rel.startswith(scope) and rel not in seen]:
+                self._forget(rel)
+                self.counters["removed"] += 1
+                changed += 1
+            complete = True
+            for n, (rel, (mtime_ns, size)) in enumerate(seen.items()):
+                if n % 64 == 63 and deadline is not None and time.monotonic() > deadline:
+                    complete = False
+                    break
+                changed += self._check(rel, mtime_ns, size)
+            if self.dead > 1000 and self.dead > len(self.files):
+                self._compact()
+            t1 = time.time()
+            if complete:
+                if not scope:
+                    self.scanned.clear()
+                self.scanned[scope] = t1
+            self.unsaved += changed
+            if changed:
+                logger.info("%s trigram index: %d files changed in %r, %d files total, %0.2fs%s", self.root, changed, scope, len(self.files), t1 - t0, "" if complete else ", out of time")
+            if self.unsaved and len(self.files) >= TRIGRAM_PERSIST_MIN_FILES and (self.unsaved >= 1000 or t1 - self.saved_ts > TRIGRAM_SAVE_SEC):
+                self._save()
+            return complete
+        finally:
+            self.lock.release()
+
+    def search(self, pattern: re.Pattern) -> List[str]:
+        # Files that might have a line matching the pattern, sorted. Files that don't are never opened.
+        q = regex_query(pattern)
+        with self.lock:
+            self.counters["queries"] += 1
+            if q is None:
+                result = list(self.files)
+            else:
+                ids: Set[int] = set()
+                for conj in q:
+                    ids |= self._intersect(conj)
+                paths = self.paths
+                result = [p for p in (paths[i] for i in ids) if p is not None]
+                result.extend(self.unindexed)
+            self.counters["candidates"] += len(result)
+        result.sort()
+        return result
+
+    def all_files(self) -> List[str]:
+        with self.lock:
+            return list(self.files)
+
+    def _intersect(self, conj: FrozenSet[bytes]) -> Set[int]:
+        lists = []
+        for t in conj:
+            if (arr := self.postings.get(t)) is None:
+                return set()
+            lists.append(arr)
+        lists.sort(key=len)
+        ids = set(lists[0])
+        for arr in lists[1:]:
+            if not ids:
+                break
+            ids.intersection_update(arr)
+        return ids
+
+    def _check(self, rel: str, mtime_ns: int, size: int) -> bool:
+        old = self.files.get(rel)
+        if old is not None and old[0] == mtime_ns and old[1] == size:
+            return False
+        self._update(rel, mtime_ns, size, old)
+        return True
+
+    def _update(self, rel: str, mtime_ns: int, size: int, old: Optional[Tuple[int, int, int, bytes]]) -> None:
+        if size > TRIGRAM_MAX_FILE:
+            self._forget(rel)
+            self.files[rel] = (mtime_ns, size, -1, b"")
+            self.unindexed.add(rel)
+            return
+        try:
+            with open(os.path.join(self.root, rel), "rb") as f:
+                data = f.read()
+        except OSError:
+            self._forget(rel)
+            return
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        if old is not None and old[2] >= 0 and old[3] == digest:
+            self.files[rel] = (mtime_ns, size, old[2], digest)   # touched or checked out again, same content
+            self.counters["rehashed"] += 1
+            return
+        self._forget(rel)
+        fid = len(self.paths)
+        self.paths.append(rel)
+        trigrams = _trigrams(data)
+        collections.deque(map(array.array.append, map(self.postings.__getitem__, trigrams), itertools.repeat(fid, len(trigrams))), maxlen=0)
+        self.files[rel] = (mtime_ns, size, fid, digest)
+        self.counters["indexed"] += 1
+
+    def _forget(self, rel: str) -> None:
+        old = self.files.pop(rel, None)
+        if old is None:
+            return
+        if old[2] >= 0:
+            self.paths[old[2]] = None
+            self.dead += 1
+        self.unindexed.discard(rel)
+
+    def _compact(self) -> None:
+        paths = self.paths
+        for t in list(self.postings):
+            arr = array.array("I", [i for i in self.postings[t] if paths[i] is not None])
+            if arr:
+                self.postings[t] = arr
+            else:
+                del self.postings[t]
+        self.dead = 0
+
+    def _load(self) -> None:
+        if not _private_dir(os.path.dirname(self.index_path), create=False):
+            if os.path.exists(self.index_path):
+                logger.warning("%s not loading trigram index %s, the directory is not private", self.root, self.index_path)
+            return
+        try:
+            with open(self.index_path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning("%s cannot load trigram index %s: %s", self.root, self.index_path, e)
+            return
+        if state.get("format") != TRIGRAM_FORMAT or state.get("root") != self.root:
+            return
+        self.files, self.paths, self.postings, self.dead = state["files"], state["paths"], state["postings"], state["dead"]
+        self.unindexed = {rel for rel, f in self.files.items() if f[2] < 0}
+        self.saved_ts = time.time()
+
+    def _save(self) -> None:
+        state = {"format": TRIGRAM_FORMAT, "root": self.root, "files": self.files, "paths": self.paths, "postings": self.postings, "dead": self.dead}
+        tmp = self.index_path + ".%d.tmp" % os.getpid()
+        if not _private_dir(os.path.dirname(self.index_path), create=True):
+            logger.warning("%s not saving trigram index %s, the directory is not private", self.root, self.index_path)
+            self.saved_ts = time.time()   # try again later, not on every refresh
+            return
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            logger.warning("%s cannot save trigram index %s: %s", self.root, self.index_path, e)
+            return
+        self.saved_ts = time.time()
+        self.unsaved = 0
+
+
+_indexes: Dict[str, TrigramIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def index_for(root: str, rescan_sec: Optional[float] = None) -> TrigramIndex:
+    # rescan_sec=math.inf for trees that only change when you say so with mark_stale(), like git clones
+    real = os.path.realpath(root)
+    with _indexes_lock:
+        if (idx := _indexes.get(real)) is None:
+            _indexes[real] = idx = TrigramIndex(real)
+        if rescan_sec is not None:
+            idx.rescan_sec = rescan_sec
+        return idx
+
+
+def mark_stale(root: str, path: Optional[str] = None) -> None:
+    # Call after writing into the tree: a path (relative to root) is checked before the next search, without a path
+    # the next search rescans everything
+    if (idx := _indexes.get(os.path.realpath(root))) is None:
+        return
+    rel = os.path.relpath(os.path.realpath(os.path.join(root, path)), idx.root) if path else ".."
+    if rel == ".." or rel.startswith("../"):
+        idx.scanned.clear()
+    else:
+        idx.pending.add(rel)
+
+
+def forget(root: str) -> None:
+    # The tree is gone, drop the index from memory and disk
+    with _indexes_lock:
+        idx = _indexes.pop(os.path.realpath(root), None)
+    if idx is not None:
+        try:
+            os.remove(idx.index_path)
+        except FileNotFoundError:
+            pass
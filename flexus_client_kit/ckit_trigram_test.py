@@ -0,0 +1,227 @@
+import os
+import random
+import re
+import stat
+import sys
+import tempfile
+import time
+
+from flexus_client_kit import ckit_trigram
+
+
+_WORDS = ["self", "return", "import", "logger", "info", "data", "result", "path", "value", "items", "config", "client",
+    "request", "response", "user", "token", "cache", "index", "error", "handle", "async", "await", "query", "record",
+    "message", "thread", "bot", "tool", "args", "kwargs", "None", "True", "False", "len", "dict", "list", "str", "int"]
+
+
+def make_corpus(root: str, n_files: int, seed: int = 1, rare_every: int = 1000) -> int:
+    # Benchmark corpus, python-looking files in a few levels of directories. Every rare_every-th file gets a line
+    # "RARE_MARKER_<n>" so there's something selective to search for. Returns total bytes written.
+    rnd = random.Random(seed)
+    total = 0
+    for i in range(n_files):
+        d = os.path.join(root, "pkg%02d" % (i % 50), "mod%03d" % (i // 50 % 40))
+        os.makedirs(d, exist_ok=True)
+        lines = []
+        for f in range(rnd.randrange(2, 8)):
+            lines.append("def %s_%s_%d(%s):" % (rnd.choice(_WORDS), rnd.choice(_WORDS), i, ", ".join(rnd.sample(_WORDS, 3))))
+            for _ in range(rnd.randrange(3, 12)):
+                lines.append("    %s = %s.%s(%s, %d)" % (rnd.choice(_WORDS), rnd.choice(_WORDS), rnd.choice(_WORDS), rnd.choice(_WORDS), rnd.randrange(1000)))
+            lines.append("")
+        if i % rare_every == 0:
+            lines.insert(rnd.randrange(len(lines)), "# RARE_MARKER_%d" % (i // rare_every))
+        data = ("\n".join(lines) + "\n").encode()
+        with open(os.path.join(d, "file%05d.py" % i), "wb") as fp:
+            fp.write(data)
+        total += len(data)
+    return total
+
+
+def _really_matching(root: str, pattern: re.Pattern):
+    found = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+        for fn in filenames:
+            if fn.startswith("."):
+                continue
+            with open(os.path.join(dirpath, fn), "rb") as f:
+                content = f.read()
+            text = content.decode("latin-1") if b"\x00" in content[:1024] else content.decode("utf-8", errors="replace")
+            if any(pattern.search(line) for line in text.splitlines()):
+                found.add(os.path.relpath(os.path.join(dirpath, fn), root))
+    return found
+
+
+def test_regex_query():
+    def q(p):
+        r = ckit_trigram.regex_query(re.compile(p))
+        return None if r is None else sorted(sorted(t.decode() for t in conj) for conj in r)
+
+    assert q("TODO") == [["odo", "tod"]]
+    assert q(r"handle_\w+_grep") == [sorted(["han", "and", "ndl", "dle", "le_", "_gr", "gre", "rep"])]
+    assert q("foo(bar|qux)") == [["bar", "foo"], ["foo", "qux"]]
+    assert q("foo(bar|baz)") == [["foo"]]   # the parser makes it foo(ba[rz])
+    assert q("(abc)+x") == [["abc"]] and q("(abc)*x") is None and q("ab?c") is None
+    assert q("x|.*") is None and q("a.b") is None and q("[abc]{3}") is None
+    assert q("(?i)Error") == [["err", "ror", "rro"]]
+    assert q("(?i)kilo") is None and q("(?i:Kilo)gram") == [["gra", "ram"]]
+    assert q("cafés") == [["caf"]] and q("naïve_thing") == [["_th", "e_t", "hin", "ing", "thi", "ve_"]]
+
+
+def test_search_finds_everything_the_regex_does():
+    rnd = random.Random(3)
+    with tempfile.TemporaryDirectory() as root:
+        make_corpus(root, 400, seed=5, rare_every=50)
+        os.makedirs(os.path.join(root, ".git"))
+        with open(os.path.join(root, ".git", "config"), "w") as f:
+            f.write("RARE_MARKER_0\n")
+        with open(os.path.join(root, "blob.bin"), "wb") as f:
+            f.write(b"\x00\x01" + bytes(rnd.randrange(256) for _ in range(5000)) + b"RARE_MARKER_1 caf\xe9")
+        with open(os.path.join(root, "utf.txt"), "w", encoding="utf-8") as f:
+            f.write("Café ERROR Kelvin Key\n")
+        idx = ckit_trigram.TrigramIndex(root, index_path=os.path.join(root, ".idx"))
+        idx.refresh()
+        assert not os.path.exists(idx.index_path)   # too small to persist
+        patterns = ["RARE_MARKER_3\\b", "RARE_MARKER_(1|5)", "(?i)rare_marker_7", "(?i)key", "cache\\.index\\(", "def \\w+_error_1\\d\\d\\(",
+            "token.*request", "^\\s+None = ", "RARE", "Café", "caf.", "nothing_like_this", "self|None", "x?", "\\d+_\\d+"]
+        for p in patterns:
+            pattern = re.compile(p)
+            found = set(idx.search(pattern))
+            want = _really_matching(root, pattern)
+            assert want <= found, (p, want - found)
+        assert "pkg00/mod003/file00150.py" in idx.search(re.compile("RARE_MARKER_3\\b")) and len(idx.search(re.compile("RARE_MARKER_3\\b"))) < 5
+        assert len(idx.search(re.compile("nothing_like_this"))) == 0
+        assert set(idx.search(re.compile("(?i)key"))) >= {"utf.txt"}
+        assert ".git/config" not in idx.all_files() and len(idx.all_files()) == 402
+
+
+def test_incremental_and_persistent():
+    orig = ckit_trigram.TRIGRAM_PERSIST_MIN_FILES
+    ckit_trigram.TRIGRAM_PERSIST_MIN_FILES = 10
+    try:
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as cache:
+            make_corpus(root, 60, seed=2, rare_every=20)
+            ipath = os.path.join(cache, "x.idx")
+            idx = ckit_trigram.TrigramIndex(root, index_path=ipath)
+            idx.refresh()
+            assert idx.counters["indexed"] == 60 and os.path.exists(ipath)
+            p = "pkg01/mod000/file00001.py"
+            with open(os.path.join(root, p), "a") as f:
+                f.write("NEW_THING = 1\n")
+            os.remove(os.path.join(root, "pkg00/mod000/file00000.py"))
+            os.utime(os.path.join(root, "pkg02/mod000/file00002.py"), (1, 1))   # same content, new mtime
+            idx.refresh()
+            assert idx.search(re.compile("RARE_MARKER_0")) == ["pkg00/mod000/file00000.py"]   # throttled, not rescanned yet
+            idx.refresh(force=True)
+            assert idx.search(re.compile("NEW_THING")) == [p]
+            assert idx.search(re.compile("RARE_MARKER_[01]")) == ["pkg20/mod000/file00020.py", "pkg40/mod000/file00040.py"]
+            assert idx.counters["indexed"] == 61 and idx.counters["rehashed"] == 1 and idx.counters["removed"] == 1
+            idx._save()
+
+            idx2 = ckit_trigram.TrigramIndex(root, index_path=ipath)
+            idx2.refresh()
+            assert idx2.counters["indexed"] == 0 and len(idx2.all_files()) == 59
+            assert idx2.search(re.compile("NEW_THING")) == [p]
+            for i in range(40):   # enough dead ids to compact
+                with open(os.path.join(root, p), "a") as f:
+                    f.write("v%d\n" % i)
+                idx2.refresh(force=True)
+            idx2.dead = 2000
+            idx2.refresh(force=True)
+            assert idx2.dead == 0 and idx2.search(re.compile("NEW_THING")) == [p]
+            assert all(idx2.paths[i] is not None for arr in idx2.postings.values() for i in arr)
+    finally:
+        ckit_trigram.TRIGRAM_PERSIST_MIN_FILES = orig
+
+
+def test_scoped_refresh_and_deadline():
+    with tempfile.TemporaryDirectory() as root:
+        make_corpus(root, 200, seed=4, rare_every=1000)
+        idx = ckit_trigram.TrigramIndex(root, index_path=os.path.join(root, ".idx"))
+        idx.rescan_sec = 1000
+        assert idx.refresh(scope="pkg01/") and len(idx.all_files()) == 4   # only that directory
+        for p in ["pkg01/mod000/file00001.py", "pkg02/mod000/file00002.py"]:
+            with open(os.path.join(root, p), "a") as f:
+                f.write("SCOPED_THING = 1\n")
+        assert idx.refresh(scope="pkg01/") and idx.search(re.compile("SCOPED_THING")) == []   # scanned recently
+        assert idx.refresh(scope="pkg01/", force=True) and idx.search(re.compile("SCOPED_THING")) == ["pkg01/mod000/file00001.py"]
+        assert idx.refresh() and len(idx.all_files()) == 200 and len(idx.search(re.compile("SCOPED_THING"))) == 2
+        os.remove(os.path.join(root, "pkg03/mod000/file00003.py"))
+        assert idx.refresh(scope="pkg03/") and len(idx.all_files()) == 200   # the whole tree was scanned after pkg03/
+        assert idx.refresh(scope="pkg03/", force=True) and len(idx.all_files()) == 199
+
+        idx2 = ckit_trigram.TrigramIndex(root, index_path=os.path.join(root, ".idx"))
+        assert not idx2.refresh(deadline=time.monotonic()) and not idx2.scanned
+        assert idx2.refresh(deadline=time.monotonic() + 60) and len(idx2.all_files()) == 199
+        with idx2.lock:   # somebody else is refreshing
+            t0 = time.monotonic()
+            assert not idx2.refresh(force=True, deadline=t0 + 0.1) and time.monotonic() - t0 < 1
+
+
+def test_index_dir_must_be_private():
+    orig = ckit_trigram.TRIGRAM_PERSIST_MIN_FILES
+    ckit_trigram.TRIGRAM_PERSIST_MIN_FILES = 10
+    try:
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as cache:
+            make_corpus(root, 20)
+            shared = os.path.join(cache, "shared")
+            os.mkdir(shared)
+            os.chmod(shared, 0o777)
+            idx = ckit_trigram.TrigramIndex(root, index_path=os.path.join(shared, "x.idx"))
+            idx.refresh()
+            assert not os.path.exists(idx.index_path)
+            idx = ckit_trigram.TrigramIndex(root, index_path=os.path.join(cache, "private", "x.idx"))
+            idx.refresh()
+            assert os.path.exists(idx.index_path) and stat.S_IMODE(os.stat(os.path.dirname(idx.index_path)).st_mode) == 0o700
+            os.rename(idx.index_path, os.path.join(shared, "x.idx"))   # planted by somebody else
+            idx2 = ckit_trigram.TrigramIndex(root, index_path=os.path.join(shared, "x.idx"))
+            idx2.refresh()
+            assert idx2.counters["indexed"] == 20
+    finally:
+        ckit_trigram.TRIGRAM_PERSIST_MIN_FILES = orig
+
+
+def benchmark(root: str = "", n_files: int = 50000) -> None:
+    # python -m flexus_client_kit.ckit_trigram_test [dir] [n_files], keeps the corpus in dir to run again
+    import asyncio
+    import math
+    from flexus_client_kit.format_utils import grep_output
+    from flexus_client_kit.integrations import fi_localfile
+    tmp = None
+    if not root:
+        tmp = tempfile.TemporaryDirectory()
+        root = tmp.name
+    if not os.path.exists(os.path.join(root, "pkg00")):
+        t0 = time.time()
+        size = make_corpus(root, n_files)
+        print("corpus: %d files, %0.1fMB, %0.1fs" % (n_files, size / 1e6, time.time() - t0))
+    ckit_trigram.TRIGRAM_CACHE_DIR = os.path.join(root, ".trigram")
+
+    def scan(pattern: re.Pattern) -> int:
+        n = 0   # what handle_grep did before, glob and read every file
+        for filepath in fi_localfile._glob_files(root, "*", True):
+            with open(filepath, "r", encoding="utf-8", errors="replace") as f:
+                n += bool(grep_output(filepath, f.read(), pattern, 0))
+        return n
+
+    t0 = time.time()
+    idx = ckit_trigram.index_for(root, rescan_sec=math.inf)   # like ckit_repo_cache does for checkouts
+    idx.refresh()
+    print("index: %0.2fs (%d files, %d trigrams)" % (time.time() - t0, len(idx.files), len(idx.postings)))
+    t0 = time.time()
+    idx.refresh(force=True)
+    print("rescan for changes: %0.3fs" % (time.time() - t0))
+
+    for p in ["RARE_MARKER_7\\b", "def \\w+_error_4242\\(", "(?i)rare_marker_(1|2)\\b", "self\\.cache\\.index\\(token, 999\\)"]:
+        t0 = time.perf_counter()
+        n_scan = scan(re.compile(p))
+        t1 = time.perf_counter()
+        out = asyncio.run(fi_localfile.handle_localfile(root, {"op": "grep", "args": {"pattern": p}}))
+        t2 = time.perf_counter()
+        print("%-40s scan %7.1fms  indexed %6.1fms  x%-6.0f %d files, %s" % (p, (t1 - t0) * 1e3, (t2 - t1) * 1e3, (t1 - t0) / (t2 - t1), n_scan, out.split("\n")[0]))
+    if tmp:
+        tmp.cleanup()
+
+
+if __name__ == "__main__":
+    benchmark(sys.argv[1] if len(sys.argv) > 1 else "", int(sys.argv[2]) if len(sys.argv) > 2 else 50000)
@@ -1,7 +1,8 @@
 import asyncio
+import bisect
 import logging
 import time
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, List
 
 logger = logging.getLogger(__name__)
 
@@ -38,3 +39,44 @@ def truncate_middle(text: str, max_length: int = 5000) -> str:
         return text
     keep_chars = max_length // 2
     return text[:keep_chars] + "\n...\n" + text[-keep_chars:]
+
+
+class LatencyHistogram:
+    """
+    Fixed buckets in seconds, cheap enough to call observe() on every request. Percentiles are bucket upper bounds.
+    """
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(self.BUCKETS) + 1)
+        self.n = 0
+        self.total_sec = 0.0
+        self.max_sec = 0.0
+
+    def observe(self, sec: float) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS, sec)] += 1
+        self.n += 1
+        self.total_sec += sec
+        if sec > self.max_sec:
+            self.max_sec = sec
+
+    def percentile(self, p: float) -> float:
+        if self.n == 0:
+            return 0.0
+        want = p / 100 * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= want and c:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else self.max_sec
+        return self.max_sec
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "n": self.n,
+            "avg": self.total_sec / self.n if self.n else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max_sec,
+        }
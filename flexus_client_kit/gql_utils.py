@@ -1,13 +1,57 @@
-from typing import Dict, Any, Type, TypeVar, get_type_hints, Union, Callable, Awaitable
+from typing import Dict, Any, Type, TypeVar, get_type_hints, Union, Callable, Awaitable, Optional
+import functools
 import pydantic
 import dataclasses
 import logging
 import aiohttp.client_exceptions
+import gql
+import graphql
 from flexus_client_kit import ckit_shutdown
 
 T = TypeVar('T')
 
 
+# Parsing a document is the most expensive part of sending a small mutation, and the same couple of dozen
+# documents get sent over and over. Key is the document text (str hash is cached on the object, so for
+# a literal that's one pointer compare), the value is the parsed DocumentNode. Not what gql.gql() returns:
+# in gql 4 that's a GraphQLRequest, and execute(..., variable_values=...) writes the variables into it.
+GQL_REGISTRY_MAX_DOCUMENTS = 2000
+_gql_registry: Dict[str, Any] = {}
+_gql_registry_hits = 0
+_gql_registry_misses = 0
+_GQL_4 = not isinstance(gql.gql("{ __typename }"), graphql.DocumentNode)   # gql() returns a GraphQLRequest
+
+
+def gql_cached(document_text: str) -> Any:
+    """
+    Drop-in for gql.gql(), parses (and syntax-checks) each distinct document once per process:
+
+    await h.execute(gql_utils.gql_cached('''mutation ...'''), variable_values={...})
+
+    Don't put variable values into the text, use $variables, otherwise every call is a new document.
+    Every call returns a new request object, so variables of one call don't stick to the next one.
+    """
+    global _gql_registry_hits, _gql_registry_misses
+    doc = _gql_registry.get(document_text)
+    if doc is not None:
+        _gql_registry_hits += 1
+        return gql.GraphQLRequest(doc) if _GQL_4 else doc
+    _gql_registry_misses += 1
+    parsed = gql.gql(document_text)
+    doc = parsed.document if _GQL_4 else parsed   # gql 3 executes the DocumentNode itself, nothing to copy
+    if len(_gql_registry) < GQL_REGISTRY_MAX_DOCUMENTS:
+        _gql_registry[document_text] = doc
+    return parsed
+
+
+def gql_registry_stats() -> Dict[str, int]:
+    return {
+        "hits": _gql_registry_hits,
+        "misses": _gql_registry_misses,
+        "documents": len(_gql_registry),
+    }
+
+
 def strawberry_from_prisma(prisma_obj: pydantic.BaseModel, strawberry_class: Type[T]) -> T:
     """
     Prisma models are pydantic.BaseModel.
@@ -56,7 +100,70 @@ def dataclass_from_dict(data: Dict[str, Any], cls: Type[T]) -> T:
 
     Most of the code in this project is server side, but chat advancer and some other isolated services are
     client side, meaning they use GraphQL to communicate with the server.
+
+    Looking at type annotations happens once per class, see dataclass_decoder().
     """
+    return dataclass_decoder(cls)(data)
+
+
+_dataclass_decoders: Dict[type, Callable[[Dict[str, Any]], Any]] = {}
+
+
+def dataclass_decoder(cls: Type[T]) -> Callable[[Dict[str, Any]], T]:
+    """
+    Returns a function dict -> cls, specialized for cls and cached. It does the same thing as
+    _dataclass_from_dict_reflection(), but all the typing questions are answered here, not on each call.
+    """
+    decoder = _dataclass_decoders.get(cls)
+    if decoder is not None:
+        return decoder
+    annotations = cls.__annotations__
+    converters = []
+
+    def decoder(data: Dict[str, Any]) -> T:
+        kwargs = {k: v for k, v in data.items() if k in annotations}
+        for field_name, convert in converters:
+            v = kwargs.get(field_name)
+            if v is not None:
+                kwargs[field_name] = convert(v)
+        return cls(**kwargs)
+
+    # Register before looking at fields, so self-referencing dataclasses find it
+    _dataclass_decoders[cls] = decoder
+    for field_name, field_type in annotations.items():
+        convert = _compile_field_converter(field_type)
+        if convert is not None:
+            converters.append((field_name, convert))
+    return decoder
+
+
+def _compile_field_converter(field_type: Any) -> Optional[Callable[[Any], Any]]:
+    # None means the value goes into the dataclass as is
+    if hasattr(field_type, "__origin__") and field_type.__origin__ is Union:
+        inner_types = [arg for arg in field_type.__args__ if arg is not type(None)]
+        if inner_types:
+            field_type = inner_types[0]
+    is_json = (
+        getattr(field_type, '__name__', None) == 'JSON' or
+        getattr(getattr(field_type, 'wrap', None), '__name__', None) == 'JSON'
+    )
+    if is_json:
+        return None
+    if hasattr(field_type, "__origin__") and field_type.__origin__ is list:
+        args = getattr(field_type, "__args__", None)
+        if args and dataclasses.is_dataclass(args[0]):
+            item_decoder = dataclass_decoder(args[0])
+            return lambda v: [item_decoder(item) for item in v] if isinstance(v, list) else v
+        return None
+    if field_type is Any:
+        return None
+    if dataclasses.is_dataclass(field_type):
+        return dataclass_decoder(field_type)
+    return None
+
+
+def _dataclass_from_dict_reflection(data: Dict[str, Any], cls: Type[T]) -> T:
+    # The original implementation, reference for tests and gql_utils_test.benchmark()
     filtered_data = {k: v for k, v in data.items() if k in cls.__annotations__}
     for field_name, field_value in filtered_data.items():
         if field_value is not None and field_name in cls.__annotations__:
@@ -77,7 +184,7 @@ def dataclass_from_dict(data: Dict[str, Any], cls: Type[T]) -> T:
                     inner_type = field_type.__args__[0]
                     if dataclasses.is_dataclass(inner_type):
                         # List of dataclasses
-                        filtered_data[field_name] = [dataclass_from_dict(item, inner_type) for item in field_value]
+                        filtered_data[field_name] = [_dataclass_from_dict_reflection(item, inner_type) for item in field_value]
                     else:
                         # List of primitives, keep as is
                         filtered_data[field_name] = field_value
@@ -85,10 +192,11 @@ def dataclass_from_dict(data: Dict[str, Any], cls: Type[T]) -> T:
                 # Fallback for Any type
                 filtered_data[field_name] = field_value
             elif dataclasses.is_dataclass(field_type):
-                filtered_data[field_name] = dataclass_from_dict(field_value, field_type)
+                filtered_data[field_name] = _dataclass_from_dict_reflection(field_value, field_type)
     return cls(**filtered_data)
 
 
+@functools.lru_cache(maxsize=None)
 def gql_fields(cls: Type[Any], depth: int = 4) -> str:
     """
     Another function for client side, use together with dataclass_from_dict() to prepare the query string.
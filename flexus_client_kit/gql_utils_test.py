@@ -0,0 +1,178 @@
+import time
+import dataclasses
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Union
+
+from flexus_client_kit import gql_utils, ckit_ask_model, ckit_kanban, ckit_bot_query
+
+
+def _message_payload(n: int) -> dict:
+    return {
+        "ftm_belongs_to_ft_id": "ft_3kX9aPq2",
+        "ftm_role": "assistant",
+        "ftm_content": "Sure, I've looked at the pipeline, here's the summary of %d deals..." % n,
+        "ftm_num": n,
+        "ftm_alt": 100,
+        "ftm_prev_alt": 100,
+        "ftm_usage": {"coins": 1234, "prompt_tokens": 5120, "completion_tokens": 312},
+        "ftm_tool_calls": [{"id": "call_%d" % n, "type": "function", "function": {"name": "erp_table_data", "arguments": "{\"table_name\": \"crm_deal\"}"}}],
+        "ftm_call_id": "",
+        "ftm_app_specific": None,
+        "ftm_created_ts": 1760000000.5 + n,
+        "ftm_provenance": {"system": "frog_1003", "who_is_asking": "bot"},
+        "__typename": "FThreadMessageOutput",
+    }
+
+
+def _task_payload(n: int) -> dict:
+    return {
+        "persona_id": "persona_frog1",
+        "ktask_id": "ktask_%05d" % n,
+        "ktask_title": "Reply to the lead from the website form #%d" % n,
+        "ktask_fexp_name": "default",
+        "ktask_inbox_ts": 1760000000.0,
+        "ktask_inbox_provenance": {"system": "crm_automation", "automation": "welcome_email"},
+        "ktask_daily_timekey": "20251018",
+        "ktask_coins": 0,
+        "ktask_budget": 100000,
+        "ktask_todo_ts": 1760000010.0,
+        "ktask_inprogress_ts": 0.0,
+        "ktask_inprogress_ft_id": None,
+        "ktask_inprogress_activity_ts": 0.0,
+        "ktask_done_ts": 0.0,
+        "ktask_resolution_code": None,
+        "ktask_resolution_summary": None,
+        "ktask_details": {"contact_id": "c_%d" % n, "email": "lead%d@example.com" % n},
+    }
+
+
+def _subs_payload(n: int) -> dict:
+    return {
+        "news_action": "INSERT",
+        "news_about": "flexus_thread_message",
+        "news_payload_id": "ft_3kX9aPq2:100:%03d" % n,
+        "news_payload_thread_message": _message_payload(n),
+        "news_payload_thread": None,
+        "news_payload_persona": None,
+        "news_payload_toolcall": None,
+        "news_payload_task": _task_payload(n),
+        "news_payload_erp_record_new": None,
+        "news_payload_erp_record_old": None,
+        "news_payload_emessage": None,
+        "news_payload_auth": None,
+    }
+
+
+@dataclass
+class _Leaf:
+    x: int
+    tags: List[str]
+    extra: Any = None
+
+
+@dataclass
+class _Tree:
+    name: str
+    leaf: Optional[_Leaf]
+    leaves: List[_Leaf]
+    maybe_leaves: Optional[List[_Leaf]] = None
+    either: Union[_Leaf, str, None] = None
+    children: List["_Tree"] = field(default_factory=list)
+    default_num: int = 5
+
+
+def _same(a, b) -> bool:
+    return type(a) is type(b) and a == b
+
+
+def test_compiled_same_as_reflection_realistic():
+    for n in range(5):
+        for payload, cls in [
+            (_message_payload(n), ckit_ask_model.FThreadMessageOutput),
+            (_task_payload(n), ckit_kanban.FPersonaKanbanTaskOutput),
+            (_subs_payload(n), ckit_bot_query.FBotThreadsCallsTasks),
+        ]:
+            assert _same(gql_utils.dataclass_from_dict(payload, cls), gql_utils._dataclass_from_dict_reflection(payload, cls))
+
+
+def test_compiled_same_as_reflection_nested():
+    payloads = [
+        {"name": "a", "leaf": None, "leaves": []},
+        {"name": "b", "leaf": {"x": 1, "tags": ["t"]}, "leaves": [{"x": 2, "tags": [], "extra": {"k": 1}}], "unknown": 1},
+        {"name": "c", "leaf": None, "leaves": "not a list", "maybe_leaves": [{"x": 3, "tags": []}], "default_num": 7},
+        {"name": "d", "leaf": None, "leaves": [], "either": {"x": 4, "tags": []}},
+        {"name": "e", "leaf": None, "leaves": [], "children": [{"name": "e1", "leaf": None, "leaves": []}]},
+    ]
+    for p in payloads:
+        compiled = gql_utils.dataclass_from_dict(p, _Tree)
+        assert _same(compiled, gql_utils._dataclass_from_dict_reflection(p, _Tree))
+    # Forward reference "_Tree" stays a string annotation, so children are passed through as dicts, same as before
+    assert isinstance(gql_utils.dataclass_from_dict(payloads[4], _Tree).children[0], dict)
+    assert gql_utils.dataclass_from_dict(payloads[1], _Tree).leaves[0].extra == {"k": 1}
+    assert gql_utils.dataclass_decoder(_Tree) is gql_utils.dataclass_decoder(_Tree)
+
+
+def test_compiled_missing_required_field_raises_the_same():
+    errors = []
+    for f in [gql_utils.dataclass_from_dict, gql_utils._dataclass_from_dict_reflection]:
+        try:
+            f({"name": "x"}, _Tree)
+        except TypeError as e:
+            errors.append(str(e))
+    assert len(errors) == 2 and errors[0] == errors[1]
+
+
+def test_gql_cached_requests_dont_share_variables():
+    import asyncio
+    import gql
+    from gql.transport.async_transport import AsyncTransport
+    from graphql import ExecutionResult
+
+    class Transport(AsyncTransport):
+        def __init__(self):
+            self.seen = []
+        async def connect(self):
+            pass
+        async def close(self):
+            pass
+        async def subscribe(self, request):
+            raise NotImplementedError()
+        async def execute(self, request):
+            self.seen.append(request.variable_values)
+            return ExecutionResult(data={"echo": "ok"})
+
+    text = "query GqlCachedTest($x: Int) { echo(x: $x) }"
+    big = {"x": 1, "payload": "z" * 100000}
+
+    async def go():
+        t = Transport()
+        async with gql.Client(transport=t) as h:
+            await h.execute(gql_utils.gql_cached(text), variable_values=big)
+            await h.execute(gql_utils.gql_cached(text))
+            await h.execute(gql_utils.gql_cached(text), variable_values={"x": 2})
+        return t.seen
+
+    assert asyncio.run(go()) == [big, None, {"x": 2}]
+    assert gql_utils.gql_cached(text) is not gql_utils.gql_cached(text)
+    assert getattr(gql_utils.gql_cached(text), "variable_values", None) is None   # nothing pinned in the registry
+
+
+def benchmark(n: int = 20000) -> None:
+    for title, payload, cls in [
+        ("FThreadMessageOutput", _message_payload(7), ckit_ask_model.FThreadMessageOutput),
+        ("FPersonaKanbanTaskOutput", _task_payload(7), ckit_kanban.FPersonaKanbanTaskOutput),
+        ("FBotThreadsCallsTasks", _subs_payload(7), ckit_bot_query.FBotThreadsCallsTasks),
+    ]:
+        assert dataclasses.is_dataclass(cls)
+        t0 = time.perf_counter()
+        for _ in range(n):
+            gql_utils._dataclass_from_dict_reflection(payload, cls)
+        t1 = time.perf_counter()
+        for _ in range(n):
+            gql_utils.dataclass_from_dict(payload, cls)
+        t2 = time.perf_counter()
+        print("%-26s reflection %6.2fus  compiled %6.2fus  x%0.1f" % (title, (t1 - t0) / n * 1e6, (t2 - t1) / n * 1e6, (t1 - t0) / (t2 - t1)))
+
+
+if __name__ == "__main__":
+    benchmark()
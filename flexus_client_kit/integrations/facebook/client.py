@@ -143,11 +143,11 @@ class FacebookAdsClient:
 
 
     async def _fetch_token(self) -> str:
-        from flexus_client_kit import ckit_client
+        from flexus_client_kit import gql_utils
         http = await self.fclient.use_http()
         async with http as h:
             result = await h.execute(
-                ckit_client.gql.gql("""
+                gql_utils.gql_cached("""
                     query GetFacebookToken($fuser_id: String!, $ws_id: String!, $provider: String!) {
                         external_auth_token(
                             fuser_id: $fuser_id
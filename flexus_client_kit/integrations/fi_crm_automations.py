@@ -1,16 +1,22 @@
+import asyncio
 import collections
+import dataclasses
+import functools
 import json
 import logging
 import re
 import time
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 
-import gql
 
-from flexus_client_kit import ckit_cloudtool, ckit_client, ckit_erp, ckit_kanban, ckit_bot_exec, erp_schema
+from flexus_client_kit import ckit_cloudtool, ckit_client, ckit_erp, ckit_expr, ckit_kanban, ckit_bot_exec, ckit_utils, erp_schema, gql_utils
 
 logger = logging.getLogger("crmau")
 
+CRM_AUTOMATIONS_MAX = 200   # per bot, evaluation cost depends on automations matching the event, not on this number
+CRM_ACTIONS_CONCURRENCY = 8
+CRM_BURST_SEC = 2.0         # deal lookups for move_deal_stage are reused for this long after the lookup
+
 
 CRM_AUTOMATIONS_SETUP_SCHEMA = [
     {
@@ -206,6 +212,10 @@ Special functions:
 - {{now() + 86400}} - timestamp one day from now (86400 = 24*60*60)
 - {{now() - 3600}} - timestamp one hour ago
 
+Expressions work in "fields" and "comingup_ts": + - * / // %, comparisons, and/or/not, x if cond else y, and
+functions now, minutes, hours, days, weeks, date(ts, fmt), parse_date, abs, min, max, round, int, float, str, len,
+lower, upper, strip. Example: {{trigger.new_record.contact_created_ts + days(3)}}
+
 ## Field Operations
 
 For atomic operations on fields:
@@ -267,22 +277,36 @@ class IntegrationCrmAutomations:
         self.get_setup = get_setup_func
         self.available_erp_tables = available_erp_tables or []
         self._recently_fired = collections.OrderedDict()  # (auto_name, record_id) -> timestamp
+        self._burst = ActionBurst()
+        self._compiled_from: Any = None
+        self._compiled = CompiledAutomations({})
         self._setup_automation_handlers()
 
     def _load_automations(self) -> Dict[str, Any]:
-        setup = self.get_setup()
-        crm_automations_str = setup.get("crm_automations", "{}")
+        return self._load_compiled().automations
+
+    def action_stats(self) -> Dict[str, Any]:
+        return self._burst.stats()
+
+    def _load_compiled(self) -> "CompiledAutomations":
+        # Setup arrives as the same string over and over, parse and compile only when it changes
+        crm_automations_str = self.get_setup().get("crm_automations", "{}")
+        if crm_automations_str is self._compiled_from or (isinstance(crm_automations_str, str) and crm_automations_str == self._compiled_from):
+            return self._compiled
         try:
-            return json.loads(crm_automations_str) if isinstance(crm_automations_str, str) else crm_automations_str
+            automations = json.loads(crm_automations_str) if isinstance(crm_automations_str, str) else crm_automations_str
         except json.JSONDecodeError as e:
             logger.error(f"Failed to parse crm_automations from setup: {e}")
-            return {}
+            automations = {}
+        self._compiled = CompiledAutomations(automations or {})
+        self._compiled_from = crm_automations_str
+        return self._compiled
 
     async def _save_automation(self, automation_name: str, automation_config: Optional[Dict[str, Any]]) -> None:
         http = await self.client.use_http()
         async with http as h:
             await h.execute(
-                gql.gql("""mutation PersonaSetupSetKey($persona_id: String!, $set_key: String!, $set_val: String) {
+                gql_utils.gql_cached("""mutation PersonaSetupSetKey($persona_id: String!, $set_key: String!, $set_val: String) {
                     persona_setup_set_key(
                         persona_id: $persona_id,
                         set_key: $set_key,
@@ -348,8 +372,8 @@ class IntegrationCrmAutomations:
         automations = self._load_automations()
         if name in automations:
             return f"❌ Error: Automation '{name}' already exists. Use op='update' to modify it."
-        if len(automations) >= 30:
-            return "❌ Error: Maximum 30 automations per bot. Delete unused automations first."
+        if len(automations) >= CRM_AUTOMATIONS_MAX:
+            return f"❌ Error: Maximum {CRM_AUTOMATIONS_MAX} automations per bot. Delete unused automations first."
 
         if "enabled" not in config:
             config["enabled"] = True
@@ -396,25 +420,64 @@ class IntegrationCrmAutomations:
         return f"✅ Deleted automation '{name}'"
 
     def _setup_automation_handlers(self):
-        automations = self._load_automations()
-        tables = sorted({t["table"] for cfg in automations.values() if cfg.get("enabled", True)
-                        for t in cfg.get("triggers", []) if t.get("type") == "erp_table" and t.get("table")})
+        tables = self._load_compiled().tables
 
         def make_handler(table_name):
             pk_field = erp_schema.get_pkey_field(erp_schema.ERP_TABLE_TO_SCHEMA[table_name])
             async def handler(operation: str, new_record: Any, old_record: Any):
-                if not (automations_dict := self._load_automations()):
+                self._burst.on_erp_change(table_name, new_record, old_record)
+                compiled = self._load_compiled()
+                if not compiled.triggers_for(table_name, operation):
                     return
                 if not (rid := ckit_erp.dataclass_or_dict_to_dict(new_record or old_record).get(pk_field)):
                     return
                 await execute_automations_for_erp_event(
                     self.rcx, table_name, operation, new_record, old_record,
-                    automations_dict, self._recently_fired, rid,
+                    compiled, self._recently_fired, rid, self._burst,
                 )
             return handler
 
         for t in tables:
-            self.rcx._handler_per_erp_table_change[t] = make_handler(t)
+            self.rcx.on_erp_change(t)(make_handler(t))   # not the dict directly, the erp router needs to know the tables
+
+
+class CompiledAutomations:
+    """
+    Automations from the setup, ready for events: enabled triggers indexed by (table, OPERATION) in the order
+    the old linear scan would visit them, filters compiled, templates in actions parsed.
+    """
+
+    def __init__(self, automations: Dict[str, Any]):
+        self.automations = automations
+        self.index: Dict[Tuple[str, str], List[Tuple[str, Dict[str, Any], Optional[ckit_erp.ErpFilter]]]] = {}
+        for auto_name, auto_config in automations.items():
+            if not isinstance(auto_config, dict) or not auto_config.get("enabled", True):
+                continue
+            for trigger in auto_config.get("triggers", []):
+                if trigger.get("type") != "erp_table" or not trigger.get("table"):
+                    continue
+                flt = ckit_erp.compile_erp_filters(trigger["filters"]) if trigger.get("filters") else None
+                for op in {op.upper() for op in trigger.get("operations", [])}:
+                    self.index.setdefault((trigger["table"], op), []).append((auto_name, auto_config, flt))
+            for action in auto_config.get("actions", []):
+                _warm_templates(action)
+        self.tables = sorted({table for table, _ in self.index})
+
+    def triggers_for(self, table_name: str, operation: str) -> List[Tuple[str, Dict[str, Any], Optional[ckit_erp.ErpFilter]]]:
+        return self.index.get((table_name, operation.upper()), [])
+
+
+def _warm_templates(x: Any) -> None:
+    if isinstance(x, str):
+        if "{{" in x:
+            _compile_template(x)
+            _compile_template(x.strip(), True)
+    elif isinstance(x, dict):
+        for v in x.values():
+            _warm_templates(v)
+    elif isinstance(x, list):
+        for v in x:
+            _warm_templates(v)
 
 
 async def execute_automations_for_erp_event(
@@ -423,126 +486,346 @@ async def execute_automations_for_erp_event(
     operation: str,
     new_record: Optional[Any],
     old_record: Optional[Any],
-    automations_dict: Dict[str, Any],
+    automations: CompiledAutomations,
     recently_fired: collections.OrderedDict,
     record_id: str,
+    burst: Optional["ActionBurst"] = None,
 ) -> None:
     cutoff = time.time() - 60
     while recently_fired and next(iter(recently_fired.values())) < cutoff:
         recently_fired.popitem(last=False)
 
+    if not (triggers := automations.triggers_for(table_name, operation)):
+        return
+    burst = burst or ActionBurst()
+    burst.begin()
     rec = ckit_erp.dataclass_or_dict_to_dict(old_record if operation.upper() == "DELETE" else new_record) if (new_record or old_record) else {}
-    for auto_name, auto_config in automations_dict.items():
-        if not auto_config.get("enabled", True):
+    ctx = None
+    for auto_name, auto_config, flt in triggers:
+        if flt is not None and not flt(rec):
+            logger.debug(f"Automation '{auto_name}' filtered out for {table_name}.{operation}")
+            continue
+        if (auto_name, record_id) in recently_fired:
+            logger.debug(f"Automation '{auto_name}' skipped for {record_id}: recently fired")
             continue
-        for trigger in auto_config.get("triggers", []):
-            if trigger.get("type") != "erp_table" or trigger.get("table") != table_name:
-                continue
-            if operation.upper() not in [op.upper() for op in trigger.get("operations", [])]:
-                continue
-            if trigger_filters := trigger.get("filters", []):
-                if not ckit_erp.check_record_matches_filters(rec, trigger_filters):
-                    logger.debug(f"Automation '{auto_name}' filtered out for {table_name}.{operation}")
-                    continue
-            if (auto_name, record_id) in recently_fired:
-                logger.debug(f"Automation '{auto_name}' skipped for {record_id}: recently fired")
-                continue
 
+        if ctx is None:
             ctx = {"trigger": {
                 "type": "erp_table", "table": table_name, "operation": operation,
                 "new_record": ckit_erp.dataclass_or_dict_to_dict(new_record) if new_record else None,
                 "old_record": ckit_erp.dataclass_or_dict_to_dict(old_record) if old_record else None,
             }}
-            await _execute_actions(rcx, auto_config.get("actions", []), ctx)
-            recently_fired[(auto_name, record_id)] = time.time()
-            logger.info(f"Automation '{auto_name}' executed for {table_name}.{operation}")
+        await _execute_actions(rcx, auto_config.get("actions", []), ctx, burst)
+        recently_fired[(auto_name, record_id)] = time.time()
+        logger.info(f"Automation '{auto_name}' executed for {table_name}.{operation}")
+
+
+class ActionBurst:
+    """
+    State shared by actions of events that come in quick succession: deal lookups for move_deal_stage (each one
+    expires CRM_BURST_SEC after it was made, however busy it gets), and per action type latency that stays for
+    the lifetime of the integration.
+    """
+
+    def __init__(self):
+        self.deals: Dict[Tuple[str, str], Tuple[float, Optional[Tuple[str, str]]]] = {}   # (contact_id, pipeline_id) -> (ts, (deal_id, stage_id) or None for no deal)
+        self.deal_lookups = 0
+        self.deal_lookups_cached = 0
+        self.latency: Dict[str, ckit_utils.LatencyHistogram] = collections.defaultdict(ckit_utils.LatencyHistogram)
+        self.outcomes: Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+
+    def begin(self) -> None:
+        now = time.time()
+        for key in [k for k, (ts, _) in self.deals.items() if now - ts > CRM_BURST_SEC]:
+            del self.deals[key]
+
+    def get_deal(self, key: Tuple[str, str]) -> Tuple[bool, Optional[Tuple[str, str]]]:
+        hit = self.deals.get(key)
+        if hit is None or time.time() - hit[0] > CRM_BURST_SEC:
+            return False, None
+        return True, hit[1]
+
+    def put_deal(self, key: Tuple[str, str], deal: Optional[Tuple[str, str]]) -> None:
+        self.deals[key] = (time.time(), deal)
+
+    def forget_deals(self, deal_id: str = "", contact_id: str = "", pipeline_id: str = "") -> None:
+        for key in [k for k, (_, v) in self.deals.items() if (v and v[0] == deal_id) or k == (contact_id, pipeline_id)]:
+            del self.deals[key]
+
+    def on_erp_change(self, table_name: str, new_record: Any, old_record: Any) -> None:
+        if table_name != "crm_deal":
+            return
+        for r in (new_record, old_record):
+            if r:
+                d = ckit_erp.dataclass_or_dict_to_dict(r)
+                self.forget_deals(d.get("deal_id", ""), d.get("deal_contact_id", ""), d.get("deal_pipeline_id", ""))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "actions": {t: {"outcomes": dict(self.outcomes[t]), "latency": h.summary()} for t, h in self.latency.items()},
+            "deal_lookups": self.deal_lookups,
+            "deal_lookups_cached": self.deal_lookups_cached,
+        }
+
+
+@dataclasses.dataclass
+class _PlannedAction:
+    n: int                           # position in the automation's actions, for logs
+    action_type: str
+    table: str                       # what the action touches, "bot_inbox" for tasks
+    record_id: Optional[str]         # None for a new record, "*" for anything in the table (queries, inbox order)
+    args: Dict[str, Any]
+    deps: List[int] = dataclasses.field(default_factory=list)
+    merged: List[int] = dataclasses.field(default_factory=list)
 
 
-async def _execute_actions(rcx: ckit_bot_exec.RobotContext, actions: List[Dict[str, Any]], ctx: Dict[str, Any]) -> None:
-    for action in actions:
+def _conflicts(a: _PlannedAction, b: _PlannedAction) -> bool:
+    return a.table == b.table and ("*" in (a.record_id, b.record_id) or (a.record_id is not None and a.record_id == b.record_id))
+
+
+def _field_op(v: Any) -> Optional[str]:
+    if isinstance(v, dict) and len(v) == 1 and (k := next(iter(v))) in ("$append", "$remove", "$increment", "$decrement"):
+        return k
+    return None
+
+
+def _merge_fields(into: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    # Two patches of the same record become one, unless a field has incompatible operations, like $append then a plain value
+    for k, v in fields.items():
+        if k in into and _field_op(into[k]) != _field_op(v):
+            return False
+    for k, v in fields.items():
+        op = _field_op(v)
+        if k not in into or op is None:
+            into[k] = v
+        else:
+            into[k] = {op: into[k][op] + v[op]}
+    return True
+
+
+def _plan_actions(actions: List[Dict[str, Any]], ctx: Dict[str, Any]) -> Tuple[List[_PlannedAction], List[Dict[str, Any]]]:
+    """
+    Resolves templates, then orders actions by what they touch: each action waits only for earlier actions on the same
+    record (or on the same table, if one of them is a query). Consecutive patches of one record are merged.
+    """
+    plan: List[_PlannedAction] = []
+    failed = []
+    for n, action in enumerate(actions):
+        action_type = action.get("type")
         try:
-            action_type = action.get("type")
             if action_type == "post_task_into_bot_inbox":
                 comingup_ts = 0.0
                 if comingup_raw := action.get("comingup_ts"):
                     comingup_ts = float(_resolve_field_value(comingup_raw, ctx, "comingup_ts"))
-                await ckit_kanban.bot_kanban_post_into_inbox(
-                    rcx.fclient, rcx.persona.persona_id,
-                    _resolve_template(action.get("title", ""), ctx),
-                    json.dumps({k: _resolve_template(v, ctx) if isinstance(v, str) else v for k, v in action.get("details", {}).items()}),
-                    _resolve_template(action.get("provenance", "CRM automation"), ctx),
-                    action.get("fexp_name", "default"),
-                    comingup_ts=comingup_ts,
-                )
-                logger.info(f"Posted task into inbox: {action.get('title', '')} comingup_ts={comingup_ts}")
-
+                p = _PlannedAction(n, action_type, "bot_inbox", "*", {
+                    "title": _resolve_template(action.get("title", ""), ctx),
+                    "details": {k: _resolve_template(v, ctx) if isinstance(v, str) else v for k, v in action.get("details", {}).items()},
+                    "provenance": _resolve_template(action.get("provenance", "CRM automation"), ctx),
+                    "fexp_name": action.get("fexp_name", "default"),
+                    "comingup_ts": comingup_ts,
+                })
             elif action_type == "create_erp_record":
-                table = action.get("table")
-                fields = {k: _resolve_field_value(v, ctx, k) for k, v in action.get("fields", {}).items()}
-                fields["ws_id"] = rcx.persona.ws_id
-                new_id = await ckit_erp.create_erp_record(rcx.fclient, table, rcx.persona.ws_id, fields)
-                logger.info(f"Created ERP record in {table}: {new_id}")
-
-            elif action_type == "update_erp_record":
-                table = action.get("table")
-                record_id = _resolve_template(action.get("record_id", ""), ctx)
-                fields = {k: _resolve_field_value(v, ctx, k) for k, v in action.get("fields", {}).items()}
-                logger.info(f"update_erp_record: table={table} record_id={record_id} resolved_fields={fields}")
-                await ckit_erp.patch_erp_record(rcx.fclient, table, rcx.persona.ws_id, record_id, fields)
-                logger.info(f"Updated ERP record in {table}: {record_id}")
-
-            elif action_type == "delete_erp_record":
-                table = action.get("table")
-                record_id = _resolve_template(action.get("record_id", ""), ctx)
-                await ckit_erp.delete_erp_record(rcx.fclient, table, rcx.persona.ws_id, record_id)
-                logger.info(f"Deleted ERP record from {table}: {record_id}")
-
+                p = _PlannedAction(n, action_type, action.get("table"), None, {"fields": {k: _resolve_field_value(v, ctx, k) for k, v in action.get("fields", {}).items()}})
+            elif action_type in ("update_erp_record", "delete_erp_record"):
+                p = _PlannedAction(n, action_type, action.get("table"), _resolve_template(action.get("record_id", ""), ctx), {})
+                if action_type == "update_erp_record":
+                    p.args["fields"] = {k: _resolve_field_value(v, ctx, k) for k, v in action.get("fields", {}).items()}
             elif action_type == "move_deal_stage":
-                contact_id = _resolve_template(action.get("contact_id", ""), ctx)
-                pipeline_id = _resolve_template(action.get("pipeline_id", ""), ctx)
-                from_stages = action.get("from_stages", [])
-                to_stage_id = _resolve_template(action.get("to_stage_id", ""), ctx)
-                if not contact_id or not pipeline_id or not to_stage_id:
-                    logger.info(f"move_deal_stage skipped: missing contact_id/pipeline_id/to_stage_id")
-                    continue
-                deals = await ckit_erp.query_erp_table(
-                    rcx.fclient, "crm_deal", rcx.persona.ws_id, erp_schema.CrmDeal,
-                    filters={"AND": [f"deal_contact_id:=:{contact_id}", f"deal_pipeline_id:=:{pipeline_id}"]},
-                    sort_by=["deal_modified_ts:DESC"], limit=1,
-                )
-                if not deals:
-                    logger.info(f"move_deal_stage skipped: no deal for contact {contact_id} in pipeline {pipeline_id}")
-                    continue
-                deal = deals[0]
-                deal_id = deal.deal_id
-                current_stage = deal.deal_stage_id
-                if from_stages and current_stage not in from_stages:
-                    logger.info(f"move_deal_stage skipped: deal {deal_id} stage {current_stage} not in from_stages {from_stages}")
-                    continue
-                await ckit_erp.patch_erp_record(rcx.fclient, "crm_deal", rcx.persona.ws_id, deal_id, {"deal_stage_id": to_stage_id})
-                logger.info(f"Moved deal {deal_id} from stage {current_stage} to {to_stage_id}")
-
+                p = _PlannedAction(n, action_type, "crm_deal", "*", {
+                    "contact_id": _resolve_template(action.get("contact_id", ""), ctx),
+                    "pipeline_id": _resolve_template(action.get("pipeline_id", ""), ctx),
+                    "from_stages": action.get("from_stages", []),
+                    "to_stage_id": _resolve_template(action.get("to_stage_id", ""), ctx),
+                })
             else:
                 logger.warning(f"Unknown action type: {action_type}")
+                failed.append({"n": n, "type": action_type, "outcome": "unknown"})
+                continue
         except Exception as e:
-            logger.error(f"Action '{action.get('type')}' failed: {e}", exc_info=True)
+            logger.error(f"Action '{action_type}' failed: {e}", exc_info=True)
+            failed.append({"n": n, "type": action_type, "outcome": "error"})
+            continue
+
+        earlier = [i for i, q in enumerate(plan) if _conflicts(q, p)]
+        if p.action_type == "update_erp_record" and earlier:
+            last = plan[earlier[-1]]
+            if last.action_type == "update_erp_record" and last.table == p.table and last.record_id == p.record_id and _merge_fields(last.args["fields"], p.args["fields"]):
+                last.merged.append(n)
+                continue
+        p.deps = earlier
+        plan.append(p)
+    return plan, failed
+
+
+async def _run_action(rcx: ckit_bot_exec.RobotContext, p: _PlannedAction, burst: ActionBurst) -> str:
+    a = p.args
+    if p.action_type == "post_task_into_bot_inbox":
+        await ckit_kanban.bot_kanban_post_into_inbox(
+            rcx.fclient, rcx.persona.persona_id,
+            a["title"], json.dumps(a["details"]), a["provenance"], a["fexp_name"],
+            comingup_ts=a["comingup_ts"],
+        )
+        logger.info(f"Posted task into inbox: {a['title']} comingup_ts={a['comingup_ts']}")
+
+    elif p.action_type == "create_erp_record":
+        fields = dict(a["fields"], ws_id=rcx.persona.ws_id)
+        new_id = await ckit_erp.create_erp_record(rcx.fclient, p.table, rcx.persona.ws_id, fields)
+        if p.table == "crm_deal":
+            burst.forget_deals("", fields.get("deal_contact_id", ""), fields.get("deal_pipeline_id", ""))
+        logger.info(f"Created ERP record in {p.table}: {new_id}")
+
+    elif p.action_type == "update_erp_record":
+        logger.info(f"update_erp_record: table={p.table} record_id={p.record_id} resolved_fields={a['fields']}")
+        await ckit_erp.patch_erp_record(rcx.fclient, p.table, rcx.persona.ws_id, p.record_id, a["fields"])
+        if p.table == "crm_deal":
+            burst.forget_deals(p.record_id)
+        logger.info(f"Updated ERP record in {p.table}: {p.record_id}")
+
+    elif p.action_type == "delete_erp_record":
+        await ckit_erp.delete_erp_record(rcx.fclient, p.table, rcx.persona.ws_id, p.record_id)
+        if p.table == "crm_deal":
+            burst.forget_deals(p.record_id)
+        logger.info(f"Deleted ERP record from {p.table}: {p.record_id}")
+
+    elif p.action_type == "move_deal_stage":
+        contact_id, pipeline_id, from_stages, to_stage_id = a["contact_id"], a["pipeline_id"], a["from_stages"], a["to_stage_id"]
+        if not contact_id or not pipeline_id or not to_stage_id:
+            logger.info(f"move_deal_stage skipped: missing contact_id/pipeline_id/to_stage_id")
+            return "skipped"
+        key = (contact_id, pipeline_id)
+        burst.deal_lookups += 1
+        cached, found = burst.get_deal(key)
+        if cached:
+            burst.deal_lookups_cached += 1
+        else:
+            deals = await ckit_erp.query_erp_table(
+                rcx.fclient, "crm_deal", rcx.persona.ws_id, erp_schema.CrmDeal,
+                filters={"AND": [f"deal_contact_id:=:{contact_id}", f"deal_pipeline_id:=:{pipeline_id}"]},
+                sort_by=["deal_modified_ts:DESC"], limit=1,
+            )
+            found = (deals[0].deal_id, deals[0].deal_stage_id) if deals else None
+            burst.put_deal(key, found)
+        if found is None:
+            logger.info(f"move_deal_stage skipped: no deal for contact {contact_id} in pipeline {pipeline_id}")
+            return "skipped"
+        deal_id, current_stage = found
+        if from_stages and current_stage not in from_stages:
+            logger.info(f"move_deal_stage skipped: deal {deal_id} stage {current_stage} not in from_stages {from_stages}")
+            return "skipped"
+        burst.deals.pop(key, None)   # if the patch fails, the stage is unknown
+        await ckit_erp.patch_erp_record(rcx.fclient, "crm_deal", rcx.persona.ws_id, deal_id, {"deal_stage_id": to_stage_id})
+        burst.put_deal(key, (deal_id, to_stage_id))
+        logger.info(f"Moved deal {deal_id} from stage {current_stage} to {to_stage_id}")
+    return "ok"
+
+
+async def _execute_actions(
+    rcx: ckit_bot_exec.RobotContext,
+    actions: List[Dict[str, Any]],
+    ctx: Dict[str, Any],
+    burst: Optional[ActionBurst] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Independent actions run concurrently, a failed action is logged and doesn't stop the others, even the ones
+    waiting for it. Returns a report per action: type, outcome, ms, and which later actions were merged into it.
+    """
+    burst = burst or ActionBurst()
+    plan, report = _plan_actions(actions, ctx)
+    done = [asyncio.Event() for _ in plan]
+    sem = asyncio.Semaphore(CRM_ACTIONS_CONCURRENCY)
+
+    async def run(i: int, p: _PlannedAction) -> None:
+        try:
+            for d in p.deps:
+                await done[d].wait()
+            async with sem:
+                t0 = time.perf_counter()
+                try:
+                    outcome = await _run_action(rcx, p, burst)
+                except Exception as e:
+                    logger.error(f"Action '{p.action_type}' failed: {e}", exc_info=True)
+                    outcome = "error"
+                sec = time.perf_counter() - t0
+            burst.latency[p.action_type].observe(sec)
+            burst.outcomes[p.action_type][outcome] += 1
+            report.append({"n": p.n, "type": p.action_type, "outcome": outcome, "ms": round(sec * 1000, 1), "merged": p.merged})
+        finally:
+            done[i].set()
+
+    await asyncio.gather(*[run(i, p) for i, p in enumerate(plan)])
+    report.sort(key=lambda r: r["n"])
+    if report:
+        logger.info("actions: " + ", ".join(
+            f"{r['type']} {r['outcome']}" + (f" {r['ms']}ms" if "ms" in r else "") + (f" +{len(r['merged'])} merged" if r.get("merged") else "")
+            for r in report
+        ))
+    return report
 
 
 def _resolve_path(path: str, context: Dict[str, Any]) -> Any:
+    return _resolve_parts(path.strip().split("."), context)
+
+
+def _resolve_parts(parts: List[str], context: Dict[str, Any]) -> Any:
     value = context
-    for part in path.strip().split("."):
+    for part in parts:
         if not isinstance(value, dict):
             return None
         value = value.get(part)
     return value
 
 
+_TEMPLATE_RE = re.compile(r'\{\{(.+?)\}\}')
+
+
+class _Template:
+    # "Hello {{trigger.new_record.contact_first_name}}!" -> ["Hello ", ("{{...}}", ["trigger", "new_record", ...], None), "!"]
+    # with_exprs: placeholders that look like expressions, such as {{now() + 86400}}, get a compiled ckit_expr.Expr
+    __slots__ = ("parts",)
+
+    def __init__(self, template: str, with_exprs: bool = False):
+        self.parts: List[Any] = []
+        pos = 0
+        for m in _TEMPLATE_RE.finditer(template):
+            if m.start() > pos:
+                self.parts.append(template[pos:m.start()])
+            content, expr = m.group(1).strip(), None
+            if with_exprs and any(c in content for c in '+-*/()'):
+                try:
+                    expr = ckit_expr.compile_expr(content)
+                except ckit_expr.ExprError as e:
+                    logger.info(f"Template placeholder {m.group(0)!r} is not an expression, will resolve as a path: {e}")
+            self.parts.append((m.group(0), content.split("."), expr))
+            pos = m.end()
+        if pos < len(template):
+            self.parts.append(template[pos:])
+
+    def render(self, context: Dict[str, Any]) -> str:
+        out = []
+        for p in self.parts:
+            if isinstance(p, str):
+                out.append(p)
+                continue
+            if p[2] is not None:
+                try:
+                    out.append(str(p[2](context)))
+                    continue
+                except ckit_expr.ExprError as e:
+                    logger.info(f"Template expression {p[0]!r} failed: {e}")
+            value = _resolve_parts(p[1], context)
+            out.append(p[0] if value is None else str(value))
+        return "".join(out)
+
+
+@functools.lru_cache(maxsize=4096)
+def _compile_template(template: str, with_exprs: bool = False) -> _Template:
+    return _Template(template, with_exprs)
+
+
 def _resolve_template(template: str, context: Dict[str, Any]) -> str:
-    result = template
-    for match in re.findall(r'\{\{(.+?)\}\}', template):
-        if (value := _resolve_path(match, context)) is not None:
-            result = result.replace(f"{{{{{match}}}}}", str(value))
-    return result
+    if "{{" not in template:
+        return template
+    return _compile_template(template).render(context)
 
 
 def _resolve_field_value(field_value: Any, context: Dict[str, Any], field_name: str) -> Any:
@@ -559,16 +842,8 @@ def _resolve_field_value(field_value: Any, context: Dict[str, Any], field_name:
         return field_value
 
     value = field_value.strip()
-    for match in re.findall(r'\{\{(.+?)\}\}', value):
-        match_content = match.strip()
-        if any(c in match_content for c in '+-*/()'):
-            try:
-                value = value.replace(f"{{{{{match}}}}}", str(eval(match_content, {"__builtins__": {}, "now": lambda: time.time()}, {})))
-                continue
-            except Exception:
-                pass
-        if (resolved := _resolve_path(match_content, context)) is not None:
-            value = value.replace(f"{{{{{match}}}}}", str(resolved))
+    if "{{" in value:
+        value = _compile_template(value, True).render(context)
 
     if field_name.endswith('_ts'):
         try:
@@ -0,0 +1,323 @@
+import asyncio
+import collections
+import json
+import random
+import time
+import types
+
+from flexus_client_kit import ckit_bot_exec, ckit_erp, ckit_kanban
+from flexus_client_kit.integrations import fi_crm_automations
+
+
+_TABLES = ["crm_contact", "crm_deal", "crm_activity"]
+_FILTERS = [
+    [],
+    ["contact_tags:CONTAINS:vip"],
+    ["contact_bant_score:>=:2"],
+    [{"OR": ["contact_address_country:=:US", "contact_tags:NOT_CONTAINS:lead"]}],
+]
+
+
+def _automations(rnd: random.Random, n: int) -> dict:
+    autos = {}
+    for i in range(n):
+        autos["auto%03d" % i] = {
+            "enabled": rnd.random() > 0.1,
+            "triggers": [{
+                "type": "erp_table",
+                "table": rnd.choice(_TABLES),
+                "operations": rnd.sample(["insert", "UPDATE", "Delete"], rnd.randrange(1, 3)),
+                "filters": rnd.choice(_FILTERS),
+            } for _ in range(rnd.randrange(1, 3))],
+            "actions": [{"type": "post_task_into_bot_inbox", "title": "Follow up %d with {{trigger.new_record.contact_first_name}}" % i, "details": {}}],
+        }
+    return autos
+
+
+def _contact(rnd: random.Random, i: int) -> dict:
+    return {
+        "contact_id": "c%d" % i,
+        "contact_first_name": rnd.choice(["Anna", "Bob"]),
+        "contact_address_country": rnd.choice(["US", "DE", None]),
+        "contact_tags": rnd.sample(["vip", "lead", "beta"], rnd.randrange(0, 3)),
+        "contact_bant_score": rnd.randrange(0, 4),
+    }
+
+
+def _fired_linear(autos: dict, table_name: str, operation: str, rec: dict) -> list:
+    # how events were matched before indexing: every trigger of every automation, one automation fires once per record
+    fired = []
+    for auto_name, auto_config in autos.items():
+        if not auto_config.get("enabled", True):
+            continue
+        for trigger in auto_config.get("triggers", []):
+            if trigger.get("type") != "erp_table" or trigger.get("table") != table_name:
+                continue
+            if operation.upper() not in [op.upper() for op in trigger.get("operations", [])]:
+                continue
+            if trigger.get("filters") and not ckit_erp._check_record_matches_filters_interpreted(rec, trigger["filters"]):
+                continue
+            if auto_name in fired:
+                continue
+            fired.append(auto_name)
+    return fired
+
+
+def _run_event(compiled, table_name: str, operation: str, rec: dict) -> list:
+    fired = []
+
+    async def fake_execute(rcx, actions, ctx, burst=None):
+        fired.append(actions)
+
+    orig = fi_crm_automations._execute_actions
+    fi_crm_automations._execute_actions = fake_execute
+    try:
+        new, old = (None, rec) if operation.upper() == "DELETE" else (rec, None)
+        asyncio.run(fi_crm_automations.execute_automations_for_erp_event(None, table_name, operation, new, old, compiled, collections.OrderedDict(), rec["contact_id"]))
+    finally:
+        fi_crm_automations._execute_actions = orig
+    return fired
+
+
+def test_indexed_automations_fire_same_as_linear_scan():
+    rnd = random.Random(12)
+    autos = _automations(rnd, 60)
+    compiled = fi_crm_automations.CompiledAutomations(autos)
+    checked = 0
+    for i in range(300):
+        rec = _contact(rnd, i)
+        table_name, operation = rnd.choice(_TABLES), rnd.choice(["INSERT", "update", "DELETE"])
+        want = [autos[a]["actions"] for a in _fired_linear(autos, table_name, operation, rec)]
+        assert _run_event(compiled, table_name, operation, rec) == want
+        checked += len(want)
+    assert checked > 100
+
+
+def test_templates():
+    ctx = {"trigger": {"new_record": {"name": "Anna", "score": 0, "nested": {"x": 1}}, "old_record": None}}
+    for t, want in [
+        ("Hi {{trigger.new_record.name}}!", "Hi Anna!"),
+        ("{{ trigger.new_record.score }}/{{trigger.new_record.score}}", "0/0"),
+        ("{{trigger.old_record.name}} stays", "{{trigger.old_record.name}} stays"),
+        ("{{trigger.new_record.nested}}", "{'x': 1}"),
+        ("no placeholders", "no placeholders"),
+        ("{{}} {{trigger}", "{{}} {{trigger}"),
+    ]:
+        assert fi_crm_automations._resolve_template(t, ctx) == want, t
+
+
+def test_field_values():
+    ctx = {"trigger": {"new_record": {"contact_id": "c1", "contact_created_ts": 1750000000.0, "x-y": "dash"}}}
+    t0 = time.time()
+    assert t0 + 86400 <= fi_crm_automations._resolve_field_value(" {{now() + 86400}} ", ctx, "task_due_ts") <= time.time() + 86400
+    assert fi_crm_automations._resolve_field_value("{{trigger.new_record.contact_created_ts + days(1)}}", ctx, "contact_next_ts") == 1750086400.0
+    assert fi_crm_automations._resolve_field_value("id={{trigger.new_record.contact_id}} {{trigger.new_record.x-y}}", ctx, "note") == "id=c1 dash"
+    assert fi_crm_automations._resolve_field_value("{{__import__('os')}}", ctx, "note") == "{{__import__('os')}}"
+    assert fi_crm_automations._resolve_field_value({"op": "increment", "value": "2"}, ctx, "n") == {"$increment": 2.0}
+
+
+def test_setup_compiled_once_per_change():
+    setup = {"crm_automations": json.dumps(_automations(random.Random(3), 5))}
+    rcx = ckit_bot_exec.RobotContext(None, types.SimpleNamespace(persona_id="p1"), [])
+    integration = fi_crm_automations.IntegrationCrmAutomations(None, rcx, lambda: dict(setup), ["crm_contact", "crm_deal", "crm_activity"])
+    first = integration._load_compiled()
+    assert set(rcx._handler_per_erp_table_change) == set(first.tables)
+    setup["crm_automations"] = (setup["crm_automations"] + " ")[:-1]   # another string object, same text: no recompile
+    assert integration._load_compiled() is first
+    setup["crm_automations"] = json.dumps({})
+    assert integration._load_compiled() is not first and integration._load_automations() == {}
+
+
+class _FakeBackend:
+    def __init__(self, latency: float = 0.01):
+        self.latency = latency
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.deals = {("c1", "p1"): types.SimpleNamespace(deal_id="d1", deal_stage_id="new")}
+
+    async def _call(self, *what):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            self.calls.append(what)
+        finally:
+            self.in_flight -= 1
+
+    async def post(self, client, persona_id, title, details_json, provenance, fexp_name="default", comingup_ts=0.0):
+        await self._call("post", title)
+
+    async def create(self, client, table, ws_id, fields):
+        await self._call("create", table, fields)
+        return "new1"
+
+    async def patch(self, client, table, ws_id, record_id, fields):
+        if fields.get("fail"):
+            raise ValueError("backend says no")
+        await self._call("patch", table, record_id, fields)
+
+    async def delete(self, client, table, ws_id, record_id):
+        await self._call("delete", table, record_id)
+
+    async def query(self, client, table, ws_id, cls, filters=None, sort_by=None, limit=100, **kwargs):
+        await self._call("query", table)
+        contact_id, pipeline_id = [f.split(":=:")[1] for f in filters["AND"]]
+        d = self.deals.get((contact_id, pipeline_id))
+        return [d] if d else []
+
+    def install(self):
+        self.orig = (ckit_kanban.bot_kanban_post_into_inbox, ckit_erp.create_erp_record, ckit_erp.patch_erp_record, ckit_erp.delete_erp_record, ckit_erp.query_erp_table)
+        ckit_kanban.bot_kanban_post_into_inbox, ckit_erp.create_erp_record, ckit_erp.patch_erp_record, ckit_erp.delete_erp_record, ckit_erp.query_erp_table = \
+            self.post, self.create, self.patch, self.delete, self.query
+
+    def uninstall(self):
+        ckit_kanban.bot_kanban_post_into_inbox, ckit_erp.create_erp_record, ckit_erp.patch_erp_record, ckit_erp.delete_erp_record, ckit_erp.query_erp_table = self.orig
+
+
+_RCX = types.SimpleNamespace(fclient=None, persona=types.SimpleNamespace(persona_id="p1", ws_id="ws1"))
+_CTX = {"trigger": {"new_record": {"contact_id": "c1", "contact_first_name": "Anna"}, "old_record": None}}
+
+
+def _actions_for_one_contact() -> list:
+    upd = lambda fields: {"type": "update_erp_record", "table": "crm_contact", "record_id": "{{trigger.new_record.contact_id}}", "fields": fields}
+    return [
+        {"type": "post_task_into_bot_inbox", "title": "Welcome {{trigger.new_record.contact_first_name}}"},
+        upd({"contact_tags": {"op": "append", "values": ["a"]}, "contact_bant_score": {"op": "increment", "value": 1}}),
+        {"type": "create_erp_record", "table": "crm_activity", "fields": {"activity_contact_id": "{{trigger.new_record.contact_id}}"}},
+        upd({"contact_tags": {"op": "append", "values": ["b"]}, "contact_bant_score": {"op": "increment", "value": 2}, "contact_notes": "x"}),
+        {"type": "move_deal_stage", "contact_id": "{{trigger.new_record.contact_id}}", "pipeline_id": "p1", "from_stages": [], "to_stage_id": "qualified"},
+        upd({"contact_notes": "y"}),
+        {"type": "post_task_into_bot_inbox", "title": "Second"},
+    ]
+
+
+def test_actions_planned_merged_and_concurrent():
+    backend = _FakeBackend(latency=0.05)
+    backend.install()
+    try:
+        t0 = time.perf_counter()
+        report = asyncio.run(fi_crm_automations._execute_actions(_RCX, _actions_for_one_contact(), _CTX))
+        dt = time.perf_counter() - t0
+    finally:
+        backend.uninstall()
+    patches = [c for c in backend.calls if c[0] == "patch" and c[1] == "crm_contact"]
+    assert patches == [("patch", "crm_contact", "c1", {"contact_tags": {"$append": ["a", "b"]}, "contact_bant_score": {"$increment": 3.0}, "contact_notes": "y"})]
+    assert [c[1] for c in backend.calls if c[0] == "post"] == ["Welcome Anna", "Second"]   # tasks keep their order
+    assert [c[0] for c in backend.calls if c[1] == "crm_deal"] == ["query", "patch"]
+    assert backend.max_in_flight >= 3
+    assert dt < 0.05 * 4   # 7 actions, 6 calls after merging, 2 chains of 2
+    assert [(r["n"], r["type"], r["outcome"], r["merged"]) for r in report] == [
+        (0, "post_task_into_bot_inbox", "ok", []),
+        (1, "update_erp_record", "ok", [3, 5]),
+        (2, "create_erp_record", "ok", []),
+        (4, "move_deal_stage", "ok", []),
+        (6, "post_task_into_bot_inbox", "ok", []),
+    ]
+    assert all(r["ms"] >= 40 for r in report)
+
+
+def test_actions_incompatible_patches_and_failures():
+    backend = _FakeBackend(latency=0)
+    backend.install()
+    try:
+        actions = [
+            {"type": "update_erp_record", "table": "crm_contact", "record_id": "c1", "fields": {"contact_tags": {"op": "append", "values": ["a"]}}},
+            {"type": "update_erp_record", "table": "crm_contact", "record_id": "c1", "fields": {"contact_tags": ["reset"]}},
+            {"type": "update_erp_record", "table": "crm_contact", "record_id": "c2", "fields": {"fail": True}},
+            {"type": "delete_erp_record", "table": "crm_contact", "record_id": "c2"},
+            {"type": "post_task_into_bot_inbox", "title": "t", "comingup_ts": "not a number"},
+            {"type": "no_such_action"},
+        ]
+        report = asyncio.run(fi_crm_automations._execute_actions(_RCX, actions, _CTX))
+    finally:
+        backend.uninstall()
+    # $append then a plain value can't be one patch, both go out in order; delete waits for the failed patch of c2
+    assert [c for c in backend.calls if c[2] == "c1"] == [
+        ("patch", "crm_contact", "c1", {"contact_tags": {"$append": ["a"]}}),
+        ("patch", "crm_contact", "c1", {"contact_tags": ["reset"]}),
+    ]
+    assert [c for c in backend.calls if c[2] == "c2"] == [("delete", "crm_contact", "c2")]
+    assert [r["outcome"] for r in report] == ["ok", "ok", "error", "ok", "error", "unknown"]
+
+
+def test_deal_lookups_cached_for_burst():
+    backend = _FakeBackend(latency=0)
+    backend.install()
+    burst = fi_crm_automations.ActionBurst()
+    move = lambda frm, to: [{"type": "move_deal_stage", "contact_id": "c1", "pipeline_id": "p1", "from_stages": frm, "to_stage_id": to}]
+    try:
+        async def go():
+            burst.begin()
+            await fi_crm_automations._execute_actions(_RCX, move(["new"], "qualified"), _CTX, burst)
+            await fi_crm_automations._execute_actions(_RCX, move(["qualified"], "won"), _CTX, burst)
+            await fi_crm_automations._execute_actions(_RCX, move(["new"], "lost"), _CTX, burst)   # skipped, stage is "won" now
+            burst.on_erp_change("crm_deal", {"deal_id": "d1", "deal_contact_id": "c1", "deal_pipeline_id": "p1"}, None)
+            await fi_crm_automations._execute_actions(_RCX, move(["won"], "closed"), _CTX, burst)
+        asyncio.run(go())
+    finally:
+        backend.uninstall()
+    assert [c[0] for c in backend.calls] == ["query", "patch", "patch", "query"]   # the fake backend still says "new"
+    st = burst.stats()
+    assert st["deal_lookups"] == 4 and st["deal_lookups_cached"] == 2
+    assert st["actions"]["move_deal_stage"]["outcomes"] == {"ok": 2, "skipped": 2}
+
+
+def test_deal_lookups_expire_on_a_busy_workspace():
+    backend = _FakeBackend(latency=0)
+    backend.install()
+    burst = fi_crm_automations.ActionBurst()
+    move = [{"type": "move_deal_stage", "contact_id": "c1", "pipeline_id": "p1", "from_stages": ["new"], "to_stage_id": "qualified"}]
+    now = [1000.0]
+    orig_time = fi_crm_automations.time.time
+    fi_crm_automations.time.time = lambda: now[0]
+    try:
+        async def go():
+            for _ in range(10):   # an event every second for 10 seconds, never quiet for CRM_BURST_SEC
+                burst.begin()
+                await fi_crm_automations._execute_actions(_RCX, move, _CTX, burst)
+                now[0] += 1.0
+        asyncio.run(go())
+    finally:
+        fi_crm_automations.time.time = orig_time
+        backend.uninstall()
+    queries = [c for c in backend.calls if c[0] == "query"]
+    assert len(queries) == 4 and burst.stats()["deal_lookups_cached"] == 6   # looked up again every 3 seconds
+
+
+def benchmark_actions(latency: float = 0.05) -> None:
+    backend = _FakeBackend(latency=latency)
+    backend.install()
+    try:
+        t0 = time.perf_counter()
+        for a in _actions_for_one_contact():   # one by one, like before planning
+            asyncio.run(fi_crm_automations._execute_actions(_RCX, [a], _CTX))
+        t1 = time.perf_counter()
+        asyncio.run(fi_crm_automations._execute_actions(_RCX, _actions_for_one_contact(), _CTX))
+        t2 = time.perf_counter()
+    finally:
+        backend.uninstall()
+    print("7 actions, %dms per backend call: sequential %0.3fs  planned %0.3fs" % (latency * 1000, t1 - t0, t2 - t1))
+
+
+def benchmark(n_events: int = 2000) -> None:
+    rnd = random.Random(42)
+    records = [_contact(rnd, i) for i in range(n_events)]
+    for n_autos in [30, 200, 1000]:
+        autos = _automations(random.Random(n_autos), n_autos)
+        setup_str = json.dumps(autos)
+        t0 = time.perf_counter()
+        for rec in records:
+            # before: parse the setup on every event, then scan every trigger with the interpreting filter
+            _fired_linear(json.loads(setup_str), "crm_contact", "UPDATE", rec)
+        t1 = time.perf_counter()
+        compiled = fi_crm_automations.CompiledAutomations(autos)
+        for rec in records:
+            [a for a, _, flt in compiled.triggers_for("crm_contact", "UPDATE") if flt is None or flt(rec)]
+        t2 = time.perf_counter()
+        print("%4d automations: per event linear %7.1fus  indexed %6.1fus  x%0.1f" % (n_autos, (t1 - t0) / n_events * 1e6, (t2 - t1) / n_events * 1e6, (t1 - t0) / (t2 - t1)))
+
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark_actions()
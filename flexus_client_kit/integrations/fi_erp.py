@@ -1,10 +1,12 @@
+import asyncio
+import codecs
+import collections
 import csv
 import dataclasses
-import io
 import json
 import time
 import logging
-from typing import Dict, Any, Optional, List, Type, Union, get_origin, get_args
+from typing import Dict, Any, Optional, List, Type, Union, Callable, AsyncIterator, Deque, get_origin, get_args
 from pymongo.collection import Collection
 
 import gql.transport.exceptions
@@ -180,28 +182,138 @@ def _resolve_field_type(field_type: Optional[Type[Any]]) -> Optional[Type[Any]]:
     return field_type
 
 
+def _csv_converter(field_type: Optional[Type[Any]]) -> Callable[[str], Any]:
+    # Resolved once per column, not per cell
+    normalized_type = _resolve_field_type(field_type)
+    if normalized_type is bool:
+        def conv_bool(value: str) -> bool:
+            lowered = value.lower()
+            if lowered in ("true", "1", "yes", "y"):
+                return True
+            if lowered in ("false", "0", "no", "n"):
+                return False
+            raise ValueError(f"Value {value!r} is not a valid boolean")
+        return conv_bool
+    if normalized_type in (int, float):
+        return normalized_type
+    if normalized_type in (list, dict):
+        def conv_json(value: str) -> Any:
+            try:
+                return json.loads(value)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Expected JSON for {normalized_type.__name__}: {e}")
+        return conv_json
+    return lambda value: value
+
+
 def _convert_csv_value(raw_value: str, field_type: Optional[Type[Any]]) -> Any:
     value = raw_value.strip()
     if value == "":
         return None
-    normalized_type = _resolve_field_type(field_type)
-    if normalized_type is bool:
-        lowered = value.lower()
-        if lowered in ("true", "1", "yes", "y"):
-            return True
-        if lowered in ("false", "0", "no", "n"):
+    return _csv_converter(field_type)(value)
+
+
+CSV_IMPORT_BATCH_SIZE = 1000
+CSV_IMPORT_CONCURRENCY = 4          # upsert batches in flight
+CSV_IMPORT_RETRIES = 3              # attempts per batch on network errors, the backend rejecting a batch is final
+CSV_IMPORT_RETRY_SEC = 1.0          # doubles each attempt
+CSV_IMPORT_MAX_FAILED_BATCHES = 3
+CSV_IMPORT_CHECKPOINTS = "erp_import_checkpoints"
+
+
+def _csv_in_quotes(line: str, in_quotes: bool) -> bool:
+    # Same rules as the csv module with the default dialect: a quote is special only at the start of a field, "" inside
+    # quotes is an escaped quote. Returns whether the record is still inside a quoted field at the end of this line.
+    if not in_quotes and '"' not in line:
+        return False
+    pos = 0
+    while True:
+        if in_quotes:
+            j = line.find('"', pos)
+            if j < 0:
+                return True
+            if line.startswith('"', j + 1):
+                pos = j + 2
+                continue
+            in_quotes = False
+            if (pos := line.find(",", j + 1)) < 0:
+                return False
+            pos += 1
+        if line.startswith('"', pos):
+            in_quotes = True
+            pos += 1
+            continue
+        if (pos := line.find(",", pos)) < 0:
             return False
-        raise ValueError(f"Value {value!r} is not a valid boolean")
-    if normalized_type is int:
-        return int(value)
-    if normalized_type is float:
-        return float(value)
-    if normalized_type in (list, dict):
-        try:
-            return json.loads(value)
-        except json.JSONDecodeError as e:
-            raise ValueError(f"Expected JSON for {normalized_type.__name__}: {e}")
-    return value
+        pos += 1
+
+
+async def _csv_records(pieces: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    # Incremental decode, split on \n only like open(newline=""), lines of a record with quoted newlines are yielded
+    # together, so csv never runs out of input in the middle of a record
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    record: List[str] = []
+    in_quotes = False
+    async for piece in pieces:
+        parts = (tail + decoder.decode(piece)).split("\n")
+        tail = parts.pop()
+        for line in parts:
+            record.append(line + "\n")
+            if not (in_quotes := _csv_in_quotes(line, in_quotes)):
+                yield "".join(record)
+                record = []
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        record.append(tail)
+    if record:
+        yield "".join(record)
+
+
+class _LineFeed:
+    # csv reader pulls lines from here, running dry between records is fine, reading continues after more are pushed
+    def __init__(self):
+        self.lines: Deque[str] = collections.deque()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+
+def _ranges_add(ranges: List[List[int]], first: int, last: int) -> List[List[int]]:
+    merged: List[List[int]] = []
+    for a, b in sorted(ranges + [[first, last]]):
+        if merged and a <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], b)
+        else:
+            merged.append([a, b])
+    return merged
+
+
+@dataclasses.dataclass
+class CsvImportReport:
+    rows_read: int = 0
+    rows_resumed: int = 0       # skipped, already imported by a previous run according to the checkpoint
+    rows_invalid: int = 0
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    batches_sent: int = 0
+    batches_failed: int = 0
+    batches_partial: int = 0    # the backend took the batch but reported some rows in it as failed
+    retries: int = 0
+    aborted: bool = False
+    errors: List[str] = dataclasses.field(default_factory=list)
+    started_ts: float = dataclasses.field(default_factory=time.time)
+    finished_ts: float = 0.0
+
+    def rows_per_sec(self) -> float:
+        dt = (self.finished_ts or time.time()) - self.started_ts
+        return (self.rows_read - self.rows_resumed) / dt if dt > 0 else 0.0
 
 
 class IntegrationErp:
@@ -422,20 +534,25 @@ class IntegrationErp:
             return f"❌ Unknown table '{table_name}'. Run erp_table_meta for available tables."
         pk_field = erp_schema.get_pkey_field(schema_class)
 
-        if not (document := await ckit_mongo.mongo_retrieve_file(self.mongo_collection, mongo_path)):
+        if not (document := await ckit_mongo.mongo_retrieve_file(self.mongo_collection, mongo_path, load_chunks=False)):
             return f"❌ File {mongo_path!r} not found in MongoDB."
 
-        if not (file_bytes := document.get("data") or (json.dumps(document["json"]).encode("utf-8") if document.get("json") is not None else None)):
+        if not document.get("mon_chunks") and not document.get("data") and document.get("json") is None:
             return f"❌ File {mongo_path!r} is empty."
 
+        # Chunks are fetched as csv gets to them, a big file is never in memory as a whole
+        records = _csv_records(ckit_mongo.mongo_open_stream(self.mongo_collection, document))
+        feed = _LineFeed()
+        reader = csv.DictReader(feed)
         try:
-            csv_text = file_bytes.decode("utf-8-sig")
+            async for rec in records:
+                feed.lines.append(rec)
+                if reader.fieldnames is not None:
+                    break
+            if not reader.fieldnames:
+                return "❌ CSV header row is missing."
         except UnicodeDecodeError:
             return "❌ CSV must be UTF-8 encoded."
-
-        reader = csv.DictReader(io.StringIO(csv_text))
-        if not reader.fieldnames:
-            return "❌ CSV header row is missing."
         reader.fieldnames = trimmed_headers = [(name or "").strip() for name in reader.fieldnames]
 
         allowed_fields = set(schema_class.__annotations__.keys())
@@ -450,57 +567,170 @@ class IntegrationErp:
 
         field_types = schema_class.__annotations__
         required_fields = {name for name, field_info in schema_class.__dataclass_fields__.items() if field_info.default == dataclasses.MISSING and field_info.default_factory == dataclasses.MISSING and name != pk_field and name != "ws_id"}
-
-        errors: List[str] = []
-        records = []
-        for row_idx, row in enumerate(reader, start=1):
-            try:
-                record = {}
-                for column in trimmed_headers:
-                    if column and column != pk_field and (raw_value := str(row.get(column, "")).strip()):
-                        record[column] = _convert_csv_value(raw_value, field_types.get(column))
-
-                if "ws_id" in allowed_fields and not record.get("ws_id"):
-                    record["ws_id"] = self.ws_id
-
-                if upsert_key and not (key_value := str(row.get(upsert_key, "")).strip()):
-                    raise ValueError(f"Missing value for upsert_key '{upsert_key}'")
-
-                if missing := required_fields - record.keys():
-                    raise ValueError(f"Missing required fields: {', '.join(sorted(missing))}")
-
-                records.append(record)
-            except Exception as e:
-                errors.append(f"Row {row_idx}: {e}")
-
-        BATCH_SIZE = 1000
-        total_created = total_updated = 0
-        total_failed = sum(1 for e in errors if e.startswith('Row '))
-        batch_errors = 0
-
-        for i in range(0, len(records), BATCH_SIZE):
-            try:
-                result = await ckit_erp.batch_upsert_erp_records(self.client, table_name, self.ws_id, upsert_key or "", records[i:i+BATCH_SIZE])
-                total_created += result.get("created", 0)
-                total_updated += result.get("updated", 0)
-                total_failed += result.get("failed", 0)
-                errors.extend(f"Batch {i//BATCH_SIZE + 1}: {err}" for err in result.get("errors", []))
-            except Exception as e:
-                total_failed += len(records[i:i+BATCH_SIZE])
-                errors.append(f"Batch {i//BATCH_SIZE + 1} failed: {e}")
-                batch_errors += 1
-                if batch_errors > 3:
-                    errors.append("Aborting: too many batch errors")
-                    break
+        converters = [(column, _csv_converter(field_types.get(column))) for column in trimmed_headers if column and column != pk_field]
+
+        def parse_row(row: Dict[str, Any]) -> Dict[str, Any]:
+            record = {}
+            for column, conv in converters:
+                if raw_value := str(row.get(column, "")).strip():
+                    record[column] = conv(raw_value)
+            if "ws_id" in allowed_fields and not record.get("ws_id"):
+                record["ws_id"] = self.ws_id
+            if upsert_key and not str(row.get(upsert_key, "")).strip():
+                raise ValueError(f"Missing value for upsert_key '{upsert_key}'")
+            if missing := required_fields - record.keys():
+                raise ValueError(f"Missing required fields: {', '.join(sorted(missing))}")
+            return record
+
+        checkpoint_id = f"{self.ws_id}:{table_name}:{mongo_path}:{upsert_key}:{document.get('mon_mtime', 0)}"
+        async def rows() -> AsyncIterator[Dict[str, Any]]:
+            for row in reader:
+                yield row
+            async for rec in records:
+                feed.lines.append(rec)
+                for row in reader:
+                    yield row
+
+        rep = await self._csv_import_pipeline(rows(), parse_row, table_name, upsert_key, checkpoint_id)
 
         lines = [
-            f"Processed {len(records) + sum(1 for e in errors if e.startswith('Row '))} row(s) from {mongo_path}.",
-            f"Created: {total_created}, Updated: {total_updated}, Failed: {total_failed}.",
+            f"Processed {rep.rows_read - rep.rows_resumed} row(s) from {mongo_path}.",
+            f"Created: {rep.created}, Updated: {rep.updated}, Failed: {rep.failed}.",
+            f"Batches: {rep.batches_sent} sent, {rep.batches_failed} failed, {rep.retries} retried, {CSV_IMPORT_CONCURRENCY} in parallel; "
+            f"{rep.finished_ts - rep.started_ts:.1f}s, {rep.rows_per_sec():.0f} rows/s.",
         ]
-        if errors:
+        if rep.rows_resumed:
+            lines.append(f"Resumed: skipped {rep.rows_resumed} row(s) imported by a previous run.")
+        if rep.batches_partial:
+            lines.append(f"{rep.batches_partial} batch(es) had failed rows and are not marked as imported.")
+        if rep.aborted or rep.batches_failed or rep.batches_partial:
+            lines.append("Progress is saved, run the same import again to retry only what didn't make it.")
+        if rep.errors:
             lines.append("Errors:")
-            lines.extend(f"  • {err}" for err in errors[:5])
-            if len(errors) > 5:
-                lines.append(f"  …and {len(errors) - 5} more errors.")
+            lines.extend(f"  • {err}" for err in rep.errors[:5])
+            if len(rep.errors) > 5:
+                lines.append(f"  …and {len(rep.errors) - 5} more errors.")
 
         return "\n".join(lines)
+
+    async def _csv_import_pipeline(
+        self,
+        rows: AsyncIterator[Dict[str, Any]],
+        parse_row: Callable[[Dict[str, Any]], Dict[str, Any]],
+        table_name: str,
+        upsert_key: str,
+        checkpoint_id: str,
+    ) -> CsvImportReport:
+        """
+        Rows are parsed while earlier batches upload, CSV_IMPORT_CONCURRENCY batches at a time, the queue between
+        them is bounded so memory doesn't grow with file size. Each batch covers a contiguous range of CSV rows,
+        finished ranges go to a checkpoint in mongo, so a failed or interrupted import can be restarted and
+        won't send the same rows twice (matters a lot without upsert_key). A batch the backend reported failed rows
+        in stays out of the checkpoint and is sent again in full on restart, there's no way to tell which rows
+        made it. A clean finish deletes the checkpoint.
+        """
+        rep = CsvImportReport()
+        checkpoints = self.mongo_collection.database[CSV_IMPORT_CHECKPOINTS]
+        cp = await checkpoints.find_one({"_id": checkpoint_id})
+        done_ranges: List[List[int]] = cp["done_ranges"] if cp else []
+        skip_ranges = [list(r) for r in done_ranges]
+        queue: asyncio.Queue = asyncio.Queue(maxsize=CSV_IMPORT_CONCURRENCY)
+
+        async def save_checkpoint(first: int, last: int) -> None:
+            nonlocal done_ranges
+            done_ranges = _ranges_add(done_ranges, first, last)
+            await checkpoints.update_one({"_id": checkpoint_id}, {"$set": {"done_ranges": done_ranges, "cp_table": table_name, "cp_mtime": time.time()}}, upsert=True)
+
+        async def send(batch_n: int, records: List[Dict[str, Any]]) -> Dict[str, Any]:
+            for attempt in range(CSV_IMPORT_RETRIES):
+                try:
+                    return await ckit_erp.batch_upsert_erp_records(self.client, table_name, self.ws_id, upsert_key or "", records)
+                except gql.transport.exceptions.TransportQueryError:
+                    raise
+                except (gql.transport.exceptions.TransportError, OSError, asyncio.TimeoutError) as e:
+                    if attempt == CSV_IMPORT_RETRIES - 1:
+                        raise
+                    rep.retries += 1
+                    logger.info("csv import %s batch %d attempt %d failed, will retry: %s %s", table_name, batch_n, attempt + 1, type(e).__name__, e)
+                    await asyncio.sleep(CSV_IMPORT_RETRY_SEC * 2 ** attempt)
+
+        async def worker() -> None:
+            while (item := await queue.get()) is not None:
+                batch_n, first, last, records = item
+                if rep.aborted:
+                    continue
+                rep.batches_sent += 1
+                try:
+                    result = await send(batch_n, records)
+                except Exception as e:
+                    rep.failed += len(records)
+                    rep.batches_failed += 1
+                    rep.errors.append(f"Batch {batch_n} failed: {e}")
+                    if rep.batches_failed > CSV_IMPORT_MAX_FAILED_BATCHES and not rep.aborted:
+                        rep.errors.append("Aborting: too many batch errors")
+                        rep.aborted = True
+                    continue
+                rep.created += result.get("created", 0)
+                rep.updated += result.get("updated", 0)
+                rep.failed += result.get("failed", 0)
+                rep.errors.extend(f"Batch {batch_n}: {err}" for err in result.get("errors", []))
+                if result.get("failed") or result.get("errors"):
+                    rep.batches_partial += 1
+                    continue
+                try:
+                    await save_checkpoint(first, last)
+                except Exception as e:
+                    logger.warning("csv import %s checkpoint not saved: %s %s", table_name, type(e).__name__, e)
+
+        workers = [asyncio.create_task(worker()) for _ in range(CSV_IMPORT_CONCURRENCY)]
+        batch: List[Dict[str, Any]] = []
+        batch_n = 0
+        batch_first = 1
+
+        async def flush(last: int) -> None:
+            nonlocal batch, batch_n, batch_first
+            if batch:
+                batch_n += 1
+                await queue.put((batch_n, batch_first, last, batch))
+                await asyncio.sleep(0)   # let workers pick it up now, put() doesn't yield unless the queue is full
+            batch, batch_first = [], last + 1
+
+        try:
+            try:
+                async for row in rows:
+                    rep.rows_read += 1
+                    row_idx = rep.rows_read
+                    while skip_ranges and skip_ranges[0][1] < row_idx:
+                        skip_ranges.pop(0)
+                    if skip_ranges and skip_ranges[0][0] <= row_idx:
+                        rep.rows_resumed += 1
+                        await flush(row_idx - 1)
+                        batch_first = row_idx + 1
+                        continue
+                    try:
+                        batch.append(parse_row(row))
+                    except Exception as e:
+                        rep.rows_invalid += 1
+                        rep.errors.append(f"Row {row_idx}: {e}")
+                    if len(batch) >= CSV_IMPORT_BATCH_SIZE:
+                        await flush(row_idx)
+                    if rep.aborted:
+                        break
+                else:
+                    await flush(rep.rows_read)
+            except (UnicodeDecodeError, csv.Error) as e:
+                rep.aborted = True
+                rep.errors.append(f"Can't read CSV after row {rep.rows_read}: {e}")
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for w in workers:
+                w.cancel()
+        rep.failed += rep.rows_invalid
+        rep.finished_ts = time.time()
+        if not rep.aborted and not rep.batches_failed and not rep.batches_partial:
+            await checkpoints.delete_one({"_id": checkpoint_id})
+        logger.info("csv import %s: %d rows %d resumed %d created %d updated %d failed, %d batches %d retries %.1fs", table_name,
+            rep.rows_read, rep.rows_resumed, rep.created, rep.updated, rep.failed, rep.batches_sent, rep.retries, rep.finished_ts - rep.started_ts)
+        return rep
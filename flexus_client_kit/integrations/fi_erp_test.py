@@ -0,0 +1,213 @@
+import asyncio
+import time
+import tracemalloc
+from typing import Any, Dict, List, Optional
+
+import gql.transport.exceptions
+
+from flexus_client_kit import ckit_erp
+from flexus_client_kit.integrations import fi_erp
+
+
+class _FakeCollection:
+    def __init__(self, database: "_FakeDatabase", name: str):
+        self.database = database
+        self.name = name
+        self.docs: List[Dict[str, Any]] = []
+
+    def _match(self, doc: dict, flt: dict) -> bool:
+        return all(doc.get(k) == v for k, v in flt.items())
+
+    async def find_one(self, flt: dict, projection: Optional[dict] = None) -> Optional[dict]:
+        return next((dict(d) for d in self.docs if self._match(d, flt)), None)
+
+    async def update_one(self, flt: dict, update: dict, upsert: bool = False) -> None:
+        doc = next((d for d in self.docs if self._match(d, flt)), None)
+        if doc is None:
+            if not upsert:
+                return
+            doc = dict(flt)
+            self.docs.append(doc)
+        doc.update(update.get("$set", {}))
+
+    async def find(self, flt: dict):
+        for d in self.docs:
+            if d["_id"] in flt["_id"]["$in"]:
+                yield dict(d)
+
+    async def delete_one(self, flt: dict) -> None:
+        self.docs = [d for d in self.docs if not self._match(d, flt)]
+
+
+class _FakeDatabase:
+    def __init__(self):
+        self.collections: Dict[str, _FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> _FakeCollection:
+        return self.collections.setdefault(name, _FakeCollection(self, name))
+
+
+class _FakeBackend:
+    def __init__(self, latency: float = 0.01, keep_rows: bool = True):
+        self.latency = latency
+        self.keep_rows = keep_rows
+        self.rows: List[dict] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.fail = lambda records: None   # raise from here to simulate problems, or return how many rows the backend rejects
+
+    async def batch_upsert(self, client, table_name: str, ws_id: str, upsert_key: str, records: List[Any]) -> dict:
+        self.calls += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+            failed = self.fail(records) or 0
+            if self.keep_rows:
+                self.rows.extend(records)
+            return {"created": len(records) - failed, "updated": 0, "failed": failed, "errors": ["%d row(s) rejected" % failed] if failed else []}
+        finally:
+            self.in_flight -= 1
+
+
+def _csv(n: int, bad_every: int = 0) -> bytes:
+    lines = ["contact_first_name,contact_last_name,contact_email,contact_bant_score,contact_tags,contact_notes"]
+    for i in range(1, n + 1):
+        score = "not-a-number" if bad_every and i % bad_every == 0 else str(i % 5)
+        lines.append('Name%d,Last,user%d@example.com,%s,"[""t%d""]","line one\nline, two"' % (i, i, score, i % 3))
+    return ("﻿" + "\r\n".join(lines) + "\r\n").encode("utf-8")
+
+
+def _setup(csv_bytes: bytes, backend: _FakeBackend):
+    db = _FakeDatabase()
+    files = db["personal_mongo"]
+    files.docs.append({"_id": "f1", "path": "import/contacts.csv", "data": csv_bytes, "mon_mtime": 1760000000.0})
+    integration = fi_erp.IntegrationErp(None, "ws1", files)
+    ckit_erp.batch_upsert_erp_records = backend.batch_upsert
+    return integration, db
+
+
+def _import(integration, upsert_key: str = "") -> str:
+    return asyncio.run(integration.handle_csv_import(None, {"table_name": "crm_contact", "mongo_path": "import/contacts.csv", "upsert_key": upsert_key}))
+
+
+def test_csv_import_streams_batches_concurrently():
+    orig = ckit_erp.batch_upsert_erp_records
+    try:
+        backend = _FakeBackend()
+        integration, db = _setup(_csv(2500, bad_every=1000), backend)
+        text = _import(integration, upsert_key="contact_email")
+        assert "Processed 2500 row(s)" in text
+        assert "Created: 2498, Updated: 0, Failed: 2." in text
+        assert "Row 1000: invalid literal" in text
+        assert backend.calls == 3 and backend.max_in_flight > 1
+        r = backend.rows[0]
+        assert r == {"contact_first_name": "Name1", "contact_last_name": "Last", "contact_email": "user1@example.com", "contact_bant_score": 1, "contact_tags": ["t1"], "contact_notes": "line one\nline, two", "ws_id": "ws1"}
+        assert db[fi_erp.CSV_IMPORT_CHECKPOINTS].docs == []
+    finally:
+        ckit_erp.batch_upsert_erp_records = orig
+
+
+def test_csv_import_resumes_from_checkpoint():
+    orig = ckit_erp.batch_upsert_erp_records
+    orig_retry_sec = fi_erp.CSV_IMPORT_RETRY_SEC
+    try:
+        fi_erp.CSV_IMPORT_RETRY_SEC = 0
+        backend = _FakeBackend()
+        flaky = {"n": 0}
+
+        def fail(records):
+            emails = {r["contact_email"] for r in records}
+            if "user1500@example.com" in emails:
+                raise gql.transport.exceptions.TransportQueryError("backend says no")
+            if "user3500@example.com" in emails and flaky["n"] < 2:
+                flaky["n"] += 1
+                raise OSError("connection reset")
+        backend.fail = fail
+        integration, db = _setup(_csv(4200), backend)
+        text = _import(integration)
+        assert "Created: 3200, Updated: 0, Failed: 1000." in text
+        assert "1 failed, 2 retried" in text
+        assert "run the same import again" in text
+        cp = db[fi_erp.CSV_IMPORT_CHECKPOINTS].docs
+        assert len(cp) == 1 and cp[0]["done_ranges"] == [[1, 1000], [2001, 4200]]
+
+        backend.fail = lambda records: None
+        text = _import(integration)
+        assert "Created: 1000, Updated: 0, Failed: 0." in text
+        assert "skipped 3200 row(s)" in text
+        assert db[fi_erp.CSV_IMPORT_CHECKPOINTS].docs == []
+        emails = [r["contact_email"] for r in backend.rows]
+        assert len(emails) == len(set(emails)) == 4200   # without upsert_key, nothing was sent twice
+    finally:
+        ckit_erp.batch_upsert_erp_records = orig
+        fi_erp.CSV_IMPORT_RETRY_SEC = orig_retry_sec
+
+
+def test_csv_import_reads_chunked_file():
+    orig = ckit_erp.batch_upsert_erp_records
+    try:
+        csv_bytes = _csv(1500).replace(b"Name7,", 'Zo"\u00eb7,'.encode("utf-8"))   # stray quote, multibyte char
+        plain = _FakeBackend(latency=0)
+        integration, _ = _setup(csv_bytes, plain)
+        _import(integration)
+
+        backend = _FakeBackend(latency=0)
+        integration, db = _setup(csv_bytes, backend)
+        chunks = [csv_bytes[i:i + 97] for i in range(0, len(csv_bytes), 97)]
+        db["personal_mongo"].docs[0] = {"_id": "f1", "path": "import/contacts.csv", "mon_chunks": [{"h": "h%d" % i} for i in range(len(chunks))], "mon_mtime": 1760000000.0}
+        db["personal_mongo_chunks"].docs = [{"_id": "h%d" % i, "data": c} for i, c in enumerate(chunks)]
+        text = _import(integration)
+        assert "Processed 1500 row(s)" in text and "Failed: 0." in text
+        assert backend.rows == plain.rows and len(backend.rows) == 1500
+        assert backend.rows[6]["contact_first_name"] == 'Zo"\u00eb7' and backend.rows[6]["contact_notes"] == "line one\nline, two"
+    finally:
+        ckit_erp.batch_upsert_erp_records = orig
+
+
+def test_csv_import_retries_batches_with_failed_rows():
+    orig = ckit_erp.batch_upsert_erp_records
+    try:
+        backend = _FakeBackend(latency=0)
+        backend.fail = lambda records: 1 if any(r["contact_email"] == "user1500@example.com" for r in records) else 0
+        integration, db = _setup(_csv(2500), backend)
+        text = _import(integration)
+        assert "Created: 2499, Updated: 0, Failed: 1." in text
+        assert "Batch 2: 1 row(s) rejected" in text and "run the same import again" in text
+        cp = db[fi_erp.CSV_IMPORT_CHECKPOINTS].docs
+        assert len(cp) == 1 and cp[0]["done_ranges"] == [[1, 1000], [2001, 2500]]
+
+        backend.fail = lambda records: 0
+        text = _import(integration)
+        assert "Created: 1000, Updated: 0, Failed: 0." in text and "skipped 1500 row(s)" in text
+        assert db[fi_erp.CSV_IMPORT_CHECKPOINTS].docs == []
+    finally:
+        ckit_erp.batch_upsert_erp_records = orig
+
+
+def benchmark(n_rows: int = 200000, latency: float = 0.05) -> None:
+    orig = ckit_erp.batch_upsert_erp_records
+    orig_concurrency = fi_erp.CSV_IMPORT_CONCURRENCY
+    csv_bytes = _csv(n_rows)
+    try:
+        for concurrency in [1, 2, 4, 8]:
+            fi_erp.CSV_IMPORT_CONCURRENCY = concurrency
+            integration, _ = _setup(csv_bytes, _FakeBackend(latency=latency, keep_rows=False))
+            t0 = time.perf_counter()
+            _import(integration)
+            print("%dk rows (%0.1fMB csv), %dms per batch, concurrency %d: %6.2fs" % (n_rows // 1000, len(csv_bytes) / 1e6, latency * 1000, concurrency, time.perf_counter() - t0))
+        for n in [n_rows // 10, n_rows]:
+            integration, _ = _setup(_csv(n), _FakeBackend(latency=0, keep_rows=False))
+            tracemalloc.start()
+            _import(integration)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print("%dk rows: peak python memory during import %0.1fMB" % (n // 1000, peak / 1e6))
+    finally:
+        ckit_erp.batch_upsert_erp_records = orig
+        fi_erp.CSV_IMPORT_CONCURRENCY = orig_concurrency
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,10 +1,19 @@
+import asyncio
+import concurrent.futures
+import difflib
+import fnmatch
+import json
 import os
 import logging
 import re
 import glob
+import stat
+import tempfile
+import threading
+import time
 from typing import Dict, Any, Optional, List, Tuple, NamedTuple
 
-from flexus_client_kit import ckit_cloudtool
+from flexus_client_kit import ckit_cloudtool, ckit_trigram
 from flexus_client_kit.format_utils import format_text_output, grep_output, DEFAULT_SAFETY_VALVE
 
 logger = logging.getLogger("localfile")
@@ -16,6 +25,67 @@ FORBIDDEN_PATTERNS = ['.env.', 'secret', 'password', 'key', 'token', 'credential
 MAX_FILE_SIZE = 1024 * 1024
 MAX_SEARCH_SIZE = 10 * 1024 * 1024
 MAX_FIND_RESULTS = 100
+MAX_REPLACE_SIZE = 64 * 1024 * 1024   # replace streams, it doesn't need the whole file in memory
+MAX_DIFF_LINES = 200
+REPLACE_CHUNK = 256 * 1024
+LOCALFILE_WORKERS = 4
+LOCALFILE_TIME_BUDGET = {"cat": 10.0, "replace": 10.0, "find": 20.0, "grep": 30.0, "ls": 10.0}
+LOCALFILE_BUDGET_GRACE = 5.0   # a thread that ignores its deadline, don't wait for it longer than that
+
+
+class _FsCall:
+    # One tool call running in the thread pool: stat results cached for its duration, the deadline loops check
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.deadline = time.monotonic() + budget
+        self.timed_out = False
+        self.stats: Dict[str, Optional[os.stat_result]] = {}
+        self.lock = threading.Lock()
+        self.abandoned = False   # the caller stopped waiting and told the model it failed
+        self.committed = False
+
+    def stat(self, path: str) -> Optional[os.stat_result]:
+        if path not in self.stats:
+            try:
+                self.stats[path] = os.stat(path)
+            except OSError:
+                self.stats[path] = None
+        return self.stats[path]
+
+    def exists(self, path: str) -> bool:
+        return self.stat(path) is not None
+
+    def isfile(self, path: str) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def isdir(self, path: str) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def out_of_time(self) -> bool:
+        if not self.timed_out and time.monotonic() > self.deadline:
+            self.timed_out = True
+        return self.timed_out
+
+    def commit(self, fn) -> bool:
+        # Runs fn (the step that changes something for real) if there's still time and the caller is still waiting,
+        # commit() and abandon() can't cross: either the change is made and reported, or neither
+        with self.lock:
+            if self.abandoned or self.out_of_time():
+                return False
+            fn()
+            self.committed = True
+            return True
+
+    def abandon(self) -> bool:
+        # The caller gives up waiting, returns False if it's too late for that because the change is already made
+        with self.lock:
+            self.abandoned = not self.committed
+            return self.abandoned
+
+
+_fs_pool: Optional[concurrent.futures.ThreadPoolExecutor] = None
 
 
 def _validate_file_security(filepath: str) -> Optional[str]:
@@ -28,45 +98,66 @@ def _validate_file_security(filepath: str) -> Optional[str]:
     return None
 
 
-def _is_binary_file(filepath: str) -> bool:
+def _read_file(filepath: str) -> Tuple[bytes, bool]:
+    # Contents and whether it looks binary (zero byte in the first 1k), one open
     with open(filepath, 'rb') as f:
-        chunk = f.read(1024)
-        return b'\x00' in chunk
+        data = f.read()
+    return data, b'\x00' in data[:1024]
 
 
-def _validate_file_for_reading(workdir: str, path: str) -> Tuple[Optional[str], Optional[str]]:
+def _check_file(workdir: str, path: str, fs: _FsCall, max_size: int) -> Tuple[Optional[str], Optional[str]]:
+    # Returns (realpath, error)
     path_error = validate_path(path)
     if path_error:
         return None, path_error
 
     realpath = os.path.join(workdir, path)
-    if not os.path.exists(realpath):
+    if not fs.exists(realpath):
         return None, f"File {path} does not exist"
 
     security_error = _validate_file_security(realpath)
     if security_error:
         return None, security_error
 
-    file_size = os.path.getsize(realpath)
-    if file_size > MAX_FILE_SIZE:
-        return None, f"File {path} is too large ({file_size} bytes). Maximum allowed size is {MAX_FILE_SIZE} bytes"
+    file_size = fs.stat(realpath).st_size
+    if file_size > max_size:
+        return None, f"File {path} is too large ({file_size} bytes). Maximum allowed size is {max_size} bytes"
+    return realpath, None
 
-    if _is_binary_file(realpath):
-        return None, f"File {path} appears to be binary and cannot be read as text"
 
-    return realpath, None
+def _validate_file_for_reading(workdir: str, path: str, fs: _FsCall) -> Tuple[Optional[str], Optional[bytes], Optional[str]]:
+    # Returns (realpath, contents, error)
+    realpath, error = _check_file(workdir, path, fs, MAX_FILE_SIZE)
+    if error:
+        return None, None, error
+
+    data, binary = _read_file(realpath)
+    if binary:
+        return None, None, f"File {path} appears to be binary and cannot be read as text"
 
+    return realpath, data, None
 
-def _glob_files(realpath: str, include: str, recursive: bool) -> List[str]:
-    if os.path.isfile(realpath):
+
+def _glob_files(realpath: str, include: str, recursive: bool, fs: Optional[_FsCall] = None) -> List[str]:
+    fs = fs or _FsCall(LOCALFILE_TIME_BUDGET["find"])
+    if fs.isfile(realpath):
         return [realpath]
 
     if recursive:
-        search_pattern = os.path.join(realpath, "**", include)
-        return [f for f in glob.glob(search_pattern, recursive=True) if os.path.isfile(f)]
+        it = glob.iglob(os.path.join(realpath, "**", include), recursive=True)
     else:
-        search_pattern = os.path.join(realpath, include)
-        return [f for f in glob.glob(search_pattern) if os.path.isfile(f)]
+        it = glob.iglob(os.path.join(realpath, include))
+    files = []
+    for i, f in enumerate(it):
+        if i % 1000 == 999 and fs.out_of_time():
+            break
+        if fs.isfile(f):
+            files.append(f)
+    return files
+
+
+def _out_of_time_note(fs: _FsCall) -> str:
+    return f"\n\nThe {fs.budget:.0f}s time budget ran out, results are incomplete. Try a narrower path or pattern." if fs.timed_out else ""
 
 
 def _parse_bool(value: Any, default: bool) -> bool:
@@ -109,6 +200,7 @@ cat     - Read file contents
 
 replace - Replace text in file, shows git-style diff
           args: path (required), find (required), replace, count (-1=all, N=limit)
+          or several at once: path, edits (list of {"find", "replace", "count"}), all searched in the original text
 
 find    - Find files by glob pattern
           args: path (default "."), pattern (required, e.g. "*.py", "test_*", "**/*.js")
@@ -126,6 +218,7 @@ HELP_EXAMPLES = r"""
 Examples:
   localfile(op="cat", args={"path": "folder1/something_20250803.json", "lines_range": "1:20", "safety_valve": "10k"})
   localfile(op="replace", args={"path": "config.yaml", "find": "old", "replace": "new", "count": -1})
+  localfile(op="replace", args={"path": "app.py", "edits": [{"find": "foo(", "replace": "bar("}, {"find": "DEBUG = True", "replace": "DEBUG = False", "count": 1}]})
   localfile(op="find", args={"pattern": "*.py"})
   localfile(op="grep", args={"pattern": "TODO", "context_lines": 2, "include": "*.py"})
   localfile(op="ls", args={"path": "src"})
@@ -153,7 +246,7 @@ async def handle_localfile(
 
     valid_args = {
         "cat": {"path", "lines_range", "safety_valve"},
-        "replace": {"path", "find", "replace", "count"},
+        "replace": {"path", "find", "replace", "count", "edits"},
         "find": {"path", "pattern"},
         "grep": {"path", "pattern", "recursive", "include", "context_lines"},
         "ls": {"path"},
@@ -163,40 +256,48 @@ async def handle_localfile(
         if bad:
             return f"Error: unknown args {bad} for op={op}. Valid: {sorted(valid_args[op])}"
 
+    handlers = {"cat": handle_cat, "replace": handle_replace, "find": handle_find, "grep": handle_grep, "ls": handle_ls}
+    if op not in handlers:
+        return "Error: need a valid `op` parameter.\n" + HELP
+
+    # Disk work happens in a small thread pool, a big grep in one bot doesn't stall the event loop for everybody else
+    global _fs_pool
+    if _fs_pool is None:
+        _fs_pool = concurrent.futures.ThreadPoolExecutor(LOCALFILE_WORKERS, thread_name_prefix="localfile")
+    fs = _FsCall(LOCALFILE_TIME_BUDGET[op])
     try:
-        if op == "cat":
-            return handle_cat(workdir, path, args, model_produced_args)
-        elif op == "replace":
-            return handle_replace(workdir, path, args, model_produced_args)
-        elif op == "find":
-            return handle_find(workdir, path, args, model_produced_args)
-        elif op == "grep":
-            return handle_grep(workdir, path, args, model_produced_args)
-        elif op == "ls":
-            return handle_ls(workdir, path)
-        else:
-            return "Error: need a valid `op` parameter.\n" + HELP
+        fut = asyncio.get_running_loop().run_in_executor(_fs_pool, handlers[op], workdir, path, args, model_produced_args, fs)
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), fs.budget + LOCALFILE_BUDGET_GRACE)
+        except asyncio.TimeoutError:
+            if fs.abandon():
+                raise
+            return await fut   # a replace that already got to os.replace(), it's done, report what it did
+    except asyncio.TimeoutError:
+        logger.warning(f"Operation {op} in {workdir} did not finish in {fs.budget + LOCALFILE_BUDGET_GRACE:.0f}s")
+        return f"Error: {op} took too long. Try a narrower path or pattern."
     except Exception as e:
         logger.error(f"Operation {op} failed: {e}", exc_info=True)
         return f"Error: {e}"
 
 
-def handle_cat(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any]) -> str:
+def handle_cat(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any], fs: Optional[_FsCall] = None) -> str:
+    fs = fs or _FsCall(LOCALFILE_TIME_BUDGET["cat"])
     if not path:
         return "Error: path parameter required for cat operation"
 
-    realpath, error = _validate_file_for_reading(workdir, path)
+    realpath, data, error = _validate_file_for_reading(workdir, path, fs)
     if error:
         return f"Error: {error}"
 
-    with open(realpath, 'rb') as f:
-        content = f.read().decode('utf-8', errors='replace')
+    content = data.decode('utf-8', errors='replace')
     lines_range = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "lines_range", "0:")
     safety_valve = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "safety_valve", DEFAULT_SAFETY_VALVE)
     return format_text_output(path, content, lines_range, str(safety_valve))
 
 
-def handle_find(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any]) -> str:
+def handle_find(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any], fs: Optional[_FsCall] = None) -> str:
+    fs = fs or _FsCall(LOCALFILE_TIME_BUDGET["find"])
     path = path or "."
 
     path_error = validate_path(path, allow_empty=True)
@@ -204,29 +305,30 @@ def handle_find(workdir: str, path: str, args: Dict[str, Any], model_produced_ar
         return f"Error: {path_error}"
 
     realpath = os.path.join(workdir, path)
-    if not os.path.exists(realpath):
+    if not fs.exists(realpath):
         return f"Error: Path {path} does not exist"
 
     pattern = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "pattern", "")
     if not pattern:
         return "Error: pattern parameter required for find operation"
 
-    found_files = [os.path.relpath(f, workdir) for f in _glob_files(realpath, pattern, recursive=True)]
+    found_files = [os.path.relpath(f, workdir) for f in _glob_files(realpath, pattern, recursive=True, fs=fs)]
     if len(found_files) > MAX_FIND_RESULTS:
-        return f"Found {len(found_files)} files matching '{pattern}', showing first {MAX_FIND_RESULTS}:\n" + "\n".join(found_files[:MAX_FIND_RESULTS])
-    return "\n".join(found_files) if found_files else f"No files found matching '{pattern}'"
+        return f"Found {len(found_files)} files matching '{pattern}', showing first {MAX_FIND_RESULTS}:\n" + "\n".join(found_files[:MAX_FIND_RESULTS]) + _out_of_time_note(fs)
+    return ("\n".join(found_files) if found_files else f"No files found matching '{pattern}'") + _out_of_time_note(fs)
 
 
-def handle_grep(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any]) -> str:
+def handle_grep(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any], fs: Optional[_FsCall] = None) -> str:
+    fs = fs or _FsCall(LOCALFILE_TIME_BUDGET["grep"])
     if not path:
         path = "."
     path_error = validate_path(path, allow_empty=True)
     if path_error:
         return f"Error: {path_error}"
     realpath = os.path.join(workdir, path)
-    if not os.path.exists(realpath):
+    if not fs.exists(realpath):
         return f"Error: Path {path} does not exist"
-    if os.path.getsize(realpath) > MAX_SEARCH_SIZE:
+    if fs.stat(realpath).st_size > MAX_SEARCH_SIZE:
         return f"Error: File too large"
     pattern = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "pattern", "")
     if not pattern:
@@ -241,84 +343,263 @@ def handle_grep(workdir: str, path: str, args: Dict[str, Any], model_produced_ar
     )
     include = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "include", "*")
     context = int(ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "context_lines", "0"))
-    files_to_search = _glob_files(realpath, include, recursive)
-    if not files_to_search:
-        return f"No files found in {path}"
+    files_to_search, total = _grep_candidates(workdir, realpath, include, recursive, pattern, fs)
+    if not total:
+        return f"No files found in {path}" + _out_of_time_note(fs)
 
     results = []
     files_with_matches = 0
     for filepath in files_to_search:
+        if fs.out_of_time():
+            break
         rel_filepath = os.path.relpath(filepath, workdir)
-        if _is_binary_file(filepath):
-            with open(filepath, 'rb') as f:
-                if pattern.search(f.read().decode('latin-1', errors='ignore')):
-                    files_with_matches += 1
-                    results.append(f"Binary file {rel_filepath} matches")
-        else:
-            with open(filepath, "r", encoding="utf-8", errors="replace") as f:
-                content = f.read()
-            if result := grep_output(rel_filepath, content, pattern, context):
+        try:
+            data, binary = _read_file(filepath)
+        except FileNotFoundError:   # deleted since it was indexed
+            continue
+        if binary:
+            if pattern.search(data.decode('latin-1', errors='ignore')):
                 files_with_matches += 1
-                results.append(result)
+                results.append(f"Binary file {rel_filepath} matches")
+        elif result := grep_output(rel_filepath, data.decode("utf-8", errors="replace"), pattern, context):
+            files_with_matches += 1
+            results.append(result)
     if not results:
-        return f"No matches found for pattern in {len(files_to_search)} files"
-
-    summary = f"Found pattern in {files_with_matches}/{len(files_to_search)} files:"
-    return summary + "\n" + "\n".join(results)
+        return f"No matches found for pattern in {total} files" + _out_of_time_note(fs)
+
+    summary = f"Found pattern in {files_with_matches}/{total} files:"
+    return summary + "\n" + "\n".join(results) + _out_of_time_note(fs)
+
+
+def _grep_candidates(workdir: str, realpath: str, include: str, recursive: bool, pattern: re.Pattern, fs: _FsCall) -> Tuple[List[str], int]:
+    # Directories go through the trigram index of the workdir: files that can't have a matching line are never opened.
+    # Returns (files to run the regex on, how many files the search covers)
+    if fs.isfile(realpath) or "/" in include or include.startswith("."):
+        files = _glob_files(realpath, include, recursive, fs)
+        return files, len(files)
+    idx = ckit_trigram.index_for(workdir)
+    scope = os.path.relpath(os.path.realpath(realpath), idx.root)
+    if scope == ".." or scope.startswith("../"):
+        files = _glob_files(realpath, include, recursive, fs)
+        return files, len(files)
+    scope = "" if scope == "." else scope + "/"
+    match_name = None if include == "*" else re.compile(fnmatch.translate(include)).match
+
+    def wanted(rel: str) -> bool:
+        if not rel.startswith(scope):
+            return False
+        name = rel[len(scope):]
+        if "/" in name:
+            if not recursive:
+                return False
+            name = name.rsplit("/", 1)[1]
+        return match_name is None or match_name(name) is not None
+
+    # Only the part of the tree being searched is rescanned. The index gets half the budget, if it's not up to date by
+    # then (first search in a huge tree, another search holding it) this one goes through the files without it.
+    if not idx.refresh(scope=scope, deadline=fs.deadline - fs.budget / 2):
+        files = _glob_files(realpath, include, recursive, fs)
+        return files, len(files)
+    total = sum(1 for rel in idx.all_files() if wanted(rel)) if scope or match_name or not recursive else len(idx.files)
+    return [os.path.join(workdir, rel) for rel in idx.search(pattern) if wanted(rel)], total
+
+
+def _parse_edits(args: Dict[str, Any], model_produced_args: Dict[str, Any]) -> Tuple[List[Tuple[str, str, int]], Optional[str]]:
+    # Either find/replace/count or edits=[{"find", "replace", "count"}, ...], returns [(find, replace, count)]
+    edits = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "edits", None)
+    if edits is None:
+        edits = [{
+            "find": ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "find", ""),
+            "replace": ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "replace", ""),
+            "count": ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "count", "-1"),
+        }]
+    elif isinstance(edits, str):
+        try:
+            edits = json.loads(edits)
+        except json.JSONDecodeError:
+            return [], "Error: edits must be a list of {\"find\": ..., \"replace\": ..., \"count\": ...}"
+    if not isinstance(edits, list) or not all(isinstance(e, dict) for e in edits) or not edits:
+        return [], "Error: edits must be a list of {\"find\": ..., \"replace\": ..., \"count\": ...}"
+    result = []
+    for e in edits:
+        if not e.get("find"):
+            return [], "Error: find parameter required for replace operation"
+        count = e.get("count")
+        result.append((str(e["find"]), str(e.get("replace") or ""), -1 if count is None else int(count)))
+    return result, None
+
+
+def _stream_replace(src, out, edits: List[Tuple[str, str, int]], fs: _FsCall) -> Tuple[List[int], List[Tuple[int, int, int, int]]]:
+    # One pass over the text, all edits at once: at each position the longest find wins, replaced text is not
+    # searched again. A newline in find matches \n and \r\n, a file with \r\n line endings gets them in the replacement
+    # too. Returns (replacements per edit, changes as (old first line, old last line, new first, new last))
+    counts = [0] * len(edits)
+    changes = []
+    active = [i for i, e in enumerate(edits) if e[2] != 0]
+    finds = [e[0].replace("\r\n", "\n") for e in edits]
+    replaces = [e[1] for e in edits]
+    old_line = new_line = 0
+
+    def compile_active():
+        if not active:
+            return None, 0
+        order = sorted(active, key=lambda i: -len(finds[i]))
+        rx = re.compile("|".join("(?P<e%d>%s)" % (i, re.escape(finds[i]).replace("\\\n", "\\r?\\n")) for i in order))
+        return rx, max(len(finds[i]) + finds[i].count("\n") for i in order)
+
+    rx, maxlen = compile_active()
+    buf, eof, first, crlf = "", False, True, None
+    while not eof:
+        chunk = src.read(REPLACE_CHUNK)
+        if first and "\x00" in chunk[:1024]:
+            raise ValueError("appears to be binary and cannot be edited as text")
+        if fs.out_of_time():
+            raise TimeoutError(f"the {fs.budget:.0f}s time budget ran out, file not changed")
+        first, eof = False, not chunk
+        buf += chunk
+        if crlf is None:   # line endings of the file are those of its first line
+            if (nl := buf.find("\n")) != -1:
+                crlf = buf[nl - 1:nl] == "\r"
+            elif eof or len(buf) >= 4 * 256 * 1024:   # no line break in the first megabyte, not a text file with lines
+                crlf = False
+            else:
+                continue
+            if crlf:
+                replaces = [re.sub(r"(?<!\r)\n", "\r\n", r) for r in replaces]
+        pos = 0
+        while rx is not None:
+            limit = len(buf) if eof else len(buf) - maxlen + 1   # a match starting further might continue in the next chunk
+            m = rx.search(buf, pos)
+            if m is None or m.start() >= limit:
+                break
+            same = buf[pos:m.start()]
+            out.write(same)
+            old_line += same.count("\n")
+            new_line += same.count("\n")
+            i = int(m.lastgroup[1:])
+            replace, count = replaces[i], edits[i][2]
+            out.write(replace)
+            old_n, new_n = m.group().count("\n"), replace.count("\n")
+            changes.append((old_line, old_line + old_n, new_line, new_line + new_n))
+            old_line += old_n
+            new_line += new_n
+            counts[i] += 1
+            pos = m.end()
+            if count != -1 and counts[i] >= count:
+                active.remove(i)
+                rx, maxlen = compile_active()
+        keep = len(buf) if rx is None or eof else max(pos, len(buf) - maxlen + 1)
+        same = buf[pos:keep]
+        out.write(same)
+        old_line += same.count("\n")
+        new_line += same.count("\n")
+        buf = buf[keep:]
+    return counts, changes
+
+
+def _read_lines(filepath: str, ranges: List[Tuple[int, int]]) -> List[List[str]]:
+    # Lines first..last (inclusive, sorted, not overlapping) from a file of any size. Split on \n only, like the line
+    # numbers from _stream_replace() count them, a lone \r stays inside its line.
+    result = [[] for _ in ranges]
+    r = 0
+    with open(filepath, "rb") as f:
+        for n, line in enumerate(f):
+            while r < len(ranges) and n > ranges[r][1]:
+                r += 1
+            if r == len(ranges):
+                break
+            if n >= ranges[r][0]:
+                result[r].append(line.decode("utf-8", errors="replace").rstrip("\r\n"))
+    return result
+
+
+def _diff_range(start: int, length: int) -> str:
+    # Same as diff -u and difflib: "3" for one line, "2,0" for none after line 2
+    if length == 1:
+        return str(start + 1)
+    return f"{start + 1 if length else start},{length}"
+
+
+def _unified_diff(old_path: str, new_path: str, path: str, changes: List[Tuple[int, int, int, int]], context: int = 3) -> List[str]:
+    # Hunks come from where the replacements went, only those lines are read back from both files, so a big file
+    # doesn't end up in memory. Inside a hunk difflib lines up what stayed the same. Replacements past
+    # MAX_DIFF_LINES are counted but not shown.
+    shown, size = 0, 0
+    for o0, o1, n0, n1 in changes:
+        size += (o1 - o0 + 1) + (n1 - n0 + 1)
+        if size > MAX_DIFF_LINES and shown:
+            break
+        shown += 1
+    hunks: List[List[int]] = []
+    for o0, o1, n0, n1 in changes[:shown]:
+        a0 = max(0, o0 - context)
+        if hunks and a0 <= hunks[-1][1] + 1:
+            hunks[-1][1], hunks[-1][3] = o1 + context, n1 + context
+        else:
+            hunks.append([a0, o1 + context, n0 - (o0 - a0), n1 + context])
+    old = _read_lines(old_path, [(h[0], h[1]) for h in hunks])
+    new = _read_lines(new_path, [(h[2], h[3]) for h in hunks])
+    out = [f"--- a/{path}", f"+++ b/{path}"]
+    for h, a, b in zip(hunks, old, new):
+        out.append(f"@@ -{_diff_range(h[0], len(a))} +{_diff_range(h[2], len(b))} @@")
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b, autojunk=False).get_opcodes():
+            if tag == "equal":
+                out.extend(" " + line for line in a[i1:i2])
+                continue
+            out.extend("-" + line for line in a[i1:i2])
+            out.extend("+" + line for line in b[j1:j2])
+    if len(out) > MAX_DIFF_LINES + 2:
+        out = out[:MAX_DIFF_LINES + 2] + [f"... diff cut at {MAX_DIFF_LINES} lines"]
+    if shown < len(changes):
+        out.append(f"... {len(changes) - shown} more replacements not shown")
+    return out
 
 
-def handle_replace(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any]) -> str:
+def handle_replace(workdir: str, path: str, args: Dict[str, Any], model_produced_args: Dict[str, Any], fs: Optional[_FsCall] = None) -> str:
+    fs = fs or _FsCall(LOCALFILE_TIME_BUDGET["replace"])
     if not path:
         return "Error: path parameter required for replace operation"
 
-    realpath, error = _validate_file_for_reading(workdir, path)
+    realpath, error = _check_file(workdir, path, fs, MAX_REPLACE_SIZE)
     if error:
         return f"Error: {error}"
 
-    find_text = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "find", "")
-    replace_text = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "replace", "")
-    count = int(ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "count", "-1"))
-
-    if not find_text:
-        return "Error: find parameter required for replace operation"
-
-    with open(realpath, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    if count == -1:
-        new_content = content.replace(find_text, replace_text)
-        replacements = content.count(find_text)
-    else:
-        new_content = content.replace(find_text, replace_text, count)
-        replacements = min(content.count(find_text), count)
-
-    if replacements == 0:
-        return f"No matches found for '{find_text}' in {path}"
-
-    with open(realpath, 'w', encoding='utf-8') as f:
-        f.write(new_content)
-
-    old_lines = content.splitlines()
-    new_lines = new_content.splitlines()
-
-    diff_output = [f"Updated {path} ({replacements} replacement{'s' if replacements > 1 else ''}):\n"]
-
-    for i, (old_line, new_line) in enumerate(zip(old_lines, new_lines), 1):
-        if old_line != new_line:
-            diff_output.append(f"  {i:4d} - {old_line}")
-            diff_output.append(f"  {i:4d} + {new_line}")
-
-    if len(new_lines) > len(old_lines):
-        for i in range(len(old_lines), len(new_lines)):
-            diff_output.append(f"  {i+1:4d} + {new_lines[i]}")
-    elif len(old_lines) > len(new_lines):
-        for i in range(len(new_lines), len(old_lines)):
-            diff_output.append(f"  {i+1:4d} - {old_lines[i]}")
-
-    return "\n".join(diff_output)
-
+    edits, error = _parse_edits(args, model_produced_args)
+    if error:
+        return error
 
-def handle_ls(workdir: str, path: str) -> str:
+    # Streams into a temporary file next to the original, renamed over it when done: memory doesn't depend on the
+    # file size, and a failure halfway leaves the file as it was
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(realpath), prefix="." + os.path.basename(realpath) + ".", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8", newline="") as out, open(realpath, "r", encoding="utf-8", newline="") as src:
+            counts, changes = _stream_replace(src, out, edits, fs)
+        replacements = sum(counts)
+        if replacements == 0:
+            if len(edits) == 1:
+                return f"No matches found for '{edits[0][0]}' in {path}"
+            return f"No matches found for any of the {len(edits)} edits in {path}"
+        diff = _unified_diff(realpath, tmp, path, changes)
+        os.chmod(tmp, stat.S_IMODE(fs.stat(realpath).st_mode))
+        if not fs.commit(lambda: os.replace(tmp, realpath)):
+            raise TimeoutError(f"the {fs.budget:.0f}s time budget ran out, file not changed")
+    except UnicodeDecodeError:
+        return f"Error: {path} is not valid utf-8, cannot edit it as text"
+    except (ValueError, TimeoutError) as e:
+        return f"Error: {path} {e}"
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    ckit_trigram.mark_stale(workdir, path)
+
+    summary = f"Updated {path} ({replacements} replacement{'s' if replacements > 1 else ''})"
+    if len(edits) > 1:
+        summary += ", per edit: " + ", ".join(str(c) for c in counts)
+    return summary + ":\n\n" + "\n".join(diff)
+
+
+def handle_ls(workdir: str, path: str, args: Optional[Dict[str, Any]] = None, model_produced_args: Optional[Dict[str, Any]] = None, fs: Optional[_FsCall] = None) -> str:
+    fs = fs or _FsCall(LOCALFILE_TIME_BUDGET["ls"])
     path = path or "."
 
     path_error = validate_path(path, allow_empty=True)
@@ -326,16 +607,16 @@ def handle_ls(workdir: str, path: str) -> str:
         return f"Error: {path_error}"
 
     realpath = os.path.join(workdir, path)
-    if not os.path.exists(realpath):
+    if not fs.exists(realpath):
         return f"Error: Path {path} does not exist"
-    if not os.path.isdir(realpath):
+    if not fs.isdir(realpath):
         return f"Error: {path} is not a directory"
 
     try:
         entries = []
         for item in sorted(os.listdir(realpath)):
             full_path = os.path.join(realpath, item)
-            is_dir = os.path.isdir(full_path)
+            is_dir = fs.isdir(full_path)
 
             if not is_dir and _validate_file_security(full_path):
                 continue
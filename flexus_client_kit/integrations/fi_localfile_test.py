@@ -0,0 +1,291 @@
+import asyncio
+import builtins
+import difflib
+import io
+import os
+import random
+import re
+import stat
+import tempfile
+import time
+
+from flexus_client_kit import ckit_trigram
+from flexus_client_kit.integrations import fi_localfile
+
+
+def _grep(workdir: str, **args) -> str:
+    return asyncio.run(fi_localfile.handle_localfile(workdir, {"op": "grep", "args": args}))
+
+
+def _grep_glob(workdir: str, **args) -> str:
+    # The same search without the index, like grep was before it
+    orig = fi_localfile._grep_candidates
+    fi_localfile._grep_candidates = lambda workdir, realpath, include, recursive, pattern, fs: (lambda f: (sorted(f), len(f)))(fi_localfile._glob_files(realpath, include, recursive, fs))
+    try:
+        return _grep(workdir, **args)
+    finally:
+        fi_localfile._grep_candidates = orig
+
+
+def test_grep_same_as_glob():
+    with tempfile.TemporaryDirectory() as workdir:
+        for rel, content in [
+            ("a.py", "def handle_grep():\n    return 1\n"),
+            ("src/b.py", "x = 1\n# TODO handle_grep later\n"),
+            ("src/deep/c.txt", "TODO in text\nsecond line\n"),
+            ("src/deep/d.py", "nothing here\n"),
+            (".hidden/e.py", "TODO hidden\n"),
+            ("src/.f.py", "TODO dotfile\n"),
+            ("bin/blob", "\x00\x01TODO binary"),
+        ]:
+            os.makedirs(os.path.dirname(os.path.join(workdir, rel)) or workdir, exist_ok=True)
+            with open(os.path.join(workdir, rel), "w") as f:
+                f.write(content)
+        for args in [
+            {"pattern": "TODO"},
+            {"pattern": "handle_gr[e]p", "context_lines": 1},
+            {"pattern": "TODO", "path": "src"},
+            {"pattern": "TODO", "path": "src", "recursive": False},
+            {"pattern": "TODO", "include": "*.py"},
+            {"pattern": "TODO", "path": "src/deep", "include": "*.txt"},
+            {"pattern": "TODO", "include": "src/*.py"},
+            {"pattern": "(?i)todo|nothing"},
+            {"pattern": "no_such_thing"},
+            {"pattern": "TODO", "include": "*.rs"},
+            {"pattern": "TODO", "path": "src/b.py"},
+        ]:
+            assert _grep(workdir, **args) == _grep_glob(workdir, **args), args
+        assert "Found pattern in 3/5 files" in _grep(workdir, pattern="TODO")
+        assert "No files found" in _grep(workdir, pattern="TODO", include="*.rs")
+
+        assert "Updated src/deep/d.py" in asyncio.run(fi_localfile.handle_localfile(workdir, {"op": "replace", "args": {"path": "src/deep/d.py", "find": "nothing", "replace": "TODO"}}))
+        assert "src/deep/d.py" in _grep(workdir, pattern="TODO")   # index picks up our own writes right away
+        os.remove(os.path.join(workdir, "a.py"))
+        ckit_trigram.mark_stale(workdir)
+        assert "a.py" not in _grep(workdir, pattern="handle_grep")
+
+
+def _make_tree(workdir: str, n: int, lines: int) -> None:
+    for i in range(n):
+        d = os.path.join(workdir, "d%02d" % (i % 20))
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, "f%04d.txt" % i), "w") as f:
+            f.write("".join("line %d of file %d with some words in it\n" % (j, i) for j in range(lines)) + "marker_%04d\n" % i)
+
+
+def test_big_grep_does_not_stall_the_loop():
+    with tempfile.TemporaryDirectory() as workdir:
+        _make_tree(workdir, 400, 1000)
+        lags = []
+
+        async def ticker(stop: asyncio.Event):
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                await asyncio.sleep(0.005)
+                lags.append(time.perf_counter() - t0 - 0.005)
+
+        async def go():
+            stop = asyncio.Event()
+            t = asyncio.create_task(ticker(stop))
+            t0 = time.perf_counter()
+            out = await fi_localfile.handle_localfile(workdir, {"op": "grep", "args": {"pattern": "file \\d+ with( no)? words"}})
+            took = time.perf_counter() - t0
+            stop.set()
+            await t
+            return out, took
+
+        out, took = asyncio.run(go())
+        assert out.startswith("No matches found for pattern in 400 files")
+        print("grep %0.2fs, loop lag max %0.1fms, %d ticks" % (took, max(lags) * 1000, len(lags)))
+        assert took > 0.2 and max(lags) < 0.1 and len(lags) > took / 0.05
+
+
+def test_time_budget_and_single_open():
+    with tempfile.TemporaryDirectory() as workdir:
+        _make_tree(workdir, 100, 50)
+        opened = []
+
+        def counting_open(file, *a, **kw):
+            opened.append(file)
+            return builtins.open(file, *a, **kw)
+
+        fi_localfile.open = counting_open
+        try:
+            out = _grep(workdir, pattern="marker_0007$")
+            assert "Found pattern in 1/100 files" in out and len(opened) == 1   # the rest pruned by the index
+            out = _grep(workdir, pattern="of file \\d+")
+            assert "Found pattern in 100/100 files" in out and len(opened) == 101   # once per file, binary check included
+            assert "line 1 of file 5 " in _call(workdir, "cat", path="d05/f0005.txt") and opened[-1].endswith("f0005.txt") and len(opened) == 102
+        finally:
+            del fi_localfile.open
+
+        orig = dict(fi_localfile.LOCALFILE_TIME_BUDGET)
+        fi_localfile.LOCALFILE_TIME_BUDGET["grep"] = 0.0
+        try:
+            out = _grep(workdir, pattern="of file \\d+")
+            assert "time budget ran out, results are incomplete" in out
+        finally:
+            fi_localfile.LOCALFILE_TIME_BUDGET.update(orig)
+
+
+def test_grep_without_index_when_it_is_busy():
+    with tempfile.TemporaryDirectory() as workdir:
+        _make_tree(workdir, 40, 5)
+        idx = ckit_trigram.index_for(workdir)
+        orig = dict(fi_localfile.LOCALFILE_TIME_BUDGET)
+        fi_localfile.LOCALFILE_TIME_BUDGET["grep"] = 0.4
+        try:
+            with idx.lock:   # a refresh of a huge tree in another call
+                t0 = time.monotonic()
+                out = _grep(workdir, pattern="marker_0007$", path="d07")
+                assert "Found pattern in 1/2 files" in out and time.monotonic() - t0 < 1
+            assert not idx.files
+            assert _grep(workdir, pattern="marker_0007$", path="d07") == out
+            assert sorted(idx.all_files()) == ["d07/f0007.txt", "d07/f0027.txt"]   # only the directory searched
+        finally:
+            fi_localfile.LOCALFILE_TIME_BUDGET.update(orig)
+            ckit_trigram.forget(workdir)
+
+
+def _call(workdir: str, op: str, **args) -> str:
+    return asyncio.run(fi_localfile.handle_localfile(workdir, {"op": op, "args": args}))
+
+
+def _replace(workdir: str, path: str, **args) -> str:
+    return _call(workdir, "replace", path=path, **args)
+
+
+def _reference_replace(text: str, edits, count: int = 0):
+    # What replace should do, all in memory: \n in find matches \r\n too, a file that starts with \r\n endings gets
+    # them in replacements. Returns (new text, matches)
+    crlf = "\n" in text and text[text.index("\n") - 1:text.index("\n")] == "\r"
+    finds = {f.replace("\r\n", "\n"): re.sub(r"(?<!\r)\n", "\r\n", r) if crlf else r for f, r, _ in edits}
+    rx = re.compile("|".join("(%s)" % re.escape(f).replace("\\\n", "\\r?\\n") for f in sorted(finds, key=len, reverse=True)))
+    order = sorted(finds, key=len, reverse=True)
+    return rx.subn(lambda m: finds[order[m.lastindex - 1]], text, count)
+
+
+def test_streaming_replace_same_as_str_replace():
+    rnd = random.Random(11)
+    orig = fi_localfile.REPLACE_CHUNK
+    try:
+        for chunk in [1, 3, 7, 64]:
+            fi_localfile.REPLACE_CHUNK = chunk
+            for _ in range(150):
+                text = "".join(rnd.choice(["ab", "a", "b", "\n", "abc", "c\n", "\r\n", "é"]) for _ in range(rnd.randrange(0, 60)))
+                finds = [rnd.choice(["ab", "b\na", "abc", "c", "a", "bb", "\r\nab"]) for _ in range(rnd.randrange(1, 4))]
+                edits = [(f, rnd.choice(["", "X", "YY\n", f + f]), -1) for f in dict.fromkeys(finds)]
+                out = io.StringIO()
+                counts, changes = fi_localfile._stream_replace(io.StringIO(text), out, edits, fi_localfile._FsCall(10))
+                want, n_found = _reference_replace(text, edits)
+                assert out.getvalue() == want, (chunk, text, edits)
+                assert sum(counts) == n_found == len(changes)
+                if len(edits) == 1 and rnd.random() < 0.5:
+                    n = rnd.randrange(0, 4)
+                    out = io.StringIO()
+                    fi_localfile._stream_replace(io.StringIO(text), out, [(edits[0][0], edits[0][1], n)], fi_localfile._FsCall(10))
+                    assert out.getvalue() == (_reference_replace(text, edits, n)[0] if n else text)
+    finally:
+        fi_localfile.REPLACE_CHUNK = orig
+
+
+def test_replace_diff_is_unified_diff():
+    rnd = random.Random(5)
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(40):
+            lines = ["line %d %s" % (i, rnd.choice(["alpha", "beta", "gamma", "delta"])) for i in range(rnd.randrange(1, 80))]
+            text = "\n".join(lines) + rnd.choice(["", "\n"])
+            with open(os.path.join(workdir, "f.txt"), "w") as f:
+                f.write(text)
+            find, repl = rnd.choice([("beta", "BETA"), ("gamma\nline", "g\nl"), ("delta\n", ""), ("alpha", "a\nb\nc")])
+            out = _replace(workdir, "f.txt", find=find, replace=repl)
+            if find not in text:
+                assert out.startswith("No matches found")
+                continue
+            with open(os.path.join(workdir, "f.txt")) as f:
+                assert f.read() == text.replace(find, repl)
+            want = list(difflib.unified_diff(text.splitlines(), text.replace(find, repl).splitlines(), "a/f.txt", "b/f.txt", lineterm=""))
+            got = out.split("\n\n", 1)[1].split("\n")
+            if len(want) > fi_localfile.MAX_DIFF_LINES:
+                assert got[-1].endswith("more replacements not shown") or got[-1].startswith("... diff cut")
+                continue
+            assert got == want, (text, find, repl)
+
+
+def test_replace_edits_atomic_and_big_files():
+    with tempfile.TemporaryDirectory() as workdir:
+        p = os.path.join(workdir, "app.py")
+        with open(p, "w", newline="") as f:
+            f.write("foo = 1\r\nfoobar = foo\r\nbar = 2\r\n")
+        os.chmod(p, 0o640)
+        out = _replace(workdir, "app.py", edits=[{"find": "foo", "replace": "bar"}, {"find": "bar", "replace": "foo"}, {"find": "foobar", "replace": "qux", "count": 1}])
+        assert out.startswith("Updated app.py (4 replacements), per edit: 2, 1, 1:")
+        with open(p, "rb") as f:
+            assert f.read() == b"bar = 1\r\nqux = bar\r\nfoo = 2\r\n"   # swapped in one pass, line endings kept
+        assert stat.S_IMODE(os.stat(p).st_mode) == 0o640
+        assert "No matches found for any of the 2 edits" in _replace(workdir, "app.py", edits=[{"find": "zzz"}, {"find": "yyy"}])
+        assert "edits must be a list" in _replace(workdir, "app.py", edits="nonsense")
+
+        with open(p, "wb") as f:
+            f.write(b"ok line\n" * 100000 + b"\xff\xfe broken\n")
+        assert "is not valid utf-8" in _replace(workdir, "app.py", find="ok", replace="fine")
+        with open(p, "rb") as f:
+            assert f.read(7) == b"ok line"
+        assert sorted(os.listdir(workdir)) == ["app.py"]   # nothing left behind
+
+        big = os.path.join(workdir, "big.log")
+        with open(big, "w") as f:
+            for i in range(200000):
+                f.write("%06d INFO request served in %dms\n" % (i, i % 97))
+        assert os.path.getsize(big) > fi_localfile.MAX_FILE_SIZE
+        out = _replace(workdir, "big.log", find="INFO", replace="DEBUG")
+        assert out.startswith("Updated big.log (200000 replacements)") and "more replacements not shown" in out
+        assert len(out.split("\n")) < fi_localfile.MAX_DIFF_LINES + 10
+        with open(big) as f:
+            assert f.readline() == "000000 DEBUG request served in 0ms\n"
+
+
+def test_replace_crlf_file():
+    with tempfile.TemporaryDirectory() as workdir:
+        p = os.path.join(workdir, "win.txt")
+        with open(p, "wb") as f:
+            f.write(b"line one\r\nline two\r\nline three\r\n")
+        out = _replace(workdir, "win.txt", find="one\nline two", replace="1\nline 2")
+        assert out.startswith("Updated win.txt (1 replacement):"), out
+        with open(p, "rb") as f:
+            assert f.read() == b"line 1\r\nline 2\r\nline three\r\n"   # find with \n matched, file's own endings written
+        want = difflib.unified_diff(["line one", "line two", "line three"], ["line 1", "line 2", "line three"], "a/win.txt", "b/win.txt", lineterm="")
+        assert out.split("\n")[2:] == list(want), out
+
+        with open(p, "wb") as f:
+            f.write(b"a\rb\nc\n")
+        out = _replace(workdir, "win.txt", find="c", replace="C")
+        assert out.split("\n")[2:] == ["--- a/win.txt", "+++ b/win.txt", "@@ -1,2 +1,2 @@", " a\rb", "-c", "+C"], out   # a lone \r is not a line break
+
+
+def test_replace_result_matches_the_file_after_timeout():
+    orig_budget, orig_grace = dict(fi_localfile.LOCALFILE_TIME_BUDGET), fi_localfile.LOCALFILE_BUDGET_GRACE
+    orig_diff, orig_replace = fi_localfile._unified_diff, os.replace
+    with tempfile.TemporaryDirectory() as workdir:
+        p = os.path.join(workdir, "a.txt")
+        try:
+            fi_localfile.LOCALFILE_TIME_BUDGET["replace"] = 1.0
+            fi_localfile.LOCALFILE_BUDGET_GRACE = -0.8   # the caller stops waiting before the thread's deadline
+
+            with open(p, "w") as f:
+                f.write("old\n")
+            fi_localfile._unified_diff = lambda *a: (time.sleep(0.4), orig_diff(*a))[1]   # past the wait, before the deadline
+            assert "replace took too long" in _replace(workdir, "a.txt", find="old", replace="new")
+            time.sleep(0.5)
+            with open(p) as f:
+                assert f.read() == "old\n"   # reported as failed, and it didn't happen later either
+
+            fi_localfile._unified_diff = orig_diff
+            os.replace = lambda *a: (time.sleep(0.4), orig_replace(*a))[1]   # already replacing when the wait ends
+            assert _replace(workdir, "a.txt", find="old", replace="new").startswith("Updated a.txt")
+            with open(p) as f:
+                assert f.read() == "new\n"
+        finally:
+            fi_localfile.LOCALFILE_TIME_BUDGET.update(orig_budget)
+            fi_localfile.LOCALFILE_BUDGET_GRACE = orig_grace
+            fi_localfile._unified_diff, os.replace = orig_diff, orig_replace
@@ -7,10 +7,15 @@ from flexus_client_kit.integrations.fi_localfile import _validate_file_security
 from pymongo.collection import Collection
 
 from flexus_client_kit import ckit_cloudtool, ckit_mongo
-from flexus_client_kit.format_utils import DEFAULT_SAFETY_VALVE, format_cat_output, grep_output
+from flexus_client_kit.format_utils import DEFAULT_SAFETY_VALVE, IMAGE_EXTENSIONS, format_cat_output, format_text_output, grep_output
 
 logger = logging.getLogger("mongo_store")
 
+LIST_MAX_FILES = 1000
+GREP_PER_FILE = 20
+GREP_MAX_MATCHES = 200
+GREP_TIME_BUDGET = 10.0
+
 
 MONGO_STORE_TOOL = ckit_cloudtool.CloudTool(
     strict=True,
@@ -64,6 +69,8 @@ delete  - Delete a stored file by exact path (no wildcards).
 
 grep    - Search file contents using Python regex using per-line matching
           args: path (default "."), pattern (required), context (0)
+          If path is not an exact file, all files under that prefix are searched ("." means all files), files with
+          most matches first, at most 20 matches shown per file and 200 total, searching stops after 10 seconds.
           Sometimes you need to grep .json files on disk, remember that all the strings inside are escaped in that case, making
           it a bit harder to match.
 
@@ -73,6 +80,7 @@ Examples:
   mongo_store(op="save", args={"path": "investigations/abc123.json", "content": "{...json...}"})
   mongo_store(op="delete", args={"path": "folder1/something_20250803.json"})
   mongo_store(op="grep", args={"path": "tasks.txt", "pattern": "TODO", "context": 2})
+  mongo_store(op="grep", args={"path": "investigations/", "pattern": "refund|chargeback", "context": 1})
 """
 
 # There's also a secret op="undelete" command that can bring deleted files
@@ -107,11 +115,9 @@ async def handle_mongo_store(
         if path_error:
             return f"Error: {path_error}"
         file_data = content.encode("utf-8")
-        existing_doc = await mongo_collection.find_one({"path": path}, {"mon_ctime": 1})
-        was_overwritten = existing_doc is not None
-        await ckit_mongo.mongo_store_file(mongo_collection, path, file_data, 60 * 60 * 24 * 365)
+        saved = await ckit_mongo.mongo_save(mongo_collection, path, file_data, 60 * 60 * 24 * 365, ckit_mongo.SAVE_OVERWRITE)
         result_msg = f"Saved {path} -> MongoDB ({len(file_data)} bytes)"
-        if was_overwritten:
+        if saved.overwritten:
             result_msg += " [OVERWRITTEN]"
         return result_msg
 
@@ -121,17 +127,18 @@ async def handle_mongo_store(
         realpath = os.path.join(workdir, path)
         if not os.path.exists(realpath):
             return f"Error: File {path} does not exist"
-        with open(realpath, 'rb') as f:
-            file_data = f.read()
         path_error = validate_path(path)
         if path_error:
             return f"Error: {path_error}"
         mongo_path = path
-        existing_doc = await mongo_collection.find_one({"path": mongo_path}, {"mon_ctime": 1})
-        was_overwritten = existing_doc is not None
-        result_id = await ckit_mongo.mongo_store_file(mongo_collection, mongo_path, file_data, 60 * 60 * 24 * 365)
+        if os.path.getsize(realpath) > ckit_mongo.MAX_FILE_SIZE:
+            saved = await ckit_mongo.mongo_save_stream(mongo_collection, mongo_path, _read_chunks(realpath), 60 * 60 * 24 * 365, ckit_mongo.SAVE_OVERWRITE)
+        else:
+            with open(realpath, 'rb') as f:
+                file_data = f.read()
+            saved = await ckit_mongo.mongo_save(mongo_collection, mongo_path, file_data, 60 * 60 * 24 * 365, ckit_mongo.SAVE_OVERWRITE)
         result_msg = f"Uploaded {path} -> MongoDB"
-        if was_overwritten:
+        if saved.overwritten:
             result_msg += " [OVERWRITTEN existing file]"
         return result_msg
 
@@ -143,10 +150,13 @@ async def handle_mongo_store(
         path_error = validate_path(path, allow_empty=True)
         if path_error:
             return f"Error: {path_error}"
-        documents = await ckit_mongo.mongo_ls(mongo_collection, path)
+        documents, next_page = await ckit_mongo.mongo_ls_page(mongo_collection, path, limit=LIST_MAX_FILES)
         if not documents:
             return f"No files found with prefix: {path!r}"
-        result = f"Found {len(documents)} files with prefix {path!r}:\n"
+        if next_page:
+            result = f"First {len(documents)} files with prefix {path!r}, there are more, list a longer prefix to see them:\n"
+        else:
+            result = f"Found {len(documents)} files with prefix {path!r}:\n"
         for doc in documents:
             file_path = doc["path"]
             size = doc["mon_size"]
@@ -162,13 +172,17 @@ async def handle_mongo_store(
         security_error = _validate_file_security(path)
         if security_error:
             return security_error
-        document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path)
+        document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path, load_chunks=False)
         if not document:
             return f"Error: File {path} not found in MongoDB"
-        # XXX decide is it json, image or text, remove guesswork
-        file_data = document.get("data", document.get("json", None))
         lines_range = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "lines_range", "0:")
         safety_valve = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "safety_valve", DEFAULT_SAFETY_VALVE)
+        if "mon_chunks" in document:
+            if os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS:
+                return await _cat_chunked(mongo_collection, path, document, str(lines_range), str(safety_valve))
+            document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path)
+        # XXX decide is it json, image or text, remove guesswork
+        file_data = document.get("data", document.get("json", None))
         return format_cat_output(path, file_data, lines_range, str(safety_valve))
 
     elif op == "grep":
@@ -186,9 +200,9 @@ async def handle_mongo_store(
             return "Error: invalid regex pattern"
         context = int(ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "context", "0"))
 
-        document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path)
+        document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path) if path != "." else None
         if not document:
-            return f"Error: File {path} not found in MongoDB"
+            return await _grep_many(mongo_collection, "" if path == "." else path, pattern, context)
         if document.get("data"):
             content = document["data"].decode("utf-8")
         elif document.get("json"):
@@ -215,6 +229,30 @@ async def handle_mongo_store(
         return HELP
 
 
+def _read_chunks(realpath: str):
+    with open(realpath, "rb") as f:
+        while piece := f.read(ckit_mongo.MONGO_CHUNK_SIZE):
+            yield piece
+
+
+async def _cat_chunked(mongo_collection: Collection, path: str, document: Dict[str, Any], lines_range: str, safety_valve: str) -> str:
+    # Large files: fetch only chunks with the lines requested, safety_valve caps how many
+    if ":" in lines_range:
+        start_str, end_str = lines_range.split(":", 1)
+        start = max(1, int(start_str) if start_str else 1) - 1
+        end = int(end_str) if end_str else None
+    else:
+        start = max(1, int(lines_range)) - 1
+        end = start + 1
+    max_chars = int(safety_valve[:-1]) * 1000 if safety_valve.lower().endswith("k") else int(safety_valve)
+    data, total_lines = await ckit_mongo.mongo_read_lines(mongo_collection, document, start, end, max_bytes=max(1000, max_chars) * 4 + 1)
+    if start >= total_lines:
+        return f"📄 {path}\n\nFile has {total_lines} lines, nothing in lines_range {lines_range!r}"
+    text = data.decode("utf-8", errors="replace")
+    result = format_text_output(path, text, ":", safety_valve, line_offset=start)
+    return result.replace(f"📄 {path}", f"📄 {path} ({document['mon_size']:,} bytes, {total_lines} lines, showing from line {start + 1})", 1)
+
+
 def validate_path(path: str, allow_empty: bool = False) -> Optional[str]:
     if not path:
         if allow_empty:
@@ -239,13 +277,17 @@ async def download_file(mongo_collection, path, local_path):
     path_error = validate_path(path)
     if path_error:
         raise RuntimeError(f"Error: {path_error}")
-    document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path)
+    document = await ckit_mongo.mongo_retrieve_file(mongo_collection, path, load_chunks=False)
     if not document:
         raise RuntimeError(f"Error: File {path} not found in MongoDB")
     resolved_path = os.path.abspath(local_path)
     os.makedirs(os.path.dirname(resolved_path), exist_ok=True)
     resolved_path = os.path.abspath(local_path)
-    if "data" in document:
+    if "mon_chunks" in document:
+        with open(resolved_path, 'wb') as f:
+            async for piece in ckit_mongo.mongo_open_stream(mongo_collection, document):
+                f.write(piece)
+    elif "data" in document:
         with open(resolved_path, 'wb') as f:
             f.write(document["data"])
     elif "json" in document:
@@ -254,3 +296,39 @@ async def download_file(mongo_collection, path, local_path):
     else:
         raise RuntimeError("Error: File {path} has unknown format, cannot save it")
     return path
+
+
+async def _grep_many(mongo_collection: Collection, prefix: str, pattern: re.Pattern, context: int) -> str:
+    r = await ckit_mongo.mongo_grep(mongo_collection, prefix, pattern, context, per_file=GREP_PER_FILE, max_matches=GREP_MAX_MATCHES, time_budget=GREP_TIME_BUDGET)
+    if r.candidates == 0:
+        return f"Error: File {prefix} not found in MongoDB, and no files start with it" if prefix else "Error: no files stored"
+    stats = f"searched {r.scanned + r.prefiltered} of {r.candidates} files"
+    if r.skipped_binary:
+        stats += f", {r.skipped_binary} binary skipped"
+    if r.timed_out:
+        stats += f", stopped after {GREP_TIME_BUDGET:.0f}s, there might be more"
+    if not r.files:
+        return f"No matches found for pattern ({stats})"
+    total = sum(f.matches for f in r.files) + r.dropped_matches
+    out = [f"Found {total} matching lines in {len(r.files) + r.dropped_files} files ({stats})"]
+    budget = GREP_MAX_MATCHES
+    for i, f in enumerate(r.files):
+        if budget <= 0:
+            r.dropped_files += len(r.files) - i
+            break
+        shown = min(f.matches, GREP_PER_FILE, budget)
+        out.append(f"\n=== {f.path} ({f.matches} matches) ===")
+        n = 0
+        for line_n, line in f.lines:
+            if pattern.search(line):
+                n += 1
+                if n > shown:
+                    break
+            out.append(f"{line_n:4d}: {line}")
+        if f.matches > shown:
+            out.append(f"... {f.matches - shown} more matches in this file")
+        budget -= shown
+    if r.dropped_files:
+        out.append(f"\n... {r.dropped_files} more files with matches not shown, narrow down the path or the pattern")
+    return "\n".join(out)
+
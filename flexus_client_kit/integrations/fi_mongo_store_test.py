@@ -0,0 +1,69 @@
+import asyncio
+import os
+import tempfile
+
+from flexus_client_kit import ckit_mongo
+from flexus_client_kit.ckit_mongo_test import FakeCollection, _text
+from flexus_client_kit.integrations import fi_mongo_store
+
+
+def _call(workdir: str, coll: FakeCollection, op: str, **args) -> str:
+    full = {"path": None, "lines_range": None, "safety_valve": None, "pattern": None, "context": None, "content": None}
+    full.update(args)
+    return asyncio.run(fi_mongo_store.handle_mongo_store(workdir, coll, None, {"op": op, "args": full}))
+
+
+def test_big_file_upload_cat_download():
+    coll = FakeCollection()
+    big = _text(8000, seed=9)
+    lines = big.decode().splitlines()
+    with tempfile.TemporaryDirectory() as workdir:
+        with open(os.path.join(workdir, "export.csv"), "wb") as f:
+            f.write(big)
+        assert "Uploaded export.csv" in _call(workdir, coll, "upload", path="export.csv")
+        doc = coll.docs[0]
+        assert "mon_chunks" in doc and "data" not in doc
+
+        chunks = coll.database[coll.name + "_chunks"]
+        before = chunks.returned
+        out = _call(workdir, coll, "cat", path="export.csv", lines_range="5001:5003", safety_valve="10k")
+        assert chunks.returned - before <= 2
+        assert "8000 lines, showing from line 5001" in out
+        assert out.split("\n\n", 1)[1].splitlines() == lines[5000:5003]
+
+        out = _call(workdir, coll, "cat", path="export.csv", lines_range="0:", safety_valve="5k")
+        assert lines[0] in out and lines[7999] not in out and "safety_valve" in out
+        assert "nothing in lines_range" in _call(workdir, coll, "cat", path="export.csv", lines_range="9000:", safety_valve="5k")
+
+        assert "line 7777 " in _call(workdir, coll, "grep", path="export.csv", pattern="^line 7777 ", context=0)
+
+        local = os.path.join(workdir, "down", "export.csv")
+        asyncio.run(fi_mongo_store.download_file(coll, "export.csv", local))
+        with open(local, "rb") as f:
+            assert f.read() == big
+
+
+def test_small_file_cat_unchanged():
+    coll = FakeCollection()
+    asyncio.run(ckit_mongo.mongo_store_file(coll, "notes.txt", b"one\ntwo\nthree\n"))
+    out = _call("/nonexistent", coll, "cat", path="notes.txt", lines_range="2:2", safety_valve="10k")
+    assert "two" in out and "one" not in out and "three" not in out
+
+
+def test_grep_prefix_ranked_and_capped():
+    coll = FakeCollection()
+
+    async def fill():
+        for i in range(30):
+            await ckit_mongo.mongo_store_file(coll, "notes/n%02d.txt" % i, ("TODO %d\n" % i * (i + 1)).encode())
+        await ckit_mongo.mongo_store_file(coll, "tasks.txt", b"a\nTODO b\nc\n")
+    asyncio.run(fill())
+    out = _call("/nonexistent", coll, "grep", path="notes/", pattern="TODO", context=0)
+    head, first = out.split("\n")[:2], out.split("\n=== ")[1]
+    assert head[0].startswith("Found 465 matching lines in 30 files (searched 30 of 30 files)")
+    assert first.startswith("notes/n29.txt (30 matches) ===") and "... 10 more matches in this file" in first
+    assert out.count("TODO") == fi_mongo_store.GREP_MAX_MATCHES and "more files with matches" in out
+    out = _call("/nonexistent", coll, "grep", path="tasks.txt", pattern="TODO", context=1)
+    assert "a" in out and "TODO b" in out and "Found" not in out   # exact file, same output as before
+    assert "no files start with it" in _call("/nonexistent", coll, "grep", path="nope/", pattern="TODO")
+    assert "No matches found" in _call("/nonexistent", coll, "grep", path=".", pattern="XYZ")
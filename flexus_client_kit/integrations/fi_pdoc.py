@@ -1,6 +1,10 @@
+import asyncio
+import copy
 import json
 import logging
-from typing import Dict, Any, Optional, List
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Tuple
 from dataclasses import dataclass
 
 import gql
@@ -14,6 +18,10 @@ from flexus_client_kit import gql_utils
 
 logger = logging.getLogger("pdocs")
 
+PDOC_CACHE_TTL = 60.0          # documents younger than that are served from memory
+PDOC_CACHE_MAX_AGE = 900.0     # older than TTL but younger than that: only ask the backend for pdoc_modified_ts
+PDOC_CACHE_MAX_ENTRIES = 500
+
 
 POLICY_DOCUMENT_TOOL = ckit_cloudtool.CloudTool(
     strict=False,
@@ -89,6 +97,95 @@ class PdocDocument:
     pdoc_modified_ts: float
 
 
+@dataclass
+class _CacheEntry:
+    doc: Optional[PdocDocument]   # None is "not found", also worth remembering
+    ts: float                     # monotonic, when fetched or confirmed unchanged
+
+
+class PdocCache:
+    """
+    Per IntegrationPdoc, keyed by (path, fuser_id) because permissions might differ. Writes from this process go
+    through the cache, writes from elsewhere (user edits in the UI, other bots) are seen after TTL, when
+    pdoc_modified_ts no longer matches. Callers get copies, changing the content doesn't change the cache.
+    """
+    def __init__(self, ttl: float = PDOC_CACHE_TTL, max_age: float = PDOC_CACHE_MAX_AGE, max_entries: int = PDOC_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.docs: "OrderedDict[Tuple[str, Optional[str]], _CacheEntry]" = OrderedDict()
+        self.lists: Dict[Tuple[str, Optional[str], int], Tuple[float, List[PdocListItem]]] = {}
+        self.inflight: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+        self.generation: Dict[str, int] = {}   # bumped by writes, a fetch that started before a write doesn't store its result
+        self.counters = {"hits": 0, "joined": 0, "revalidated": 0, "fetched": 0, "written": 0, "invalidated": 0}
+
+    def lookup(self, key: Tuple[str, Optional[str]], max_age: Optional[float]) -> Tuple[str, Optional[_CacheEntry]]:
+        e = self.docs.get(key)
+        if e is None:
+            return "miss", None
+        age = time.monotonic() - e.ts
+        if age < (self.ttl if max_age is None else max_age):
+            self.docs.move_to_end(key)
+            return "fresh", e
+        if age < self.max_age and e.doc is not None:
+            return "stale", e
+        return "miss", None
+
+    def put(self, key: Tuple[str, Optional[str]], doc: Optional[PdocDocument]) -> None:
+        self.docs[key] = _CacheEntry(doc, time.monotonic())
+        self.docs.move_to_end(key)
+        while len(self.docs) > self.max_entries:
+            self.docs.popitem(last=False)
+
+    def _touch(self, p: str) -> List[Tuple[str, Optional[str]]]:
+        self.generation[p] = self.generation.get(p, 0) + 1
+        self.lists.clear()   # any write might change doc counts up the tree
+        return [k for k in self.docs if k[0] == p]
+
+    def written(self, p: str, fuser_id: Optional[str], content: Any) -> None:
+        keys = self._touch(p)
+        prev = next((self.docs[k].doc for k in keys if self.docs[k].doc is not None), None)
+        now = time.time()
+        doc = PdocDocument(
+            pdoc_id=prev.pdoc_id if prev else "",   # not known for a new document until it's read back
+            path=p,
+            pdoc_content=content,
+            pdoc_created_ts=prev.pdoc_created_ts if prev else now,
+            pdoc_modified_ts=now,   # not what the backend has, the first revalidation fetches the real one
+        )
+        for k in keys:
+            if self.docs[k].doc is None and k != (p, fuser_id):
+                del self.docs[k]   # "not found" for somebody else might be "no access", next read asks the backend
+        for k in {k for k in keys if k in self.docs} | {(p, fuser_id)}:
+            self.put(k, copy.deepcopy(doc))
+        self.counters["written"] += 1
+
+    def invalidate(self, p: str) -> None:
+        for k in self._touch(p):
+            del self.docs[k]
+        self.counters["invalidated"] += 1
+
+    def removed(self, p: str, fuser_id: Optional[str]) -> None:
+        self.invalidate(p)
+        self.put((p, fuser_id), None)
+
+    def find_content(self, p: str) -> Optional[Any]:
+        for k, e in self.docs.items():
+            if k[0] == p and e.doc is not None and time.monotonic() - e.ts < self.ttl:
+                return e.doc.pdoc_content
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        c = self.counters
+        reads = c["hits"] + c["joined"] + c["revalidated"] + c["fetched"]
+        return {
+            **c,
+            "entries": len(self.docs),
+            "hit_rate": round((c["hits"] + c["joined"]) / reads, 3) if reads else 0.0,
+            "no_download_rate": round((c["hits"] + c["joined"] + c["revalidated"]) / reads, 3) if reads else 0.0,
+        }
+
+
 def _format_tree(items: List[PdocListItem], base_path: str) -> tuple:
     if not items:
         return "", 0, 0
@@ -145,6 +242,10 @@ class IntegrationPdoc:
         self.fclient = rcx.fclient
         self.fgroup_id = ws_root_group_id
         self.is_fake = rcx.running_test_scenario
+        self.cache = PdocCache()
+
+    def cache_stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
 
     async def called_by_model(self, toolcall: ckit_cloudtool.FCloudtoolCall, model_produced_args: Optional[Dict[str, Any]]) -> str:
         if not model_produced_args:
@@ -166,7 +267,7 @@ class IntegrationPdoc:
                 p = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "p", "/")
                 if self.is_fake:
                     return await ckit_scenario.scenario_generate_tool_result_via_model(self.fclient, toolcall, open(__file__).read())
-                result = await self.pdoc_list(p, fuser_id, depth=5)
+                result = await self.pdoc_list(p, fuser_id, depth=5, max_age=0)
                 tree_text, doc_count, folder_count = _format_tree(result, p)
                 r += f"Listing {p}\n\n"
                 r += tree_text
@@ -179,7 +280,7 @@ class IntegrationPdoc:
                     return f"Error: p required\n\n{HELP}"
                 if self.is_fake:
                     return await ckit_scenario.scenario_generate_tool_result_via_model(self.fclient, toolcall, open(__file__).read())
-                result = await self.pdoc_cat(p, fuser_id)
+                result = await self.pdoc_cat(p, fuser_id, max_age=0)   # the user might have just edited it
                 if not result:
                     return f"Policy document not found: {p}"
                 if op == "activate":
@@ -263,11 +364,15 @@ class IntegrationPdoc:
 
         return r
 
-    async def pdoc_list(self, p: str = "/", fuser_id: str = None, depth: int = 1) -> List[PdocListItem]:
+    async def pdoc_list(self, p: str = "/", fuser_id: str = None, depth: int = 1, max_age: Optional[float] = None) -> List[PdocListItem]:
+        key = (p, fuser_id, depth)
+        cached = self.cache.lists.get(key)
+        if cached and time.monotonic() - cached[0] < (self.cache.ttl if max_age is None else max_age):
+            return copy.deepcopy(cached[1])
         http = await self.fclient.use_http()
         async with http as h:
             result = await h.execute(
-                gql.gql(f"""
+                gql_utils.gql_cached(f"""
                     query PdocList($fgroup_id: String!, $p: String!, $fuser_id: String, $depth: Int) {{
                         policydoc_list(fgroup_id: $fgroup_id, p: $p, fuser_id: $fuser_id, depth: $depth) {{
                             {gql_utils.gql_fields(PdocListItem)}
@@ -277,16 +382,58 @@ class IntegrationPdoc:
                 variable_values={"fgroup_id": self.fgroup_id, "p": p, "fuser_id": fuser_id, "depth": depth},
             )
             items = result.get("policydoc_list", [])
-            return [gql_utils.dataclass_from_dict(item, PdocListItem) for item in items]
-
-    async def pdoc_cat(self, p: str, fuser_id: str = None, best_effort_to_find: bool = False) -> Optional[PdocDocument]:
+            items = [gql_utils.dataclass_from_dict(item, PdocListItem) for item in items]
+        self.cache.lists[key] = (time.monotonic(), items)
+        return copy.deepcopy(items)
+
+    async def pdoc_cat(self, p: str, fuser_id: str = None, best_effort_to_find: bool = False, max_age: Optional[float] = None) -> Optional[PdocDocument]:
+        """
+        Cached, see PdocCache. max_age=0 checks with the backend that the document didn't change, it's a small
+        query that returns pdoc_modified_ts only. Concurrent reads of the same document share one request.
+        """
+        if best_effort_to_find:   # might resolve to another path, not cached
+            return await self._fetch_doc(p, fuser_id, best_effort_to_find)
+        key = (p, fuser_id)
+        state, e = self.cache.lookup(key, max_age)
+        if state == "fresh":
+            self.cache.counters["hits"] += 1
+            return copy.deepcopy(e.doc)
+        fut = self.cache.inflight.get(key)
+        if fut is not None:
+            self.cache.counters["joined"] += 1
+        else:
+            fut = asyncio.ensure_future(self._load(key, e))
+            self.cache.inflight[key] = fut
+            fut.add_done_callback(lambda _: self.cache.inflight.pop(key, None))
+        return copy.deepcopy(await asyncio.shield(fut))
+
+    async def _load(self, key: Tuple[str, Optional[str]], stale: Optional[_CacheEntry]) -> Optional[PdocDocument]:
+        p, fuser_id = key
+        gen = self.cache.generation.get(p, 0)
+        if stale is not None:
+            check = await self._fetch_doc(p, fuser_id, False, fields="pdoc_modified_ts")
+            if check is not None and check.get("pdoc_modified_ts") == stale.doc.pdoc_modified_ts:
+                self.cache.counters["revalidated"] += 1
+                doc = stale.doc
+            else:
+                doc = await self._fetch_doc(p, fuser_id, False) if check is not None else None
+                self.cache.counters["fetched"] += 1
+        else:
+            doc = await self._fetch_doc(p, fuser_id, False)
+            self.cache.counters["fetched"] += 1
+        if self.cache.generation.get(p, 0) == gen:
+            self.cache.put(key, doc)
+        return doc
+
+    async def _fetch_doc(self, p: str, fuser_id: Optional[str], best_effort_to_find: bool, fields: Optional[str] = None) -> Any:
+        # With fields, returns the raw dict with only those fields, otherwise PdocDocument
         http = await self.fclient.use_http()
         async with http as h:
             result = await h.execute(
-                gql.gql(f"""
+                gql_utils.gql_cached(f"""
                     query PdocCat($fgroup_id: String!, $p: String!, $fuser_id: String, $best_effort_to_find: Boolean) {{
                         policydoc_cat(fgroup_id: $fgroup_id, p: $p, fuser_id: $fuser_id, best_effort_to_find: $best_effort_to_find) {{
-                            {gql_utils.gql_fields(PdocDocument)}
+                            {fields or gql_utils.gql_fields(PdocDocument)}
                         }}
                     }}
                 """),
@@ -295,64 +442,82 @@ class IntegrationPdoc:
             doc = result.get("policydoc_cat")
             if not doc:
                 return None
+            if fields:
+                return doc
             return gql_utils.dataclass_from_dict(doc, PdocDocument)
 
     async def pdoc_create(self, p: str, text: str, fuser_id: str) -> None:
         http = await self.fclient.use_http()
         async with http as h:
             await h.execute(
-                gql.gql("""
+                gql_utils.gql_cached("""
                     mutation PdocCreate($fgroup_id: String!, $p: String!, $text: String!, $fuser_id: String) {
                         policydoc_create(fgroup_id: $fgroup_id, p: $p, text: $text, fuser_id: $fuser_id)
                     }
                 """),
                 variable_values={"fgroup_id": self.fgroup_id, "p": p, "text": text, "fuser_id": fuser_id},
             )
+        self._written(p, fuser_id, text)
 
     async def pdoc_overwrite(self, p: str, text: str, fuser_id: str) -> None:
         http = await self.fclient.use_http()
         async with http as h:
             await h.execute(
-                gql.gql("""
+                gql_utils.gql_cached("""
                     mutation PdocOverwrite($fgroup_id: String!, $p: String!, $text: String!, $fuser_id: String) {
                         policydoc_overwrite(fgroup_id: $fgroup_id, p: $p, text: $text, fuser_id: $fuser_id)
                     }
                 """),
                 variable_values={"fgroup_id": self.fgroup_id, "p": p, "text": text, "fuser_id": fuser_id},
             )
+        self._written(p, fuser_id, text)
 
     async def pdoc_update_json_text(self, p: str, json_path: str, text: str, fuser_id: str) -> None:
         http = await self.fclient.use_http()
         async with http as h:
             await h.execute(
-                gql.gql("""
+                gql_utils.gql_cached("""
                     mutation PdocUpdateJsonText($fgroup_id: String!, $p: String!, $json_path: String!, $text: String!, $fuser_id: String) {
                         policydoc_update_json_text(fgroup_id: $fgroup_id, p: $p, json_path: $json_path, text: $text, fuser_id: $fuser_id)
                     }
                 """),
                 variable_values={"fgroup_id": self.fgroup_id, "p": p, "json_path": json_path, "text": text, "fuser_id": fuser_id},
             )
+        self.cache.invalidate(p)   # how the backend puts text into the document is up to the backend, read it again
 
     async def pdoc_cp(self, p1: str, p2: str, fuser_id: str) -> None:
         http = await self.fclient.use_http()
         async with http as h:
             await h.execute(
-                gql.gql("""
+                gql_utils.gql_cached("""
                     mutation PdocCp($fgroup_id: String!, $p1: String!, $p2: String!, $fuser_id: String) {
                         policydoc_cp(fgroup_id: $fgroup_id, p1: $p1, p2: $p2, fuser_id: $fuser_id)
                     }
                 """),
                 variable_values={"fgroup_id": self.fgroup_id, "p1": p1, "p2": p2, "fuser_id": fuser_id},
             )
+        content = self.cache.find_content(p1)
+        if content is not None:
+            self.cache.written(p2, fuser_id, copy.deepcopy(content))
+        else:
+            self.cache.invalidate(p2)
 
     async def pdoc_rm(self, p: str, fuser_id: str) -> None:
         http = await self.fclient.use_http()
         async with http as h:
             await h.execute(
-                gql.gql("""
+                gql_utils.gql_cached("""
                     mutation PdocRm($fgroup_id: String!, $p: String!, $fuser_id: String) {
                         policydoc_rm(fgroup_id: $fgroup_id, p: $p, fuser_id: $fuser_id)
                     }
                 """),
                 variable_values={"fgroup_id": self.fgroup_id, "p": p, "fuser_id": fuser_id},
             )
+        self.cache.removed(p, fuser_id)
+
+    def _written(self, p: str, fuser_id: Optional[str], text: str) -> None:
+        try:
+            self.cache.written(p, fuser_id, json.loads(text))
+        except ValueError:
+            self.cache.invalidate(p)
+
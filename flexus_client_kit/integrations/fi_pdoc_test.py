@@ -0,0 +1,162 @@
+import asyncio
+import json
+import time
+import types
+from typing import Any, Dict, List
+
+from flexus_client_kit.integrations import fi_pdoc
+
+
+class _FakeBackend:
+    # Stands in for fclient.use_http(), answers policydoc_* queries from a dict, counts requests
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.requests: List[str] = []
+        self.delay = 0.0
+
+    async def use_http(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def user_edit(self, p: str, content: Any) -> None:
+        now = time.time()
+        prev = self.docs.get(p)
+        self.docs[p] = {"pdoc_id": prev["pdoc_id"] if prev else "id_" + p, "path": p, "pdoc_content": content,
+            "pdoc_created_ts": prev["pdoc_created_ts"] if prev else now, "pdoc_modified_ts": now}
+
+    async def execute(self, request, variable_values: Dict[str, Any]) -> Dict[str, Any]:
+        definition = request.document.definitions[0]
+        op = definition.name.value
+        top = definition.selection_set.selections[0]
+        fields = [sel.name.value for sel in top.selection_set.selections] if top.selection_set else []
+        self.requests.append(op if op != "PdocCat" or len(fields) > 1 else "PdocCat:" + ",".join(fields))
+        await asyncio.sleep(self.delay)
+        v = variable_values
+        if op == "PdocCat":
+            d = self.docs.get(v["p"])
+            return {"policydoc_cat": {k: d[k] for k in fields} if d else None}
+        if op == "PdocList":
+            return {"policydoc_list": [{"path": p, "is_folder": False, "doc_count": 0} for p in sorted(self.docs) if p.startswith(v["p"])]}
+        if op in ("PdocCreate", "PdocOverwrite"):
+            self.user_edit(v["p"], json.loads(v["text"]))
+        elif op == "PdocUpdateJsonText":
+            d = self.docs[v["p"]]
+            d["pdoc_content"][v["json_path"]] = v["text"]
+            d["pdoc_modified_ts"] = time.time()
+        elif op == "PdocCp":
+            self.user_edit(v["p2"], json.loads(json.dumps(self.docs[v["p1"]]["pdoc_content"])))
+        elif op == "PdocRm":
+            del self.docs[v["p"]]
+        return {}
+
+
+def _make():
+    backend = _FakeBackend()
+    rcx = types.SimpleNamespace(fclient=backend, running_test_scenario=False)
+    return backend, fi_pdoc.IntegrationPdoc(rcx, "ws1")
+
+
+def test_repeated_reads_hit_the_network_once():
+    backend, pdoc = _make()
+    backend.user_edit("/company/ad-ops-config", {"a": 1})
+    backend.delay = 0.01
+
+    async def go():
+        docs = await asyncio.gather(*[pdoc.pdoc_cat("/company/ad-ops-config", "u1") for _ in range(5)])
+        assert all(d.pdoc_content == {"a": 1} for d in docs)
+        d = await pdoc.pdoc_cat("/company/ad-ops-config", "u1")
+        d.pdoc_content["a"] = 2   # callers own what they get
+        assert (await pdoc.pdoc_cat("/company/ad-ops-config", "u1")).pdoc_content == {"a": 1}
+        assert await pdoc.pdoc_cat("/nope", "u1") is None and await pdoc.pdoc_cat("/nope", "u1") is None
+    asyncio.run(go())
+    assert backend.requests == ["PdocCat", "PdocCat"]
+    st = pdoc.cache_stats()
+    assert st["joined"] == 4 and st["hits"] == 3 and st["fetched"] == 2 and st["hit_rate"] == 0.778
+
+
+def test_write_through_and_invalidation():
+    backend, pdoc = _make()
+
+    async def go():
+        await pdoc.pdoc_create("/x/doc", json.dumps({"v": 1}), "u1")
+        assert (await pdoc.pdoc_cat("/x/doc", "u1")).pdoc_content == {"v": 1}
+        await pdoc.pdoc_overwrite("/x/doc", json.dumps({"v": 2, "f": "old"}), "u1")
+        assert (await pdoc.pdoc_cat("/x/doc", "u1")).pdoc_content == {"v": 2, "f": "old"}
+        assert backend.requests == ["PdocCreate", "PdocOverwrite"]
+
+        await pdoc.pdoc_cp("/x/doc", "/x/copy", "u1")
+        assert (await pdoc.pdoc_cat("/x/copy", "u1")).pdoc_content == {"v": 2, "f": "old"}
+        await pdoc.pdoc_update_json_text("/x/doc", "f", "new", "u1")
+        assert (await pdoc.pdoc_cat("/x/doc", "u1")).pdoc_content == {"v": 2, "f": "new"}
+        assert backend.requests[-2:] == ["PdocUpdateJsonText", "PdocCat"]
+        await pdoc.pdoc_rm("/x/copy", "u1")
+        assert await pdoc.pdoc_cat("/x/copy", "u1") is None
+        assert backend.requests[-1] == "PdocRm"
+
+        n = len(backend.requests)
+        assert [i.path for i in await pdoc.pdoc_list("/x/", "u1")] == ["/x/doc"]
+        assert [i.path for i in await pdoc.pdoc_list("/x/", "u1")] == ["/x/doc"]
+        await pdoc.pdoc_create("/x/another", "{}", "u1")
+        assert [i.path for i in await pdoc.pdoc_list("/x/", "u1")] == ["/x/another", "/x/doc"]
+        assert backend.requests[n:] == ["PdocList", "PdocCreate", "PdocList"]
+    asyncio.run(go())
+
+
+def test_write_updates_only_docs_others_could_read():
+    backend, pdoc = _make()
+    backend.user_edit("/shared", {"v": 1})
+
+    async def go():
+        assert (await pdoc.pdoc_cat("/shared", "u2")).pdoc_content == {"v": 1}
+        assert await pdoc.pdoc_cat("/new", "u2") is None and await pdoc.pdoc_cat("/new", "u3") is None
+        await pdoc.pdoc_overwrite("/shared", json.dumps({"v": 2}), "u1")
+        await pdoc.pdoc_create("/new", json.dumps({"n": 1}), "u1")
+        assert set(pdoc.cache.docs) == {("/shared", "u1"), ("/shared", "u2"), ("/new", "u1")}
+        n = len(backend.requests)
+        assert (await pdoc.pdoc_cat("/shared", "u2")).pdoc_content == {"v": 2}   # could read it before, sees the write
+        assert (await pdoc.pdoc_cat("/new", "u3")).pdoc_content == {"n": 1}
+        assert backend.requests[n:] == ["PdocCat"]   # "not found" for u3 wasn't turned into the doc, asked the backend
+    asyncio.run(go())
+
+
+def test_revalidation_after_ttl():
+    backend, pdoc = _make()
+    backend.user_edit("/big", {"rows": list(range(1000))})
+
+    async def go():
+        await pdoc.pdoc_cat("/big", "u1")
+        for e in pdoc.cache.docs.values():
+            e.ts -= fi_pdoc.PDOC_CACHE_TTL + 1
+        assert (await pdoc.pdoc_cat("/big", "u1")).pdoc_content["rows"][-1] == 999
+        assert backend.requests == ["PdocCat", "PdocCat:pdoc_modified_ts"]   # unchanged, content not downloaded again
+
+        backend.user_edit("/big", {"rows": []})   # the user edits it in the UI
+        assert len((await pdoc.pdoc_cat("/big", "u1")).pdoc_content["rows"]) == 1000   # within TTL the old content is fine
+        assert (await pdoc.pdoc_cat("/big", "u1", max_age=0)).pdoc_content == {"rows": []}   # what the model's "cat" does
+        assert backend.requests[2:] == ["PdocCat:pdoc_modified_ts", "PdocCat"]
+
+        for e in pdoc.cache.docs.values():
+            e.ts -= fi_pdoc.PDOC_CACHE_MAX_AGE + 1
+        await pdoc.pdoc_cat("/big", "u1")
+        assert backend.requests[-1] == "PdocCat"   # too old to revalidate
+    asyncio.run(go())
+    assert pdoc.cache_stats()["revalidated"] == 1
+
+
+def test_write_during_read_wins():
+    backend, pdoc = _make()
+    backend.user_edit("/d", {"v": "before"})
+    backend.delay = 0.02
+
+    async def go():
+        reader = asyncio.create_task(pdoc.pdoc_cat("/d", "u1"))
+        await asyncio.sleep(0.005)
+        await pdoc.pdoc_overwrite("/d", json.dumps({"v": "after"}), "u1")
+        await reader
+        assert (await pdoc.pdoc_cat("/d", "u1")).pdoc_content == {"v": "after"}
+    asyncio.run(go())
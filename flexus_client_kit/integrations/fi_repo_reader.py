@@ -1,21 +1,11 @@
-import os
 import logging
-import time
-import subprocess
-import tempfile
 from typing import Dict, Any, Optional
 
-from flexus_client_kit import ckit_cloudtool, ckit_github, ckit_devenv, ckit_bot_exec
+from flexus_client_kit import ckit_cloudtool, ckit_github, ckit_devenv, ckit_bot_exec, ckit_repo_cache
 from flexus_client_kit.integrations import fi_localfile
 
 logger = logging.getLogger("repo_file")
 
-REPO_CACHE_DIR = os.path.join(tempfile.gettempdir(), "flexus_repos")
-REPO_REFRESH_TIMEOUT = 600
-
-_repo_last_access: Dict[str, float] = {}
-
-
 REPO_READER_TOOL = ckit_cloudtool.CloudTool(
     strict=True,
     name="repo_reader",
@@ -65,34 +55,10 @@ Examples:
 HELP = fi_localfile.HELP_TEXT + "\n" + HELP_EXAMPLES
 
 
-async def _ensure_repo_cached(repo_url: str, branch: Optional[str], github_token: Optional[ckit_github.GhRepoToken], persona_id: str) -> str:
+async def _ensure_repo_cached(repo_url: str, branch: Optional[str], github_token: Optional[ckit_github.GhRepoToken]) -> str:
     if not (repo_path := ckit_github.extract_repo_path_from_url(repo_url)):
         raise ValueError(f"Invalid repo URL: {repo_url}")
-
-    cache_key = f"{persona_id}/{repo_path}/{branch}" if branch else f"{persona_id}/{repo_path}"
-    cache_path = os.path.join(REPO_CACHE_DIR, cache_key)
-    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
-
-    token_part = f"oauth2:{github_token.token}@" if github_token else ""
-    clone_url = f"https://{token_part}github.com/{repo_path}.git"
-
-    needs_clone = not os.path.exists(cache_path)
-    needs_pull = not needs_clone and time.time() - _repo_last_access.get(cache_key, 0) > REPO_REFRESH_TIMEOUT
-
-    if needs_clone:
-        logger.info(f"{cache_path} Cloning {cache_key}...")
-        cmd = ["git", "clone", "--depth", "1"] + (["--branch", branch] if branch else []) + [clone_url, cache_path]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            raise RuntimeError(f"Failed to clone {cache_key}: {result.stderr}")
-    elif needs_pull:
-        logger.info(f"{cache_path} Pulling latest changes for {cache_key}...")
-        result = subprocess.run(["git", "pull"], capture_output=True, text=True, cwd=cache_path)
-        if result.returncode != 0:
-            logger.info(f"Failed to pull {cache_key}: {result.stderr}", exc_info=True)
-
-    _repo_last_access[cache_key] = time.time()
-    return cache_path
+    return await ckit_repo_cache.ensure_repo(f"https://github.com/{repo_path}.git", branch, github_token.token if github_token else None)
 
 
 async def handle_repo_reader(
@@ -111,10 +77,10 @@ async def handle_repo_reader(
     gh_token = await ckit_github.get_github_token_with_cache(rcx.fclient, rcx.persona.located_fgroup_id, repo_url)
     branch = ckit_cloudtool.try_best_to_find_argument(args, model_produced_args, "branch", None)
     try:
-        cache_path = await _ensure_repo_cached(repo_url, branch, gh_token, rcx.persona.persona_id)
+        cache_path = await _ensure_repo_cached(repo_url, branch, gh_token)
     except ValueError as e:
         return f"{e}\n\n" + await ckit_devenv.format_devenv_list(rcx.fclient, rcx.persona.located_fgroup_id)
-    except (RuntimeError, OSError, subprocess.SubprocessError) as e:
+    except (RuntimeError, OSError) as e:
         logger.info(f"Could not access repo {repo_url}: {e}", exc_info=True)
         return f"Error accessing repository: {e}\n\n" + await ckit_devenv.format_devenv_list(rcx.fclient, rcx.persona.located_fgroup_id)
 
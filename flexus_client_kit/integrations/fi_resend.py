@@ -4,10 +4,9 @@ import os
 from dataclasses import dataclass
 from typing import Dict, Any, List, Optional
 
-import gql
 import httpx
 
-from flexus_client_kit import ckit_bot_exec, ckit_bot_query, ckit_client, ckit_cloudtool
+from flexus_client_kit import ckit_bot_exec, ckit_bot_query, ckit_client, ckit_cloudtool, gql_utils
 
 logger = logging.getLogger("resend")
 
@@ -180,7 +179,7 @@ class IntegrationResend:
             return "Provide 'html' and/or 'text'"
         http = await self.fclient.use_http()
         async with http as h:
-            r = await h.execute(gql.gql("""mutation ResendBotSendEmail($input: ResendEmailSendInput!) {
+            r = await h.execute(gql_utils.gql_cached("""mutation ResendBotSendEmail($input: ResendEmailSendInput!) {
                 resend_email_send(input: $input)
             }"""), variable_values={"input": {
                 "persona_id": self.rcx.persona.persona_id,
@@ -218,7 +217,7 @@ class IntegrationResend:
             return "domain_id is required for " + op
         http = await self.fclient.use_http()
         async with http as h:
-            r = await h.execute(gql.gql("""mutation ResendBotSetupDomain($input: ResendSetupDomainInput!) {
+            r = await h.execute(gql_utils.gql_cached("""mutation ResendBotSetupDomain($input: ResendSetupDomainInput!) {
                 resend_setup_domain(input: $input)
             }"""), variable_values={"input": gql_input})
         return r.get("resend_setup_domain", "")
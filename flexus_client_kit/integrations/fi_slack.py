@@ -42,6 +42,10 @@ logger = logging.getLogger("slack")
 # Apps unsuitable for Slack Marketplace:
 # https://api.slack.com/slack-marketplace/guidelines
 
+SLACK_DIRECTORY_TTL = 3600       # full re-list of users and channels, events keep it fresh in between
+SLACK_DIRECTORY_PAGE = 200       # users.list and conversations.list want <= 200 per page
+SLACK_RATELIMIT_RETRIES = 5
+
 
 SLACK_TOOL = ckit_cloudtool.CloudTool(
     strict=False,
@@ -151,6 +155,230 @@ class ActivitySlack:
     file_contents: List[Dict[str, str]] = field(default_factory=list)
 
 
+def _slack_error_passes(e: SlackApiError) -> bool:
+    # Ratelimits and Slack's own 5xx go away by themselves, missing_scope, not_authed and the like need a human
+    return e.response.get("error") == "ratelimited" or (e.response.status_code or 0) >= 500
+
+
+class SlackDirectory:
+    # Users and channels by id and by name, so handling an event doesn't cost a conversations.info and a users.info
+    # round trip. Filled by refresh() from paginated lists, kept up to date by events (renames, joins, new DMs),
+    # re-listed every SLACK_DIRECTORY_TTL in the background. A miss asks Slack once, no matter how many events
+    # wait for the same id.
+    def __init__(self, ttl: float = SLACK_DIRECTORY_TTL):
+        self.ttl = ttl
+        self.channels: Dict[str, Dict[str, Any]] = {}   # id -> {"id", "name", "is_im", "user", "is_member"}, both channels and DMs
+        self.channels_id2name: Dict[str, str] = {}
+        self.channels_name2id: Dict[str, str] = {}
+        self.users_id2name: Dict[str, str] = {}
+        self.users_name2id: Dict[str, str] = {}
+        self.users_name2dm: Dict[str, str] = {}
+        self.refreshed_ts = 0.0
+        self.refresh_task: Optional[asyncio.Task] = None
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.counters = {"hits": 0, "misses": 0, "api_calls": 0}
+
+    async def refresh(self, web_api_client: AsyncWebClient) -> List[str]:
+        # Lists everything and swaps the maps in place (IntegrationSlack and the tool share these dicts), returns problems.
+        # A list that fails for good (missing scope) keeps its old part until the next ttl, only a ratelimit or a Slack
+        # outage (or a transport error raised from here) leaves the directory stale, to be listed again soon.
+        problems = []
+        retry_soon = False
+        users, ims, public = None, None, None
+        try:
+            users = await self._paginate(web_api_client.users_list, "members")
+        except SlackApiError as e:
+            logger.exception("Failed to list users")
+            problems.append(f"Failed to list users: {type(e).__name__} {e}")
+            retry_soon |= _slack_error_passes(e)
+        try:
+            ims = await self._paginate(web_api_client.conversations_list, "channels", types="im")
+        except SlackApiError as e:
+            logger.exception("Failed to list DMs")
+            problems.append(f"Failed to list DMs: {type(e).__name__} {e}")
+            retry_soon |= _slack_error_passes(e)
+        try:
+            public = await self._paginate(web_api_client.conversations_list, "channels", types="public_channel", exclude_archived=True)
+        except SlackApiError as e:
+            logger.exception("Failed to list channels")
+            problems.append(f"Failed to list channels: {type(e).__name__} {e}")
+            retry_soon |= _slack_error_passes(e)
+
+        if users is not None:
+            id2name, name2id = {}, {}
+            for user in users:
+                id2name[user["id"]] = user["name"]   # deleted users and bots still write messages we need names for
+                if not user.get("deleted", False) and not user.get("is_bot", False):
+                    name2id[user["name"]] = user["id"]
+            _replace_dict(self.users_id2name, id2name)
+            _replace_dict(self.users_name2id, name2id)
+        if ims is not None or public is not None:
+            channels = {k: v for k, v in self.channels.items() if (ims is None and v["is_im"]) or (public is None and not v["is_im"])}
+            for rec in (ims or []) + (public or []):
+                channels[rec["id"]] = _channel_entry(rec)
+            _replace_dict(self.channels, channels)
+            _replace_dict(self.channels_id2name, {c["id"]: c["name"] for c in channels.values() if not c["is_im"]})
+            _replace_dict(self.channels_name2id, {c["name"]: c["id"] for c in channels.values() if not c["is_im"]})
+            _replace_dict(self.users_name2dm, {self.users_id2name[c["user"]]: c["id"] for c in channels.values() if c["is_im"] and c["user"] in self.users_id2name})
+        if not retry_soon:
+            self.refreshed_ts = time.time()
+        logger.info("slack directory: %d users, %d channels, %d DMs, %d api calls so far",
+            len(self.users_id2name), len(self.channels_id2name), len(self.users_name2dm), self.counters["api_calls"])
+        return problems
+
+    def maybe_refresh(self, web_api_client: AsyncWebClient) -> None:
+        # Stale data is served while a new list is downloaded, events don't wait for it
+        if time.time() - self.refreshed_ts < self.ttl or (self.refresh_task and not self.refresh_task.done()):
+            return
+        self.refresh_task = asyncio.create_task(self._refresh_in_background(web_api_client))
+
+    async def _refresh_in_background(self, web_api_client: AsyncWebClient) -> None:
+        try:
+            await self.refresh(web_api_client)
+        except Exception:
+            logger.exception("slack directory refresh failed, will keep the old one")
+        self.refreshed_ts = max(self.refreshed_ts, time.time() - self.ttl + 60)   # ratelimited or Slack down: try again in a minute, not on every event
+
+    async def close(self) -> None:
+        if self.refresh_task and not self.refresh_task.done():
+            self.refresh_task.cancel()
+            try:
+                await self.refresh_task
+            except asyncio.CancelledError:
+                pass
+        self.refresh_task = None
+
+    async def user_name(self, web_api_client: AsyncWebClient, user_id: str) -> str:
+        name = self.users_id2name.get(user_id)
+        if name is not None:
+            self.counters["hits"] += 1
+            return name
+        self.counters["misses"] += 1
+        return await self._single_flight("user/" + user_id, lambda: self._fetch_user(web_api_client, user_id))
+
+    async def channel(self, web_api_client: AsyncWebClient, channel_id: str) -> Dict[str, Any]:
+        c = self.channels.get(channel_id)
+        if c is not None:
+            self.counters["hits"] += 1
+            return c
+        self.counters["misses"] += 1
+        return await self._single_flight("channel/" + channel_id, lambda: self._fetch_channel(web_api_client, channel_id))
+
+    async def _fetch_user(self, web_api_client: AsyncWebClient, user_id: str) -> str:
+        try:
+            self.counters["api_calls"] += 1
+            author_info = await web_api_client.users_info(user=user_id)
+            self.remember_user(author_info["user"])
+            return author_info["user"]["name"]
+        except Exception as e:
+            logger.warning(f"Could not resolve user {user_id}: {e}")
+            author_name = f"user_{user_id}"   # until the next refresh or until this user joins somewhere
+            self.users_id2name[user_id] = author_name
+            return author_name
+
+    async def _fetch_channel(self, web_api_client: AsyncWebClient, channel_id: str) -> Dict[str, Any]:
+        self.counters["api_calls"] += 1
+        channel_info = await web_api_client.conversations_info(channel=channel_id)
+        return self.remember_channel(channel_info["channel"])
+
+    async def _single_flight(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self.inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fetch())
+            self.inflight[key] = fut
+            fut.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(fut)   # one waiter cancelled doesn't cancel the lookup for everybody else
+
+    async def _paginate(self, method: Callable[..., Awaitable[Any]], key: str, **kwargs) -> List[Dict[str, Any]]:
+        result = []
+        cursor = None
+        retries = 0
+        while True:
+            try:
+                self.counters["api_calls"] += 1
+                resp = await method(limit=SLACK_DIRECTORY_PAGE, cursor=cursor, **kwargs)
+            except SlackApiError as e:
+                if e.response.get("error") != "ratelimited" or retries >= SLACK_RATELIMIT_RETRIES:
+                    raise
+                retries += 1
+                wait = float((e.response.headers or {}).get("Retry-After", 10))
+                logger.info("ratelimit, listing %s again in %0.0fs", key, wait)
+                await asyncio.sleep(wait)
+                continue
+            result.extend(resp[key])
+            cursor = resp.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                return result
+
+    def remember_user(self, user: Dict[str, Any]) -> None:
+        old_name = self.users_id2name.get(user["id"])
+        if old_name is not None and old_name != user["name"]:
+            if self.users_name2id.get(old_name) == user["id"]:
+                del self.users_name2id[old_name]
+            if old_name in self.users_name2dm:
+                self.users_name2dm[user["name"]] = self.users_name2dm.pop(old_name)
+        self.users_id2name[user["id"]] = user["name"]
+        if not user.get("deleted", False) and not user.get("is_bot", False):
+            self.users_name2id[user["name"]] = user["id"]
+
+    def remember_channel(self, rec: Dict[str, Any]) -> Dict[str, Any]:
+        c = _channel_entry(rec)
+        old = self.channels.get(c["id"])
+        if old is not None and not old["is_im"] and self.channels_name2id.get(old["name"]) == c["id"]:
+            del self.channels_name2id[old["name"]]
+        if old is not None and "is_member" not in rec:   # rename events carry less than conversations.info
+            c["is_member"] = old["is_member"]
+        self.channels[c["id"]] = c
+        if c["is_im"]:
+            if c["user"] in self.users_id2name:
+                self.users_name2dm[self.users_id2name[c["user"]]] = c["id"]
+        else:
+            self.channels_id2name[c["id"]] = c["name"]
+            self.channels_name2id[c["name"]] = c["id"]
+        return c
+
+    def forget_channel(self, channel_id: str) -> None:
+        c = self.channels.pop(channel_id, None)
+        self.channels_id2name.pop(channel_id, None)
+        if c and not c["is_im"] and self.channels_name2id.get(c["name"]) == channel_id:
+            del self.channels_name2id[c["name"]]
+
+    def on_event(self, event: Dict[str, Any]) -> None:
+        # Directory events carry the new state, so no api calls here
+        t = event.get("type")
+        if t in ("channel_rename", "group_rename", "channel_created"):
+            self.remember_channel(event["channel"])
+        elif t in ("channel_deleted", "group_deleted", "channel_archive", "group_archive"):
+            self.forget_channel(event["channel"])
+        elif t == "im_created":
+            self.remember_channel({**event["channel"], "is_im": True, "user": event["user"]})
+        elif t in ("member_joined_channel", "member_left_channel"):
+            # Membership changed, the next event in that channel looks it up again (names stay, posting by name
+            # still works meanwhile). A private channel we were just invited to gets known that way too.
+            c = self.channels.get(event["channel"])
+            if c is not None and not c["is_im"]:
+                del self.channels[event["channel"]]
+            if self.users_id2name.get(event["user"]) == f"user_{event['user']}":
+                del self.users_id2name[event["user"]]
+        elif t in ("team_join", "user_change"):
+            self.remember_user(event["user"])
+
+
+def _channel_entry(rec: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": rec["id"],
+        "name": rec.get("name", ""),
+        "is_im": rec.get("is_im", False),
+        "user": rec.get("user"),
+        "is_member": rec.get("is_member", False),
+    }
+
+
+def _replace_dict(d: Dict, new: Dict) -> None:
+    d.clear()
+    d.update(new)
+
+
 class IntegrationSlack:
     def __init__(
             self,
@@ -172,6 +400,7 @@ class IntegrationSlack:
         self.problems_other = list()
         self.socket_mode_something = None
         self.reactive_task = None
+        self.directory = SlackDirectory()
         try:
             if not SLACK_BOT_TOKEN:
                 raise ValueError("no token configured") # with no token, _setup_even_handlers will work, but all subsquent calls will fail
@@ -183,11 +412,11 @@ class IntegrationSlack:
             self.reactive_slack = None
         self.activity_callback: Optional[Callable[[ActivitySlack, bool], Awaitable[None]]] = None
         self.prev_messages = deque(maxlen=200)
-        self.channels_id2name = {}
-        self.channels_name2id = {}
-        self.users_id2name = {}
-        self.users_name2id = {}
-        self.users_name2dm = {}
+        self.channels_id2name = self.directory.channels_id2name
+        self.channels_name2id = self.directory.channels_name2id
+        self.users_id2name = self.directory.users_id2name
+        self.users_name2id = self.directory.users_name2id
+        self.users_name2dm = self.directory.users_name2dm
 
     def set_activity_callback(self, cb: Callable[[ActivitySlack, bool], Awaitable[None]]):
         self.activity_callback = cb
@@ -214,6 +443,7 @@ class IntegrationSlack:
         if self.socket_mode_something:
             await self.socket_mode_something.close_async()
             self.socket_mode_something = None
+        await self.directory.close()
         self.reactive_slack = None
 
     async def called_by_model(self, toolcall: ckit_cloudtool.FCloudtoolCall, model_produced_args: Optional[Dict[str, Any]]) -> str:
@@ -258,6 +488,7 @@ class IntegrationSlack:
                 for problem in self.problems_other:
                     r += "  %s\n" % problem
                 r += "\n"
+            r += "Know %d users, %d channels, %d DMs\n\n" % (len(self.users_id2name), len(self.channels_id2name), len(self.users_name2dm))
 
         if print_help:
             r += HELP
@@ -478,7 +709,14 @@ class IntegrationSlack:
 
         @self.reactive_slack.event("im_created")
         async def handle_im3(event, client, logger):
-            print("QQQQ handle_im3")
+            self.directory.on_event(event)
+
+        # These only keep the directory up to date, the app needs to subscribe to them
+        for directory_event in ["channel_rename", "group_rename", "channel_created", "channel_deleted", "group_deleted",
+                "channel_archive", "group_archive", "member_joined_channel", "member_left_channel", "team_join", "user_change"]:
+            @self.reactive_slack.event(directory_event)
+            async def handle_directory(event, client, logger):
+                self.directory.on_event(event)
 
         @self.reactive_slack.event("group_topic")  # use conversation.topic
         async def handle_group_topic(event, client, logger):
@@ -509,24 +747,25 @@ class IntegrationSlack:
         web_api_client = self.reactive_slack.client
         t0 = time.time()
 
+        self.directory.maybe_refresh(web_api_client)
         something_id = None   # will look for captured thread slack/ + something_id
         something_name = None
-        # XXX use channels_id2name = {}
         if 1:
-            channel_info = await web_api_client.conversations_info(channel=slack_event["channel"])
+            channel = await self.directory.channel(web_api_client, slack_event["channel"])   # usually no api call
+            # What conversations_info returns, the directory keeps id, name, is_im, user, is_member out of it:
             # print("channel_info", channel_info)
             # for a DM:
             # channel_info {'ok': True, 'channel': {'id': 'D0978UQ5N13', 'created': 1753360767, 'is_archived': False, 'is_im': True, 'is_org_shared': False, 'context_team_id': 'T02M4C97Y7L', 'updated': 1753411231245, 'user': 'U02M4CUNSRH', 'last_read': '0000000000.000000',
             # 'latest': {'user': 'U02M4CUNSRH', 'type': 'message', 'ts': '1753858934.524369', 'client_msg_id': 'bd72e041-89af-4c97-ac92-629479ce6710', 'text': 'hi Karen', 'team': 'T02M4C97Y7L',
             # 'blocks': [{'type': 'rich_text', 'block_id': 'TxFjM', 'elements': [{'type': 'rich_text_section', 'elements': [{'type': 'text', 'text': 'hi Karen'}]}]}]},
             # 'unread_count': 11, 'unread_count_display': 9, 'is_open': True, 'properties': {'tabs': [{'type': 'files', 'label': '', 'id': 'files'}], 'tabz': [{'type': 'files'}]}, 'priority': 0}}
-            is_dm = channel_info["channel"]["is_im"]
-            something_id = channel_info["channel"]["id"]
+            is_dm = channel["is_im"]
+            something_id = channel["id"]
             if is_dm:
-                user_id = channel_info["channel"]["user"]
+                user_id = channel["user"]
                 something_name = self.users_id2name.get(user_id, None)
             else:
-                something_name = self.channels_id2name.get(something_id, None)
+                something_name = channel["name"]
         # print("something_id", something_id)
         # print("something_name", something_name)
 
@@ -709,69 +948,35 @@ class IntegrationSlack:
         my_user_id = my_info["user_id"]
         logger.info(f"Bot user ID: {my_user_id}")
 
-        try:
-            users_response = await web_api_client.users_list(limit=5000)
-            for user in users_response["members"]:
-                if not user.get("deleted", False) and not user.get("is_bot", False):
-                    user_id = user["id"]
-                    user_name = user["name"]
-                    self.users_id2name[user_id] = user_name
-                    self.users_name2id[user_name] = user_id
-                    logger.info(f"👤 User {user_name} -> {user_id}")
-        except SlackApiError as e:
-            logger.exception("Failed to list users")
-            self.problems_other.append(f"Failed to list users: {type(e).__name__} {e}")
-
-        try:
-            channels_response = await web_api_client.conversations_list(types="im", limit=5000)
-            for rec in channels_response["channels"]:
-                # {'id': 'D097A1KDER3', 'created': 1753370403, 'is_archived': False, 'is_im': True, 'is_org_shared': False, 'context_team_id': 'T02M4C97Y7L', 'updated': 1753370403910, 'user': 'U06CTJEKA3B', 'is_user_deleted': False, 'priority': 0}
-                if not rec['is_im']:
-                    logger.error("Hmm I asked for DM list, and I see", rec)
-                    continue
-                user_id = rec['user']
-                dm_channel_id = rec['id']
-                username = self.users_id2name.get(user_id)
-                if username:
-                    self.users_name2dm[username] = dm_channel_id
-                    logger.info(f"✉️  DM {user_id} -> {dm_channel_id}")
-                else:
-                    logger.error(f"User {user_id} not found in users_id2name, cannot map DM channel {dm_channel_id}")
-        except SlackApiError as e:
-            logger.exception("Failed to list DMs")
-            self.problems_other.append(f"Failed to list DMs: {type(e).__name__} {e}")
-
-        try:
-            channels_response = await web_api_client.conversations_list(types="public_channel", limit=1000)
-            for channel in channels_response["channels"]:
-                self.channels_id2name[channel["id"]] = channel["name"]
-                self.channels_name2id[channel["name"]] = channel["id"]
-
-                should_join = channel['name'] in self.should_join or ("#" + channel['name']) in self.should_join
-                is_member = channel.get('is_member', False)
+        self.problems_other.extend(await self.directory.refresh(web_api_client))
+        for user_name, dm_channel_id in self.users_name2dm.items():
+            logger.info(f"✉️  DM {user_name} -> {dm_channel_id}")
 
-                if not should_join:
-                    if is_member:
-                        try:
-                            await web_api_client.conversations_leave(channel=channel["id"])
-                            logger.info(f"❌ Left #{channel['name']}")
-                        except SlackApiError as e:
-                            self.problems_joining.append("%s %s" % (type(e).__name__, e))
-                    logger.info(f"✖️  channel #{channel['name']} -> {channel['id']}")
-                    continue
+        for channel in [c for c in list(self.directory.channels.values()) if not c["is_im"]]:   # public ones, after refresh()
+            should_join = channel['name'] in self.should_join or ("#" + channel['name']) in self.should_join
+            is_member = channel['is_member']
 
-                logger.info(f"☑️  channel #{channel['name']} -> {channel['id']}")
-                self.actually_joined.add(channel['name'])
-
-                if not is_member:
+            if not should_join:
+                if is_member:
                     try:
-                        await web_api_client.conversations_join(channel=channel["id"])
-                        logger.info(f"✅ Joined #{channel['name']}")
+                        await web_api_client.conversations_leave(channel=channel["id"])
+                        channel["is_member"] = False
+                        logger.info(f"❌ Left #{channel['name']}")
                     except SlackApiError as e:
                         self.problems_joining.append("%s %s" % (type(e).__name__, e))
-        except SlackApiError as e:
-            logger.exception("Failed to list channels")
-            self.problems_other.append(f"Failed to list channels: {type(e).__name__} {e}")
+                logger.info(f"✖️  channel #{channel['name']} -> {channel['id']}")
+                continue
+
+            logger.info(f"☑️  channel #{channel['name']} -> {channel['id']}")
+            self.actually_joined.add(channel['name'])
+
+            if not is_member:
+                try:
+                    await web_api_client.conversations_join(channel=channel["id"])
+                    channel["is_member"] = True
+                    logger.info(f"✅ Joined #{channel['name']}")
+                except SlackApiError as e:
+                    self.problems_joining.append("%s %s" % (type(e).__name__, e))
 
     def _thread_capturing(self, something_id_slash_thread: str):
         searchable = "slack/" + something_id_slash_thread
@@ -879,16 +1084,4 @@ class IntegrationSlack:
             return None, None
 
     async def _get_user_name(self, web_api_client: AsyncWebClient, user_id: str) -> str:
-        if user_id in self.users_id2name:
-            return self.users_id2name[user_id]
-        try:
-            author_info = await web_api_client.users_info(user=user_id)
-            author_name = author_info["user"]["name"]
-            self.users_id2name[user_id] = author_name
-            self.users_name2id[author_name] = user_id
-            return author_name
-        except Exception as e:
-            logger.warning(f"Could not resolve user {user_id}: {e}")
-            author_name = f"user_{user_id}"
-            self.users_id2name[user_id] = author_name
-            return author_name
+        return await self.directory.user_name(web_api_client, user_id)
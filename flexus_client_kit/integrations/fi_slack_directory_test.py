@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_slack_response import AsyncSlackResponse
+
+from flexus_client_kit.integrations.fi_slack import SlackDirectory
+
+
+def _slack_error(error: str, status_code: int) -> SlackApiError:
+    return SlackApiError(error, AsyncSlackResponse(client=None, http_verb="POST", api_url="", req_args={},
+        data={"ok": False, "error": error}, headers={"Retry-After": "0"}, status_code=status_code))
+
+
+class _FakeWebClient:
+    # Just enough of AsyncWebClient for SlackDirectory, pages like Slack does, counts calls
+    def __init__(self, n_users: int, n_channels: int):
+        self.users = [{"id": "U%04d" % i, "name": "user%d" % i, "is_bot": i == 1, "deleted": i == 2} for i in range(n_users)]
+        self.public = [{"id": "C%04d" % i, "name": "chan%d" % i, "is_member": i == 0} for i in range(n_channels)]
+        self.ims = [{"id": "D%04d" % i, "is_im": True, "user": "U%04d" % i} for i in range(3)]
+        self.private = {"G0001": {"id": "G0001", "name": "secret", "is_private": True}}
+        self.calls = []
+        self.ratelimits = 0
+        self.missing_scope = set()   # conversations.list types that fail for good
+
+    async def _page(self, method, items, key, limit, cursor):
+        self.calls.append(method)
+        await asyncio.sleep(0.01)
+        if self.ratelimits:
+            self.ratelimits -= 1
+            raise _slack_error("ratelimited", 429)
+        start = int(cursor or 0)
+        nxt = str(start + limit) if start + limit < len(items) else ""
+        return {key: items[start:start + limit], "response_metadata": {"next_cursor": nxt}}
+
+    async def users_list(self, limit=None, cursor=None):
+        return await self._page("users_list", self.users, "members", limit, cursor)
+
+    async def conversations_list(self, types, limit=None, cursor=None, exclude_archived=False):
+        if types in self.missing_scope:
+            self.calls.append("conversations_list")
+            raise _slack_error("missing_scope", 200)
+        return await self._page("conversations_list", self.ims if types == "im" else self.public, "channels", limit, cursor)
+
+    async def users_info(self, user):
+        self.calls.append("users_info")
+        await asyncio.sleep(0.01)
+        if user == "UGONE":
+            raise ValueError("user_not_found")
+        return {"user": {"id": user, "name": "late_" + user}}
+
+    async def conversations_info(self, channel):
+        self.calls.append("conversations_info")
+        await asyncio.sleep(0.01)
+        return {"channel": self.private[channel]}
+
+
+def test_slack_directory():
+    async def go():
+        client = _FakeWebClient(450, 5)
+        d = SlackDirectory(ttl=3600)
+        client.ratelimits = 1
+        assert await d.refresh(client) == []
+        assert client.calls.count("users_list") == 4 and client.calls.count("conversations_list") == 2   # 3 pages + 1 ratelimited
+        assert len(d.users_id2name) == 450 and "user1" not in d.users_name2id and "user2" not in d.users_name2id
+        assert d.users_name2dm == {"user0": "D0000", "user1": "D0001", "user2": "D0002"}
+        assert d.channels_name2id["chan3"] == "C0003" and d.channels["C0000"]["is_member"]
+
+        # Events in known places and from known people don't call Slack
+        client.calls.clear()
+        assert (await d.channel(client, "C0003"))["name"] == "chan3"
+        assert (await d.channel(client, "D0001"))["user"] == "U0001"
+        assert await d.user_name(client, "U0449") == "user449"
+        assert client.calls == []
+
+        # Misses ask once, however many events wait for the same id
+        names = await asyncio.gather(*[d.user_name(client, "UNEW") for _ in range(10)], *[d.user_name(client, "UGONE") for _ in range(3)])
+        chans = await asyncio.gather(*[d.channel(client, "G0001") for _ in range(10)])
+        assert names == ["late_UNEW"] * 10 + ["user_UGONE"] * 3 and all(c["name"] == "secret" for c in chans)
+        assert client.calls == ["users_info", "users_info", "conversations_info"] and d.inflight == {}
+        assert await d.user_name(client, "UGONE") == "user_UGONE" and len(client.calls) == 3
+
+        # Directory events carry the new state
+        d.on_event({"type": "channel_rename", "channel": {"id": "C0003", "name": "chan3-renamed", "created": 1}})
+        assert "chan3" not in d.channels_name2id and d.channels_id2name["C0003"] == "chan3-renamed"
+        d.on_event({"type": "user_change", "user": {"id": "U0001", "name": "robot", "is_bot": True}})
+        assert d.users_name2dm["robot"] == "D0001" and d.users_id2name["U0001"] == "robot"
+        d.on_event({"type": "im_created", "user": "U0005", "channel": {"id": "D0005"}})
+        assert d.users_name2dm["user5"] == "D0005" and (await d.channel(client, "D0005"))["is_im"]
+        d.on_event({"type": "member_joined_channel", "user": "UGONE", "channel": "G0001", "channel_type": "G"})
+        assert "UGONE" not in d.users_id2name and "G0001" not in d.channels and d.channels_name2id["secret"] == "G0001"
+        d.on_event({"type": "channel_deleted", "channel": "C0004"})
+        assert "chan4" not in d.channels_name2id
+        assert len(client.calls) == 3
+
+        # Stale directory gets re-listed in the background, once, events don't wait for it
+        d.refreshed_ts -= 7200
+        for _ in range(5):
+            d.maybe_refresh(client)
+            assert await d.user_name(client, "U0010") == "user10"
+        await d.refresh_task
+        assert client.calls.count("users_list") == 3 and d.channels_name2id["chan3"] == "C0003" and "chan3-renamed" not in d.channels_name2id
+        assert time.time() - d.refreshed_ts < 5
+        await d.close()
+
+    asyncio.run(go())
+
+
+def test_slack_directory_refresh_failures():
+    async def go():
+        # A scope the app doesn't have won't appear in a minute, the rest is listed and it waits for the ttl like a success
+        client = _FakeWebClient(10, 3)
+        client.missing_scope = {"im"}
+        d = SlackDirectory(ttl=3600)
+        problems = await d.refresh(client)
+        assert len(problems) == 1 and "missing_scope" in problems[0]
+        assert len(d.users_id2name) == 10 and d.channels_name2id["chan2"] == "C0002" and d.users_name2dm == {}
+        assert time.time() - d.refreshed_ts < 5
+        d.maybe_refresh(client)
+        assert d.refresh_task is None
+
+        # Ratelimited past the retries: stays stale, the background path tries again in a minute, not on every event
+        client.missing_scope = set()
+        client.ratelimits = 100
+        d.refreshed_ts -= 7200
+        d.maybe_refresh(client)
+        await d.refresh_task
+        assert abs(d.refreshed_ts - (time.time() - 3600 + 60)) < 5
+        client.calls.clear()
+        d.maybe_refresh(client)
+        assert d.refresh_task.done() and client.calls == []
+        await d.close()
+
+    asyncio.run(go())
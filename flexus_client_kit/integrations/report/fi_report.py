@@ -594,7 +594,8 @@ async def handle_fill_section_tool(
         try:
             json_filename = f"meta_data_{report_id}_{section_name}.json"
             json_content = json.dumps(content, indent=2).encode('utf-8')
-            await ckit_mongo.mongo_store_file(mongo_collection, json_filename, json_content)
+            # temporary: if the report is never finished, mongo deletes it after the ttl
+            await ckit_mongo.mongo_save(mongo_collection, json_filename, json_content, temporary=True)
             json_data_file = json_filename
             logger.info(f"Stored meta section data to {json_filename} ({len(json_content)} bytes)")
         except Exception as e:
@@ -944,20 +945,17 @@ No reports available in the database."""
 
     # 3. Delete associated meta data files
     try:
-        all_files = await ckit_mongo.mongo_ls(mongo_collection)
-        meta_files = [f for f in all_files if f["path"].startswith(f"meta_data_{report_id}_")]
-
-        for file_info in meta_files:
-            file_path = file_info["path"]
-            try:
-                if await ckit_mongo.mongo_rm(mongo_collection, file_path):
-                    deleted_files.append(file_path)
-                    logger.info(f"Deleted meta data file: {file_path}")
-                else:
-                    failed_files.append(file_path)
-            except Exception as e:
-                logger.error(f"Failed to delete meta file {file_path}: {e}")
-                failed_files.append(file_path)
+        meta_files = [f["path"] for f in await ckit_mongo.mongo_ls(mongo_collection, f"meta_data_{report_id}_")]
+        if meta_files:
+            n = await ckit_mongo.mongo_rm_many(mongo_collection, paths=meta_files)
+            if n == len(meta_files):
+                deleted_files.extend(meta_files)
+                logger.info(f"Deleted {n} meta data files for report {report_id}")
+            else:
+                # deleted by somebody else in between, or failed, look which ones are still there
+                left = {f["path"] for f in await ckit_mongo.mongo_ls(mongo_collection, f"meta_data_{report_id}_")}
+                deleted_files.extend(p for p in meta_files if p not in left)
+                failed_files.extend(p for p in meta_files if p in left)
     except Exception as e:
         logger.error(f"Error while cleaning up meta files for report {report_id}: {e}")
 
@@ -1030,21 +1028,7 @@ with open(filenames[0], 'r') as f:
 
 async def _cleanup_temporary_files(mongo_collection: Collection, report_id: str) -> int:
     try:
-        all_files = await ckit_mongo.mongo_ls(mongo_collection)
-        temp_files = [f for f in all_files if not f["path"].startswith("report_")]
-        deleted_count = 0
-        for file_info in temp_files:
-            file_path = file_info["path"]
-            try:
-                success = await ckit_mongo.mongo_rm(mongo_collection, file_path)
-                if success:
-                    deleted_count += 1
-                    logger.info(f"Cleaned up temporary file: {file_path}")
-                else:
-                    logger.warning(f"Failed to delete temporary file: {file_path}")
-            except Exception as e:
-                logger.error(f"Error deleting temporary file {file_path}: {e}")
-
+        deleted_count = await ckit_mongo.mongo_rm_many(mongo_collection, path_prefix="", except_prefix="report_")
         if deleted_count > 0:
             logger.info(f"Cleanup completed: removed {deleted_count} temporary files for report {report_id}")
 
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import time
@@ -315,17 +316,19 @@ class IntegrationExperimentExecution:
                 await self._check_single_experiment(experiment_id, tracking)
             except Exception as e:
                 logger.error(f"Error checking experiment {experiment_id}: {e}", exc_info=e)
+        logger.info("pdoc cache after experiment checks: %s", self.pdoc_integration.cache_stats())
 
     async def _check_single_experiment(self, experiment_id: str, tracking: ExperimentTracking) -> None:
         """Check and optimize a single experiment."""
         # Use bot's fuser_id for pdoc access
         fuser_id = self.pdoc_integration.rcx.persona.persona_id
 
-        # 1. Load runtime doc (wrapped in meta-runtime key)
+        # 1. Load runtime doc (wrapped in meta-runtime key), the rest is only needed for running experiments
         runtime_path = f"/gtm/discovery/{experiment_id}/meta-runtime"
+        metrics_path = f"/gtm/discovery/{experiment_id}/metrics"
+        tactics_tracking_path = f"/gtm/discovery/{experiment_id}/tactics-tracking"
         try:
-            runtime_doc = await self.pdoc_integration.pdoc_cat(runtime_path, fuser_id)
-            raw_content = runtime_doc.pdoc_content
+            raw_content = (await self.pdoc_integration.pdoc_cat(runtime_path, fuser_id)).pdoc_content
             # Extract inner runtime from meta-runtime wrapper
             runtime = raw_content.get("meta_runtime", raw_content) if isinstance(raw_content, dict) else {}
         except Exception as e:
@@ -333,21 +336,22 @@ class IntegrationExperimentExecution:
             return
         if not runtime or runtime.get("experiment_status") == "completed":
             return
+        metrics_doc, tactics_doc = await asyncio.gather(
+            self.pdoc_integration.pdoc_cat(metrics_path, fuser_id),
+            self.pdoc_integration.pdoc_cat(tactics_tracking_path, fuser_id),
+            return_exceptions=True,
+        )
 
-        # 2. Load metrics doc (for rules)
-        metrics_path = f"/gtm/discovery/{experiment_id}/metrics"
+        # 2. Metrics doc (for rules)
         metrics = None
         try:
-            metrics_doc = await self.pdoc_integration.pdoc_cat(metrics_path, fuser_id)
             metrics = metrics_doc.pdoc_content
         except Exception:
             pass
 
-        # 3. Load tactics-tracking doc (for iteration_guide)
-        tactics_tracking_path = f"/gtm/discovery/{experiment_id}/tactics-tracking"
+        # 3. Tactics-tracking doc (for iteration_guide)
         tactics_tracking = None
         try:
-            tactics_doc = await self.pdoc_integration.pdoc_cat(tactics_tracking_path, fuser_id)
             tactics_raw = tactics_doc.pdoc_content
             # Extract from wrapper: {"tactics_tracking": {"meta": {...}, "iteration_guide": {...}}}
             tactics_tracking = tactics_raw.get("tactics_tracking", tactics_raw) if isinstance(tactics_raw, dict) else {}
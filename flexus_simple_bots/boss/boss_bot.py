@@ -12,6 +12,7 @@ from flexus_client_kit import ckit_shutdown
 from flexus_client_kit import ckit_ask_model
 from flexus_client_kit import ckit_mongo
 from flexus_client_kit import ckit_utils
+from flexus_client_kit import gql_utils
 from flexus_client_kit.integrations import fi_mongo_store
 from flexus_client_kit.integrations import fi_pdoc
 from flexus_client_kit.integrations import fi_widget
@@ -127,7 +128,7 @@ async def handle_setup_colleagues(fclient: ckit_client.FlexusClient, ws_id: str,
         async with http as h:
             try:
                 r = await h.execute(
-                    gql.gql("""mutation BossSetupColleagues($ws_id: String!, $bot_name: String!, $op: String!, $key: String) {
+                    gql_utils.gql_cached("""mutation BossSetupColleagues($ws_id: String!, $bot_name: String!, $op: String!, $key: String) {
                         boss_setup_colleagues(ws_id: $ws_id, bot_name: $bot_name, op: $op, key: $key)
                     }"""),
                     variable_values={"ws_id": ws_id, "bot_name": bot_name, "op": "get", "key": set_key},
@@ -155,7 +156,7 @@ async def handle_setup_colleagues(fclient: ckit_client.FlexusClient, ws_id: str,
     async with http as h:
         try:
             r = await h.execute(
-                gql.gql("""mutation BossSetupColleagues($ws_id: String!, $bot_name: String!, $op: String!, $key: String, $val: String) {
+                gql_utils.gql_cached("""mutation BossSetupColleagues($ws_id: String!, $bot_name: String!, $op: String!, $key: String, $val: String) {
                     boss_setup_colleagues(ws_id: $ws_id, bot_name: $bot_name, op: $op, key: $key, val: $val)
                 }"""),
                 variable_values={"ws_id": ws_id, "bot_name": bot_name, "op": op, "key": set_key, "val": set_val},
@@ -178,7 +179,7 @@ async def handle_thread_messages(fclient: ckit_client.FlexusClient, model_produc
     async with http as h:
         try:
             r = await h.execute(
-                gql.gql("""query BossThreadMsgs($a2a_task_id: String, $ft_id: String) {
+                gql_utils.gql_cached("""query BossThreadMsgs($a2a_task_id: String, $ft_id: String) {
                     thread_messages_printed(a2a_task_id_to_resolve: $a2a_task_id, ft_id: $ft_id) { thread_messages_data }
                 }"""),
                 variable_values={"a2a_task_id": a2a_task_id, "ft_id": ft_id},
@@ -206,7 +207,7 @@ async def handle_bot_bug_report(fclient: ckit_client.FlexusClient, ws_id: str, m
     async with http as h:
         try:
             r = await h.execute(
-                gql.gql("""query WorkspacePersonasList($ws_id: String!, $persona_names_filter: [String!]) {
+                gql_utils.gql_cached("""query WorkspacePersonasList($ws_id: String!, $persona_names_filter: [String!]) {
                     workspace_personas_list(ws_id: $ws_id, persona_names_filter: $persona_names_filter) {
                         personas {
                             persona_marketable_name
@@ -225,7 +226,7 @@ async def handle_bot_bug_report(fclient: ckit_client.FlexusClient, ws_id: str, m
 
             if op == "list_reported_bugs":
                 r = await h.execute(
-                    gql.gql("""query MarketplaceFeedbackListByBot($persona_marketable_name: String!, $persona_marketable_version: Int!) {
+                    gql_utils.gql_cached("""query MarketplaceFeedbackListByBot($persona_marketable_name: String!, $persona_marketable_version: Int!) {
                         priviledged_feedback_list(persona_marketable_name: $persona_marketable_name, persona_marketable_version: $persona_marketable_version) {
                             total_count feedbacks { feedback_text }
                         }
@@ -250,7 +251,7 @@ async def handle_bot_bug_report(fclient: ckit_client.FlexusClient, ws_id: str, m
                 return f"Error: ft_id and bug_summary required for report_bug\n\n{BOT_BUG_REPORT_HELP}"
 
             r = await h.execute(
-                gql.gql("""mutation ReportBotBug(
+                gql_utils.gql_cached("""mutation ReportBotBug(
                     $persona_marketable_name: String!,
                     $persona_marketable_version: Int!,
                     $feedback_ft_id: String!,
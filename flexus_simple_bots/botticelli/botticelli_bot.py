@@ -235,6 +235,7 @@ async def botticelli_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_
     dbname = rcx.persona.persona_id + "_db"
     mydb = mongo[dbname]
     personal_mongo = mydb["personal_mongo"]
+    compaction = ckit_mongo.mongo_start_compaction(personal_mongo)
 
     # Lazy initialization of OpenAI client - only create when needed
     openai_client = None
@@ -990,6 +991,7 @@ Full brief saved to: {brief_path}
             await rcx.unpark_collected_events(sleep_if_no_work=10.0)
 
     finally:
+        compaction.cancel()
         logger.info("%s exit" % (rcx.persona.persona_id,))
 
 
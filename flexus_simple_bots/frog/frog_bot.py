@@ -104,6 +104,7 @@ async def frog_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_exec.R
     dbname = rcx.persona.persona_id + "_db"
     mydb = mongo[dbname]
     personal_mongo = mydb["personal_mongo"]
+    compaction = ckit_mongo.mongo_start_compaction(personal_mongo)
     pdoc_integration = fi_pdoc.IntegrationPdoc(rcx, rcx.persona.ws_root_group_id)
 
     tongue_capacity_used = {}
@@ -221,6 +222,7 @@ async def frog_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_exec.R
             # Here you can do whatever, just don't block with non-async code! Try not to keep sockets/resources you don't need,
             # also a common pitfall: execution reaches here far more often than every 10s when updates from backend actively arrive.
     finally:
+        compaction.cancel()
         logger.info("%s exit" % (rcx.persona.persona_id,))
 
 
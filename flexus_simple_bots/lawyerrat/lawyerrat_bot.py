@@ -89,6 +89,7 @@ async def lawyerrat_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_e
     dbname = rcx.persona.persona_id + "_db"
     mydb = mongo[dbname]
     personal_mongo = mydb["personal_mongo"]
+    compaction = ckit_mongo.mongo_start_compaction(personal_mongo)
 
     pdoc_integration = fi_pdoc.IntegrationPdoc(rcx, rcx.persona.ws_root_group_id)
 
@@ -266,6 +267,7 @@ Be systematic and thorough like a diligent rat examining every detail!"""
             await rcx.unpark_collected_events(sleep_if_no_work=10.0)
 
     finally:
+        compaction.cancel()
         logger.info("%s exit" % (rcx.persona.persona_id,))
 
 
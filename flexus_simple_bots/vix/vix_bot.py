@@ -58,6 +58,7 @@ async def vix_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_exec.Ro
     dbname = rcx.persona.persona_id + "_db"
     mydb = mongo[dbname]
     personal_mongo = mydb["personal_mongo"]
+    compaction = ckit_mongo.mongo_start_compaction(personal_mongo)
 
     pdoc_integration = fi_pdoc.IntegrationPdoc(rcx, rcx.persona.ws_root_group_id)
     erp_integration = fi_erp.IntegrationErp(fclient, rcx.persona.ws_id, personal_mongo)
@@ -208,6 +209,7 @@ async def vix_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_exec.Ro
             await rcx.unpark_collected_events(sleep_if_no_work=10.0)
 
     finally:
+        compaction.cancel()
         await telegram.close()
         logger.info("%s exit" % (rcx.persona.persona_id,))
 
@@ -215,6 +217,7 @@ async def vix_main_loop(fclient: ckit_client.FlexusClient, rcx: ckit_bot_exec.Ro
 def main():
     scenario_fn = ckit_bot_exec.parse_bot_args()
     fclient = ckit_client.FlexusClient(ckit_client.bot_service_name(BOT_NAME, BOT_VERSION), endpoint="/v1/jailed-bot")
+    ckit_erp.enable_erp_cache()   # contact lookups by email for every incoming message, kept fresh by ERP_TABLES subscription
 
     asyncio.run(ckit_bot_exec.run_bots_in_this_group(
         fclient,